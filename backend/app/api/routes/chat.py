@@ -1,69 +1,90 @@
-from fastapi import APIRouter, Depends, HTTPException, status
-from fastapi.responses import StreamingResponse
-from sqlalchemy.orm import Session
-from typing import List
-import json
+from fastapi import APIRouter, Depends, HTTPException, status, Query, Header
+from sqlalchemy import inspect, select
+from sqlalchemy.ext.asyncio import AsyncSession
+from typing import List, Optional
 import uuid
-from app.core.database import get_db
-from app.core.deps import get_current_active_user
+from app.core.database import get_async_db
+from app.core.deps import get_current_active_user_async
+from app.core.config import settings
+from app.core.pagination import keyset_paginate
 from app.core.security import generate_session_id
+from app.core.sse import CLIENT_DISCONNECTED, SSEWriter, coalesce_deltas
+from app.core.stream_replay import stream_replay
 from app.models.user import User
 from app.models.chat import ChatSession, ChatMessage
 from app.schemas.chat import (
     ChatSessionCreate,
     ChatSessionResponse,
-    ChatSessionWithMessages,
     ChatMessageCreate,
     ChatMessageResponse
 )
-from app.schemas.common import ApiResponse
+from app.schemas.common import ApiResponse, PaginatedResponse
 from app.services.ai_service import ai_service
+from app.services.context_builder import chat_context_builder, estimate_tokens
+from app.services.knowledge_retriever import knowledge_retriever
+from app.services.message_writer import message_writer, utc_now
+from app.services.session_summaries import session_summaries
+from app.services.session_purge import session_purger
 
 router = APIRouter()
 
 @router.get("/sessions", response_model=ApiResponse)
 async def get_chat_sessions(
     mode: str = "kb",  # 添加模式参数
-    current_user: User = Depends(get_current_active_user),
-    db: Session = Depends(get_db)
+    current_user: User = Depends(get_current_active_user_async),
+    db: AsyncSession = Depends(get_async_db),
+    limit: Optional[int] = Query(None, ge=1, le=100, description="每页会话数，不指定时返回全部会话"),
+    cursor: Optional[str] = Query(None, description="上一页返回的 next_cursor")
 ):
-    """获取用户的聊天会话列表"""
-    sessions = db.query(ChatSession).filter(
+    """获取用户的聊天会话列表
+
+    指定 limit 或 cursor 时按 (updated_at, id) 游标分页，返回分页格式。
+    """
+    # 等待该用户尚在写入队列中的消息和标题写入
+    await message_writer.wait_for(current_user.id)
+    conditions = (
         ChatSession.user_id == current_user.id,
         ChatSession.mode == mode  # 按模式过滤
-    ).order_by(ChatSession.updated_at.desc()).all()
+    )
+    paginated = limit is not None or cursor is not None
+    if paginated:
+        sessions, page_info = await db.run_sync(lambda sync_db: keyset_paginate(
+            sync_db, sync_db.query(ChatSession).filter(*conditions), ChatSession,
+            1, limit or 20, cursor, "none", sort_column="updated_at"
+        ))
+    else:
+        sessions = (await db.scalars(
+            select(ChatSession).where(*conditions).order_by(ChatSession.updated_at.desc())
+        )).all()
     
-    # 添加消息数量和最后一条消息
+    # 添加消息数量和最后一条用户消息（一次查询统计全部会话）
+    summaries = await db.run_sync(session_summaries, ChatMessage, [session.id for session in sessions])
     session_data = []
     for session in sessions:
-        # 获取最后一条用户消息作为预览
-        last_message = db.query(ChatMessage).filter(
-            ChatMessage.session_id == session.id,
-            ChatMessage.role == "user"
-        ).order_by(ChatMessage.created_at.desc()).first()
-        
-        message_count = db.query(ChatMessage).filter(
-            ChatMessage.session_id == session.id
-        ).count()
-        
+        message_count, last_message = summaries.get(session.id, (0, ""))
         session_dict = ChatSessionResponse.from_orm(session).dict()
         # 手动处理 datetime 序列化
         session_dict['created_at'] = session.created_at.isoformat()
         session_dict['updated_at'] = session.updated_at.isoformat()
         session_dict["message_count"] = message_count
-        session_dict["last_message"] = last_message.content if last_message else ""
+        session_dict["last_message"] = last_message
         session_data.append(session_dict)
     
     return ApiResponse(
         message="Chat sessions retrieved successfully",
-        data=session_data
+        data=PaginatedResponse(
+            page=1,
+            page_size=limit or 20,
+            records=session_data,
+            **page_info
+        ) if paginated else session_data
     )
 
 @router.post("/sessions", response_model=ApiResponse)
 async def create_chat_session(
     session_data: ChatSessionCreate,
-    current_user: User = Depends(get_current_active_user),
-    db: Session = Depends(get_db)
+    current_user: User = Depends(get_current_active_user_async),
+    db: AsyncSession = Depends(get_async_db)
 ):
     """创建新的聊天会话"""
     session = ChatSession(
@@ -74,8 +95,8 @@ async def create_chat_session(
     )
     
     db.add(session)
-    db.commit()
-    db.refresh(session)
+    await db.commit()
+    await db.refresh(session)
     
     session_response = ChatSessionResponse.from_orm(session).dict()
     session_response['created_at'] = session.created_at.isoformat()
@@ -89,14 +110,14 @@ async def create_chat_session(
 @router.get("/sessions/{session_id}", response_model=ApiResponse)
 async def get_chat_session(
     session_id: str,
-    current_user: User = Depends(get_current_active_user),
-    db: Session = Depends(get_db)
+    current_user: User = Depends(get_current_active_user_async),
+    db: AsyncSession = Depends(get_async_db)
 ):
     """获取聊天会话详情和消息"""
-    session = db.query(ChatSession).filter(
+    session = await db.scalar(select(ChatSession).where(
         ChatSession.id == session_id,
         ChatSession.user_id == current_user.id
-    ).first()
+    ))
     
     if not session:
         raise HTTPException(
@@ -104,41 +125,47 @@ async def get_chat_session(
             detail="Chat session not found"
         )
     
-    # 获取会话消息
-    messages = db.query(ChatMessage).filter(
-        ChatMessage.session_id == session_id
-    ).order_by(ChatMessage.created_at.asc()).all()
-    
-    session_data = ChatSessionWithMessages.from_orm(session).dict()
-    # 手动处理 datetime 序列化
-    session_data['created_at'] = session.created_at.isoformat()
-    session_data['updated_at'] = session.updated_at.isoformat()
+    # 获取会话消息（先等待该会话尚在写入队列中的消息）
+    await message_writer.wait_for(session_id)
+    messages = (await db.scalars(
+        select(ChatMessage).where(
+            ChatMessage.session_id == session_id
+        ).order_by(ChatMessage.created_at.asc())
+    )).all()
     
+    # 只返回消息列表（不经过 session.messages 关系属性，异步会话中不能延迟加载）
     messages_data = []
     for msg in messages:
         msg_data = ChatMessageResponse.from_orm(msg).dict()
         msg_data['created_at'] = msg.created_at.isoformat()
         messages_data.append(msg_data)
-    session_data["messages"] = messages_data
     
     return ApiResponse(
         message="Chat session retrieved successfully",
-        data=session_data["messages"]  # 只返回消息列表
+        data=messages_data
     )
 
 @router.post("/sessions/{session_id}/messages")
 async def send_message_stream(
     session_id: str,
     message_data: ChatMessageCreate,
-    current_user: User = Depends(get_current_active_user),
-    db: Session = Depends(get_db)
+    current_user: User = Depends(get_current_active_user_async),
+    db: AsyncSession = Depends(get_async_db),
+    last_event_id: Optional[str] = Header(None, description="断线重连时携带最后收到的事件ID，续传正在进行的回答"),
+    stream_resume: bool = Header(False, alias="X-Stream-Resume", description="客户端支持断线续传时为 true，断开后生成保留宽限期等待重连")
 ):
-    """发送消息到聊天会话（流式响应）"""
+    """发送消息到聊天会话（流式响应）
+
+    回答在后台任务中生成，每帧带事件ID；断线后携带 Last-Event-ID 重新请求，
+    补发错过的帧并继续接收同一次生成，不会重复保存消息或重新调用LLM。
+    只有请求带 X-Stream-Resume: true 时断开后才等待重连，否则断开即停止生成。
+    用户消息不等待提交就开始调用LLM，用户消息、回答和标题交给写后队列写入。
+    """
     # 验证会话存在且属于当前用户
-    session = db.query(ChatSession).filter(
+    session = await db.scalar(select(ChatSession).where(
         ChatSession.id == session_id,
         ChatSession.user_id == current_user.id
-    ).first()
+    ))
     
     if not session:
         raise HTTPException(
@@ -146,36 +173,58 @@ async def send_message_stream(
             detail="Chat session not found"
         )
     
-    # 创建用户消息
+    # 续传只接受本会话的回答
+    if last_event_id:
+        return stream_replay.response(*stream_replay.resume(last_event_id, current_user.id, "chat", session_id))
+    
+    # 创建用户消息（写入时间在入队时确定，保证排在本轮回答之前）
     user_message = ChatMessage(
         id=generate_session_id(),
         session_id=session_id,
         role="user",
-        content=message_data.content
+        content=message_data.content,
+        truncated=False,
+        created_at=utc_now()
     )
+    write_keys = (session_id, current_user.id)
     
-    db.add(user_message)
-    db.commit()
-    db.refresh(user_message)
+    # 上一轮的回答可能仍在写入队列中，构建上下文前等待写入
+    await message_writer.wait_for(session_id)
     
-    # 获取会话历史用于AI上下文
-    messages = db.query(ChatMessage).filter(
-        ChatMessage.session_id == session_id
-    ).order_by(ChatMessage.created_at.asc()).all()
+    # 构建AI上下文：预算内的最近消息 + 较早消息的摘录窗口，本轮用户消息尚未写入，直接加在最后
+    ai_messages, message_count = await db.run_sync(
+        lambda sync_db: chat_context_builder.build(sync_db, session, user_message)
+    )
+    message_writer.add(user_message, write_keys)
+    # 折叠摘要时更新了会话，updated_at 由数据库生成，需要重新加载
+    if "updated_at" in inspect(session).unloaded:
+        await db.refresh(session)
     
-    # 构建AI消息历史
-    ai_messages = []
-    for msg in messages:
-        ai_messages.append({
-            "role": msg.role,
-            "content": msg.content
-        })
+    # 知识库模式：检索相关资料注入提示词，并记录引用
+    references = None
+    if session.mode == "kb":
+        passages = await knowledge_retriever.retrieve(db, message_data.content)
+        context_message = knowledge_retriever.build_context_message(passages)
+        if context_message:
+            ai_messages.insert(0, context_message)
+            references = knowledge_retriever.to_references(passages)
+    
+    # 结束读事务并归还连接：流式输出期间不占用连接池，回答完成后再取连接写入
+    await db.commit()
     
     # 创建流式响应生成器
     async def generate_response():
         assistant_message_id = generate_session_id()
-        full_content = ""
+        answer_parts = []
         reasoning_content = ""
+        max_tokens = 2000
+        sse = SSEWriter("chat")
+        chunks = coalesce_deltas(ai_service.stream_chat_completion(
+            ai_messages, 
+            mode=session.mode,
+            temperature=0.7,
+            max_tokens=max_tokens
+        ))
         
         try:
             # 发送会话信息（用于前端同步）
@@ -186,90 +235,105 @@ async def send_message_stream(
                 'created_at': session.created_at.isoformat(),
                 'updated_at': session.updated_at.isoformat()
             }
-            yield f"data: {json.dumps({'type': 'session_info', 'data': session_info})}\n\n"
+            yield sse.frame({'type': 'session_info', 'data': session_info})
             
             # 发送用户消息确认
             user_msg_data = ChatMessageResponse.from_orm(user_message).dict()
             user_msg_data['created_at'] = user_message.created_at.isoformat()
-            yield f"data: {json.dumps({'type': 'user_message', 'data': user_msg_data})}\n\n"
+            yield sse.frame({'type': 'user_message', 'data': user_msg_data})
+            
+            # 在回答之前发送引用的知识库资料
+            if references:
+                yield sse.frame({'type': 'references', 'message_id': assistant_message_id, 'data': references})
             
             # 获取AI流式响应
-            async for chunk in ai_service.stream_chat_completion(
-                ai_messages, 
-                mode=session.mode,
-                temperature=0.7,
-                max_tokens=2000
-            ):
+            async for chunk in chunks:
                 if chunk["type"] == "thinking":
-                    yield f"data: {json.dumps(chunk)}\n\n"
+                    yield sse.frame(chunk)
                 elif chunk["type"] == "answer_start":
-                    yield f"data: {json.dumps({'type': 'answer_start', 'message_id': assistant_message_id})}\n\n"
+                    yield sse.frame({'type': 'answer_start', 'message_id': assistant_message_id})
                 elif chunk["type"] == "answer":
-                    full_content += chunk["content"]
-                    yield f"data: {json.dumps(chunk)}\n\n"
+                    answer_parts.append(chunk["content"])
+                    yield sse.frame(chunk)
                 elif chunk["type"] == "done":
-                    # 不要覆盖累积的内容，使用已经累积的full_content
+                    # 不要覆盖累积的内容，使用已经累积的回答片段
                     reasoning_content = chunk.get("reasoning", "")
+                    full_content = "".join(answer_parts)
                     
-                    # 保存AI响应到数据库
+                    # 保存AI响应到数据库（交给写后队列，不等待提交）
                     assistant_message = ChatMessage(
                         id=assistant_message_id,
                         session_id=session_id,
                         role="assistant",
-                        content=full_content  # 使用累积的完整内容
+                        content=full_content,  # 使用累积的完整内容
+                        references=references,
+                        truncated=False,
+                        created_at=utc_now()
                     )
-                    
-                    db.add(assistant_message)
+                    message_writer.add(assistant_message, write_keys)
                     
                     # 更新会话时间和标题（如果是第一条消息）
-                    if len(ai_messages) <= 2:  # 系统消息 + 用户消息
-                        # 生成会话标题（取用户消息的前20个字符）
-                        session.title = message_data.content[:20] + ("..." if len(message_data.content) > 20 else "")
-                    
-                    # 让数据库自动更新 updated_at 字段
-                    # session.updated_at 会通过 onupdate=func.now() 自动更新
-                    db.commit()
-                    db.refresh(assistant_message)
+                    if message_count <= 2:  # 系统消息 + 用户消息
+                        # 生成会话标题（取用户消息的前20个字符），updated_at 通过 onupdate=func.now() 自动更新
+                        message_writer.update(ChatSession, session_id, {
+                            'title': message_data.content[:20] + ("..." if len(message_data.content) > 20 else "")
+                        }, write_keys)
                     
                     # 发送完成消息
                     assistant_msg_data = ChatMessageResponse.from_orm(assistant_message).dict()
                     assistant_msg_data['created_at'] = assistant_message.created_at.isoformat()
-                    yield f"data: {json.dumps({'type': 'assistant_message', 'data': assistant_msg_data})}\n\n"
-                    yield f"data: {json.dumps({'type': 'done'})}\n\n"
+                    yield sse.frame({'type': 'assistant_message', 'data': assistant_msg_data})
+                    yield sse.frame({'type': 'done'})
                     break
                 elif chunk["type"] == "usage":
-                    yield f"data: {json.dumps(chunk)}\n\n"
+                    yield sse.frame(chunk)
+                elif chunk["type"] == "error":
+                    yield sse.frame(chunk)
+                    break
                     
+        except CLIENT_DISCONNECTED:
+            # 客户端断开后宽限期内未重连：停止上游生成，保存已输出的部分回答并标记为截断
+            partial_content = "".join(answer_parts)
+            sse.disconnected(partial_content, estimate_tokens(partial_content), max_tokens, lambda content: message_writer.add(ChatMessage(
+                id=assistant_message_id,
+                session_id=session_id,
+                role="assistant",
+                content=content,
+                references=references,
+                truncated=True,
+                created_at=utc_now()
+            ), write_keys))
+            raise
         except Exception as e:
             error_msg = f"AI响应生成失败: {str(e)}"
-            yield f"data: {json.dumps({'type': 'error', 'message': error_msg})}\n\n"
+            yield sse.frame({'type': 'error', 'message': error_msg})
+        finally:
+            await chunks.aclose()
+            sse.close()
     
-    return StreamingResponse(
-        generate_response(),
-        media_type="text/plain",
-        headers={
-            "Cache-Control": "no-cache",
-            "Connection": "keep-alive",
-            "Content-Type": "text/event-stream"
-        }
-    )
+    return stream_replay.response(stream_replay.start("chat", current_user.id, generate_response(), session_id, stream_resume))
 
 # 新增：自动创建会话的消息发送接口
 @router.post("/messages")
 async def send_message_auto_session(
     message_data: ChatMessageCreate,
-    current_user: User = Depends(get_current_active_user),
-    db: Session = Depends(get_db)
+    current_user: User = Depends(get_current_active_user_async),
+    db: AsyncSession = Depends(get_async_db),
+    last_event_id: Optional[str] = Header(None, description="断线重连时携带最后收到的事件ID，续传正在进行的回答"),
+    stream_resume: bool = Header(False, alias="X-Stream-Resume", description="客户端支持断线续传时为 true，断开后生成保留宽限期等待重连")
 ):
     """发送消息（自动创建会话）"""
+    if last_event_id:
+        return stream_replay.response(*stream_replay.resume(last_event_id, current_user.id, "chat"))
+    
     # 检查用户是否有该模式的活跃会话
     mode = getattr(message_data, 'mode', 'kb')
     
     # 查找最近的会话
-    recent_session = db.query(ChatSession).filter(
+    recent_session = await db.scalar(select(ChatSession).where(
         ChatSession.user_id == current_user.id,
         ChatSession.mode == mode
-    ).order_by(ChatSession.updated_at.desc()).first()
+    ).order_by(ChatSession.updated_at.desc()))
     
     # 如果没有会话或最近会话超过24小时，创建新会话
     if not recent_session:
@@ -281,26 +345,26 @@ async def send_message_auto_session(
             mode=mode
         )
         db.add(session)
-        db.commit()
-        db.refresh(session)
+        await db.commit()
+        await db.refresh(session)
         session_id = session.id
     else:
         session_id = recent_session.id
     
     # 重定向到流式消息接口
-    return await send_message_stream(session_id, message_data, current_user, db)
+    return await send_message_stream(session_id, message_data, current_user, db, None, stream_resume)
 
 @router.delete("/sessions/{session_id}", response_model=ApiResponse)
 async def delete_chat_session(
     session_id: str,
-    current_user: User = Depends(get_current_active_user),
-    db: Session = Depends(get_db)
+    current_user: User = Depends(get_current_active_user_async),
+    db: AsyncSession = Depends(get_async_db)
 ):
     """删除聊天会话"""
-    session = db.query(ChatSession).filter(
+    session = await db.scalar(select(ChatSession).where(
         ChatSession.id == session_id,
         ChatSession.user_id == current_user.id
-    ).first()
+    ))
     
     if not session:
         raise HTTPException(
@@ -308,41 +372,60 @@ async def delete_chat_session(
             detail="Chat session not found"
         )
     
-    # 先删除相关的消息
-    messages = db.query(ChatMessage).filter(ChatMessage.session_id == session_id).all()
-    for message in messages:
-        db.delete(message)
-    
-    # 再删除会话
-    db.delete(session)
-    db.commit()
+    # 队列中的消息写入后再删除，避免删除后又写入孤立的消息
+    await message_writer.wait_for(session_id)
+    # 按会话ID直接删除消息和会话，不加载消息
+    await db.run_sync(lambda sync_db: session_purger.delete_sessions(
+        ChatSession, ChatMessage, [session.id], db=sync_db
+    ))
     
     return ApiResponse(message="Chat session deleted successfully")
 
 @router.delete("/sessions", response_model=ApiResponse)
 async def clear_all_chat_sessions(
     mode: str = "kb",  # 添加模式参数，只清空指定模式的会话
-    current_user: User = Depends(get_current_active_user),
-    db: Session = Depends(get_db)
+    current_user: User = Depends(get_current_active_user_async),
+    db: AsyncSession = Depends(get_async_db)
 ):
-    """清空用户的所有聊天会话"""
-    # 获取用户在指定模式下的所有会话
-    sessions = db.query(ChatSession).filter(
+    """清空用户的所有聊天会话
+
+    会话较多时在后台分块删除，返回任务信息，通过 /purge-jobs/{job_id} 查询进度。
+    """
+    await message_writer.wait_for(current_user.id)
+    # 获取用户在指定模式下的所有会话ID
+    session_ids = (await db.scalars(select(ChatSession.id).where(
         ChatSession.user_id == current_user.id,
         ChatSession.mode == mode
-    ).all()
+    ))).all()
     
-    deleted_count = 0
-    for session in sessions:
-        # 先删除相关的消息
-        messages = db.query(ChatMessage).filter(ChatMessage.session_id == session.id).all()
-        for message in messages:
-            db.delete(message)
-        
-        # 再删除会话
-        db.delete(session)
-        deleted_count += 1
+    if len(session_ids) > settings.session_purge_background_threshold:
+        job = session_purger.start_job(current_user.id, "chat_sessions", ChatSession, ChatMessage, session_ids)
+        return ApiResponse(
+            message=f"Clearing {len(session_ids)} chat sessions in background",
+            data=job.as_dict()
+        )
     
-    db.commit()
+    deleted_count, _ = await db.run_sync(lambda sync_db: session_purger.delete_sessions(
+        ChatSession, ChatMessage, session_ids, db=sync_db
+    ))
     
-    return ApiResponse(message=f"Successfully cleared {deleted_count} chat sessions") 
\ No newline at end of file
+    return ApiResponse(message=f"Successfully cleared {deleted_count} chat sessions")
+
+@router.get("/purge-jobs/{job_id}", response_model=ApiResponse)
+async def get_purge_job(
+    job_id: str,
+    current_user: User = Depends(get_current_active_user_async)
+):
+    """查询后台清空会话任务的进度"""
+    job = session_purger.get_job(job_id, current_user.id)
+    
+    if not job:
+        raise HTTPException(
+            status_code=status.HTTP_404_NOT_FOUND,
+            detail="Purge job not found"
+        )
+    
+    return ApiResponse(
+        message="Purge job retrieved successfully",
+        data=job.as_dict()
+    )
@@ -1,11 +1,13 @@
-from fastapi import APIRouter, Depends, HTTPException, status
-from fastapi.responses import StreamingResponse
-from sqlalchemy.orm import Session
-from typing import List
-import json
-from app.core.database import get_db
-from app.core.deps import get_current_active_user
+from fastapi import APIRouter, Depends, HTTPException, status, Query, Header
+from sqlalchemy import select
+from sqlalchemy.ext.asyncio import AsyncSession
+from typing import List, Optional
+from app.core.database import get_async_db
+from app.core.deps import get_current_active_user_async
+from app.core.pagination import keyset_paginate
 from app.core.security import generate_session_id
+from app.core.sse import CLIENT_DISCONNECTED, SSEWriter, coalesce_deltas
+from app.core.stream_replay import stream_replay
 from app.models.user import User
 from app.models.emergency import EmergencySession, EmergencyMessage
 from app.schemas.emergency import (
@@ -17,8 +19,12 @@ from app.schemas.emergency import (
     EmergencyMessageResponse
 )
 from pydantic import BaseModel
-from app.schemas.common import ApiResponse
+from app.schemas.common import ApiResponse, PaginatedResponse
 from app.services.ai_service import ai_service
+from app.services.context_builder import estimate_tokens
+from app.services.message_writer import message_writer, utc_now
+from app.services.session_summaries import session_summaries
+from app.services.session_purge import session_purger
 
 router = APIRouter()
 
@@ -137,40 +143,57 @@ async def get_nearby_equipment(
 
 @router.get("/sessions", response_model=ApiResponse)
 async def get_emergency_sessions(
-    current_user: User = Depends(get_current_active_user),
-    db: Session = Depends(get_db)
+    current_user: User = Depends(get_current_active_user_async),
+    db: AsyncSession = Depends(get_async_db),
+    limit: Optional[int] = Query(None, ge=1, le=100, description="每页会话数，不指定时返回全部会话"),
+    cursor: Optional[str] = Query(None, description="上一页返回的 next_cursor")
 ):
-    """获取用户的应急会话列表"""
-    sessions = db.query(EmergencySession).filter(
-        EmergencySession.user_id == current_user.id
-    ).order_by(EmergencySession.updated_at.desc()).all()
+    """获取用户的应急会话列表
+
+    指定 limit 或 cursor 时按 (updated_at, id) 游标分页，返回分页格式。
+    """
+    # 等待该用户尚在写入队列中的消息和会话更新写入
+    await message_writer.wait_for(current_user.id)
+    condition = EmergencySession.user_id == current_user.id
+    paginated = limit is not None or cursor is not None
+    if paginated:
+        sessions, page_info = await db.run_sync(lambda sync_db: keyset_paginate(
+            sync_db, sync_db.query(EmergencySession).filter(condition), EmergencySession,
+            1, limit or 20, cursor, "none", sort_column="updated_at"
+        ))
+    else:
+        sessions = (await db.scalars(
+            select(EmergencySession).where(condition).order_by(EmergencySession.updated_at.desc())
+        )).all()
     
-    # 添加最后一条消息信息
+    # 添加消息数量和最后一条用户消息（一次查询统计全部会话）
+    summaries = await db.run_sync(session_summaries, EmergencyMessage, [session.id for session in sessions])
     session_data = []
     for session in sessions:
-        # 获取最后一条用户消息作为预览
-        last_message = db.query(EmergencyMessage).filter(
-            EmergencyMessage.session_id == session.id,
-            EmergencyMessage.role == "user"
-        ).order_by(EmergencyMessage.created_at.desc()).first()
-        
+        message_count, last_message = summaries.get(session.id, (0, ""))
         session_dict = EmergencySessionResponse.from_orm(session).dict()
         # 手动处理 datetime 序列化
         session_dict['created_at'] = session.created_at.isoformat()
         session_dict['updated_at'] = session.updated_at.isoformat()
-        session_dict["last_message"] = last_message.content if last_message else ""
+        session_dict["message_count"] = message_count
+        session_dict["last_message"] = last_message
         session_data.append(session_dict)
     
     return ApiResponse(
         message="Emergency sessions retrieved successfully",
-        data=session_data
+        data=PaginatedResponse(
+            page=1,
+            page_size=limit or 20,
+            records=session_data,
+            **page_info
+        ) if paginated else session_data
     )
 
 @router.post("/sessions", response_model=ApiResponse)
 async def create_emergency_session(
     session_data: EmergencySessionCreate,
-    current_user: User = Depends(get_current_active_user),
-    db: Session = Depends(get_db)
+    current_user: User = Depends(get_current_active_user_async),
+    db: AsyncSession = Depends(get_async_db)
 ):
     """创建新的应急会话"""
     session = EmergencySession(
@@ -182,8 +205,8 @@ async def create_emergency_session(
     )
     
     db.add(session)
-    db.commit()
-    db.refresh(session)
+    await db.commit()
+    await db.refresh(session)
     
     # 不再自动创建初始指导消息，让用户主动开始对话
     
@@ -196,14 +219,14 @@ async def create_emergency_session(
 @router.get("/sessions/{session_id}", response_model=ApiResponse)
 async def get_emergency_session(
     session_id: str,
-    current_user: User = Depends(get_current_active_user),
-    db: Session = Depends(get_db)
+    current_user: User = Depends(get_current_active_user_async),
+    db: AsyncSession = Depends(get_async_db)
 ):
     """获取特定应急会话及其消息"""
-    session = db.query(EmergencySession).filter(
+    session = await db.scalar(select(EmergencySession).where(
         EmergencySession.id == session_id,
         EmergencySession.user_id == current_user.id
-    ).first()
+    ))
     
     if not session:
         raise HTTPException(
@@ -211,9 +234,13 @@ async def get_emergency_session(
             detail="Emergency session not found"
         )
     
-    messages = db.query(EmergencyMessage).filter(
-        EmergencyMessage.session_id == session_id
-    ).order_by(EmergencyMessage.created_at.asc()).all()
+    # 先等待该会话尚在写入队列中的消息
+    await message_writer.wait_for(session_id)
+    messages = (await db.scalars(
+        select(EmergencyMessage).where(
+            EmergencyMessage.session_id == session_id
+        ).order_by(EmergencyMessage.created_at.asc())
+    )).all()
     
     # 只返回消息列表，与前端期望的格式一致
     messages_data = []
@@ -231,15 +258,22 @@ async def get_emergency_session(
 async def send_emergency_message(
     session_id: str,
     message_data: EmergencyMessageCreate,
-    current_user: User = Depends(get_current_active_user),
-    db: Session = Depends(get_db)
+    current_user: User = Depends(get_current_active_user_async),
+    db: AsyncSession = Depends(get_async_db),
+    last_event_id: Optional[str] = Header(None, description="断线重连时携带最后收到的事件ID，续传正在进行的指导"),
+    stream_resume: bool = Header(False, alias="X-Stream-Resume", description="客户端支持断线续传时为 true，断开后生成保留宽限期等待重连")
 ):
-    """发送消息到应急会话（流式响应）"""
+    """发送消息到应急会话（流式响应）
+
+    指导在后台任务中生成，断线后携带 Last-Event-ID 重新请求即可续传，不重新调用LLM。
+    只有请求带 X-Stream-Resume: true 时断开后才等待重连，否则断开即停止生成。
+    用户消息不等待提交就开始调用LLM，消息和会话更新交给写后队列写入。
+    """
     # 验证会话存在且属于当前用户
-    session = db.query(EmergencySession).filter(
+    session = await db.scalar(select(EmergencySession).where(
         EmergencySession.id == session_id,
         EmergencySession.user_id == current_user.id
-    ).first()
+    ))
     
     if not session:
         raise HTTPException(
@@ -247,33 +281,46 @@ async def send_emergency_message(
             detail="Emergency session not found"
         )
     
-    # 创建用户消息
+    # 续传只接受本会话的指导
+    if last_event_id:
+        return stream_replay.response(*stream_replay.resume(last_event_id, current_user.id, "emergency", session_id))
+    
+    # 创建用户消息（写入时间在入队时确定，保证排在本轮指导之前）
     user_message = EmergencyMessage(
         id=generate_session_id(),
         session_id=session_id,
         role="user",
-        content=message_data.content
+        content=message_data.content,
+        truncated=False,
+        created_at=utc_now()
     )
+    write_keys = (session_id, current_user.id)
     
-    db.add(user_message)
-    db.commit()
-    db.refresh(user_message)
+    # 获取会话历史用于AI上下文（先等待上一轮尚在写入队列中的消息），本轮用户消息尚未写入，直接加在最后
+    await message_writer.wait_for(session_id)
+    messages = (await db.scalars(
+        select(EmergencyMessage).where(
+            EmergencyMessage.session_id == session_id
+        ).order_by(EmergencyMessage.created_at.asc())
+    )).all()
+    messages.append(user_message)
+    # 结束读事务并归还连接：流式输出期间不占用连接池
+    await db.commit()
+    message_writer.add(user_message, write_keys)
     
     # 创建流式响应生成器
     async def generate_response():
         assistant_message_id = generate_session_id()
-        full_content = ""
+        answer_parts = []
+        max_tokens = 2000
+        sse = SSEWriter("emergency")
+        chunks = None
         
         try:
             # 发送用户消息确认
             user_msg_data = EmergencyMessageResponse.from_orm(user_message).dict()
             user_msg_data['created_at'] = user_message.created_at.isoformat()
-            yield f"data: {json.dumps({'type': 'user_message', 'data': user_msg_data})}\n\n"
-            
-            # 获取会话历史用于AI上下文
-            messages = db.query(EmergencyMessage).filter(
-                EmergencyMessage.session_id == session_id
-            ).order_by(EmergencyMessage.created_at.asc()).all()
+            yield sse.frame({'type': 'user_message', 'data': user_msg_data})
             
             # 构建AI消息历史
             ai_messages = []
@@ -301,19 +348,20 @@ async def send_emergency_message(
                 })
             
             # 获取AI流式响应
-            async for chunk in ai_service.stream_chat_completion(
+            chunks = coalesce_deltas(ai_service.stream_chat_completion(
                 ai_messages, 
                 mode="emergency",
                 temperature=0.2,
-                max_tokens=2000
-            ):
+                max_tokens=max_tokens
+            ))
+            async for chunk in chunks:
                 if chunk["type"] == "answer_start":
-                    yield f"data: {json.dumps({'type': 'answer_start', 'message_id': assistant_message_id})}\n\n"
+                    yield sse.frame({'type': 'answer_start', 'message_id': assistant_message_id})
                 elif chunk["type"] == "answer":
-                    full_content += chunk["content"]
-                    yield f"data: {json.dumps(chunk)}\n\n"
+                    answer_parts.append(chunk["content"])
+                    yield sse.frame(chunk)
                 elif chunk["type"] == "done":
-                    full_content = chunk["content"]
+                    full_content = chunk.get("content") or "".join(answer_parts)
                     
                     # 解析步骤和设备（简单实现）
                     steps = []
@@ -327,60 +375,67 @@ async def send_emergency_message(
                         elif line.startswith(('设备', '器材', '工具')):
                             equipment.append(line)
                     
-                    # 保存AI响应到数据库
+                    # 保存AI响应到数据库（交给写后队列，不等待提交）
                     assistant_message = EmergencyMessage(
                         id=assistant_message_id,
                         session_id=session_id,
                         role="assistant",
                         content=full_content,
                         steps=steps[:5] if steps else None,
-                        equipment=equipment[:5] if equipment else None
+                        equipment=equipment[:5] if equipment else None,
+                        truncated=False,
+                        created_at=utc_now()
                     )
+                    message_writer.add(assistant_message, write_keys)
                     
-                    db.add(assistant_message)
-                    
-                    # 触发会话的updated_at自动更新（通过修改任意字段）
-                    session.status = session.status  # 这会触发onupdate
-                    db.commit()
-                    db.refresh(assistant_message)
+                    # 更新会话的updated_at
+                    message_writer.update(EmergencySession, session_id, {'updated_at': assistant_message.created_at}, write_keys)
                     
                     # 发送完成消息
                     assistant_msg_data = EmergencyMessageResponse.from_orm(assistant_message).dict()
                     assistant_msg_data['created_at'] = assistant_message.created_at.isoformat()
-                    yield f"data: {json.dumps({'type': 'assistant_message', 'data': assistant_msg_data})}\n\n"
-                    yield f"data: {json.dumps({'type': 'done'})}\n\n"
+                    yield sse.frame({'type': 'assistant_message', 'data': assistant_msg_data})
+                    yield sse.frame({'type': 'done'})
                     break
                 elif chunk["type"] == "usage":
-                    yield f"data: {json.dumps(chunk)}\n\n"
+                    yield sse.frame(chunk)
                 elif chunk["type"] == "error":
-                    yield f"data: {json.dumps(chunk)}\n\n"
+                    yield sse.frame(chunk)
                     break
                     
+        except CLIENT_DISCONNECTED:
+            # 客户端断开后宽限期内未重连：停止上游生成，保存已输出的部分指导并标记为截断
+            partial_content = "".join(answer_parts)
+            sse.disconnected(partial_content, estimate_tokens(partial_content), max_tokens, lambda content: message_writer.add(EmergencyMessage(
+                id=assistant_message_id,
+                session_id=session_id,
+                role="assistant",
+                content=content,
+                truncated=True,
+                created_at=utc_now()
+            ), write_keys))
+            raise
         except Exception as e:
             error_msg = f"应急指导生成失败: {str(e)}"
-            yield f"data: {json.dumps({'type': 'error', 'message': error_msg})}\n\n"
+            yield sse.frame({'type': 'error', 'message': error_msg})
+        finally:
+            if chunks is not None:
+                await chunks.aclose()
+            sse.close()
     
-    return StreamingResponse(
-        generate_response(),
-        media_type="text/plain",
-        headers={
-            "Cache-Control": "no-cache",
-            "Connection": "keep-alive",
-            "Content-Type": "text/event-stream"
-        }
-    )
+    return stream_replay.response(stream_replay.start("emergency", current_user.id, generate_response(), session_id, stream_resume))
 
 @router.delete("/sessions/{session_id}", response_model=ApiResponse)
 async def delete_emergency_session(
     session_id: str,
-    current_user: User = Depends(get_current_active_user),
-    db: Session = Depends(get_db)
+    current_user: User = Depends(get_current_active_user_async),
+    db: AsyncSession = Depends(get_async_db)
 ):
     """删除应急会话"""
-    session = db.query(EmergencySession).filter(
+    session = await db.scalar(select(EmergencySession).where(
         EmergencySession.id == session_id,
         EmergencySession.user_id == current_user.id
-    ).first()
+    ))
     
     if not session:
         raise HTTPException(
@@ -388,7 +443,11 @@ async def delete_emergency_session(
             detail="Emergency session not found"
         )
     
-    db.delete(session)
-    db.commit()
+    # 队列中的消息写入后再删除，避免删除后又写入孤立的消息
+    await message_writer.wait_for(session_id)
+    # 按会话ID直接删除消息和会话，不加载消息
+    await db.run_sync(lambda sync_db: session_purger.delete_sessions(
+        EmergencySession, EmergencyMessage, [session.id], db=sync_db
+    ))
     
     return ApiResponse(message="Emergency session deleted successfully") 
\ No newline at end of file
@@ -1,109 +1,178 @@
-from fastapi import APIRouter, Depends, HTTPException, status, Query
+from fastapi import APIRouter, Depends, HTTPException, status, Query, Request, Response, UploadFile, File
+from sqlalchemy import select
+from sqlalchemy.ext.asyncio import AsyncSession
 from sqlalchemy.orm import Session
-from typing import List
-from app.core.database import get_db
-from app.core.deps import get_current_active_user, get_admin_user
+import asyncio
+from typing import List, Optional, Tuple
+from app.core.database import get_async_db
+from app.core.deps import get_current_active_user_async, get_admin_user_async
+from app.core.pagination import keyset_paginate, offset_cursor, offset_page_info, TotalMode
+from app.core.projection import parse_fields, column_options, project
 from app.models.user import User
 from app.models.knowledge import KnowledgeCategory, KnowledgeItem, VideoLink, BookLink, UserFavorite
 from app.schemas.knowledge import (
-    KnowledgeCategoryResponse, KnowledgeItemResponse, VideoLinkResponse, 
+    KnowledgeItemResponse, VideoLinkResponse, 
     BookLinkResponse, UserFavoriteResponse, KnowledgeItemCreate, KnowledgeItemUpdate,
-    VideoLinkCreate, VideoLinkUpdate, BookLinkCreate, BookLinkUpdate
+    VideoLinkCreate, VideoLinkUpdate, BookLinkCreate, BookLinkUpdate,
+    KNOWLEDGE_ITEM_FIELDS, KNOWLEDGE_ITEM_FIELD_PRESETS, VIDEO_LINK_FIELDS, BOOK_LINK_FIELDS, LINK_FIELD_PRESETS
 )
 from app.schemas.common import ApiResponse, PaginatedResponse
+from app.services.knowledge_index import knowledge_index
+from app.services.knowledge_fts import knowledge_fts
+from app.services.knowledge_vectors import knowledge_vectors
+from app.services.knowledge_sync import knowledge_sync
+from app.services.category_cache import category_tree_cache
+from app.services.item_counters import item_counters
+from app.services.knowledge_importer import knowledge_importer, detect_format, IMPORT_FORMATS
 
 router = APIRouter()
 
+def search_items_page(
+    db: Session,
+    keyword: str,
+    offset: int,
+    limit: int,
+    category_id: Optional[int] = None,
+    content_type: Optional[str] = None,
+    fields: Optional[List[str]] = None
+) -> Optional[Tuple[int, List[KnowledgeItem]]]:
+    """通过检索索引搜索知识条目，只查询当前页，返回 (总数, 当前页条目)
+
+    优先使用内存索引，其次使用数据库全文检索表，两者都不可用时返回 None。
+    fields 为返回的字段，只从数据库读取这些列。
+    同步函数，路由中通过 AsyncSession.run_sync 调用。
+    """
+    result = knowledge_index.search(keyword, category_id, content_type, limit=offset + limit)
+    if result is not None:
+        total, ranked_ids = result
+        page_ids = ranked_ids[offset:offset + limit]
+    else:
+        result = knowledge_fts.search(db, keyword, offset, limit, category_id, content_type)
+        if result is None:
+            return None
+        total, page_ids = result
+    
+    if not page_ids:
+        return total, []
+    
+    items = db.query(KnowledgeItem).options(*column_options(KnowledgeItem, fields)).filter(
+        KnowledgeItem.id.in_(page_ids),
+        KnowledgeItem.status == "active"
+    ).all()
+    items_by_id = {item.id: item for item in items}
+    return total, [items_by_id[item_id] for item_id in page_ids if item_id in items_by_id]
+
+def item_fields(fields: Optional[str]) -> Optional[List[str]]:
+    """解析知识条目列表的 fields 参数"""
+    return parse_fields(fields, KNOWLEDGE_ITEM_FIELDS, KNOWLEDGE_ITEM_FIELD_PRESETS)
+
+def serialize_items(items: List[KnowledgeItem], fields: Optional[List[str]]) -> list:
+    """未指定 fields 时返回完整条目，否则只返回指定字段"""
+    if fields is None:
+        return [KnowledgeItemResponse.from_orm(item) for item in items]
+    return [project(item, fields) for item in items]
+
+# fields 参数说明
+FIELDS_DESCRIPTION = "逗号分隔的返回字段或预设（summary 不含正文），默认返回全部字段"
+
 @router.get("/categories", response_model=ApiResponse)
 async def get_knowledge_categories(
-    current_user: User = Depends(get_current_active_user),
-    db: Session = Depends(get_db)
+    request: Request,
+    current_user: User = Depends(get_current_active_user_async),
+    db: AsyncSession = Depends(get_async_db)
 ):
-    """获取知识库分类"""
-    # 获取顶级分类
-    categories = db.query(KnowledgeCategory).filter(
-        KnowledgeCategory.parent_id.is_(None),
-        KnowledgeCategory.status == "active"
-    ).order_by(KnowledgeCategory.sort_order).all()
-    
-    # 构建分类树
-    def build_category_tree(category):
-        children = db.query(KnowledgeCategory).filter(
-            KnowledgeCategory.parent_id == category.id,
-            KnowledgeCategory.status == "active"
-        ).order_by(KnowledgeCategory.sort_order).all()
-        
-        category_data = KnowledgeCategoryResponse.from_orm(category)
-        if children:
-            category_data.children = [build_category_tree(child) for child in children]
-        
-        return category_data
-    
-    category_tree = [build_category_tree(cat) for cat in categories]
-    
-    return ApiResponse(
-        message="Knowledge categories retrieved successfully",
-        data=category_tree
-    )
+    """获取知识库分类（缓存的分类树，支持 If-None-Match 条件请求）"""
+    body, version = await db.run_sync(category_tree_cache.get)
+    etag = f'"{version}"'
+    headers = {"ETag": etag, "Cache-Control": "private, no-cache"}
+    if_none_match = request.headers.get("if-none-match")
+    if if_none_match:
+        tags = [tag.strip() for tag in if_none_match.split(",")]
+        if "*" in tags or etag in tags or f"W/{etag}" in tags:
+            return Response(status_code=status.HTTP_304_NOT_MODIFIED, headers=headers)
+    return Response(content=body, media_type="application/json", headers=headers)
 
 @router.get("/items", response_model=ApiResponse)
 async def get_knowledge_items(
-    current_user: User = Depends(get_current_active_user),
-    db: Session = Depends(get_db),
+    current_user: User = Depends(get_current_active_user_async),
+    db: AsyncSession = Depends(get_async_db),
     category_id: int = Query(None),
     content_type: str = Query(None),
     search: str = Query(None),
     page: int = Query(1, ge=1),
-    page_size: int = Query(10, ge=1, le=100)
+    page_size: int = Query(10, ge=1, le=100),
+    cursor: Optional[str] = Query(None, description="上一页返回的 next_cursor"),
+    total: Optional[TotalMode] = Query(None, description="exact、approx 或 none"),
+    fields: Optional[str] = Query(None, description=FIELDS_DESCRIPTION)
 ):
     """获取知识库项目"""
-    offset = (page - 1) * page_size
-    
-    # 构建查询
-    query = db.query(KnowledgeItem).filter(KnowledgeItem.status == "active")
+    selected = item_fields(fields)
+    # 有搜索词时优先使用检索索引（按相关度排序，游标中记录偏移量）
+    offset = offset_cursor(cursor, page, page_size)
+    if search and offset is not None:
+        indexed = await db.run_sync(
+            search_items_page, search, offset, page_size, category_id, content_type, selected
+        )
+        if indexed is not None:
+            search_total, items = indexed
+            return ApiResponse(
+                message="Knowledge items retrieved successfully",
+                data=PaginatedResponse(
+                    page=page,
+                    page_size=page_size,
+                    records=serialize_items(items, selected),
+                    **offset_page_info(offset, page_size, len(items), search_total)
+                )
+            )
+    
+    # 构建查询条件
+    conditions = [KnowledgeItem.status == "active"]
     
     if category_id:
-        query = query.filter(KnowledgeItem.category_id == category_id)
+        conditions.append(KnowledgeItem.category_id == category_id)
     
     if content_type:
-        query = query.filter(KnowledgeItem.content_type == content_type)
+        conditions.append(KnowledgeItem.content_type == content_type)
     
     if search:
-        query = query.filter(
+        conditions.append(
             KnowledgeItem.title.contains(search) |
             KnowledgeItem.content.contains(search) |
             KnowledgeItem.author.contains(search)
         )
     
-    # 获取总数
-    total = query.count()
+    # 按 (created_at, id) 分页（指定 fields 时不读取正文等未返回的列）
+    items, page_info = await db.run_sync(lambda sync_db: keyset_paginate(
+        sync_db,
+        sync_db.query(KnowledgeItem).options(
+            *column_options(KnowledgeItem, selected, ("id", "created_at"))
+        ).filter(*conditions),
+        KnowledgeItem, page, page_size, cursor, total
+    ))
     
-    # 获取分页数据
-    items = query.order_by(KnowledgeItem.created_at.desc()).offset(offset).limit(page_size).all()
-    
-    item_data = [KnowledgeItemResponse.from_orm(item) for item in items]
+    item_data = serialize_items(items, selected)
     
     return ApiResponse(
         message="Knowledge items retrieved successfully",
         data=PaginatedResponse(
-            total=total,
             page=page,
             page_size=page_size,
-            records=item_data
+            records=item_data,
+            **page_info
         )
     )
 
 @router.get("/items/{item_id}", response_model=ApiResponse)
 async def get_knowledge_item(
     item_id: int,
-    current_user: User = Depends(get_current_active_user),
-    db: Session = Depends(get_db)
+    current_user: User = Depends(get_current_active_user_async),
+    db: AsyncSession = Depends(get_async_db)
 ):
     """获取知识库项目详情"""
-    item = db.query(KnowledgeItem).filter(
+    item = await db.scalar(select(KnowledgeItem).where(
         KnowledgeItem.id == item_id,
         KnowledgeItem.status == "active"
-    ).first()
+    ))
     
     if not item:
         raise HTTPException(
@@ -111,28 +180,88 @@ async def get_knowledge_item(
             detail="Knowledge item not found"
         )
     
-    # 增加查看次数
-    item.view_count += 1
-    db.commit()
+    # 增加查看次数（内存累加，后台批量写入）
+    item_counters.increment("view_count", item.id)
+    item_data = KnowledgeItemResponse.from_orm(item)
+    item_data.view_count += item_counters.pending("view_count", item.id)
+    item_data.download_count += item_counters.pending("download_count", item.id)
     
     return ApiResponse(
         message="Knowledge item retrieved successfully",
-        data=KnowledgeItemResponse.from_orm(item)
+        data=item_data
+    )
+
+@router.post("/items/{item_id}/download", response_model=ApiResponse)
+async def download_knowledge_item(
+    item_id: int,
+    current_user: User = Depends(get_current_active_user_async),
+    db: AsyncSession = Depends(get_async_db)
+):
+    """记录一次下载并返回文件链接"""
+    item = await db.scalar(select(KnowledgeItem).where(
+        KnowledgeItem.id == item_id,
+        KnowledgeItem.status == "active"
+    ))
+    
+    if not item or not item.file_url:
+        raise HTTPException(
+            status_code=status.HTTP_404_NOT_FOUND,
+            detail="Knowledge item file not found"
+        )
+    
+    item_counters.increment("download_count", item.id)
+    
+    return ApiResponse(
+        message="Knowledge item download recorded",
+        data={"file_url": item.file_url}
     )
 
 # 管理员API - 知识内容管理
+@router.post("/admin/items/import", response_model=ApiResponse)
+async def import_knowledge_items(
+    file: UploadFile = File(...),
+    format: Optional[str] = Query(None, description="text、ndjson 或 csv，默认按文件扩展名判断"),
+    current_user: User = Depends(get_admin_user_async)
+):
+    """批量导入知识内容（管理员）
+
+    上传内容由框架写入临时文件（超过1MB落盘），在线程池中逐行解析、分批写入，按内容哈希去重。
+    """
+    import_format = format or detect_format(file.filename)
+    if import_format not in IMPORT_FORMATS:
+        raise HTTPException(
+            status_code=status.HTTP_400_BAD_REQUEST,
+            detail=f"Unsupported import format: {import_format}"
+        )
+    
+    loop = asyncio.get_running_loop()
+    try:
+        stats = await loop.run_in_executor(None, knowledge_importer.import_stream, file.file, import_format)
+    except UnicodeDecodeError:
+        raise HTTPException(
+            status_code=status.HTTP_400_BAD_REQUEST,
+            detail="File must be UTF-8 encoded"
+        )
+    finally:
+        await file.close()
+    
+    return ApiResponse(
+        message="Knowledge items imported successfully",
+        data=stats.as_dict()
+    )
+
 @router.post("/admin/items", response_model=ApiResponse)
 async def create_knowledge_item(
     item_data: KnowledgeItemCreate,
-    current_user: User = Depends(get_admin_user),
-    db: Session = Depends(get_db)
+    current_user: User = Depends(get_admin_user_async),
+    db: AsyncSession = Depends(get_async_db)
 ):
     """创建知识内容（管理员）"""
     # 验证分类是否存在
-    category = db.query(KnowledgeCategory).filter(
+    category = await db.scalar(select(KnowledgeCategory).where(
         KnowledgeCategory.id == item_data.category_id,
         KnowledgeCategory.status == "active"
-    ).first()
+    ))
     
     if not category:
         raise HTTPException(
@@ -142,8 +271,8 @@ async def create_knowledge_item(
     
     item = KnowledgeItem(**item_data.dict())
     db.add(item)
-    db.commit()
-    db.refresh(item)
+    await db.commit()
+    await db.refresh(item)
     
     return ApiResponse(
         message="Knowledge item created successfully",
@@ -154,11 +283,11 @@ async def create_knowledge_item(
 async def update_knowledge_item(
     item_id: int,
     item_data: KnowledgeItemUpdate,
-    current_user: User = Depends(get_admin_user),
-    db: Session = Depends(get_db)
+    current_user: User = Depends(get_admin_user_async),
+    db: AsyncSession = Depends(get_async_db)
 ):
     """更新知识内容（管理员）"""
-    item = db.query(KnowledgeItem).filter(KnowledgeItem.id == item_id).first()
+    item = await db.scalar(select(KnowledgeItem).where(KnowledgeItem.id == item_id))
     
     if not item:
         raise HTTPException(
@@ -171,8 +300,8 @@ async def update_knowledge_item(
     for field, value in update_data.items():
         setattr(item, field, value)
     
-    db.commit()
-    db.refresh(item)
+    await db.commit()
+    await db.refresh(item)
     
     return ApiResponse(
         message="Knowledge item updated successfully",
@@ -182,11 +311,11 @@ async def update_knowledge_item(
 @router.delete("/admin/items/{item_id}", response_model=ApiResponse)
 async def delete_knowledge_item(
     item_id: int,
-    current_user: User = Depends(get_admin_user),
-    db: Session = Depends(get_db)
+    current_user: User = Depends(get_admin_user_async),
+    db: AsyncSession = Depends(get_async_db)
 ):
     """删除知识内容（管理员）"""
-    item = db.query(KnowledgeItem).filter(KnowledgeItem.id == item_id).first()
+    item = await db.scalar(select(KnowledgeItem).where(KnowledgeItem.id == item_id))
     
     if not item:
         raise HTTPException(
@@ -196,7 +325,7 @@ async def delete_knowledge_item(
     
     # 软删除
     item.status = "inactive"
-    db.commit()
+    await db.commit()
     
     return ApiResponse(
         message="Knowledge item deleted successfully",
@@ -206,18 +335,23 @@ async def delete_knowledge_item(
 # 视频链接相关API
 @router.get("/videos", response_model=ApiResponse)
 async def get_video_links(
-    current_user: User = Depends(get_current_active_user),
-    db: Session = Depends(get_db),
-    category_id: int = Query(None)
+    current_user: User = Depends(get_current_active_user_async),
+    db: AsyncSession = Depends(get_async_db),
+    category_id: int = Query(None),
+    fields: Optional[str] = Query(None, description=FIELDS_DESCRIPTION)
 ):
     """获取视频链接列表"""
-    query = db.query(VideoLink).filter(VideoLink.status == "active")
+    selected = parse_fields(fields, VIDEO_LINK_FIELDS, LINK_FIELD_PRESETS["video"])
+    query = select(VideoLink).options(*column_options(VideoLink, selected)).where(VideoLink.status == "active")
     
     if category_id:
-        query = query.filter(VideoLink.category_id == category_id)
+        query = query.where(VideoLink.category_id == category_id)
     
-    videos = query.order_by(VideoLink.sort_order).all()
-    video_data = [VideoLinkResponse.from_orm(video) for video in videos]
+    videos = (await db.scalars(query.order_by(VideoLink.sort_order))).all()
+    if selected is None:
+        video_data = [VideoLinkResponse.from_orm(video) for video in videos]
+    else:
+        video_data = [project(video, selected) for video in videos]
     
     return ApiResponse(
         message="Video links retrieved successfully",
@@ -227,14 +361,14 @@ async def get_video_links(
 @router.get("/videos/{video_id}", response_model=ApiResponse)
 async def get_video_link(
     video_id: int,
-    current_user: User = Depends(get_current_active_user),
-    db: Session = Depends(get_db)
+    current_user: User = Depends(get_current_active_user_async),
+    db: AsyncSession = Depends(get_async_db)
 ):
     """获取视频链接详情"""
-    video = db.query(VideoLink).filter(
+    video = await db.scalar(select(VideoLink).where(
         VideoLink.id == video_id,
         VideoLink.status == "active"
-    ).first()
+    ))
     
     if not video:
         raise HTTPException(
@@ -251,15 +385,15 @@ async def get_video_link(
 @router.post("/admin/videos", response_model=ApiResponse)
 async def create_video_link(
     video_data: VideoLinkCreate,
-    current_user: User = Depends(get_admin_user),
-    db: Session = Depends(get_db)
+    current_user: User = Depends(get_admin_user_async),
+    db: AsyncSession = Depends(get_async_db)
 ):
     """创建视频链接（管理员）"""
     # 验证分类是否存在
-    category = db.query(KnowledgeCategory).filter(
+    category = await db.scalar(select(KnowledgeCategory).where(
         KnowledgeCategory.id == video_data.category_id,
         KnowledgeCategory.status == "active"
-    ).first()
+    ))
     
     if not category:
         raise HTTPException(
@@ -269,8 +403,8 @@ async def create_video_link(
     
     video = VideoLink(**video_data.dict())
     db.add(video)
-    db.commit()
-    db.refresh(video)
+    await db.commit()
+    await db.refresh(video)
     
     return ApiResponse(
         message="Video link created successfully",
@@ -281,11 +415,11 @@ async def create_video_link(
 async def update_video_link(
     video_id: int,
     video_data: VideoLinkUpdate,
-    current_user: User = Depends(get_admin_user),
-    db: Session = Depends(get_db)
+    current_user: User = Depends(get_admin_user_async),
+    db: AsyncSession = Depends(get_async_db)
 ):
     """更新视频链接（管理员）"""
-    video = db.query(VideoLink).filter(VideoLink.id == video_id).first()
+    video = await db.scalar(select(VideoLink).where(VideoLink.id == video_id))
     
     if not video:
         raise HTTPException(
@@ -298,8 +432,8 @@ async def update_video_link(
     for field, value in update_data.items():
         setattr(video, field, value)
     
-    db.commit()
-    db.refresh(video)
+    await db.commit()
+    await db.refresh(video)
     
     return ApiResponse(
         message="Video link updated successfully",
@@ -309,11 +443,11 @@ async def update_video_link(
 @router.delete("/admin/videos/{video_id}", response_model=ApiResponse)
 async def delete_video_link(
     video_id: int,
-    current_user: User = Depends(get_admin_user),
-    db: Session = Depends(get_db)
+    current_user: User = Depends(get_admin_user_async),
+    db: AsyncSession = Depends(get_async_db)
 ):
     """删除视频链接（管理员）"""
-    video = db.query(VideoLink).filter(VideoLink.id == video_id).first()
+    video = await db.scalar(select(VideoLink).where(VideoLink.id == video_id))
     
     if not video:
         raise HTTPException(
@@ -323,7 +457,7 @@ async def delete_video_link(
     
     # 软删除
     video.status = "inactive"
-    db.commit()
+    await db.commit()
     
     return ApiResponse(
         message="Video link deleted successfully",
@@ -333,15 +467,22 @@ async def delete_video_link(
 # 书籍链接相关API
 @router.get("/books", response_model=ApiResponse)
 async def get_book_links(
-    current_user: User = Depends(get_current_active_user),
-    db: Session = Depends(get_db)
+    current_user: User = Depends(get_current_active_user_async),
+    db: AsyncSession = Depends(get_async_db),
+    fields: Optional[str] = Query(None, description=FIELDS_DESCRIPTION)
 ):
     """获取书籍链接列表"""
-    books = db.query(BookLink).filter(
-        BookLink.status == "active"
-    ).order_by(BookLink.sort_order).all()
-    
-    book_data = [BookLinkResponse.from_orm(book) for book in books]
+    selected = parse_fields(fields, BOOK_LINK_FIELDS, LINK_FIELD_PRESETS["book"])
+    books = (await db.scalars(
+        select(BookLink).options(*column_options(BookLink, selected)).where(
+            BookLink.status == "active"
+        ).order_by(BookLink.sort_order)
+    )).all()
+    
+    if selected is None:
+        book_data = [BookLinkResponse.from_orm(book) for book in books]
+    else:
+        book_data = [project(book, selected) for book in books]
     
     return ApiResponse(
         message="Book links retrieved successfully",
@@ -351,14 +492,14 @@ async def get_book_links(
 @router.get("/books/{book_id}", response_model=ApiResponse)
 async def get_book_link(
     book_id: int,
-    current_user: User = Depends(get_current_active_user),
-    db: Session = Depends(get_db)
+    current_user: User = Depends(get_current_active_user_async),
+    db: AsyncSession = Depends(get_async_db)
 ):
     """获取书籍链接详情"""
-    book = db.query(BookLink).filter(
+    book = await db.scalar(select(BookLink).where(
         BookLink.id == book_id,
         BookLink.status == "active"
-    ).first()
+    ))
     
     if not book:
         raise HTTPException(
@@ -375,14 +516,14 @@ async def get_book_link(
 @router.post("/admin/books", response_model=ApiResponse)
 async def create_book_link(
     book_data: BookLinkCreate,
-    current_user: User = Depends(get_admin_user),
-    db: Session = Depends(get_db)
+    current_user: User = Depends(get_admin_user_async),
+    db: AsyncSession = Depends(get_async_db)
 ):
     """创建书籍链接（管理员）"""
     book = BookLink(**book_data.dict())
     db.add(book)
-    db.commit()
-    db.refresh(book)
+    await db.commit()
+    await db.refresh(book)
     
     return ApiResponse(
         message="Book link created successfully",
@@ -393,11 +534,11 @@ async def create_book_link(
 async def update_book_link(
     book_id: int,
     book_data: BookLinkUpdate,
-    current_user: User = Depends(get_admin_user),
-    db: Session = Depends(get_db)
+    current_user: User = Depends(get_admin_user_async),
+    db: AsyncSession = Depends(get_async_db)
 ):
     """更新书籍链接（管理员）"""
-    book = db.query(BookLink).filter(BookLink.id == book_id).first()
+    book = await db.scalar(select(BookLink).where(BookLink.id == book_id))
     
     if not book:
         raise HTTPException(
@@ -410,8 +551,8 @@ async def update_book_link(
     for field, value in update_data.items():
         setattr(book, field, value)
     
-    db.commit()
-    db.refresh(book)
+    await db.commit()
+    await db.refresh(book)
     
     return ApiResponse(
         message="Book link updated successfully",
@@ -421,11 +562,11 @@ async def update_book_link(
 @router.delete("/admin/books/{book_id}", response_model=ApiResponse)
 async def delete_book_link(
     book_id: int,
-    current_user: User = Depends(get_admin_user),
-    db: Session = Depends(get_db)
+    current_user: User = Depends(get_admin_user_async),
+    db: AsyncSession = Depends(get_async_db)
 ):
     """删除书籍链接（管理员）"""
-    book = db.query(BookLink).filter(BookLink.id == book_id).first()
+    book = await db.scalar(select(BookLink).where(BookLink.id == book_id))
     
     if not book:
         raise HTTPException(
@@ -435,7 +576,7 @@ async def delete_book_link(
     
     # 软删除
     book.status = "inactive"
-    db.commit()
+    await db.commit()
     
     return ApiResponse(
         message="Book link deleted successfully",
@@ -447,16 +588,16 @@ async def delete_book_link(
 async def add_favorite(
     favorite_type: str,
     favorite_id: int,
-    current_user: User = Depends(get_current_active_user),
-    db: Session = Depends(get_db)
+    current_user: User = Depends(get_current_active_user_async),
+    db: AsyncSession = Depends(get_async_db)
 ):
     """添加收藏"""
     # 检查是否已经收藏
-    existing_favorite = db.query(UserFavorite).filter(
+    existing_favorite = await db.scalar(select(UserFavorite).where(
         UserFavorite.user_id == current_user.id,
         UserFavorite.favorite_type == favorite_type,
         UserFavorite.favorite_id == favorite_id
-    ).first()
+    ))
     
     if existing_favorite:
         raise HTTPException(
@@ -471,8 +612,8 @@ async def add_favorite(
         favorite_id=favorite_id
     )
     db.add(favorite)
-    db.commit()
-    db.refresh(favorite)
+    await db.commit()
+    await db.refresh(favorite)
     
     return ApiResponse(
         message="Favorite added successfully",
@@ -482,14 +623,14 @@ async def add_favorite(
 @router.delete("/favorites/{favorite_id}", response_model=ApiResponse)
 async def remove_favorite(
     favorite_id: int,
-    current_user: User = Depends(get_current_active_user),
-    db: Session = Depends(get_db)
+    current_user: User = Depends(get_current_active_user_async),
+    db: AsyncSession = Depends(get_async_db)
 ):
     """取消收藏"""
-    favorite = db.query(UserFavorite).filter(
+    favorite = await db.scalar(select(UserFavorite).where(
         UserFavorite.id == favorite_id,
         UserFavorite.user_id == current_user.id
-    ).first()
+    ))
     
     if not favorite:
         raise HTTPException(
@@ -497,8 +638,8 @@ async def remove_favorite(
             detail="Favorite not found"
         )
     
-    db.delete(favorite)
-    db.commit()
+    await db.delete(favorite)
+    await db.commit()
     
     return ApiResponse(
         message="Favorite removed successfully",
@@ -507,31 +648,28 @@ async def remove_favorite(
 
 @router.get("/favorites", response_model=ApiResponse)
 async def get_user_favorites(
-    current_user: User = Depends(get_current_active_user),
-    db: Session = Depends(get_db),
+    current_user: User = Depends(get_current_active_user_async),
+    db: AsyncSession = Depends(get_async_db),
     page: int = Query(1, ge=1),
-    page_size: int = Query(10, ge=1, le=100)
+    page_size: int = Query(10, ge=1, le=100),
+    cursor: Optional[str] = Query(None, description="上一页返回的 next_cursor"),
+    total: Optional[TotalMode] = Query(None, description="exact、approx 或 none")
 ):
     """获取用户收藏列表"""
-    offset = (page - 1) * page_size
-    
-    favorites = db.query(UserFavorite).filter(
-        UserFavorite.user_id == current_user.id
-    ).order_by(UserFavorite.created_at.desc()).offset(offset).limit(page_size).all()
-    
-    total = db.query(UserFavorite).filter(
-        UserFavorite.user_id == current_user.id
-    ).count()
+    favorites, page_info = await db.run_sync(lambda sync_db: keyset_paginate(
+        sync_db, sync_db.query(UserFavorite).filter(UserFavorite.user_id == current_user.id),
+        UserFavorite, page, page_size, cursor, total
+    ))
     
     favorite_data = [UserFavoriteResponse.from_orm(fav) for fav in favorites]
     
     return ApiResponse(
         message="User favorites retrieved successfully",
         data=PaginatedResponse(
-            total=total,
             page=page,
             page_size=page_size,
-            records=favorite_data
+            records=favorite_data,
+            **page_info
         )
     )
 
@@ -539,33 +677,75 @@ async def get_user_favorites(
 @router.get("/search", response_model=ApiResponse)
 async def search_knowledge(
     keyword: str = Query(..., min_length=1),
-    current_user: User = Depends(get_current_active_user),
-    db: Session = Depends(get_db),
+    current_user: User = Depends(get_current_active_user_async),
+    db: AsyncSession = Depends(get_async_db),
     page: int = Query(1, ge=1),
-    page_size: int = Query(10, ge=1, le=100)
+    page_size: int = Query(10, ge=1, le=100),
+    cursor: Optional[str] = Query(None, description="上一页返回的 next_cursor"),
+    total: Optional[TotalMode] = Query(None, description="exact、approx 或 none"),
+    fields: Optional[str] = Query(None, description=FIELDS_DESCRIPTION)
 ):
     """搜索知识库内容"""
-    offset = (page - 1) * page_size
-    
-    # 搜索知识项目
-    items_query = db.query(KnowledgeItem).filter(
-        KnowledgeItem.status == "active",
-        (KnowledgeItem.title.contains(keyword) |
-         KnowledgeItem.content.contains(keyword) |
-         KnowledgeItem.author.contains(keyword))
-    )
-    
-    total = items_query.count()
-    items = items_query.order_by(KnowledgeItem.created_at.desc()).offset(offset).limit(page_size).all()
-    
-    item_data = [KnowledgeItemResponse.from_orm(item) for item in items]
+    selected = item_fields(fields)
+    # 优先使用检索索引（游标中记录偏移量），索引未就绪时回退到SQL模糊查询（按 (created_at, id) 分页）
+    offset = offset_cursor(cursor, page, page_size)
+    indexed = await db.run_sync(
+        search_items_page, keyword, offset, page_size, fields=selected
+    ) if offset is not None else None
+    if indexed is not None:
+        search_total, items = indexed
+        page_info = offset_page_info(offset, page_size, len(items), search_total)
+    else:
+        items, page_info = await db.run_sync(lambda sync_db: keyset_paginate(
+            sync_db,
+            sync_db.query(KnowledgeItem).options(
+                *column_options(KnowledgeItem, selected, ("id", "created_at"))
+            ).filter(
+                KnowledgeItem.status == "active",
+                (KnowledgeItem.title.contains(keyword) |
+                 KnowledgeItem.content.contains(keyword) |
+                 KnowledgeItem.author.contains(keyword))
+            ),
+            KnowledgeItem, page, page_size, cursor, total
+        ))
+    
+    item_data = serialize_items(items, selected)
     
     return ApiResponse(
         message="Search completed successfully",
         data=PaginatedResponse(
-            total=total,
             page=page,
             page_size=page_size,
-            records=item_data
+            records=item_data,
+            **page_info
         )
-    ) 
\ No newline at end of file
+    ) 
+
+@router.get("/admin/search-index/stats", response_model=ApiResponse)
+async def get_search_index_stats(
+    current_user: User = Depends(get_admin_user_async)
+):
+    """获取知识库检索索引统计（管理员），sync 中包含索引落后于数据库的变更数和延迟"""
+    return ApiResponse(
+        message="Search index stats retrieved successfully",
+        data={
+            "keyword": knowledge_index.stats(),
+            "vector": knowledge_vectors.stats(),
+            "sync": await knowledge_sync.stats()
+        }
+    )
+
+@router.post("/admin/search-index/rebuild", response_model=ApiResponse)
+async def rebuild_search_index(
+    current_user: User = Depends(get_admin_user_async)
+):
+    """重建知识库检索索引（管理员）"""
+    await knowledge_index.rebuild()
+    await knowledge_vectors.rebuild()
+    return ApiResponse(
+        message="Search index rebuilt successfully",
+        data={
+            "keyword": knowledge_index.stats(),
+            "vector": knowledge_vectors.stats()
+        }
+    )
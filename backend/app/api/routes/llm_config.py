@@ -3,6 +3,9 @@ from sqlalchemy.orm import Session
 from typing import List
 from app.core.database import get_db
 from app.core.deps import get_current_active_user, require_admin
+from app.core.sse import sse_metrics
+from app.core.stream_replay import stream_replay
+from app.services.message_writer import message_writer
 from app.core.security import generate_session_id
 from app.models.user import User
 from app.models.llm_config import LLMConfig
@@ -13,6 +16,12 @@ from app.schemas.llm_config import (
     LLMConfigListResponse
 )
 from app.schemas.common import ApiResponse
+from app.services.ai_service import ai_service
+from app.services.response_cache import response_cache
+from app.services.single_flight import single_flight
+from app.services.llm_client_pool import llm_client_pool
+from app.services.llm_scheduler import llm_scheduler
+from app.services.llm_endpoint_stats import llm_latency_tracker
 
 router = APIRouter()
 
@@ -88,6 +97,9 @@ async def create_llm_config(
     db.commit()
     db.refresh(config)
     
+    # 立即生效，无需等待缓存过期
+    ai_service.update_module_config(config)
+    
     config_dict = LLMConfigResponse.from_orm(config).dict()
     config_dict['created_at'] = config.created_at.isoformat()
     config_dict['updated_at'] = config.updated_at.isoformat()
@@ -121,6 +133,9 @@ async def update_llm_config(
     db.commit()
     db.refresh(config)
     
+    # 立即生效，无需等待缓存过期
+    ai_service.update_module_config(config)
+    
     config_dict = LLMConfigResponse.from_orm(config).dict()
     config_dict['created_at'] = config.created_at.isoformat()
     config_dict['updated_at'] = config.updated_at.isoformat()
@@ -145,11 +160,51 @@ async def delete_llm_config(
             detail="LLM config not found"
         )
     
+    module_name = config.module_name
     db.delete(config)
     db.commit()
     
+    ai_service.invalidate_module_config(module_name)
+    
     return ApiResponse(message="LLM config deleted successfully")
 
+@router.get("/stats", response_model=ApiResponse)
+async def get_llm_runtime_stats(
+    current_user: User = Depends(require_admin)
+):
+    """获取LLM运行时统计（仅管理员）"""
+    return ApiResponse(
+        message="LLM runtime stats retrieved successfully",
+        data={
+            "client_pool": llm_client_pool.stats(),
+            "response_cache": response_cache.stats(),
+            "single_flight": single_flight.stats(),
+            "scheduler": llm_scheduler.stats(),
+            "endpoints": llm_latency_tracker.stats(),
+            "sse": sse_metrics.stats(),
+            "stream_replay": stream_replay.stats(),
+            "message_writer": message_writer.stats()
+        }
+    )
+
+@router.get("/cache/stats", response_model=ApiResponse)
+async def get_response_cache_stats(
+    current_user: User = Depends(require_admin)
+):
+    """获取LLM回复缓存统计（仅管理员）"""
+    return ApiResponse(
+        message="Response cache stats retrieved successfully",
+        data=response_cache.stats()
+    )
+
+@router.delete("/cache", response_model=ApiResponse)
+async def clear_response_cache(
+    current_user: User = Depends(require_admin)
+):
+    """清空LLM回复缓存（仅管理员）"""
+    response_cache.clear()
+    return ApiResponse(message="Response cache cleared successfully")
+
 @router.post("/configs/init-default", response_model=ApiResponse)
 async def init_default_configs(
     current_user: User = Depends(require_admin),
@@ -253,6 +308,9 @@ async def init_default_configs(
     
     db.commit()
     
+    # 批量创建后整体重新加载缓存
+    await ai_service.refresh_config_cache()
+    
     return ApiResponse(
         message=f"Default configs initialized successfully. Created: {', '.join(created_configs) if created_configs else 'None (all already exist)'}",
         data={"created_count": len(created_configs)}
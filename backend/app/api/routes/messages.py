@@ -3,6 +3,7 @@ from sqlalchemy.orm import Session
 from typing import List, Optional
 from app.core.database import get_db
 from app.core.deps import get_current_user
+from app.core.pagination import keyset_paginate, TotalMode
 from app.core.security import generate_user_id
 from app.models.user import User
 from app.models.message import ContactMessage
@@ -58,7 +59,9 @@ async def get_contact_messages(
     db: Session = Depends(get_db),
     status_filter: Optional[str] = Query(None, description="状态筛选: unread, read, replied"),
     page: int = Query(1, ge=1, description="页码"),
-    size: int = Query(10, ge=1, le=100, description="每页数量")
+    size: int = Query(10, ge=1, le=100, description="每页数量"),
+    cursor: Optional[str] = Query(None, description="上一页返回的 next_cursor"),
+    total: Optional[TotalMode] = Query(None, description="exact、approx 或 none")
 ):
     """获取联系留言列表（仅管理员）"""
     # 检查管理员权限
@@ -75,21 +78,21 @@ async def get_contact_messages(
     if status_filter:
         query = query.filter(ContactMessage.status == status_filter)
     
-    # 分页
-    offset = (page - 1) * size
-    messages = query.order_by(ContactMessage.created_at.desc()).offset(offset).limit(size).all()
-    
-    # 获取总数
-    total = query.count()
+    # 分页（带游标时按 (created_at, id) 继续，不使用 OFFSET）
+    messages, page_info = keyset_paginate(db, query, ContactMessage, page, size, cursor, total)
+    message_total = page_info["total"]
     
     return ApiResponse(
         message="获取留言列表成功",
         data={
             "messages": [ContactMessageResponse.from_orm(msg) for msg in messages],
-            "total": total,
+            "total": message_total,
             "page": page,
             "size": size,
-            "pages": (total + size - 1) // size
+            "pages": (message_total + size - 1) // size if message_total is not None else None,
+            "total_exact": page_info["total_exact"],
+            "has_more": page_info["has_more"],
+            "next_cursor": page_info["next_cursor"]
         }
     )
 
@@ -1,24 +1,27 @@
-from fastapi import APIRouter, Depends, HTTPException, status, Query
-from fastapi.responses import StreamingResponse
-from sqlalchemy.orm import Session
-from typing import List
-import json
-from app.core.database import get_db
-from app.core.deps import get_current_active_user
+from fastapi import APIRouter, Depends, HTTPException, status, Query, Header
+from sqlalchemy import select
+from sqlalchemy.ext.asyncio import AsyncSession
+from typing import List, Optional
+from app.core.database import AsyncSessionLocal, get_async_db
+from app.core.deps import get_current_active_user_async
 from app.core.security import generate_session_id
+from app.core.sse import CLIENT_DISCONNECTED, SSEWriter, coalesce_deltas
+from app.core.stream_replay import stream_replay
+from app.core.pagination import keyset_paginate, TotalMode
 from app.models.user import User
 from app.models.triage import TriageRecord
 from app.schemas.triage import TriageRequest, TriageResponse, TriageHistoryItem
 from app.schemas.common import ApiResponse, PaginatedResponse
 from app.services.triage_service import triage_service
+from app.services.context_builder import estimate_tokens
 
 router = APIRouter()
 
 @router.post("/analyze", response_model=ApiResponse)
 async def analyze_triage_data(
     triage_data: TriageRequest,
-    current_user: User = Depends(get_current_active_user),
-    db: Session = Depends(get_db)
+    current_user: User = Depends(get_current_active_user_async),
+    db: AsyncSession = Depends(get_async_db)
 ):
     """AI分诊分析"""
     try:
@@ -68,8 +71,8 @@ async def analyze_triage_data(
         )
         
         db.add(triage_record)
-        db.commit()
-        db.refresh(triage_record)
+        await db.commit()
+        await db.refresh(triage_record)
         
         return ApiResponse(
             message="Triage analysis completed successfully",
@@ -88,24 +91,33 @@ async def analyze_triage_data(
 @router.post("/analyze/stream")
 async def analyze_triage_data_stream(
     triage_data: TriageRequest,
-    current_user: User = Depends(get_current_active_user),
-    db: Session = Depends(get_db)
+    current_user: User = Depends(get_current_active_user_async),
+    last_event_id: Optional[str] = Header(None, description="断线重连时携带最后收到的事件ID，续传正在进行的分析"),
+    stream_resume: bool = Header(False, alias="X-Stream-Resume", description="客户端支持断线续传时为 true，断开后生成保留宽限期等待重连")
 ):
-    """AI分诊分析（流式输出）"""
+    """AI分诊分析（流式输出）
+
+    分析在后台任务中生成，断线后携带 Last-Event-ID 重新发送同一请求即可续传，不重新调用LLM。
+    只有请求带 X-Stream-Resume: true 时断开后才等待重连，否则断开即停止生成。
+    """
+    if last_event_id:
+        return stream_replay.response(*stream_replay.resume(last_event_id, current_user.id, "triage"))
     
     async def generate_response():
+        sse = SSEWriter("triage")
+        answer_parts = []
+        chunks = coalesce_deltas(triage_service.analyze_triage_stream(triage_data))
         try:
             # 发送开始信号
-            yield f"data: {json.dumps({'type': 'analysis_start'})}\n\n"
+            yield sse.frame({'type': 'analysis_start'})
             
             # 获取AI流式响应
-            full_content = ""
-            async for chunk in triage_service.analyze_triage_stream(triage_data):
+            async for chunk in chunks:
                 if chunk["type"] == "answer":
-                    full_content += chunk["content"]
-                    yield f"data: {json.dumps(chunk)}\n\n"
+                    answer_parts.append(chunk["content"])
+                    yield sse.frame(chunk)
                 elif chunk["type"] == "done":
-                    full_content = chunk["content"]
+                    full_content = chunk.get("content") or "".join(answer_parts)
                     
                     # 解析AI响应并保存分诊记录
                     try:
@@ -156,57 +168,54 @@ async def analyze_triage_data_stream(
                             }
                         )
                         
-                        db.add(triage_record)
-                        db.commit()
-                        db.refresh(triage_record)
+                        # 生成在后台任务中运行，使用独立的数据库会话写入
+                        async with AsyncSessionLocal() as db:
+                            db.add(triage_record)
+                            await db.commit()
+                            await db.refresh(triage_record)
                         
                         # 发送分析结果
-                        yield f"data: {json.dumps({'type': 'analysis_result', 'data': {'record_id': triage_record.id, 'analysis': analysis_result.dict()}})}\n\n"
+                        yield sse.frame({'type': 'analysis_result', 'data': {'record_id': triage_record.id, 'analysis': analysis_result.dict()}})
                         
                     except Exception as parse_error:
-                        yield f"data: {json.dumps({'type': 'error', 'message': f'结果解析失败: {str(parse_error)}'})}\n\n"
+                        yield sse.frame({'type': 'error', 'message': f'结果解析失败: {str(parse_error)}'})
                     
-                    yield f"data: {json.dumps({'type': 'done'})}\n\n"
+                    yield sse.frame({'type': 'done'})
                     break
                 elif chunk["type"] == "error":
-                    yield f"data: {json.dumps(chunk)}\n\n"
+                    yield sse.frame(chunk)
                     break
                 else:
-                    yield f"data: {json.dumps(chunk)}\n\n"
+                    yield sse.frame(chunk)
                     
+        except CLIENT_DISCONNECTED:
+            # 客户端断开后宽限期内未重连：停止上游生成（分析未完成，不保存分诊记录）
+            partial_content = "".join(answer_parts)
+            sse.disconnected(partial_content, estimate_tokens(partial_content))
+            raise
         except Exception as e:
             error_msg = f"分诊分析失败: {str(e)}"
-            yield f"data: {json.dumps({'type': 'error', 'message': error_msg})}\n\n"
+            yield sse.frame({'type': 'error', 'message': error_msg})
+        finally:
+            await chunks.aclose()
+            sse.close()
     
-    return StreamingResponse(
-        generate_response(),
-        media_type="text/plain",
-        headers={
-            "Cache-Control": "no-cache",
-            "Connection": "keep-alive",
-            "Content-Type": "text/event-stream"
-        }
-    )
+    return stream_replay.response(stream_replay.start("triage", current_user.id, generate_response(), resumable=stream_resume))
 
 @router.get("/history", response_model=ApiResponse)
 async def get_triage_history(
-    current_user: User = Depends(get_current_active_user),
-    db: Session = Depends(get_db),
+    current_user: User = Depends(get_current_active_user_async),
+    db: AsyncSession = Depends(get_async_db),
     page: int = Query(1, ge=1),
-    page_size: int = Query(10, ge=1, le=100)
+    page_size: int = Query(10, ge=1, le=100),
+    cursor: Optional[str] = Query(None, description="上一页返回的 next_cursor"),
+    total: Optional[TotalMode] = Query(None, description="exact、approx 或 none")
 ):
     """获取分诊历史"""
-    offset = (page - 1) * page_size
-    
-    # 查询总数
-    total = db.query(TriageRecord).filter(
-        TriageRecord.user_id == current_user.id
-    ).count()
-    
-    # 查询记录
-    records = db.query(TriageRecord).filter(
-        TriageRecord.user_id == current_user.id
-    ).order_by(TriageRecord.created_at.desc()).offset(offset).limit(page_size).all()
+    records, page_info = await db.run_sync(lambda sync_db: keyset_paginate(
+        sync_db, sync_db.query(TriageRecord).filter(TriageRecord.user_id == current_user.id),
+        TriageRecord, page, page_size, cursor, total
+    ))
     
     # 转换为响应格式
     history_items = [
@@ -223,24 +232,24 @@ async def get_triage_history(
     return ApiResponse(
         message="Triage history retrieved successfully",
         data=PaginatedResponse(
-            total=total,
             page=page,
             page_size=page_size,
-            records=history_items
+            records=history_items,
+            **page_info
         )
     )
 
 @router.get("/history/{record_id}", response_model=ApiResponse)
 async def get_triage_record(
     record_id: str,
-    current_user: User = Depends(get_current_active_user),
-    db: Session = Depends(get_db)
+    current_user: User = Depends(get_current_active_user_async),
+    db: AsyncSession = Depends(get_async_db)
 ):
     """获取特定分诊记录详情"""
-    record = db.query(TriageRecord).filter(
+    record = await db.scalar(select(TriageRecord).where(
         TriageRecord.id == record_id,
         TriageRecord.user_id == current_user.id
-    ).first()
+    ))
     
     if not record:
         raise HTTPException(
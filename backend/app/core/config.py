@@ -1,5 +1,5 @@
 from pydantic_settings import BaseSettings
-from typing import Optional, List
+from typing import Optional, List, Dict
 import os
 
 class Settings(BaseSettings):
@@ -30,6 +30,91 @@ class Settings(BaseSettings):
     kb_model: str = "qwen-plus"  # 知识库检索模型（不开启思考）
     complex_model: str = "qwen-plus"  # 复杂问答模型（开启思考）
     
+    # LLM连接池配置
+    llm_max_connections: int = 100  # 每个端点的最大连接数
+    llm_max_keepalive_connections: int = 20  # 保持空闲的长连接数
+    llm_keepalive_expiry: float = 60.0  # 空闲连接保留时间（秒）
+    llm_connect_timeout: float = 5.0  # 建立连接超时（秒）
+    llm_request_timeout: float = 120.0  # 请求读写超时（秒）
+    llm_max_retries: int = 1  # SDK层面的重试次数
+    llm_config_cache_ttl: int = 300  # LLM配置缓存的后台刷新间隔（秒）
+    
+    # LLM回复缓存配置（重复的知识问答直接回放）
+    response_cache_enabled: bool = True
+    response_cache_modules: List[str] = ["chat_kb"]  # 启用回复缓存的模块
+    response_cache_max_entries: int = 1000
+    response_cache_ttl: int = 3600  # 缓存有效期（秒）
+    llm_single_flight_enabled: bool = True  # 合并相同的并发LLM请求
+    
+    # LLM调度配置（优先级：emergency > triage > graph > kb）
+    llm_max_concurrency: int = 32  # 全局上游并发上限
+    llm_concurrency_limits: Dict[str, int] = {"emergency": 16, "triage": 8, "graph": 4, "kb": 8}
+    llm_queue_reject_thresholds: Dict[str, int] = {"graph": 20, "kb": 40}  # 排队超过该深度直接拒绝
+    llm_queue_timeouts: Dict[str, float] = {"graph": 30.0, "kb": 20.0}  # 排队等待超时（秒）
+    
+    # 多端点故障转移与对冲请求配置
+    llm_hedge_enabled: bool = True  # 首token超时后向备用端点发起对冲请求
+    llm_hedge_default_delay: float = 3.0  # 延迟样本不足时的对冲等待时间（秒）
+    llm_hedge_p95_multiplier: float = 1.2  # 对冲等待时间 = p95首token延迟 × 该系数
+    llm_hedge_min_delay: float = 0.5
+    llm_hedge_max_delay: float = 10.0
+    llm_latency_ewma_alpha: float = 0.2  # 首token延迟EWMA平滑系数
+    llm_latency_window: int = 100  # 计算p95的滑动窗口样本数
+    llm_endpoint_cooldown: float = 30.0  # 端点失败后排到末尾的冷却时间（秒）
+    
+    # SSE输出配置（合并连续的模型增量，减少帧数）
+    sse_flush_interval: float = 0.05  # 增量最长缓冲时间（秒），0为不合并
+    sse_max_frame_bytes: int = 2048  # 单帧增量内容达到该字节数时立即发送
+    
+    # 断线续传配置（生成的帧缓冲在内存中，重连时按 Last-Event-ID 补发）
+    stream_replay_max_frames: int = 2000  # 每次生成最多缓冲的帧数
+    stream_replay_ttl: int = 120  # 生成结束后缓冲的保留时间（秒）
+    # 声明支持续传（X-Stream-Resume）的客户端全部断开后继续生成的时间（秒），期间未重连则停止生成；
+    # 生成在宽限期内继续占用LLM并发，调大便于弱网重连，调小则断开后更快释放LLM
+    # （未声明支持续传或没收到任何帧就断开的生成立即停止）
+    stream_resume_grace: float = 5.0
+    
+    # 消息写后队列配置（用户/助手消息和会话更新在后台按批写入，失败重试）
+    write_behind_batch_size: int = 100  # 每个事务最多写入的记录数
+    write_behind_retry_backoff: float = 0.5  # 写入失败后的首次重试间隔（秒），之后每次加倍
+    write_behind_max_retries: int = 8  # 单条记录连续失败该次数后移入日志文件，不阻塞后续写入
+    write_behind_wait_timeout: float = 5.0  # 读取会话前等待未完成写入的最长时间（秒）
+    write_behind_journal: str = "./data/write_behind_journal.jsonl"  # 无法写入的记录保存在此，预写日志段为同名的 .seg-* 文件，启动时重放
+    write_behind_fsync: bool = False  # 每条记录追加到预写日志后立即落盘（可承受断电，入队变慢）
+    
+    # 对话上下文配置（按模式的token预算，超出部分折叠进较早消息的摘录窗口）
+    context_token_budgets: Dict[str, int] = {"kb": 3000, "graph": 6000}
+    context_token_budget_default: int = 3000
+    context_summary_token_budget: int = 800  # 较早消息摘录窗口的token预算（不超过模式预算的一半）
+    context_max_messages: int = 40  # 每轮最多加载的最近消息数
+    
+    # 知识库检索配置
+    knowledge_index_enabled: bool = True  # 使用内存倒排索引（汉字二元组 + BM25）检索知识库
+    category_cache_ttl: int = 300  # 分类树缓存有效期（秒），其他进程修改分类后最长在该时间后生效
+    counter_flush_interval: float = 5.0  # 查看/下载次数批量写入数据库的间隔（秒）
+    rag_enabled: bool = True  # kb 模式回答前检索知识库资料注入提示词
+    rag_top_k: int = 5  # 最多注入的资料条数
+    rag_token_budget: int = 1500  # 注入资料的token预算
+    rag_passage_chars: int = 400  # 每条资料截取的最大字符数
+    
+    # 知识库语义向量索引配置（CPU，向量文件内存映射，多个worker共享）
+    vector_index_enabled: bool = True
+    vector_index_dir: str = "./data/vector_index"
+    vector_embedder: str = "hashing"  # hashing，或 "模块路径:工厂函数"（工厂函数接收维度，返回嵌入函数）
+    vector_dim: int = 256
+    vector_dtype: str = "float16"  # float16 或 int8
+    vector_passage_chars: int = 300  # 每个向量对应的段落长度
+    
+    # 知识库检索索引增量维护（条目变更写入 outbox 表，后台任务增量应用，定期合并为全量重建）
+    index_sync_interval: float = 2.0  # 轮询变更记录的间隔（秒）
+    index_compact_threshold: int = 500  # 增量条目（墓碑）数达到该值时合并
+    index_compact_interval: int = 3600  # 存在增量时最长的合并间隔（秒）
+    index_sync_gap_timeout: float = 60.0  # 变更记录ID空缺（较小的ID晚提交）的最长等待时间（秒），超时视为已回滚
+    
+    # 会话批量删除（按会话ID分块执行 DELETE，每块一个事务）
+    session_purge_chunk_size: int = 200  # 每块删除的会话数
+    session_purge_background_threshold: int = 500  # 清空的会话数超过该值时在后台任务中删除
+    
     # Redis配置
     redis_url: str = "redis://localhost:6379/0"
     
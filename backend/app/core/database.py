@@ -1,7 +1,8 @@
-from sqlalchemy import create_engine
+from sqlalchemy import create_engine, event, inspect, text
+from sqlalchemy.ext.asyncio import AsyncSession, async_sessionmaker, create_async_engine
 from sqlalchemy.ext.declarative import declarative_base
 from sqlalchemy.orm import sessionmaker, Session
-from typing import Generator
+from typing import AsyncGenerator, Generator, List, Tuple
 from .config import settings
 
 # 创建数据库引擎
@@ -11,8 +12,38 @@ engine = create_engine(
     echo=settings.debug
 )
 
+def async_database_url(url: str) -> str:
+    """同步驱动的连接串换成对应的异步驱动：SQLite 使用 aiosqlite，PostgreSQL 使用 asyncpg"""
+    if url.startswith("sqlite:"):
+        return "sqlite+aiosqlite:" + url[len("sqlite:"):]
+    for prefix in ("postgresql+psycopg2:", "postgresql:", "postgres:"):
+        if url.startswith(prefix):
+            return "postgresql+asyncpg:" + url[len(prefix):]
+    return url
+
+# 异步引擎：聊天、应急指导、分诊和知识库接口使用，查询期间不阻塞事件循环（其他流式响应照常输出）
+# SQLite 的写入在多个连接间串行，并发流式回答同时保存时等待写锁的时间放宽到30秒（默认5秒）
+async_engine = create_async_engine(
+    async_database_url(settings.database_url),
+    connect_args={"timeout": 30} if "sqlite" in settings.database_url else {},
+    echo=settings.debug
+)
+
+def _set_sqlite_pragmas(dbapi_connection, connection_record):
+    # WAL 模式下读不阻塞写：后台构建检索索引的长时间读取不会让导入和管理员写入报 database is locked
+    cursor = dbapi_connection.cursor()
+    cursor.execute("PRAGMA journal_mode=WAL")
+    cursor.execute("PRAGMA synchronous=NORMAL")
+    cursor.close()
+
+if engine.dialect.name == "sqlite":
+    event.listen(engine, "connect", _set_sqlite_pragmas)
+    event.listen(async_engine.sync_engine, "connect", _set_sqlite_pragmas)
+
 # 创建会话工厂
 SessionLocal = sessionmaker(autocommit=False, autoflush=False, bind=engine)
+# 提交后不使对象过期：异步会话中访问过期属性会触发隐式查询而报错
+AsyncSessionLocal = async_sessionmaker(async_engine, expire_on_commit=False, autoflush=False)
 
 # 创建基础模型类
 Base = declarative_base()
@@ -25,6 +56,71 @@ def get_db() -> Generator[Session, None, None]:
     finally:
         db.close()
 
+# 依赖注入：获取异步数据库会话
+async def get_async_db() -> AsyncGenerator[AsyncSession, None]:
+    async with AsyncSessionLocal() as db:
+        yield db
+
 # 创建所有表
 def create_tables():
-    Base.metadata.create_all(bind=engine) 
\ No newline at end of file
+    Base.metadata.create_all(bind=engine)
+
+# 已有表的增量字段：(表名, 字段名, 字段DDL)
+# create_all 不会修改已存在的表，新增字段需在此登记
+COLUMN_UPGRADES = [
+    ("chat_sessions", "summary", "TEXT"),
+    ("chat_sessions", "summary_message_count", "INTEGER NOT NULL DEFAULT 0"),
+    ("chat_sessions", "summary_last_created_at", "TIMESTAMP WITH TIME ZONE"),
+    ("chat_sessions", "summary_last_message_id", "VARCHAR"),
+    ("llm_configs", "fallback_endpoints", "JSON"),
+    ("chat_messages", "truncated", "BOOLEAN NOT NULL DEFAULT FALSE"),
+    ("emergency_messages", "truncated", "BOOLEAN NOT NULL DEFAULT FALSE"),
+    ("knowledge_items", "content_hash", "VARCHAR(64)"),
+    ("knowledge_items", "snippet", "VARCHAR(300)"),
+]
+
+# 已有表上新增的索引：(索引名, 表名, 字段, 是否唯一)
+INDEX_UPGRADES = [
+    ("ix_knowledge_items_content_hash", "knowledge_items", "content_hash", True),
+    ("ix_knowledge_items_status_created_id", "knowledge_items", "status, created_at, id", False),
+    ("ix_knowledge_items_category_created_id", "knowledge_items", "category_id, created_at, id", False),
+    ("ix_user_favorites_user_created_id", "user_favorites", "user_id, created_at, id", False),
+    ("ix_triage_records_user_created_id", "triage_records", "user_id, created_at, id", False),
+    ("ix_contact_messages_created_id", "contact_messages", "created_at, id", False),
+    ("ix_contact_messages_status_created_id", "contact_messages", "status, created_at, id", False),
+    ("ix_chat_sessions_user_mode_updated_id", "chat_sessions", "user_id, mode, updated_at, id", False),
+    ("ix_chat_messages_session_created", "chat_messages", "session_id, created_at", False),
+    ("ix_emergency_sessions_user_updated_id", "emergency_sessions", "user_id, updated_at, id", False),
+    ("ix_emergency_messages_session_created", "emergency_messages", "session_id, created_at", False),
+]
+
+# 为已有数据库补齐新增字段
+def upgrade_schema() -> List[Tuple[str, str]]:
+    """按 COLUMN_UPGRADES / INDEX_UPGRADES 补齐缺失的列和索引（幂等，启动时执行），返回本次新增的 (表名, 字段名)
+
+    新增字段需要为已有数据补值时，调用方按返回值只在新增的那一次执行补值。
+
+    项目尚未建立 alembic 迁移环境（requirements 中的 alembic 未使用），这里只做只增不改的 ALTER；
+    修改或删除已有列需要迁移脚本，引入 alembic 后这两个列表应转为迁移版本。
+    """
+    inspector = inspect(engine)
+    existing_tables = set(inspector.get_table_names())
+    added = []
+    with engine.begin() as conn:
+        for table, column, ddl in COLUMN_UPGRADES:
+            if table not in existing_tables:
+                continue
+            columns = {col["name"] for col in inspector.get_columns(table)}
+            if column not in columns:
+                conn.execute(text(f"ALTER TABLE {table} ADD COLUMN {column} {ddl}"))
+                print(f"Added column {table}.{column}")
+                added.append((table, column))
+        for name, table, columns, unique in INDEX_UPGRADES:
+            if table not in existing_tables:
+                continue
+            if name not in {index["name"] for index in inspector.get_indexes(table)}:
+                conn.execute(text(
+                    f"CREATE {'UNIQUE ' if unique else ''}INDEX IF NOT EXISTS {name} ON {table} ({columns})"
+                ))
+                print(f"Created index {name}")
+    return added
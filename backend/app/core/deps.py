@@ -1,19 +1,18 @@
 from fastapi import Depends, HTTPException, status
 from fastapi.security import HTTPBearer, HTTPAuthorizationCredentials
+from sqlalchemy import select
+from sqlalchemy.ext.asyncio import AsyncSession
 from sqlalchemy.orm import Session
 from typing import Optional
-from .database import get_db
+from .database import get_db, get_async_db
 from .security import verify_token
 from ..models.user import User
 
 # HTTP Bearer 认证
 security = HTTPBearer()
 
-def get_current_user(
-    credentials: HTTPAuthorizationCredentials = Depends(security),
-    db: Session = Depends(get_db)
-) -> User:
-    """获取当前用户"""
+def _token_user_id(credentials: HTTPAuthorizationCredentials) -> str:
+    """校验访问令牌，返回用户ID"""
     token = credentials.credentials
     payload = verify_token(token, "access")
     user_id = payload.get("sub")
@@ -23,8 +22,9 @@ def get_current_user(
             status_code=status.HTTP_401_UNAUTHORIZED,
             detail="Could not validate credentials"
         )
-    
-    user = db.query(User).filter(User.id == user_id).first()
+    return user_id
+
+def _check_user(user: Optional[User]) -> User:
     if user is None:
         raise HTTPException(
             status_code=status.HTTP_401_UNAUTHORIZED,
@@ -39,18 +39,48 @@ def get_current_user(
     
     return user
 
+def _check_admin(current_user: User) -> User:
+    if current_user.role != "admin":
+        raise HTTPException(
+            status_code=status.HTTP_403_FORBIDDEN,
+            detail="Not enough permissions"
+        )
+    return current_user
+
+def get_current_user(
+    credentials: HTTPAuthorizationCredentials = Depends(security),
+    db: Session = Depends(get_db)
+) -> User:
+    """获取当前用户"""
+    user_id = _token_user_id(credentials)
+    return _check_user(db.query(User).filter(User.id == user_id).first())
+
 def get_current_active_user(current_user: User = Depends(get_current_user)) -> User:
     """获取当前活跃用户"""
     return current_user
 
 def get_admin_user(current_user: User = Depends(get_current_user)) -> User:
     """获取管理员用户"""
-    if current_user.role != "admin":
-        raise HTTPException(
-            status_code=status.HTTP_403_FORBIDDEN,
-            detail="Not enough permissions"
-        )
-    return current_user 
+    return _check_admin(current_user)
+
+async def get_current_user_async(
+    credentials: HTTPAuthorizationCredentials = Depends(security),
+    db: AsyncSession = Depends(get_async_db)
+) -> User:
+    """获取当前用户（使用异步会话的接口，与接口共用同一个会话）"""
+    user_id = _token_user_id(credentials)
+    user = _check_user(await db.scalar(select(User).where(User.id == user_id)))
+    # 结束读事务并归还连接：流式接口在输出期间不占用连接池
+    await db.commit()
+    return user
+
+async def get_current_active_user_async(current_user: User = Depends(get_current_user_async)) -> User:
+    """获取当前活跃用户（异步会话）"""
+    return current_user
+
+async def get_admin_user_async(current_user: User = Depends(get_current_user_async)) -> User:
+    """获取管理员用户（异步会话）"""
+    return _check_admin(current_user)
 
 # 别名，为了兼容性
 require_admin = get_admin_user 
\ No newline at end of file
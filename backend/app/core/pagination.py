@@ -0,0 +1,155 @@
+from typing import Any, Dict, List, Literal, Optional, Tuple
+from datetime import datetime
+import base64
+import json
+from fastapi import HTTPException, status
+from sqlalchemy import String, and_, func, or_, type_coerce
+from sqlalchemy.orm import Query, Session
+
+# 总数模式：exact 精确计数，approx 估算（PostgreSQL 取执行计划的行数估计，其他数据库计数到上限为止），none 不计数
+TOTAL_MODES = ("exact", "approx", "none")
+TotalMode = Literal["exact", "approx", "none"]
+
+# approx 模式下非 PostgreSQL 数据库最多计数的行数
+APPROX_COUNT_CAP = 10000
+
+def encode_cursor(data: Dict[str, Any]) -> str:
+    """把分页位置编码为不透明的游标"""
+    raw = json.dumps(data, separators=(",", ":"), ensure_ascii=False).encode("utf-8")
+    return base64.urlsafe_b64encode(raw).decode("ascii").rstrip("=")
+
+def decode_cursor(cursor: str) -> Dict[str, Any]:
+    try:
+        raw = base64.urlsafe_b64decode(cursor + "=" * (-len(cursor) % 4))
+        data = json.loads(raw.decode("utf-8"))
+        if not isinstance(data, dict):
+            raise ValueError(cursor)
+        return data
+    except ValueError:
+        raise HTTPException(
+            status_code=status.HTTP_400_BAD_REQUEST,
+            detail="Invalid cursor"
+        )
+
+def resolve_total_mode(total: Optional[TotalMode], cursor: Optional[str]) -> TotalMode:
+    """未指定时，按页码分页默认精确计数，按游标翻页默认不计数"""
+    return total or ("none" if cursor else "exact")
+
+def _sortable_timestamps(db: Session, value: datetime) -> List[Any]:
+    """游标中的时间转为与数据库中存储值可比较的形式，返回所有可能的存储形式（升序）
+
+    SQLite 以文本保存时间：CURRENT_TIMESTAMP 写入的值不带微秒，ORM 写入的值总带六位微秒，
+    按文本比较才与 ORDER BY 的结果一致；微秒为 0 时无法区分两种写法，两种形式都视为同一时间。
+    """
+    if db.get_bind().dialect.name != "sqlite":
+        return [value]
+    if value.microsecond:
+        return [value.strftime("%Y-%m-%d %H:%M:%S.%f")]
+    return [value.strftime("%Y-%m-%d %H:%M:%S"), value.strftime("%Y-%m-%d %H:%M:%S.%f")]
+
+def position_before(db: Session, column: Any, id_column: Any, timestamp: datetime, last_id: Any):
+    """(column, id) < (timestamp, last_id) 的过滤条件"""
+    values = _sortable_timestamps(db, timestamp)
+    sort_expression = type_coerce(column, String) if isinstance(values[0], str) else column
+    return or_(
+        sort_expression < values[0],
+        and_(sort_expression.in_(values), id_column < last_id)
+    )
+
+def position_after(db: Session, column: Any, id_column: Any, timestamp: datetime, last_id: Any):
+    """(column, id) > (timestamp, last_id) 的过滤条件"""
+    values = _sortable_timestamps(db, timestamp)
+    sort_expression = type_coerce(column, String) if isinstance(values[0], str) else column
+    return or_(
+        sort_expression > values[-1],
+        and_(sort_expression.in_(values), id_column > last_id)
+    )
+
+def count_total(db: Session, query: Query, mode: str) -> Optional[int]:
+    """按总数模式统计查询的行数"""
+    if mode == "none":
+        return None
+    query = query.order_by(None)
+    if mode == "approx":
+        if db.get_bind().dialect.name == "postgresql":
+            compiled = query.statement.compile(dialect=db.get_bind().dialect)
+            plan = db.connection().exec_driver_sql(
+                f"EXPLAIN (FORMAT JSON) {compiled}", compiled.params
+            ).scalar()
+            plan = json.loads(plan) if isinstance(plan, str) else plan
+            return int(plan[0]["Plan"]["Plan Rows"])
+        return db.query(func.count()).select_from(query.limit(APPROX_COUNT_CAP).subquery()).scalar()
+    return query.count()
+
+def keyset_paginate(
+    db: Session,
+    query: Query,
+    model: Any,
+    page: int,
+    page_size: int,
+    cursor: Optional[str] = None,
+    total: Optional[str] = None,
+    sort_column: str = "created_at"
+) -> Tuple[List[Any], Dict[str, Any]]:
+    """按 (created_at, id) 倒序分页（sort_column 可换成其他时间列，如 updated_at）
+
+    带游标时从游标位置继续（WHERE (created_at, id) < 游标），不再使用 OFFSET；
+    没有游标时按 page/page_size 分页，兼容原有调用方；
+    偏移量游标（检索索引不可用时回退到本函数）按偏移量继续。
+    返回 (当前页的行, 分页信息)，分页信息可直接展开到 PaginatedResponse。
+    """
+    mode = resolve_total_mode(total, cursor)
+    column = getattr(model, sort_column)
+    ordered = query.order_by(column.desc(), model.id.desc())
+    cursor_offset = offset_cursor(cursor, page, page_size)
+    if cursor_offset is None:
+        position = decode_cursor(cursor).get("k")
+        try:
+            timestamp, last_id = datetime.fromisoformat(position[0]), position[1]
+        except (TypeError, ValueError, IndexError):
+            raise HTTPException(
+                status_code=status.HTTP_400_BAD_REQUEST,
+                detail="Invalid cursor"
+            )
+        rows = ordered.filter(
+            position_before(db, column, model.id, timestamp, last_id)
+        ).limit(page_size + 1).all()
+    else:
+        rows = ordered.offset(cursor_offset).limit(page_size + 1).all()
+
+    has_more = len(rows) > page_size
+    rows = rows[:page_size]
+    next_cursor = encode_cursor({"k": [getattr(rows[-1], sort_column).isoformat(), rows[-1].id]}) if has_more else None
+    return rows, {
+        "total": count_total(db, query, mode),
+        "total_exact": mode == "exact",
+        "has_more": has_more,
+        "next_cursor": next_cursor
+    }
+
+def offset_cursor(cursor: Optional[str], page: int, page_size: int) -> Optional[int]:
+    """返回分页的偏移量；游标是 (created_at, id) 位置时返回 None
+
+    按相关度排序的结果（检索索引）没有稳定的 (created_at, id) 顺序，游标中记录的是偏移量。
+    """
+    if not cursor:
+        return (page - 1) * page_size
+    data = decode_cursor(cursor)
+    if "k" in data:
+        return None
+    offset = data.get("o")
+    if not isinstance(offset, int) or offset < 0:
+        raise HTTPException(
+            status_code=status.HTTP_400_BAD_REQUEST,
+            detail="Invalid cursor"
+        )
+    return offset
+
+def offset_page_info(offset: int, page_size: int, returned: int, total: int) -> Dict[str, Any]:
+    has_more = offset + returned < total
+    return {
+        "total": total,
+        "total_exact": True,
+        "has_more": has_more,
+        "next_cursor": encode_cursor({"o": offset + page_size}) if has_more else None
+    }
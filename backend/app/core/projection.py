@@ -0,0 +1,44 @@
+from typing import Any, Dict, Iterable, List, Optional, Sequence
+from fastapi import HTTPException, status
+from sqlalchemy.orm import load_only
+
+def parse_fields(
+    fields: Optional[str],
+    allowed: Sequence[str],
+    presets: Optional[Dict[str, Sequence[str]]] = None
+) -> Optional[List[str]]:
+    """解析 fields 参数：逗号分隔的字段名或预设名（如 summary）
+
+    未指定时返回 None，表示返回全部字段；id 总是包含在内。
+    """
+    if not fields:
+        return None
+    presets = presets or {}
+    selected: List[str] = ["id"]
+    for part in fields.split(","):
+        name = part.strip()
+        if not name:
+            continue
+        for field in presets.get(name, (name,)):
+            if field not in allowed:
+                raise HTTPException(
+                    status_code=status.HTTP_400_BAD_REQUEST,
+                    detail=f"Unknown field: {field}"
+                )
+            if field not in selected:
+                selected.append(field)
+    return selected
+
+def column_options(model: Any, fields: Optional[Sequence[str]], required: Iterable[str] = ("id",)) -> list:
+    """只从数据库读取需要的列（其余列不加载），fields 为 None 时读取全部列
+
+    required 为排序、分页需要的列，即使不在返回字段中也要加载。
+    """
+    if fields is None:
+        return []
+    names = list(dict.fromkeys(list(fields) + list(required)))
+    return [load_only(*[getattr(model, name) for name in names])]
+
+def project(obj: Any, fields: Sequence[str]) -> Dict[str, Any]:
+    """按字段列表取出对象的属性"""
+    return {field: getattr(obj, field) for field in fields}
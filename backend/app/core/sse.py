@@ -0,0 +1,194 @@
+from typing import Dict, Any, List, Optional, AsyncIterator, AsyncGenerator, Callable
+import asyncio
+import json
+import time
+from fastapi.responses import StreamingResponse
+from .config import settings
+
+# 可以合并的增量事件类型
+DELTA_TYPES = ("answer", "thinking")
+
+# 客户端断开（且未在宽限期内续传）时生成器收到的异常，见 SSEResponse 和 StreamReplay
+CLIENT_DISCONNECTED = (asyncio.CancelledError, GeneratorExit)
+
+# 流式响应的响应头
+SSE_HEADERS = {
+    "Cache-Control": "no-cache",
+    "Connection": "keep-alive",
+    "Content-Type": "text/event-stream"
+}
+
+async def coalesce_deltas(
+    chunks: AsyncIterator[Dict[str, Any]],
+    flush_interval: Optional[float] = None,
+    max_bytes: Optional[int] = None
+) -> AsyncGenerator[Dict[str, Any], None]:
+    """把连续的同类增量事件（answer/thinking）合并为一个事件
+
+    满足以下任一条件时输出已合并的内容：
+    距离第一段未输出内容超过 flush_interval 秒、累计超过 max_bytes 字节、
+    事件类型变化或上游结束。其他事件先输出已合并的内容再原样输出。
+    每种增量的第一段立即输出，不增加首字延迟。
+    """
+    flush_interval = settings.sse_flush_interval if flush_interval is None else flush_interval
+    max_bytes = settings.sse_max_frame_bytes if max_bytes is None else max_bytes
+
+    iterator = chunks.__aiter__()
+    pending_type: Optional[str] = None
+    pending_parts: List[str] = []
+    pending_bytes = 0
+    pending_since = 0.0
+    next_chunk: Optional[asyncio.Future] = None
+    seen_types = set()
+
+    def take_pending() -> Dict[str, Any]:
+        nonlocal pending_type, pending_parts, pending_bytes
+        merged = {"type": pending_type, "content": "".join(pending_parts)}
+        pending_type, pending_parts, pending_bytes = None, [], 0
+        return merged
+
+    try:
+        while True:
+            if next_chunk is None:
+                next_chunk = asyncio.ensure_future(iterator.__anext__())
+
+            if pending_type is not None:
+                # 有未输出的内容时最多等到刷新时间点，不取消上游读取
+                remaining = pending_since + flush_interval - time.monotonic()
+                if remaining <= 0:
+                    yield take_pending()
+                    continue
+                done, _ = await asyncio.wait({next_chunk}, timeout=remaining)
+                if not done:
+                    yield take_pending()
+                    continue
+
+            try:
+                chunk = await next_chunk
+            except StopAsyncIteration:
+                break
+            finally:
+                if next_chunk.done():
+                    next_chunk = None
+
+            if chunk.get("type") in DELTA_TYPES and set(chunk) <= {"type", "content"}:
+                if pending_type is not None and pending_type != chunk["type"]:
+                    yield take_pending()
+                if pending_type is None:
+                    pending_type = chunk["type"]
+                    pending_since = time.monotonic()
+                content = chunk.get("content") or ""
+                pending_parts.append(content)
+                pending_bytes += len(content.encode("utf-8"))
+                if chunk["type"] not in seen_types or pending_bytes >= max_bytes or flush_interval <= 0:
+                    seen_types.add(chunk["type"])
+                    yield take_pending()
+            else:
+                if pending_type is not None:
+                    yield take_pending()
+                yield chunk
+
+        if pending_type is not None:
+            yield take_pending()
+    finally:
+        if next_chunk is not None and not next_chunk.done():
+            # 正在读取上游时直接取消读取，上游生成器随之结束
+            next_chunk.cancel()
+        else:
+            aclose = getattr(iterator, "aclose", None)
+            if aclose is not None:
+                await aclose()
+
+class SSEMetrics:
+    """SSE输出统计（所有流式响应累计）"""
+
+    def __init__(self):
+        self.responses = 0
+        self.frames = 0
+        self.bytes = 0
+        self.cancelled: Dict[str, Dict[str, int]] = {}
+
+    def record(self, frames: int, size: int):
+        self.responses += 1
+        self.frames += frames
+        self.bytes += size
+
+    def record_cancel(self, name: str, generated_tokens: int, unused_tokens: int):
+        """记录一次客户端断开：已生成的token数和未再生成的token上限"""
+        stats = self.cancelled.setdefault(name, {"streams": 0, "generated_tokens": 0, "unused_tokens": 0})
+        stats["streams"] += 1
+        stats["generated_tokens"] += generated_tokens
+        stats["unused_tokens"] += unused_tokens
+
+    def stats(self) -> Dict[str, Any]:
+        return {
+            "responses": self.responses,
+            "frames": self.frames,
+            "bytes": self.bytes,
+            "avg_frames_per_response": round(self.frames / self.responses, 1) if self.responses else 0.0,
+            "avg_bytes_per_response": round(self.bytes / self.responses, 1) if self.responses else 0.0,
+            "cancelled": self.cancelled
+        }
+
+class SSEWriter:
+    """序列化SSE帧并统计单个响应的帧数和字节数"""
+
+    def __init__(self, name: str):
+        self.name = name
+        self.frames = 0
+        self.bytes = 0
+        self._closed = False
+
+    def frame(self, payload: Dict[str, Any]) -> str:
+        data = f"data: {json.dumps(payload, ensure_ascii=False)}\n\n"
+        self.frames += 1
+        self.bytes += len(data.encode("utf-8"))
+        return data
+
+    def disconnected(
+        self,
+        partial_content: str,
+        generated_tokens: int,
+        max_tokens: Optional[int] = None,
+        save_partial: Optional[Callable[[str], None]] = None
+    ):
+        """生成器收到 CLIENT_DISCONNECTED 时调用（之后重新抛出），各流式路由共用同一处理
+
+        记录断开统计（max_tokens 未知时不统计未生成的token）；
+        已输出部分内容且提供了 save_partial 时调用它保存，保存的消息应标记为截断。
+        """
+        unused_tokens = max(0, max_tokens - generated_tokens) if max_tokens else 0
+        sse_metrics.record_cancel(self.name, generated_tokens, unused_tokens)
+        if settings.debug:
+            print(f"SSE {self.name}: client disconnected after {generated_tokens} tokens")
+        if partial_content and save_partial is not None:
+            save_partial(partial_content)
+
+    def close(self):
+        """响应结束时调用，汇总到全局统计"""
+        if self._closed:
+            return
+        self._closed = True
+        sse_metrics.record(self.frames, self.bytes)
+        if settings.debug:
+            print(f"SSE {self.name}: {self.frames} frames, {self.bytes} bytes")
+
+class SSEResponse(StreamingResponse):
+    """客户端断开后确定性关闭生成器的流式响应
+
+    Starlette 在收到 http.disconnect 时会取消正在输出的任务：
+    生成器正在等待上游时直接收到 CancelledError；
+    停在 yield 处时由这里在响应结束后 aclose()，生成器收到 GeneratorExit。
+    两种情况下生成器都应保存已生成的内容并释放上游连接。
+    """
+
+    async def __call__(self, scope, receive, send):
+        try:
+            await super().__call__(scope, receive, send)
+        finally:
+            aclose = getattr(self.body_iterator, "aclose", None)
+            if aclose is not None:
+                await aclose()
+
+# 创建全局SSE统计实例
+sse_metrics = SSEMetrics()
@@ -0,0 +1,199 @@
+from typing import Dict, Any, AsyncGenerator, AsyncIterator, Deque, Optional, Tuple
+from collections import deque
+import asyncio
+import json
+import time
+import uuid
+from fastapi import HTTPException, status
+from .config import settings
+from .sse import SSEResponse, SSE_HEADERS
+
+def _frame_payload(payload: Dict[str, Any]) -> str:
+    return f"data: {json.dumps(payload, ensure_ascii=False)}\n\n"
+
+class ReplayStream:
+    """一次生成的输出：带序号的帧环形缓冲，以及正在接收的客户端数"""
+
+    def __init__(self, name: str, owner_id: str, key: Optional[str] = None, resumable: bool = False):
+        self.id = uuid.uuid4().hex
+        self.name = name
+        self.owner_id = owner_id
+        # 生成所属的对象（如会话ID），续传时与请求的路由参数核对
+        self.key = key
+        # 客户端声明支持断线续传（或已经续传过）时，断开后才保留宽限期
+        self.resumable = resumable
+        self.frames: Deque[Tuple[int, str]] = deque(maxlen=settings.stream_replay_max_frames)
+        self.last_seq = 0
+        self.done = False
+        self.finished_at: Optional[float] = None
+        self.subscribers = 0
+        # 已发给客户端的最大序号；为 0 时客户端没有收到过 id，无法续传
+        self.delivered_seq = 0
+        self.task: Optional[asyncio.Task] = None
+        self._grace_handle: Optional[asyncio.TimerHandle] = None
+        self._changed = asyncio.Event()
+
+    def publish(self, frame: str):
+        """追加一帧，帧前加上 id 行（流ID:序号），客户端重连时作为 Last-Event-ID 发回"""
+        self.last_seq += 1
+        self.frames.append((self.last_seq, f"id: {self.id}:{self.last_seq}\n{frame}"))
+        self._notify()
+
+    def finish(self):
+        if self.done:
+            return
+        self.done = True
+        self.finished_at = time.time()
+        self._notify()
+
+    def _notify(self):
+        # 唤醒等待中的客户端，之后的等待使用新的事件
+        self._changed.set()
+        self._changed = asyncio.Event()
+
+    def frames_after(self, seq: int) -> Optional[list]:
+        """序号 seq 之后的缓冲帧；其中一部分已被挤出缓冲时返回 None"""
+        if self.frames and self.frames[0][0] > seq + 1:
+            return None
+        return [item for item in self.frames if item[0] > seq]
+
+class StreamReplay:
+    """流式回答的断线续传
+
+    每次生成在独立任务中运行，输出的帧写入该生成的环形缓冲（最多 stream_replay_max_frames 帧），
+    响应只是缓冲的订阅者：客户端断开不会中断生成，带 Last-Event-ID 重连时先补发错过的帧，
+    再继续接收正在进行的生成，不重新调用LLM。
+    客户端在请求中声明支持续传（X-Stream-Resume 请求头）时，所有客户端断开超过 stream_resume_grace 秒
+    仍未重连才取消生成（生成器按原逻辑保存截断的回答）；未声明的客户端不会重连，断开后立即取消，
+    客户端还没收到任何帧就断开时同样无法续传，立即取消。宽限期内生成继续占用LLM并发，
+    宽限期越长越容易续传、断开后浪费的生成越多。
+    生成结束后缓冲保留 stream_replay_ttl 秒。缓冲在当前进程内，多 worker 部署时需要会话保持。
+    """
+
+    def __init__(self):
+        self._streams: Dict[str, ReplayStream] = {}
+        self.started = 0
+        self.resumed = 0
+        self.replayed_frames = 0
+        self.expired_resumes = 0
+        self.abandoned = 0
+
+    def start(
+        self,
+        name: str,
+        owner_id: str,
+        frames: AsyncIterator[str],
+        key: Optional[str] = None,
+        resumable: bool = False
+    ) -> ReplayStream:
+        """在后台任务中运行生成器，返回可订阅的流；resumable 为客户端是否声明支持续传"""
+        self._prune()
+        stream = ReplayStream(name, owner_id, key, resumable)
+        self._streams[stream.id] = stream
+        stream.task = asyncio.get_running_loop().create_task(self._pump(stream, frames))
+        # 任务在第一次运行前被取消时 _pump 不会执行，finally 中的 finish() 也不会执行：
+        # 在任务结束时兜底，保证流会被清理、等待中的客户端会结束
+        stream.task.add_done_callback(lambda _: stream.finish())
+        self.started += 1
+        return stream
+
+    async def _pump(self, stream: ReplayStream, frames: AsyncIterator[str]):
+        try:
+            async for frame in frames:
+                stream.publish(frame)
+        except asyncio.CancelledError:
+            pass
+        except Exception as e:
+            print(f"Stream {stream.name} failed: {e}")
+        finally:
+            stream.finish()
+
+    def resume(self, last_event_id: str, owner_id: str, name: str, key: Optional[str] = None) -> Tuple[ReplayStream, int]:
+        """解析 Last-Event-ID，返回 (流, 客户端已收到的最后序号)
+
+        流必须属于当前用户，且由同一路由（name）为同一对象（key，如会话ID）启动。
+        """
+        stream_id, _, seq = last_event_id.strip().partition(":")
+        stream = self._streams.get(stream_id)
+        if (
+            stream is None or stream.owner_id != owner_id or not seq.isdigit()
+            or stream.name != name or (key is not None and stream.key != key)
+        ):
+            self.expired_resumes += 1
+            raise HTTPException(
+                status_code=status.HTTP_404_NOT_FOUND,
+                detail="Stream not found or expired"
+            )
+        self.resumed += 1
+        # 能带 Last-Event-ID 重连的客户端支持续传，之后再断开时保留宽限期
+        stream.resumable = True
+        return stream, int(seq)
+
+    async def subscribe(self, stream: ReplayStream, after_seq: int = 0) -> AsyncGenerator[str, None]:
+        """输出序号 after_seq 之后的帧，直到生成结束"""
+        stream.subscribers += 1
+        if stream._grace_handle is not None:
+            stream._grace_handle.cancel()
+            stream._grace_handle = None
+        replaying = after_seq > 0
+        seq = after_seq
+        try:
+            while True:
+                changed = stream._changed
+                pending = stream.frames_after(seq)
+                if pending is None:
+                    # 客户端落后太多，错过的帧已不在缓冲中，需要从会话消息中重新加载
+                    yield _frame_payload({'type': 'error', 'code': 'replay_expired', 'message': '断线期间的输出已过期，请刷新会话'})
+                    return
+                for seq, frame in pending:
+                    if replaying:
+                        self.replayed_frames += 1
+                    yield frame
+                    stream.delivered_seq = max(stream.delivered_seq, seq)
+                replaying = False
+                if stream.done and seq >= stream.last_seq:
+                    return
+                await changed.wait()
+        finally:
+            stream.subscribers -= 1
+            if stream.subscribers == 0 and not stream.done and (not stream.resumable or stream.delivered_seq == 0):
+                self._abandon(stream)
+            elif stream.subscribers == 0 and not stream.done:
+                stream._grace_handle = asyncio.get_running_loop().call_later(
+                    settings.stream_resume_grace, self._abandon, stream
+                )
+
+    def response(self, stream: ReplayStream, after_seq: int = 0) -> SSEResponse:
+        """订阅流的SSE响应"""
+        return SSEResponse(self.subscribe(stream, after_seq), media_type="text/plain", headers=SSE_HEADERS)
+
+    def _abandon(self, stream: ReplayStream):
+        """断开后不会续传或在宽限期内没有重连：停止生成"""
+        stream._grace_handle = None
+        if stream.subscribers == 0 and not stream.done and stream.task is not None:
+            self.abandoned += 1
+            stream.task.cancel()
+
+    def _prune(self):
+        cutoff = time.time() - settings.stream_replay_ttl
+        for stream_id in [
+            stream_id for stream_id, stream in self._streams.items()
+            if stream.done and stream.finished_at < cutoff
+        ]:
+            del self._streams[stream_id]
+
+    def stats(self) -> Dict[str, Any]:
+        self._prune()
+        return {
+            "streams": len(self._streams),
+            "live": sum(1 for stream in self._streams.values() if not stream.done),
+            "buffered_frames": sum(len(stream.frames) for stream in self._streams.values()),
+            "started": self.started,
+            "resumed": self.resumed,
+            "replayed_frames": self.replayed_frames,
+            "expired_resumes": self.expired_resumes,
+            "abandoned": self.abandoned
+        }
+
+# 创建全局断线续传实例
+stream_replay = StreamReplay()
@@ -15,4 +15,9 @@ __all__ = [
     "EmergencySession",
     "EmergencyMessage",
     "LLMConfig"
-] 
\ No newline at end of file
+] 
+# KnowledgeItem 的 ORM 事件在服务模块中注册；在这里导入，任何通过 ORM 写入知识条目的代码
+# （包括 init_knowledge.py 等初始化脚本）都会同步维护这些派生数据
+# 全文检索表的同步事件由 knowledge_fts.ensure_schema() 注册
+from app.services import knowledge_snippets  # noqa: E402,F401  摘要
+from app.services import knowledge_sync  # noqa: E402,F401  检索索引变更记录
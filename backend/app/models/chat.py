@@ -1,15 +1,23 @@
-from sqlalchemy import Column, String, Text, DateTime, ForeignKey, JSON, Integer
+from sqlalchemy import Column, String, Text, DateTime, ForeignKey, JSON, Integer, Boolean, Index
 from sqlalchemy.sql import func
 from sqlalchemy.orm import relationship
 from app.core.database import Base
 
 class ChatSession(Base):
     __tablename__ = "chat_sessions"
+    # 会话列表按 (updated_at, id) 游标分页
+    __table_args__ = (
+        Index("ix_chat_sessions_user_mode_updated_id", "user_id", "mode", "updated_at", "id"),
+    )
     
     id = Column(String, primary_key=True, index=True)
     user_id = Column(String, ForeignKey("users.id"), nullable=False)
     title = Column(String(200), nullable=False)
     mode = Column(String(20), default="kb", nullable=False)  # kb, graph
+    summary = Column(Text, nullable=True)  # 较早消息的摘录窗口（每条截取开头，不是模型生成的摘要）
+    summary_message_count = Column(Integer, default=0, nullable=False)  # 已折叠进摘录的消息数
+    summary_last_created_at = Column(DateTime(timezone=True), nullable=True)  # 最后一条已折叠消息的时间
+    summary_last_message_id = Column(String, nullable=True)  # 最后一条已折叠消息的ID
     created_at = Column(DateTime(timezone=True), server_default=func.now(), nullable=False)
     updated_at = Column(DateTime(timezone=True), server_default=func.now(), onupdate=func.now(), nullable=False)
     
@@ -21,12 +29,16 @@ class ChatSession(Base):
 
 class ChatMessage(Base):
     __tablename__ = "chat_messages"
+    __table_args__ = (
+        Index("ix_chat_messages_session_created", "session_id", "created_at"),
+    )
     
     id = Column(String, primary_key=True, index=True)
     session_id = Column(String, ForeignKey("chat_sessions.id"), nullable=False)
     role = Column(String(20), nullable=False)  # user, assistant
     content = Column(Text, nullable=False)
     references = Column(JSON, nullable=True)  # 引用的知识库内容
+    truncated = Column(Boolean, nullable=False, default=False)  # 客户端断开导致回答不完整
     created_at = Column(DateTime(timezone=True), server_default=func.now(), nullable=False)
     
     # 关系
@@ -1,10 +1,14 @@
-from sqlalchemy import Column, String, Text, DateTime, ForeignKey, JSON, Integer
+from sqlalchemy import Column, String, Text, DateTime, ForeignKey, JSON, Integer, Boolean, Index
 from sqlalchemy.sql import func
 from sqlalchemy.orm import relationship
 from app.core.database import Base
 
 class EmergencySession(Base):
     __tablename__ = "emergency_sessions"
+    # 会话列表按 (updated_at, id) 游标分页
+    __table_args__ = (
+        Index("ix_emergency_sessions_user_updated_id", "user_id", "updated_at", "id"),
+    )
     
     id = Column(String, primary_key=True, index=True)
     user_id = Column(String, ForeignKey("users.id"), nullable=False)
@@ -22,6 +26,9 @@ class EmergencySession(Base):
 
 class EmergencyMessage(Base):
     __tablename__ = "emergency_messages"
+    __table_args__ = (
+        Index("ix_emergency_messages_session_created", "session_id", "created_at"),
+    )
     
     id = Column(String, primary_key=True, index=True)
     session_id = Column(String, ForeignKey("emergency_sessions.id"), nullable=False)
@@ -29,6 +36,7 @@ class EmergencyMessage(Base):
     content = Column(Text, nullable=False)
     steps = Column(JSON, nullable=True)  # 操作步骤
     equipment = Column(JSON, nullable=True)  # 所需设备
+    truncated = Column(Boolean, nullable=False, default=False)  # 客户端断开导致回答不完整
     created_at = Column(DateTime(timezone=True), server_default=func.now(), nullable=False)
     
     # 关系
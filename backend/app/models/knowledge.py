@@ -1,4 +1,4 @@
-from sqlalchemy import Column, String, Text, DateTime, ForeignKey, JSON, Integer, Boolean
+from sqlalchemy import Column, String, Text, DateTime, ForeignKey, JSON, Integer, Boolean, Index
 from sqlalchemy.sql import func
 from sqlalchemy.orm import relationship
 from app.core.database import Base
@@ -23,12 +23,18 @@ class KnowledgeCategory(Base):
 
 class KnowledgeItem(Base):
     __tablename__ = "knowledge_items"
+    # 按 (created_at, id) 游标分页的复合索引
+    __table_args__ = (
+        Index("ix_knowledge_items_status_created_id", "status", "created_at", "id"),
+        Index("ix_knowledge_items_category_created_id", "category_id", "created_at", "id"),
+    )
     
     id = Column(Integer, primary_key=True, index=True)
     category_id = Column(Integer, ForeignKey("knowledge_categories.id"), nullable=False)
     title = Column(String(200), nullable=False)
     content = Column(Text, nullable=False)  # 知识内容
     content_type = Column(String(20), nullable=False)  # document, video, book
+    snippet = Column(String(300), nullable=True)  # 内容摘要，写入时生成，列表接口用来代替全文
     
     # 文档/书籍信息
     author = Column(String(100), nullable=True)
@@ -46,6 +52,9 @@ class KnowledgeItem(Base):
     view_count = Column(Integer, default=0, nullable=False)
     download_count = Column(Integer, default=0, nullable=False)
     
+    # 批量导入的去重键（分类、标题、内容的哈希），重复导入时跳过
+    content_hash = Column(String(64), nullable=True, unique=True, index=True)
+    
     status = Column(String(20), default="active", nullable=False)  # active, inactive
     created_at = Column(DateTime(timezone=True), server_default=func.now(), nullable=False)
     updated_at = Column(DateTime(timezone=True), server_default=func.now(), onupdate=func.now(), nullable=False)
@@ -56,6 +65,17 @@ class KnowledgeItem(Base):
     def __repr__(self):
         return f"<KnowledgeItem(id={self.id}, title={self.title}, content_type={self.content_type})>"
 
+class KnowledgeIndexChange(Base):
+    """知识条目变更记录（outbox），与条目写入在同一事务内提交，由后台任务增量应用到检索索引"""
+    __tablename__ = "knowledge_index_changes"
+    
+    id = Column(Integer, primary_key=True, index=True)
+    item_id = Column(Integer, nullable=False, index=True)
+    created_at = Column(DateTime(timezone=True), server_default=func.now(), nullable=False, index=True)
+    
+    def __repr__(self):
+        return f"<KnowledgeIndexChange(id={self.id}, item_id={self.item_id})>"
+
 class VideoLink(Base):
     __tablename__ = "video_links"
     
@@ -92,6 +112,9 @@ class BookLink(Base):
 
 class UserFavorite(Base):
     __tablename__ = "user_favorites"
+    __table_args__ = (
+        Index("ix_user_favorites_user_created_id", "user_id", "created_at", "id"),
+    )
     
     id = Column(Integer, primary_key=True, index=True)
     user_id = Column(Integer, ForeignKey("users.id"), nullable=False)
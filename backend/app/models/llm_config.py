@@ -1,4 +1,4 @@
-from sqlalchemy import Column, String, Text, DateTime, Boolean
+from sqlalchemy import Column, String, Text, DateTime, Boolean, JSON
 from sqlalchemy.sql import func
 from app.core.database import Base
 
@@ -16,6 +16,7 @@ class LLMConfig(Base):
     max_tokens = Column(String(10), default="2000")  # 最大token数
     is_enabled = Column(Boolean, default=True)  # 是否启用
     enable_thinking = Column(Boolean, default=False)  # 是否启用思考功能
+    fallback_endpoints = Column(JSON, nullable=True)  # 备用端点列表：[{base_url, api_key, model_name}]，按顺序故障转移
     description = Column(Text)  # 配置描述
     created_at = Column(DateTime, default=func.now())
     updated_at = Column(DateTime, default=func.now(), onupdate=func.now())
@@ -1,9 +1,14 @@
-from sqlalchemy import Column, String, Text, DateTime, Boolean
+from sqlalchemy import Column, String, Text, DateTime, Boolean, Index
 from sqlalchemy.sql import func
 from app.core.database import Base
 
 class ContactMessage(Base):
     __tablename__ = "contact_messages"
+    # 按 (created_at, id) 游标分页的复合索引
+    __table_args__ = (
+        Index("ix_contact_messages_created_id", "created_at", "id"),
+        Index("ix_contact_messages_status_created_id", "status", "created_at", "id"),
+    )
     
     id = Column(String, primary_key=True, index=True)
     name = Column(String(50), nullable=False)
@@ -1,9 +1,13 @@
-from sqlalchemy import Column, String, Text, DateTime, ForeignKey, JSON, Integer, Float
+from sqlalchemy import Column, String, Text, DateTime, ForeignKey, JSON, Integer, Float, Index
 from sqlalchemy.sql import func
 from app.core.database import Base
 
 class TriageRecord(Base):
     __tablename__ = "triage_records"
+    # 按 (created_at, id) 游标分页的复合索引
+    __table_args__ = (
+        Index("ix_triage_records_user_created_id", "user_id", "created_at", "id"),
+    )
     
     id = Column(String, primary_key=True, index=True)
     user_id = Column(String, ForeignKey("users.id"), nullable=False)
@@ -14,6 +14,7 @@ class ChatMessageResponse(BaseModel):
     role: str  # user, assistant
     content: str
     references: Optional[List[Any]] = None
+    truncated: bool = False
     created_at: datetime
 
     class Config:
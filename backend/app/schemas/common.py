@@ -10,11 +10,17 @@ class ApiResponse(BaseModel):
     timestamp: str = datetime.now().isoformat()
 
 class PaginatedResponse(BaseModel):
-    """分页响应格式"""
-    total: int
+    """分页响应格式
+
+    next_cursor 用于按游标继续翻页（cursor 参数）；total 在 total=none 时为空，total=approx 时为估计值。
+    """
+    total: Optional[int] = None
     page: int
     page_size: int
     records: List[Any]
+    total_exact: bool = True
+    has_more: Optional[bool] = None
+    next_cursor: Optional[str] = None
 
 class HealthStatus(BaseModel):
     """健康检查响应"""
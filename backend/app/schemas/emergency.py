@@ -38,6 +38,7 @@ class EmergencyMessageResponse(BaseModel):
     content: str
     steps: Optional[List[str]] = None
     equipment: Optional[List[str]] = None
+    truncated: bool = False
     created_at: datetime
 
     class Config:
@@ -52,6 +52,7 @@ class KnowledgeItemUpdate(KnowledgeItemBase):
 
 class KnowledgeItemResponse(KnowledgeItemBase):
     id: int
+    snippet: Optional[str] = None
     view_count: int
     download_count: int
     created_at: datetime
@@ -123,4 +124,20 @@ class UserFavoriteResponse(UserFavoriteBase):
     created_at: datetime
 
     class Config:
-        from_attributes = True 
\ No newline at end of file
+        from_attributes = True
+
+# 列表接口 fields 参数可选的字段及预设；summary 不含正文、描述等大文本字段
+KNOWLEDGE_ITEM_FIELDS = tuple(KnowledgeItemResponse.model_fields)
+KNOWLEDGE_ITEM_FIELD_PRESETS = {
+    "summary": (
+        "id", "category_id", "title", "snippet", "content_type", "author", "cover_url",
+        "file_url", "view_count", "download_count", "status", "created_at", "updated_at"
+    ),
+    "all": KNOWLEDGE_ITEM_FIELDS
+}
+VIDEO_LINK_FIELDS = tuple(VideoLinkResponse.model_fields)
+BOOK_LINK_FIELDS = tuple(BookLinkResponse.model_fields)
+LINK_FIELD_PRESETS = {
+    "video": {"summary": tuple(field for field in VIDEO_LINK_FIELDS if field != "description"), "all": VIDEO_LINK_FIELDS},
+    "book": {"summary": tuple(field for field in BOOK_LINK_FIELDS if field != "description"), "all": BOOK_LINK_FIELDS}
+}
@@ -1,7 +1,13 @@
 from pydantic import BaseModel, Field
-from typing import Optional
+from typing import Optional, List
 from datetime import datetime
 
+class LLMEndpoint(BaseModel):
+    """备用LLM端点（api_key、model_name 未填写时沿用主端点）"""
+    base_url: str = Field(..., description="API基础URL")
+    api_key: Optional[str] = Field(None, description="API密钥")
+    model_name: Optional[str] = Field(None, description="模型名称")
+
 class LLMConfigBase(BaseModel):
     """LLM配置基础模型"""
     module_name: str = Field(..., description="模块名称")
@@ -13,6 +19,7 @@ class LLMConfigBase(BaseModel):
     max_tokens: str = Field(default="2000", description="最大token数")
     is_enabled: bool = Field(default=True, description="是否启用")
     enable_thinking: bool = Field(default=False, description="是否启用思考功能")
+    fallback_endpoints: Optional[List[LLMEndpoint]] = Field(None, description="备用端点（按顺序故障转移/对冲）")
     description: Optional[str] = Field(None, description="配置描述")
 
 class LLMConfigCreate(LLMConfigBase):
@@ -29,6 +36,7 @@ class LLMConfigUpdate(BaseModel):
     max_tokens: Optional[str] = None
     is_enabled: Optional[bool] = None
     enable_thinking: Optional[bool] = None
+    fallback_endpoints: Optional[List[LLMEndpoint]] = None
     description: Optional[str] = None
 
 class LLMConfigResponse(LLMConfigBase):
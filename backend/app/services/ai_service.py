@@ -2,9 +2,40 @@ from typing import List, Dict, Any, Optional, AsyncGenerator
 import os
 import json
 import asyncio
+import time
 from app.core.config import settings
 from app.core.database import SessionLocal
 from app.models.llm_config import LLMConfig
+from app.services.llm_client_pool import llm_client_pool
+from app.services.response_cache import response_cache, make_request_key
+from app.services.single_flight import single_flight
+from app.services.llm_scheduler import llm_scheduler, LLMOverloadedError
+from app.services.llm_endpoint_stats import llm_latency_tracker
+
+# 刷新配置缓存时，读取期间配置被修改后重新读取的次数
+CONFIG_REFRESH_ATTEMPTS = 3
+
+class _UpstreamAttempt:
+    """向单个端点发起的一次请求，事件通过队列交给调度方"""
+    
+    def __init__(self, key: str, hedged: bool):
+        self.key = key
+        self.hedged = hedged
+        self.started_at = time.monotonic()
+        self.queue: asyncio.Queue = asyncio.Queue()
+        self.task: Optional[asyncio.Task] = None
+    
+    async def run(self, stream: AsyncGenerator[Dict[str, Any], None]):
+        try:
+            async for event in stream:
+                await self.queue.put(("event", event))
+            await self.queue.put(("end", None))
+        except asyncio.CancelledError:
+            raise
+        except Exception as e:
+            await self.queue.put(("error", e))
+        finally:
+            await stream.aclose()
 
 class AIService:
     def __init__(self):
@@ -13,32 +44,40 @@ class AIService:
         self.default_base_url = settings.openai_base_url
         self.default_model = settings.kb_model
         
-        # 缓存配置
+        # 缓存配置（只在事件循环中整体替换或按模块修改，读取为O(1)字典查找）
         self._config_cache = {}
         self._cache_timestamp = 0
-        self._cache_ttl = 300  # 5分钟缓存
+        self._cache_ttl = settings.llm_config_cache_ttl
+        self._refresh_task: Optional[asyncio.Task] = None
+        # 管理端每次修改配置时加一：在线程池中读取期间有修改的快照已过期，不能覆盖缓存
+        self._config_generation = 0
+    
+    @staticmethod
+    def _config_to_dict(config: LLMConfig) -> Dict[str, Any]:
+        """将LLMConfig转换为缓存条目"""
+        return {
+            "api_key": config.api_key,
+            "base_url": config.base_url,
+            "model_name": config.model_name,
+            "temperature": config.temperature,
+            "max_tokens": config.max_tokens,
+            "is_enabled": config.is_enabled,
+            "enable_thinking": config.enable_thinking, # 新增思考功能配置
+            "fallback_endpoints": config.fallback_endpoints or []
+        }
     
     def _get_module_config(self, module_name: str) -> Dict[str, Any]:
-        """获取模块的LLM配置"""
-        import time
-        current_time = time.time()
-        
-        # 检查缓存是否过期
-        if current_time - self._cache_timestamp > self._cache_ttl:
-            print(f"Config cache expired, refreshing...")
-            self._refresh_config_cache()
-        
-        print(f"Getting config for module: {module_name}")
-        print(f"Available modules in cache: {list(self._config_cache.keys())}")
+        """获取模块的LLM配置（不阻塞事件循环）"""
+        # 缓存过期时在后台刷新，本次先使用现有配置
+        if time.time() - self._cache_timestamp > self._cache_ttl:
+            self._schedule_config_refresh()
         
         # 从缓存获取配置
-        if module_name in self._config_cache:
-            config = self._config_cache[module_name]
-            print(f"Found config for {module_name}: API key exists = {bool(config.get('api_key'))}")
+        config = self._config_cache.get(module_name)
+        if config is not None:
             return config
         
         # 如果没有找到配置，返回默认配置
-        print(f"No config found for {module_name}, using default config")
         return {
             "api_key": self.default_api_key,
             "base_url": self.default_base_url,
@@ -48,34 +87,75 @@ class AIService:
             "is_enabled": True
         }
     
-    def _refresh_config_cache(self):
-        """刷新配置缓存"""
-        import time
+    def _schedule_config_refresh(self):
+        """在后台调度一次配置刷新（已有刷新任务时不重复调度）"""
+        if self._refresh_task is not None and not self._refresh_task.done():
+            return
+        try:
+            self._refresh_task = asyncio.get_running_loop().create_task(self.refresh_config_cache())
+        except RuntimeError:
+            # 没有运行中的事件循环（如同步脚本），直接同步加载
+            self._apply_loaded_configs(self._load_configs())
+    
+    async def ensure_config_loaded(self):
+        """确保配置缓存至少加载过一次"""
+        if self._cache_timestamp == 0:
+            await self.refresh_config_cache()
+    
+    async def refresh_config_cache(self):
+        """刷新配置缓存（数据库查询在线程池中执行）
+
+        读取期间管理端修改了配置时，读到的快照可能不含这次修改，丢弃后重新读取。
+        """
+        loop = asyncio.get_running_loop()
+        for _ in range(CONFIG_REFRESH_ATTEMPTS):
+            generation = self._config_generation
+            configs = await loop.run_in_executor(None, self._load_configs)
+            if generation == self._config_generation:
+                self._apply_loaded_configs(configs)
+                return
+        # 一直有修改：保留按模块更新过的缓存，下次读取配置时再刷新
+        print("LLM config changed during every refresh attempt; keeping current cache")
+    
+    def _load_configs(self) -> Optional[Dict[str, Dict[str, Any]]]:
+        """从数据库读取所有启用的配置（同步，运行在线程池中）"""
         db = SessionLocal()
         try:
             configs = db.query(LLMConfig).filter(LLMConfig.is_enabled == True).all()
-            self._config_cache = {}
-            print(f"Loading {len(configs)} LLM configs from database...")
-            for config in configs:
-                self._config_cache[config.module_name] = {
-                    "api_key": config.api_key,
-                    "base_url": config.base_url,
-                    "model_name": config.model_name,
-                    "temperature": config.temperature,
-                    "max_tokens": config.max_tokens,
-                    "is_enabled": config.is_enabled,
-                    "enable_thinking": config.enable_thinking # 新增思考功能配置
-                }
-                print(f"Loaded config for module: {config.module_name}")
-            self._cache_timestamp = time.time()
-            print(f"Config cache refreshed with {len(self._config_cache)} modules")
+            return {config.module_name: self._config_to_dict(config) for config in configs}
         except Exception as e:
             print(f"Failed to refresh LLM config cache: {e}")
             import traceback
             traceback.print_exc()
+            return None
         finally:
             db.close()
     
+    def _apply_loaded_configs(self, configs: Optional[Dict[str, Dict[str, Any]]]):
+        """用新加载的配置整体替换缓存"""
+        if configs is None:
+            # 加载失败时保留旧缓存，推迟下一次重试
+            self._cache_timestamp = time.time() - self._cache_ttl + 30
+            return
+        self._config_cache = configs
+        self._cache_timestamp = time.time()
+        print(f"Config cache refreshed with {len(configs)} modules")
+    
+    def update_module_config(self, config: LLMConfig):
+        """管理端创建/修改配置后立即更新缓存"""
+        self._config_generation += 1
+        if config.is_enabled:
+            self._config_cache[config.module_name] = self._config_to_dict(config)
+        else:
+            self._config_cache.pop(config.module_name, None)
+        response_cache.invalidate_module(config.module_name)
+    
+    def invalidate_module_config(self, module_name: str):
+        """管理端删除配置后立即从缓存移除"""
+        self._config_generation += 1
+        self._config_cache.pop(module_name, None)
+        response_cache.invalidate_module(module_name)
+    
     async def stream_chat_completion(
         self, 
         messages: List[Dict[str, str]], 
@@ -100,6 +180,7 @@ class AIService:
         }
         
         module_name = module_mapping.get(mode, "chat_kb")
+        await self.ensure_config_loaded()
         config = self._get_module_config(module_name)
         
         # 检查配置是否启用
@@ -109,64 +190,256 @@ class AIService:
             return
         
         # 检查API密钥
-        api_key = config.get("api_key")
-        if not api_key:
+        if not config.get("api_key"):
             async for chunk in self._mock_stream_response(messages[-1]["content"], mode):
                 yield chunk
             return
         
-        try:
-            # 导入异步OpenAI SDK
-            from openai import AsyncOpenAI
-            
-            # 创建客户端
-            client = AsyncOpenAI(
-                api_key=api_key,
-                base_url=config.get("base_url", "https://dashscope.aliyuncs.com/compatible-mode/v1")
+        request_params = self._build_request_params(config, messages, temperature, max_tokens)
+        
+        # 命中回复缓存时直接回放
+        request_key = make_request_key(module_name, request_params)
+        use_cache = response_cache.is_enabled_for(module_name)
+        if use_cache:
+            cached = response_cache.get(request_key)
+            if cached is not None:
+                async for chunk in response_cache.replay(cached):
+                    yield chunk
+                return
+        
+        def upstream():
+            return self._stream_and_cache(
+                config, request_params, mode, module_name, request_key if use_cache else None
             )
+        
+        try:
+            # 相同的并发请求共享同一次上游生成
+            if settings.llm_single_flight_enabled:
+                stream = single_flight.stream(request_key, upstream)
+            else:
+                stream = upstream()
+            async for chunk in stream:
+                yield chunk
             
-            # 处理消息格式
-            processed_messages = []
-            for msg in messages:
-                processed_messages.append({
-                    "role": msg["role"],
-                    "content": msg["content"]
-                })
-            
-            # 获取配置参数
-            model = config.get("model_name", "qwen-plus")
-            if temperature is None:
-                temperature = float(config.get("temperature", "0.7"))
-            if max_tokens is None:
-                max_tokens = int(config.get("max_tokens", "2000"))
-            
-            # 构建请求参数
-            request_params = {
-                "model": model,
-                "messages": processed_messages,
-                "stream": True,  # 强制启用流式输出
-                "temperature": temperature,
-                "max_tokens": max_tokens,
+        except LLMOverloadedError as e:
+            print(f"AI服务繁忙: {e}")
+            # 低优先级请求在过载时降级为繁忙提示，不占用上游
+            yield {
+                "type": "error",
+                "message": "当前咨询人数较多，请稍后重试。如遇紧急情况请使用应急指导或直接拨打120。"
             }
+        except Exception as e:
+            print(f"AI服务调用失败: {e}")
+            # 发生错误时返回模拟响应
+            async for chunk in self._mock_stream_response(messages[-1]["content"], mode):
+                yield chunk
+    
+    async def _stream_and_cache(
+        self,
+        config: Dict[str, Any],
+        request_params: Dict[str, Any],
+        mode: str,
+        module_name: str,
+        cache_key: Optional[str]
+    ) -> AsyncGenerator[Dict[str, Any], None]:
+        """按优先级占用上游名额后调用上游，并在正常完成时写入回复缓存"""
+        thinking_content = ""
+        async with llm_scheduler.slot(mode):
+            async for chunk in self._stream_upstream(config, request_params, mode, module_name):
+                if chunk["type"] == "thinking":
+                    thinking_content += chunk["content"]
+                elif chunk["type"] == "done" and cache_key is not None:
+                    response_cache.set(cache_key, module_name, chunk["content"], thinking_content)
+                yield chunk
+    
+    def _build_request_params(
+        self,
+        config: Dict[str, Any],
+        messages: List[Dict[str, str]],
+        temperature: Optional[float],
+        max_tokens: Optional[int]
+    ) -> Dict[str, Any]:
+        """根据模块配置构建上游请求参数"""
+        # 处理消息格式
+        processed_messages = []
+        for msg in messages:
+            processed_messages.append({
+                "role": msg["role"],
+                "content": msg["content"]
+            })
+        
+        # 获取配置参数
+        model = config.get("model_name", "qwen-plus")
+        if temperature is None:
+            temperature = float(config.get("temperature", "0.7"))
+        if max_tokens is None:
+            max_tokens = int(config.get("max_tokens", "2000"))
+        
+        # 构建请求参数
+        request_params = {
+            "model": model,
+            "messages": processed_messages,
+            "stream": True,  # 强制启用流式输出
+            "temperature": temperature,
+            "max_tokens": max_tokens,
+        }
+        
+        # 检查是否启用思考功能（从数据库配置中读取）
+        if config.get("enable_thinking", False) and "qwen" in model.lower():
+            # 根据阿里云文档，通过extra_body配置思考功能
+            request_params["extra_body"] = {
+                "enable_thinking": True,
+                "thinking_budget": 30000  # 思考过程的最大长度
+            }
+        
+        return request_params
+    
+    def _get_endpoints(self, config: Dict[str, Any]) -> List[Dict[str, Any]]:
+        """模块的有序端点列表：主端点 + 备用端点（未填写的字段沿用主端点）"""
+        primary = {
+            "api_key": config["api_key"],
+            "base_url": config.get("base_url") or self.default_base_url,
+            "model_name": config.get("model_name", "qwen-plus")
+        }
+        endpoints = [primary]
+        for fallback in config.get("fallback_endpoints") or []:
+            if not fallback.get("base_url"):
+                continue
+            endpoints.append({
+                "api_key": fallback.get("api_key") or primary["api_key"],
+                "base_url": fallback["base_url"],
+                "model_name": fallback.get("model_name") or primary["model_name"]
+            })
+        return endpoints
+    
+    async def _stream_upstream(
+        self,
+        config: Dict[str, Any],
+        request_params: Dict[str, Any],
+        mode: str,
+        module_name: str
+    ) -> AsyncGenerator[Dict[str, Any], None]:
+        """带故障转移和对冲请求的上游调用
+        
+        按顺序尝试模块的端点：首token前失败立即切换到下一个端点；
+        首token超过当前端点p95延迟仍未到达时，向下一个端点发起对冲请求，
+        先产生首token的请求胜出，另一个被取消。首token之后的失败直接抛出。
+        对冲请求另外占用一个调度名额（两个请求同时进行期间），没有空闲名额时不对冲。
+        """
+        enable_thinking = config.get("enable_thinking", False)
+        if "extra_body" in request_params:
+            print(f"启用思考模式 for model: {request_params['model']}, module: {module_name}, extra_body: {request_params['extra_body']}")
+        
+        pending = llm_latency_tracker.order_endpoints(self._get_endpoints(config))
+        attempts: List[_UpstreamAttempt] = []
+        winner: Optional[_UpstreamAttempt] = None
+        first_event = None
+        last_error: Optional[BaseException] = None
+        # 对冲请求占用的额外名额数
+        hedge_slots = 0
+        
+        try:
+            while winner is None:
+                if not attempts:
+                    if not pending:
+                        raise last_error or RuntimeError("No LLM endpoint available")
+                    attempts.append(self._start_attempt(pending.pop(0), request_params, enable_thinking, hedged=False))
+                
+                # 还有备用端点且未在对冲时，等到p95截止时间
+                timeout = None
+                if settings.llm_hedge_enabled and pending and len(attempts) == 1:
+                    timeout = llm_latency_tracker.hedge_delay(attempts[0].key)
+                
+                getters = {asyncio.ensure_future(attempt.queue.get()): attempt for attempt in attempts}
+                done, not_done = await asyncio.wait(getters, timeout=timeout, return_when=asyncio.FIRST_COMPLETED)
+                for getter in not_done:
+                    getter.cancel()
+                
+                if not done:
+                    # 首token超时，发起对冲请求；没有空闲名额时继续等待当前请求，下一个截止时间再尝试
+                    if not llm_scheduler.try_acquire(mode):
+                        continue
+                    hedge_slots += 1
+                    endpoint = pending.pop(0)
+                    print(f"首token超时，对冲请求 {module_name} -> {endpoint['base_url']}")
+                    attempts.append(self._start_attempt(endpoint, request_params, enable_thinking, hedged=True))
+                    continue
+                
+                for getter in done:
+                    attempt = getters[getter]
+                    kind, payload = getter.result()
+                    if kind == "event" and winner is None:
+                        winner = attempt
+                        first_event = payload
+                    elif kind != "event":
+                        # 首token前失败（或空响应），切换到下一个端点
+                        last_error = payload if kind == "error" else RuntimeError("Empty response from upstream")
+                        llm_latency_tracker.record_failure(attempt.key)
+                        print(f"LLM端点失败 {attempt.key}: {last_error}")
+                        attempts.remove(attempt)
+                        if hedge_slots:
+                            # 只剩一个请求时由外层名额覆盖
+                            llm_scheduler.release(mode)
+                            hedge_slots -= 1
             
-            # 检查是否启用思考功能（从数据库配置中读取）
-            enable_thinking = config.get("enable_thinking", False)
-            if enable_thinking and "qwen" in model.lower():
-                # 根据阿里云文档，通过extra_body配置思考功能
-                request_params["extra_body"] = {
-                    "enable_thinking": True,
-                    "thinking_budget": 30000  # 思考过程的最大长度
-                }
-                print(f"启用思考模式 for model: {model}, module: {module_name}, extra_body: {request_params['extra_body']}")
-            
-            # 调用OpenAI兼容API
-            completion = await client.chat.completions.create(**request_params)
-            
-            # 处理流式响应
-            full_content = ""
-            thinking_content = ""
-            is_thinking = False
+            llm_latency_tracker.record_ttft(winner.key, time.monotonic() - winner.started_at, winner.hedged)
+            for attempt in attempts:
+                if attempt is not winner:
+                    attempt.task.cancel()
+            while hedge_slots:
+                llm_scheduler.release(mode)
+                hedge_slots -= 1
             
+            yield first_event
+            while True:
+                kind, payload = await winner.queue.get()
+                if kind == "event":
+                    yield payload
+                elif kind == "error":
+                    raise payload
+                else:
+                    break
+        finally:
+            for attempt in attempts:
+                attempt.task.cancel()
+            while hedge_slots:
+                llm_scheduler.release(mode)
+                hedge_slots -= 1
+    
+    def _start_attempt(
+        self,
+        endpoint: Dict[str, Any],
+        request_params: Dict[str, Any],
+        enable_thinking: bool,
+        hedged: bool
+    ) -> "_UpstreamAttempt":
+        """在后台任务中向单个端点发起请求"""
+        params = dict(request_params, model=endpoint["model_name"])
+        attempt = _UpstreamAttempt(llm_latency_tracker.endpoint_key(endpoint), hedged)
+        attempt.task = asyncio.get_running_loop().create_task(
+            attempt.run(self._stream_endpoint(endpoint, params, enable_thinking))
+        )
+        return attempt
+    
+    async def _stream_endpoint(
+        self,
+        endpoint: Dict[str, Any],
+        request_params: Dict[str, Any],
+        enable_thinking: bool
+    ) -> AsyncGenerator[Dict[str, Any], None]:
+        """调用单个上游端点并把流式响应转换为内部事件，失败时抛出异常"""
+        # 从连接池获取长连接客户端
+        client = llm_client_pool.get_client(endpoint["api_key"], endpoint["base_url"])
+        
+        # 调用OpenAI兼容API
+        completion = await client.chat.completions.create(**request_params)
+        
+        # 处理流式响应
+        full_content = ""
+        thinking_content = ""
+        is_thinking = False
+        
+        try:
             async for chunk in completion:
                 # 解析chunk数据
                 chunk_dict = chunk.model_dump() if hasattr(chunk, 'model_dump') else chunk
@@ -184,11 +457,11 @@ class AIService:
                             "content": delta['reasoning_content']
                         }
                         continue
-                    
+                
                     # 处理回复内容
                     if 'content' in delta and delta['content']:
                         content = delta['content']
-                        
+                    
                         # 如果刚从思考模式切换到回答模式，或者是第一次输出内容
                         if (is_thinking and not full_content) or (not full_content and not is_thinking):
                             yield {
@@ -196,13 +469,13 @@ class AIService:
                                 "content": ""
                             }
                             is_thinking = False
-                        
+                    
                         full_content += content
                         yield {
                             "type": "answer",
                             "content": content
                         }
-                    
+                
                     # 检查是否完成
                     finish_reason = choice.get('finish_reason')
                     if finish_reason:
@@ -213,12 +486,9 @@ class AIService:
                             "thinking_content_length": len(thinking_content) if thinking_content else 0
                         }
                         break
-            
-        except Exception as e:
-            print(f"AI服务调用失败: {e}")
-            # 发生错误时返回模拟响应
-            async for chunk in self._mock_stream_response(messages[-1]["content"], mode):
-                yield chunk
+        finally:
+            # 提前结束（取消或出错）时立即释放上游连接
+            await completion.response.aclose()
     
     async def chat_completion(
         self, 
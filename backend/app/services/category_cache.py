@@ -0,0 +1,90 @@
+from typing import Dict, List, Optional, Tuple
+import hashlib
+import time
+from sqlalchemy import event
+from sqlalchemy.orm import Session, object_session
+from app.core.config import settings
+from app.models.knowledge import KnowledgeCategory
+from app.schemas.common import ApiResponse
+from app.schemas.knowledge import KnowledgeCategoryResponse
+
+def build_category_tree(categories: List[KnowledgeCategory]) -> List[KnowledgeCategoryResponse]:
+    """把按 sort_order 排序的分类列表组装成树（只保留从启用的顶级分类可达的节点）"""
+    children: Dict[Optional[int], List[KnowledgeCategory]] = {}
+    for category in categories:
+        children.setdefault(category.parent_id, []).append(category)
+
+    def build(category: KnowledgeCategory) -> KnowledgeCategoryResponse:
+        # 逐字段构造，不经过 ORM 关系属性（避免每个节点触发一次延迟加载）
+        return KnowledgeCategoryResponse(
+            id=category.id,
+            name=category.name,
+            description=category.description,
+            parent_id=category.parent_id,
+            sort_order=category.sort_order,
+            status=category.status,
+            created_at=category.created_at,
+            children=[build(child) for child in children[category.id]] if category.id in children else None
+        )
+
+    return [build(category) for category in children.get(None, [])]
+
+class CategoryTreeCache:
+    """知识库分类树缓存
+
+    一次查询加载全部启用的分类，在内存中组装成树，缓存序列化后的响应体。
+    版本号取响应体的哈希，作为 ETag；同一内容在各 worker 中版本一致。
+    本进程内分类变更在事务提交后立即失效，其他进程（脚本、其他 worker）的变更在 TTL 后生效。
+    """
+
+    def __init__(self):
+        self._body: Optional[bytes] = None
+        self._version: Optional[str] = None
+        self._loaded_at = 0.0
+        self.hits = 0
+        self.misses = 0
+
+    def get(self, db: Session) -> Tuple[bytes, str]:
+        """返回 (响应体, 版本号)"""
+        if self._body is None or time.time() - self._loaded_at > settings.category_cache_ttl:
+            self.misses += 1
+            categories = db.query(KnowledgeCategory).filter(
+                KnowledgeCategory.status == "active"
+            ).order_by(KnowledgeCategory.sort_order, KnowledgeCategory.id).all()
+            response = ApiResponse(
+                message="Knowledge categories retrieved successfully",
+                data=build_category_tree(categories)
+            )
+            self._body = response.model_dump_json().encode("utf-8")
+            # 只对分类数据取哈希（timestamp 各进程不同）
+            data = response.model_dump_json(include={"data"}).encode("utf-8")
+            self._version = hashlib.sha1(data).hexdigest()[:16]
+            self._loaded_at = time.time()
+        else:
+            self.hits += 1
+        return self._body, self._version
+
+    def invalidate(self):
+        self._body = None
+        self._version = None
+
+# 创建全局分类树缓存实例
+category_tree_cache = CategoryTreeCache()
+
+def _mark_changed(mapper, connection, target):
+    # 在事务提交后才失效，避免其他请求在提交前用旧数据重新填充缓存
+    session = object_session(target)
+    if session is not None:
+        session.info["category_tree_changed"] = True
+
+for _event_name in ("after_insert", "after_update", "after_delete"):
+    event.listen(KnowledgeCategory, _event_name, _mark_changed)
+
+@event.listens_for(Session, "after_commit")
+def _invalidate_after_commit(session):
+    if session.info.pop("category_tree_changed", False):
+        category_tree_cache.invalidate()
+
+@event.listens_for(Session, "after_rollback")
+def _discard_after_rollback(session):
+    session.info.pop("category_tree_changed", None)
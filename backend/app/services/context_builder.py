@@ -0,0 +1,168 @@
+from typing import List, Dict, Optional, Tuple
+from datetime import datetime
+import re
+from sqlalchemy.orm import Session
+from app.core.config import settings
+from app.core.pagination import position_after, position_before
+from app.models.chat import ChatSession, ChatMessage
+
+# 中日韩统一表意文字及全角标点，按每字约1个token估算
+_CJK_RE = re.compile(r"[\u3000-\u303f\u3400-\u4dbf\u4e00-\u9fff\uff00-\uffef]")
+_WHITESPACE_RE = re.compile(r"\s+")
+
+# 每条消息的格式开销（role、分隔符等）
+MESSAGE_TOKEN_OVERHEAD = 4
+
+# 较早消息摘录中每条消息保留的字符数
+EXCERPT_USER_CHARS = 80
+EXCERPT_ASSISTANT_CHARS = 160
+
+def estimate_tokens(text: str) -> int:
+    """本地粗略估算token数：中文按字计数，其余字符按4个字符1个token"""
+    if not text:
+        return 0
+    cjk_count = len(_CJK_RE.findall(text))
+    other_count = len(text) - cjk_count
+    return cjk_count + (other_count + 3) // 4
+
+class ChatContextBuilder:
+    """聊天上下文构建器
+
+    只把最近、且在模块token预算内的消息发送给模型；
+    滑出窗口的较早消息增量折叠进会话的摘录窗口（chat_sessions.summary）：
+    每条消息截取开头一段，不调用模型生成摘要，超出摘录预算时丢弃最早的摘录，
+    只保留最近被折叠的若干条。最后一条已折叠消息的 (created_at, id) 记录在
+    summary_last_created_at/summary_last_message_id 中，摘录只追加不重算。
+    """
+
+    def get_token_budget(self, mode: str) -> int:
+        """获取模式对应的上下文token预算"""
+        return settings.context_token_budgets.get(mode, settings.context_token_budget_default)
+
+    def get_excerpt_budget(self, mode: str) -> int:
+        """摘录窗口的token预算：context_summary_token_budget，且不超过模式预算的一半"""
+        return min(settings.context_summary_token_budget, self.get_token_budget(mode) // 2)
+
+    def build(
+        self, db: Session, session: ChatSession, new_message: Optional[ChatMessage] = None
+    ) -> Tuple[List[Dict[str, str]], int]:
+        """构建发送给模型的消息列表，返回 (消息列表, 会话消息总数)
+
+        new_message 为尚未写入数据库的本轮用户消息，作为最新一条消息加入。
+        """
+        total = db.query(ChatMessage).filter(
+            ChatMessage.session_id == session.id
+        ).count()
+        unfolded = db.query(ChatMessage).filter(ChatMessage.session_id == session.id)
+        boundary = self._folded_boundary(db, session)
+        if boundary is not None:
+            unfolded = unfolded.filter(position_after(db, ChatMessage.created_at, ChatMessage.id, *boundary))
+
+        # 只加载尚未折叠的最近若干条消息，避免读取整段历史
+        limit = settings.context_max_messages - (1 if new_message is not None else 0)
+        recent = unfolded.order_by(
+            ChatMessage.created_at.desc(), ChatMessage.id.desc()
+        ).limit(limit).all()
+        # 达到条数上限时，更早的消息中可能还有未折叠的
+        more_unfolded = len(recent) >= limit
+        recent.reverse()
+        if new_message is not None:
+            recent.append(new_message)
+            total += 1
+
+        budget = self.get_token_budget(session.mode)
+        excerpt_budget = self.get_excerpt_budget(session.mode)
+
+        # 从最新的消息向前选取，直到用完预算（最新一条总是保留）
+        window: List[ChatMessage] = []
+        used = 0
+        for msg in reversed(recent):
+            cost = estimate_tokens(msg.content) + MESSAGE_TOKEN_OVERHEAD
+            if window and used + cost > budget:
+                break
+            window.append(msg)
+            used += cost
+        window.reverse()
+
+        # 窗口以用户消息开头，开头的助手消息一并折叠进摘录
+        while len(window) > 1 and window[0].role != "user":
+            window.pop(0)
+
+        # 把滑出窗口但尚未折叠的消息增量折叠进摘录（按 (created_at, id) 位置，删除消息不影响边界）
+        if len(window) < len(recent) or more_unfolded:
+            folding = unfolded
+            if window[0] is not new_message:
+                folding = folding.filter(position_before(
+                    db, ChatMessage.created_at, ChatMessage.id, window[0].created_at, window[0].id
+                ))
+            folded = folding.order_by(ChatMessage.created_at.asc(), ChatMessage.id.asc()).all()
+            if folded:
+                session.summary = self._fold_excerpts(session.summary, folded, excerpt_budget)
+                session.summary_message_count = (session.summary_message_count or 0) + len(folded)
+                session.summary_last_created_at = folded[-1].created_at
+                session.summary_last_message_id = folded[-1].id
+                db.commit()
+
+        ai_messages: List[Dict[str, str]] = []
+        # 预算调小前保存的摘录可能超出当前预算，发送前按当前预算裁剪
+        excerpts = self._trim_excerpts(session.summary.split("\n"), excerpt_budget) if session.summary else ""
+        if excerpts:
+            ai_messages.append({
+                "role": "system",
+                "content": f"以下是本次对话中较早内容的摘录（每条只保留开头部分），供参考：\n{excerpts}"
+            })
+        for msg in window:
+            ai_messages.append({
+                "role": msg.role,
+                "content": msg.content
+            })
+        return ai_messages, total
+
+    def _folded_boundary(self, db: Session, session: ChatSession) -> Optional[Tuple[datetime, str]]:
+        """最后一条已折叠消息的 (created_at, id)，没有折叠过时返回 None
+
+        旧版本只记录了已折叠的条数，按位置取一次边界并保存。
+        """
+        if session.summary_last_message_id is not None:
+            return session.summary_last_created_at, session.summary_last_message_id
+        if not session.summary_message_count:
+            return None
+        last = db.query(ChatMessage.created_at, ChatMessage.id).filter(
+            ChatMessage.session_id == session.id
+        ).order_by(
+            ChatMessage.created_at.asc(), ChatMessage.id.asc()
+        ).offset(session.summary_message_count - 1).first()
+        if last is None:
+            return None
+        session.summary_last_created_at, session.summary_last_message_id = last.created_at, last.id
+        return last.created_at, last.id
+
+    def _fold_excerpts(self, excerpts: Optional[str], messages: List[ChatMessage], budget: int) -> str:
+        """把消息的开头一段追加进摘录窗口，超出预算时丢弃最早的摘录行"""
+        lines = excerpts.split("\n") if excerpts else []
+        for msg in messages:
+            text = _WHITESPACE_RE.sub(" ", msg.content or "").strip()
+            if not text:
+                continue
+            if msg.role == "user":
+                lines.append(f"用户：{self._truncate(text, EXCERPT_USER_CHARS)}")
+            else:
+                lines.append(f"助手：{self._truncate(text, EXCERPT_ASSISTANT_CHARS)}")
+        return self._trim_excerpts(lines, budget)
+
+    @staticmethod
+    def _trim_excerpts(lines: List[str], budget: int) -> str:
+        """丢弃最早的摘录行直到不超过预算"""
+        total = sum(estimate_tokens(line) for line in lines)
+        start = 0
+        while start < len(lines) and total > budget:
+            total -= estimate_tokens(lines[start])
+            start += 1
+        return "\n".join(lines[start:])
+
+    @staticmethod
+    def _truncate(text: str, limit: int) -> str:
+        return text if len(text) <= limit else text[:limit] + "…"
+
+# 创建全局上下文构建器实例
+chat_context_builder = ChatContextBuilder()
@@ -0,0 +1,105 @@
+from typing import Dict, Any, Optional
+import asyncio
+import time
+from sqlalchemy import text
+from app.core.config import settings
+from app.core.database import engine
+
+# 可累加的统计字段
+COUNTER_FIELDS = ("view_count", "download_count")
+
+class ItemCounterBuffer:
+    """知识条目查看/下载次数的写后合并
+
+    请求只在内存中累加（每个 worker 独立），后台任务定期把累计值
+    批量写成 UPDATE knowledge_items SET view_count = view_count + n，关闭时再写一次；
+    写入失败时把增量并回缓冲区，下一轮重试。
+    """
+
+    def __init__(self):
+        self._pending: Dict[str, Dict[int, int]] = {field: {} for field in COUNTER_FIELDS}
+        self._task: Optional[asyncio.Task] = None
+        self._inflight: Optional[asyncio.Future] = None
+        self.flushes = 0
+        self.flushed_increments = 0
+        self.failures = 0
+        self.last_flush_at: Optional[float] = None
+
+    def increment(self, field: str, item_id: int, amount: int = 1):
+        counters = self._pending[field]
+        counters[item_id] = counters.get(item_id, 0) + amount
+
+    def pending(self, field: str, item_id: int) -> int:
+        """尚未写入数据库的增量（返回详情时加到数据库中的值上）"""
+        return self._pending[field].get(item_id, 0)
+
+    def _write(self, batch: Dict[str, Dict[int, int]]):
+        """在一个事务中写入全部增量（同步，运行在线程池中）"""
+        with engine.begin() as conn:
+            for field, counters in batch.items():
+                if counters:
+                    conn.execute(
+                        text(f"UPDATE knowledge_items SET {field} = {field} + :amount WHERE id = :id"),
+                        [{"id": item_id, "amount": amount} for item_id, amount in counters.items()]
+                    )
+
+    async def flush(self) -> int:
+        """写入当前累计的增量，返回写入的次数总和"""
+        # 先换出缓冲区再写入，写入期间的新增量进入新的缓冲区
+        batch = self._pending
+        if not any(batch.values()):
+            return 0
+        self._pending = {field: {} for field in COUNTER_FIELDS}
+        try:
+            await asyncio.get_running_loop().run_in_executor(None, self._write, batch)
+        except Exception as e:
+            # 并回缓冲区，下一轮重试
+            for field, counters in batch.items():
+                for item_id, amount in counters.items():
+                    self.increment(field, item_id, amount)
+            self.failures += 1
+            print(f"Failed to flush knowledge item counters: {e}")
+            return 0
+        total = sum(sum(counters.values()) for counters in batch.values())
+        self.flushes += 1
+        self.flushed_increments += total
+        self.last_flush_at = time.time()
+        return total
+
+    async def run(self):
+        while True:
+            await asyncio.sleep(settings.counter_flush_interval)
+            # 关闭时取消后台任务不会中断正在进行的写入
+            self._inflight = asyncio.ensure_future(self.flush())
+            await asyncio.shield(self._inflight)
+
+    def start(self):
+        if self._task is None or self._task.done():
+            self._task = asyncio.get_running_loop().create_task(self.run())
+
+    async def stop(self):
+        """关闭时调用：停止后台任务并写入剩余的增量"""
+        if self._task is not None:
+            self._task.cancel()
+            try:
+                await self._task
+            except asyncio.CancelledError:
+                pass
+            self._task = None
+        if self._inflight is not None:
+            await self._inflight
+            self._inflight = None
+        await self.flush()
+
+    def stats(self) -> Dict[str, Any]:
+        return {
+            "pending_items": sum(len(counters) for counters in self._pending.values()),
+            "pending_increments": sum(sum(counters.values()) for counters in self._pending.values()),
+            "flushes": self.flushes,
+            "flushed_increments": self.flushed_increments,
+            "failures": self.failures,
+            "last_flush_at": self.last_flush_at
+        }
+
+# 创建全局条目计数缓冲实例
+item_counters = ItemCounterBuffer()
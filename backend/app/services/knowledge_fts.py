@@ -0,0 +1,257 @@
+from typing import Dict, Any, List, Optional, Tuple
+from sqlalchemy import event, inspect, text
+from sqlalchemy.engine import Connection, Engine
+from sqlalchemy.orm import Session
+from app.core.database import engine
+from app.models.knowledge import KnowledgeItem
+from app.services.knowledge_index import tokenize, query_terms, is_latin_term
+
+# SQLite 使用 FTS5 虚拟表（rowid 即知识条目ID），PostgreSQL 使用 tsvector + GIN 索引
+SQLITE_FTS_TABLE = "knowledge_items_fts"
+POSTGRES_SEARCH_TABLE = "knowledge_items_search"
+
+# 变更后需要同步检索表的字段
+INDEXED_FIELDS = ("title", "author", "content", "status")
+
+# 重建时每批写入的条目数
+REBUILD_BATCH_SIZE = 1000
+
+def _document(value: Optional[str]) -> str:
+    """预先切分为检索词（与内存索引相同的汉字二元组），以空格分隔写入全文检索表"""
+    return " ".join(tokenize(value))
+
+class KnowledgeFullTextSearch:
+    """知识库数据库全文检索（SQLite FTS5 / PostgreSQL tsvector）
+
+    检索表通过 KnowledgeItem 的 ORM 事件在同一事务内同步，事件由 ensure_schema() 注册：
+    应用启动时和写入知识条目的脚本（init_knowledge.py 等）在写入前调用。
+    批量导入（knowledge_importer）调用 index_rows()，其他绕过 ORM 的写入需要执行 rebuild_knowledge_fts.py 重建。
+    """
+
+    def __init__(self, bind: Engine = engine):
+        self.engine = bind
+        self.dialect = bind.dialect.name
+        self._available: Optional[bool] = None
+        # 全量重建期间检索表不完整，检索回退到SQL（写入照常同步）
+        self._rebuilding = False
+        # 检索表刚创建、尚未重建（表为空），检索同样回退到SQL
+        self.needs_rebuild = False
+
+    @property
+    def supported(self) -> bool:
+        return self.dialect in ("sqlite", "postgresql")
+
+    def _table_exists(self, connection: Connection) -> bool:
+        table = SQLITE_FTS_TABLE if self.dialect == "sqlite" else POSTGRES_SEARCH_TABLE
+        return inspect(connection).has_table(table)
+
+    def available(self, connection: Connection) -> bool:
+        """检索表是否可用（首次调用时检查并缓存）"""
+        if self._available is None:
+            self._available = self.supported and self._table_exists(connection)
+        return self._available
+
+    def register_listeners(self):
+        """注册 KnowledgeItem 的 ORM 事件，写入条目时在同一事务内同步检索表（重复调用无影响）"""
+        for name, listener in _LISTENERS:
+            if not event.contains(KnowledgeItem, name, listener):
+                event.listen(KnowledgeItem, name, listener)
+
+    def ensure_schema(self, rebuild_if_created: bool = True) -> bool:
+        """注册同步事件并创建检索表，返回检索表是否可用
+
+        首次创建时默认立即重建；rebuild_if_created 为 False 时由调用方稍后调用 rebuild()，
+        在此之前检索回退到SQL。
+        """
+        if not self.supported:
+            self._available = False
+            return False
+        # 先注册事件再检查检索表：之后的写入都会同步，创建时的重建包含之前已有的条目
+        self.register_listeners()
+        try:
+            with self.engine.begin() as conn:
+                created = not self._table_exists(conn)
+                if self.dialect == "sqlite":
+                    conn.execute(text(
+                        f"CREATE VIRTUAL TABLE IF NOT EXISTS {SQLITE_FTS_TABLE} "
+                        f"USING fts5(title, author, content, tokenize='unicode61')"
+                    ))
+                else:
+                    conn.execute(text(
+                        f"CREATE TABLE IF NOT EXISTS {POSTGRES_SEARCH_TABLE} ("
+                        f"item_id INTEGER PRIMARY KEY REFERENCES knowledge_items(id) ON DELETE CASCADE, "
+                        f"document TSVECTOR NOT NULL)"
+                    ))
+                    conn.execute(text(
+                        f"CREATE INDEX IF NOT EXISTS ix_{POSTGRES_SEARCH_TABLE}_document "
+                        f"ON {POSTGRES_SEARCH_TABLE} USING GIN (document)"
+                    ))
+        except Exception as e:
+            # 例如 SQLite 编译时未启用 FTS5
+            print(f"Knowledge full-text search unavailable: {e}")
+            self._available = False
+            return False
+
+        if created:
+            self.needs_rebuild = True
+        self._available = True
+        if created and rebuild_if_created:
+            count = self.rebuild()
+            print(f"Knowledge full-text search table created ({count} items indexed)")
+        return True
+
+    def _upsert(self, connection: Connection, item_id: int, title: str, author: Optional[str], content: str):
+        params = {
+            "id": item_id,
+            "title": _document(title),
+            "author": _document(author),
+            "content": _document(content)
+        }
+        if self.dialect == "sqlite":
+            connection.execute(text(f"DELETE FROM {SQLITE_FTS_TABLE} WHERE rowid = :id"), {"id": item_id})
+            connection.execute(text(
+                f"INSERT INTO {SQLITE_FTS_TABLE} (rowid, title, author, content) "
+                f"VALUES (:id, :title, :author, :content)"
+            ), params)
+        else:
+            connection.execute(text(
+                f"INSERT INTO {POSTGRES_SEARCH_TABLE} (item_id, document) VALUES (:id, "
+                f"setweight(to_tsvector('simple', :title), 'A') || "
+                f"setweight(to_tsvector('simple', :author), 'B') || "
+                f"setweight(to_tsvector('simple', :content), 'D')) "
+                f"ON CONFLICT (item_id) DO UPDATE SET document = EXCLUDED.document"
+            ), params)
+
+    def _delete(self, connection: Connection, item_id: int):
+        if self.dialect == "sqlite":
+            connection.execute(text(f"DELETE FROM {SQLITE_FTS_TABLE} WHERE rowid = :id"), {"id": item_id})
+        else:
+            connection.execute(text(f"DELETE FROM {POSTGRES_SEARCH_TABLE} WHERE item_id = :id"), {"id": item_id})
+
+    def sync_item(self, connection: Connection, item: KnowledgeItem):
+        """按条目状态写入或移除检索表中的记录"""
+        if not self.available(connection):
+            return
+        if item.status == "active":
+            self._upsert(connection, item.id, item.title, item.author, item.content)
+        else:
+            self._delete(connection, item.id)
+
+    def index_rows(self, connection: Connection, rows):
+        """写入一批新条目（批量导入绕过 ORM 时使用），rows 需包含 id、title、author、content"""
+        if not self.available(connection):
+            return
+        for row in rows:
+            self._upsert(connection, row.id, row.title, row.author, row.content)
+
+    def remove_item(self, connection: Connection, item_id: int):
+        if self.available(connection):
+            self._delete(connection, item_id)
+
+    def rebuild(self) -> int:
+        """清空并重建检索表，返回写入的条目数"""
+        table = SQLITE_FTS_TABLE if self.dialect == "sqlite" else POSTGRES_SEARCH_TABLE
+        db = Session(self.engine)
+        count = 0
+        self._rebuilding = True
+        try:
+            connection = db.connection()
+            connection.execute(text(f"DELETE FROM {table}"))
+            rows = db.query(
+                KnowledgeItem.id, KnowledgeItem.title, KnowledgeItem.author, KnowledgeItem.content
+            ).filter(
+                KnowledgeItem.status == "active"
+            ).yield_per(REBUILD_BATCH_SIZE)
+            for row in rows:
+                self._upsert(connection, row.id, row.title, row.author, row.content)
+                count += 1
+            db.commit()
+            self.needs_rebuild = False
+        finally:
+            db.close()
+            self._rebuilding = False
+        return count
+
+    def search(
+        self,
+        db: Session,
+        query: str,
+        offset: int,
+        limit: int,
+        category_id: Optional[int] = None,
+        content_type: Optional[str] = None,
+        match_all: bool = True
+    ) -> Optional[Tuple[int, List[int]]]:
+        """检索条目，返回 (命中总数, 当前页按相关度排序的ID)
+
+        match_all 含义与内存索引相同。检索表不可用，或要求全部匹配但查询含单个汉字时返回 None。
+        检索表按整词匹配英文和数字，无法像 LIKE 一样匹配词的一部分（"ae" 匹配 "AED"），
+        要求全部匹配且查询含英文/数字时也返回 None，回退到 LIKE。
+        """
+        connection = db.connection()
+        if self._rebuilding or self.needs_rebuild or not self.available(connection):
+            return None
+        terms = query_terms(query, match_all)
+        if terms is None:
+            return None
+        if match_all and any(is_latin_term(term) for term in terms):
+            return None
+        if not terms:
+            return 0, []
+
+        params: Dict[str, Any] = {"offset": offset, "limit": limit}
+        filters = "k.status = 'active'"
+        if category_id:
+            filters += " AND k.category_id = :category_id"
+            params["category_id"] = category_id
+        if content_type:
+            filters += " AND k.content_type = :content_type"
+            params["content_type"] = content_type
+
+        if self.dialect == "sqlite":
+            # 每个检索词加引号作为独立短语，短语之间为 AND（或 OR）
+            params["query"] = (" " if match_all else " OR ").join(f'"{term}"' for term in terms)
+            source = (
+                f"FROM {SQLITE_FTS_TABLE} JOIN knowledge_items k ON k.id = {SQLITE_FTS_TABLE}.rowid "
+                f"WHERE {SQLITE_FTS_TABLE} MATCH :query AND {filters}"
+            )
+            # bm25() 越小越相关，列权重与内存索引一致：标题 3，作者 2，内容 1
+            order = f"bm25({SQLITE_FTS_TABLE}, 3.0, 2.0, 1.0), k.created_at DESC"
+            id_column = f"{SQLITE_FTS_TABLE}.rowid"
+        else:
+            params["query"] = (" & " if match_all else " | ").join(terms)
+            source = (
+                f"FROM {POSTGRES_SEARCH_TABLE} s JOIN knowledge_items k ON k.id = s.item_id "
+                f"WHERE s.document @@ to_tsquery('simple', :query) AND {filters}"
+            )
+            order = "ts_rank(s.document, to_tsquery('simple', :query)) DESC, k.created_at DESC"
+            id_column = "s.item_id"
+
+        total = connection.execute(text(f"SELECT count(*) {source}"), params).scalar() or 0
+        if total <= offset:
+            return total, []
+        ids = connection.execute(
+            text(f"SELECT {id_column} {source} ORDER BY {order} LIMIT :limit OFFSET :offset"), params
+        ).scalars().all()
+        return total, list(ids)
+
+# 创建全局全文检索实例
+knowledge_fts = KnowledgeFullTextSearch()
+
+def _sync_inserted_item(mapper, connection, target):
+    knowledge_fts.sync_item(connection, target)
+
+def _sync_updated_item(mapper, connection, target):
+    # 只在检索相关字段变化时同步（查看次数等统计字段的更新不触发）
+    state = inspect(target)
+    if any(state.attrs[field].history.has_changes() for field in INDEXED_FIELDS):
+        knowledge_fts.sync_item(connection, target)
+
+def _sync_deleted_item(mapper, connection, target):
+    knowledge_fts.remove_item(connection, target.id)
+
+_LISTENERS = (
+    ("after_insert", _sync_inserted_item),
+    ("after_update", _sync_updated_item),
+    ("after_delete", _sync_deleted_item),
+)
@@ -0,0 +1,302 @@
+from typing import Dict, Any, List, Optional, Iterable, Iterator, Callable, BinaryIO
+import codecs
+import csv
+import hashlib
+import json
+import time
+from sqlalchemy import bindparam, select
+from sqlalchemy.dialects import postgresql, sqlite
+from app.core.database import engine
+from app.models.knowledge import KnowledgeCategory, KnowledgeItem
+from app.services.knowledge_fts import knowledge_fts
+from app.services.knowledge_snippets import make_snippet
+from app.services.knowledge_sync import record_changes
+
+# 支持的导入格式
+IMPORT_FORMATS = ("text", "ndjson", "csv")
+
+# 可以从导入记录中写入的字段
+IMPORT_FIELDS = (
+    "title", "content", "content_type", "author", "publisher", "publish_date",
+    "isbn", "description", "cover_url", "file_url", "file_size"
+)
+
+# 分组文本（classified_grouped_aggregated.txt）条目的默认作者
+DEFAULT_TEXT_AUTHOR = "急救医学专家团队"
+
+# 读取上传文件的块大小
+READ_CHUNK_SIZE = 64 * 1024
+
+def content_hash(category_id: int, title: str, content: str) -> str:
+    """条目的去重键"""
+    key = f"{category_id}\x1f{title.strip()}\x1f{content.strip()}"
+    return hashlib.sha256(key.encode("utf-8")).hexdigest()
+
+def backfill_content_hashes() -> int:
+    """为旧版导入脚本和 ORM 写入的条目补上 content_hash，使它们参与去重；返回补齐的条目数
+
+    需要读取全表，不在每次导入时执行：content_hash 字段新增时由启动流程执行一次，
+    之后需要时执行 backfill_content_hashes.py。
+    """
+    table = KnowledgeItem.__table__
+    # updated_at 保持原值（去重键不是内容变更）
+    statement = table.update().where(table.c.id == bindparam("item_id")).values(
+        content_hash=bindparam("digest"), updated_at=table.c.updated_at
+    )
+    count = 0
+    last_id = 0
+    with engine.begin() as conn:
+        used = set(conn.execute(
+            select(table.c.content_hash).where(table.c.content_hash.isnot(None))
+        ).scalars())
+        while True:
+            rows = conn.execute(
+                select(table.c.id, table.c.category_id, table.c.title, table.c.content)
+                .where(table.c.content_hash.is_(None), table.c.id > last_id)
+                .order_by(table.c.id).limit(1000)
+            ).all()
+            if not rows:
+                return count
+            last_id = rows[-1].id
+            updates = []
+            for row in rows:
+                digest = content_hash(row.category_id, row.title, row.content)
+                # 内容完全相同的旧条目只有第一条参与去重
+                if digest not in used:
+                    used.add(digest)
+                    updates.append({"item_id": row.id, "digest": digest})
+            if updates:
+                conn.execute(statement, updates)
+                count += len(updates)
+
+def detect_format(filename: Optional[str]) -> str:
+    """按文件扩展名判断导入格式"""
+    name = (filename or "").lower()
+    if name.endswith((".ndjson", ".jsonl")):
+        return "ndjson"
+    if name.endswith(".csv"):
+        return "csv"
+    return "text"
+
+def iter_text_lines(stream: BinaryIO, encoding: str = "utf-8-sig") -> Iterator[str]:
+    """按块读取二进制流并逐行解码（保留换行符），不把整个文件读入内存"""
+    decoder = codecs.getincrementaldecoder(encoding)()
+    buffer = ""
+    while True:
+        chunk = stream.read(READ_CHUNK_SIZE)
+        buffer += decoder.decode(chunk, final=not chunk)
+        parts = buffer.split("\n")
+        # 最后一段可能不完整，留到下一块
+        buffer = parts.pop()
+        for part in parts:
+            yield part + "\n"
+        if not chunk:
+            if buffer:
+                yield buffer
+            return
+
+def parse_grouped_text(lines: Iterable[str]) -> Iterator[Dict[str, Any]]:
+    """解析分组文本：“## 分类: 名称（说明）”开始一个分类，“[编号] 内容”开始一个条目，其余行续接到当前条目"""
+    category_name: Optional[str] = None
+    current: Optional[Dict[str, Any]] = None
+    for line in lines:
+        line = line.strip()
+        if not line:
+            continue
+        if line.startswith("## 分类: "):
+            if current:
+                yield current
+            current = None
+            category_name = line[len("## 分类: "):].split("（")[0].strip()
+            continue
+        if category_name is None:
+            continue
+        if line.startswith("[") and "]" in line:
+            if current:
+                yield current
+            item_num = line[1:line.find("]")]
+            current = {
+                "category": category_name,
+                "title": f"{category_name} - 条目{item_num}",
+                "content": line[line.find("]") + 1:].strip(),
+                "content_type": "document",
+                "author": DEFAULT_TEXT_AUTHOR
+            }
+        elif current:
+            current["content"] += "\n" + line
+    if current:
+        yield current
+
+def parse_ndjson(lines: Iterable[str]) -> Iterator[Dict[str, Any]]:
+    """每行一个 JSON 对象；无法解析的行作为空记录返回（计入无效条目）"""
+    for line in lines:
+        line = line.strip()
+        if not line:
+            continue
+        try:
+            record = json.loads(line)
+        except ValueError:
+            record = None
+        yield record if isinstance(record, dict) else {}
+
+def parse_csv(lines: Iterable[str]) -> Iterator[Dict[str, Any]]:
+    """首行为表头的 CSV，列名与字段名相同（category 或 category_id 指定分类）"""
+    for record in csv.DictReader(lines):
+        yield {key: value for key, value in record.items() if key and value not in (None, "")}
+
+PARSERS: Dict[str, Callable[[Iterable[str]], Iterator[Dict[str, Any]]]] = {
+    "text": parse_grouped_text,
+    "ndjson": parse_ndjson,
+    "csv": parse_csv
+}
+
+class ImportStats:
+    """导入统计"""
+
+    def __init__(self):
+        self.read = 0
+        self.inserted = 0
+        self.duplicates = 0
+        self.invalid = 0
+        self.started = time.monotonic()
+        self.unknown_categories: List[str] = []
+
+    @property
+    def elapsed(self) -> float:
+        return time.monotonic() - self.started
+
+    def as_dict(self) -> Dict[str, Any]:
+        elapsed = self.elapsed
+        return {
+            "read": self.read,
+            "inserted": self.inserted,
+            "duplicates": self.duplicates,
+            "invalid": self.invalid,
+            "unknown_categories": self.unknown_categories,
+            "elapsed_seconds": round(elapsed, 2),
+            "items_per_second": round(self.read / elapsed, 1) if elapsed > 0 else 0.0
+        }
+
+class KnowledgeImporter:
+    """知识条目批量导入
+
+    解析器逐条产出记录，按批用一条多行 INSERT（executemany）写入；
+    以 content_hash 去重（INSERT ... ON CONFLICT DO NOTHING），重复导入不产生新条目；
+    去重键是分类、标题和正文的哈希，修改过内容的记录会作为新条目写入。
+    没有 content_hash 的旧条目不参与去重，见 backfill_content_hashes()。
+    绕过 ORM 写入，因此在同一事务内同步全文检索表并追加检索索引变更记录。
+    """
+
+    def __init__(self, batch_size: int = 500):
+        self.batch_size = batch_size
+
+    def _load_categories(self) -> Dict[str, int]:
+        with engine.connect() as conn:
+            rows = conn.execute(select(KnowledgeCategory.id, KnowledgeCategory.name)).all()
+        categories = {row.name: row.id for row in rows}
+        categories.update({str(row.id): row.id for row in rows})
+        return categories
+
+    def _normalize(self, record: Dict[str, Any], categories: Dict[str, int], stats: ImportStats) -> Optional[Dict[str, Any]]:
+        """校验记录并转换为 knowledge_items 的一行，无效时返回 None"""
+        category = record.get("category_id", record.get("category"))
+        category_id = categories.get(str(category).strip()) if category is not None else None
+        if category_id is None:
+            if category is not None and str(category) not in stats.unknown_categories:
+                stats.unknown_categories.append(str(category))
+            return None
+        title = str(record.get("title") or "").strip()
+        content = str(record.get("content") or "").strip()
+        if not title or not content:
+            return None
+        row = {field: record[field] for field in IMPORT_FIELDS if record.get(field) not in (None, "")}
+        row.update({
+            "category_id": category_id,
+            "title": title[:200],
+            "content": content,
+            "content_type": str(row.get("content_type") or "document"),
+            "snippet": make_snippet(content),
+            "status": "active",
+            "content_hash": content_hash(category_id, title[:200], content)
+        })
+        if "file_size" in row:
+            try:
+                row["file_size"] = int(row["file_size"])
+            except (TypeError, ValueError):
+                row.pop("file_size")
+        return row
+
+    def _insert_batch(self, rows: List[Dict[str, Any]], stats: ImportStats):
+        """写入一批记录：跳过已存在的哈希，新条目同步全文检索表和变更记录"""
+        table = KnowledgeItem.__table__
+        unique_rows = list({row["content_hash"]: row for row in rows}.values())
+        stats.duplicates += len(rows) - len(unique_rows)
+        hashes = [row["content_hash"] for row in unique_rows]
+        # 缺少的可选字段补 None，保证 executemany 的每行参数一致
+        columns = set().union(*(row.keys() for row in unique_rows))
+        unique_rows = [{column: row.get(column) for column in columns} for row in unique_rows]
+
+        with engine.begin() as conn:
+            existing = set(conn.execute(
+                select(table.c.content_hash).where(table.c.content_hash.in_(hashes))
+            ).scalars())
+            new_rows = [row for row in unique_rows if row["content_hash"] not in existing]
+            if new_rows:
+                if engine.dialect.name == "sqlite":
+                    statement = sqlite.insert(table).on_conflict_do_nothing(index_elements=["content_hash"])
+                elif engine.dialect.name == "postgresql":
+                    statement = postgresql.insert(table).on_conflict_do_nothing(index_elements=["content_hash"])
+                else:
+                    statement = table.insert()
+                conn.execute(statement, new_rows)
+                inserted = conn.execute(
+                    select(table.c.id, table.c.title, table.c.author, table.c.content)
+                    .where(table.c.content_hash.in_([row["content_hash"] for row in new_rows]))
+                ).all()
+                knowledge_fts.index_rows(conn, inserted)
+                record_changes(conn, [row.id for row in inserted])
+            else:
+                inserted = []
+        stats.inserted += len(inserted)
+        stats.duplicates += len(unique_rows) - len(inserted)
+
+    def run(
+        self,
+        records: Iterable[Dict[str, Any]],
+        progress: Optional[Callable[[ImportStats], None]] = None
+    ) -> ImportStats:
+        """导入记录流，每写入一批调用一次 progress"""
+        stats = ImportStats()
+        categories = self._load_categories()
+        batch: List[Dict[str, Any]] = []
+        for record in records:
+            stats.read += 1
+            row = self._normalize(record, categories, stats)
+            if row is None:
+                stats.invalid += 1
+                continue
+            batch.append(row)
+            if len(batch) >= self.batch_size:
+                self._insert_batch(batch, stats)
+                batch = []
+                if progress:
+                    progress(stats)
+        if batch:
+            self._insert_batch(batch, stats)
+            if progress:
+                progress(stats)
+        return stats
+
+    def import_stream(
+        self,
+        stream: BinaryIO,
+        format: str,
+        progress: Optional[Callable[[ImportStats], None]] = None
+    ) -> ImportStats:
+        """从二进制流导入（文件或上传内容），format 为 text、ndjson 或 csv"""
+        if format not in PARSERS:
+            raise ValueError(f"Unsupported import format: {format}")
+        return self.run(PARSERS[format](iter_text_lines(stream)), progress)
+
+# 创建全局知识条目导入器实例
+knowledge_importer = KnowledgeImporter()
@@ -0,0 +1,441 @@
+from typing import Dict, Any, List, Optional, Tuple
+from array import array
+from bisect import bisect_left
+import heapq
+import asyncio
+import math
+import re
+import time
+import unicodedata
+from sqlalchemy import func
+from app.core.config import settings
+from app.core.database import SessionLocal
+from app.models.knowledge import KnowledgeItem, KnowledgeIndexChange
+
+# 中文按连续汉字切成二元组，英文和数字按整词索引
+# （整词索引无法匹配词的一部分，如 "ae" 之于 "aed"，这类查询回退到 SQL 的 LIKE，见 partial_latin_terms）
+_TOKEN_RE = re.compile(r"[\u3400-\u4dbf\u4e00-\u9fff]+|[a-z0-9]+")
+_CJK_START = "\u3400"
+
+# 各字段的词频权重
+FIELD_WEIGHTS = (("title", 3.0), ("author", 2.0), ("content", 1.0))
+
+# BM25 参数
+BM25_K1 = 1.2
+BM25_B = 0.75
+
+# 候选文档较少时用二分查找求交集，否则线性扫描倒排表
+BISECT_RATIO = 16
+
+def tokenize(text: Optional[str]) -> List[str]:
+    """把文本切分为索引词：汉字二元组（单字成词时保留单字）和英文/数字整词"""
+    if not text:
+        return []
+    text = unicodedata.normalize("NFKC", text).lower()
+    tokens: List[str] = []
+    for run in _TOKEN_RE.findall(text):
+        if run[0] >= _CJK_START and len(run) > 1:
+            tokens.extend(run[i:i + 2] for i in range(len(run) - 1))
+        else:
+            tokens.append(run)
+    return tokens
+
+def query_terms(query: str, match_all: bool = True) -> Optional[List[str]]:
+    """把查询切分为去重的检索词
+
+    单个汉字无法用二元组匹配：要求匹配全部词时返回 None，否则忽略该字。
+    """
+    terms = list(dict.fromkeys(tokenize(query)))
+    single_chars = [term for term in terms if len(term) == 1 and term >= _CJK_START]
+    if single_chars:
+        if match_all:
+            return None
+        terms = [term for term in terms if term not in single_chars]
+    return terms
+
+def is_latin_term(term: str) -> bool:
+    """是否为英文/数字词（按整词索引）"""
+    return term[0] < _CJK_START
+
+def document_terms(title: Optional[str], author: Optional[str], content: Optional[str]) -> Tuple[Dict[str, float], float]:
+    """按字段权重统计文档的加权词频，返回 (词频, 文档长度)"""
+    freqs: Dict[str, float] = {}
+    length = 0.0
+    for value, (_, weight) in zip((title, author, content), FIELD_WEIGHTS):
+        for token in tokenize(value):
+            freqs[token] = freqs.get(token, 0.0) + weight
+            length += weight
+    return freqs, length
+
+class _IndexSnapshot:
+    """不可变的索引快照，倒排表全部保存在连续数组中
+
+    term_ids: 词 -> 词编号
+    post_start: 词编号 -> 倒排表在 post_docs/post_tfs 中的起始位置（长度为词数+1）
+    post_docs/post_tfs: 按文档序号升序排列的倒排表和加权词频
+    文档序号按 created_at、id 倒序分配，序号越小越新。
+    """
+
+    def __init__(self):
+        self.term_ids: Dict[str, int] = {}
+        self.post_start = array("I", [0])
+        self.post_docs = array("I")
+        self.post_tfs = array("f")
+        self.doc_ids = array("q")
+        self.doc_norms = array("f")  # BM25 中 k1 * (1 - b + b * dl / avgdl)
+        self.doc_categories = array("q")
+        self.doc_types: List[str] = []
+        self.latin_terms = "\n"  # 英文/数字词表，以换行分隔（首尾也有换行），用于查找部分匹配
+        self.avg_length = 1.0
+        self.change_id = 0  # 构建开始时最新的变更记录ID，之前的变更都已包含在快照中
+        self.built_at = 0.0
+        self.build_ms = 0.0
+
+    @property
+    def doc_count(self) -> int:
+        return len(self.doc_ids)
+
+    def postings(self, term_id: int) -> Tuple[int, int]:
+        return self.post_start[term_id], self.post_start[term_id + 1]
+
+class _DeltaDocument:
+    """快照之后新增或修改的条目（增量段）"""
+
+    __slots__ = ("change_id", "item_id", "category_id", "content_type", "freqs", "length")
+
+    def __init__(self, change_id: int, item_id: int, category_id: int, content_type: str,
+                 freqs: Dict[str, float], length: float):
+        self.change_id = change_id
+        self.item_id = item_id
+        self.category_id = category_id
+        self.content_type = content_type
+        self.freqs = freqs
+        self.length = length
+
+class KnowledgeSearchIndex:
+    """知识库内存倒排索引（汉字二元组 + BM25 排序）
+
+    启动时在后台线程从数据库构建，构建完成后原子替换快照。
+    条目变更由 knowledge_sync 通过 apply_change() 增量应用：新版本写入增量段，
+    快照中的旧版本记入墓碑并在检索时跳过；增量较多时合并（重建快照）。
+    索引未就绪时 search() 返回 None，调用方回退到 SQL 查询。
+    """
+
+    def __init__(self):
+        self._snapshot: Optional[_IndexSnapshot] = None
+        self._delta: Dict[int, _DeltaDocument] = {}  # 条目ID -> 增量文档
+        self._tombstones: Dict[int, int] = {}  # 快照中已失效的条目ID -> 变更记录ID
+        self.required_change_id = 0  # 变更积压时跳过增量，快照需要包含到该位置
+        self._rebuild_task: Optional[asyncio.Task] = None
+        self._rebuild_pending = False
+        self.searches = 0
+        self.search_time_total = 0.0
+
+    @property
+    def ready(self) -> bool:
+        return settings.knowledge_index_enabled and self._snapshot is not None
+
+    def _build(self) -> _IndexSnapshot:
+        """从数据库构建索引快照（同步，运行在线程池中）"""
+        started = time.monotonic()
+        db = SessionLocal()
+        snapshot = _IndexSnapshot()
+        try:
+            # 先记录变更位置再读取条目，之后的变更由增量段补上
+            snapshot.change_id = db.query(func.max(KnowledgeIndexChange.id)).scalar() or 0
+            rows = db.query(
+                KnowledgeItem.id,
+                KnowledgeItem.category_id,
+                KnowledgeItem.content_type,
+                KnowledgeItem.title,
+                KnowledgeItem.author,
+                KnowledgeItem.content
+            ).filter(
+                KnowledgeItem.status == "active"
+            ).order_by(
+                KnowledgeItem.created_at.desc(), KnowledgeItem.id.desc()
+            ).yield_per(1000)
+
+            postings: Dict[str, List[Tuple[int, float]]] = {}
+            doc_lengths: List[float] = []
+            for doc, row in enumerate(rows):
+                freqs, length = document_terms(row.title, row.author, row.content)
+                for token, tf in freqs.items():
+                    postings.setdefault(token, []).append((doc, tf))
+                snapshot.doc_ids.append(row.id)
+                snapshot.doc_categories.append(row.category_id)
+                snapshot.doc_types.append(row.content_type)
+                doc_lengths.append(length)
+        finally:
+            db.close()
+
+        avg_length = sum(doc_lengths) / len(doc_lengths) if doc_lengths else 1.0
+        snapshot.avg_length = avg_length or 1.0
+        snapshot.doc_norms = array("f", (
+            BM25_K1 * (1 - BM25_B + BM25_B * length / snapshot.avg_length) for length in doc_lengths
+        ))
+        for term_id, (token, entries) in enumerate(postings.items()):
+            snapshot.term_ids[token] = term_id
+            for doc, tf in entries:
+                snapshot.post_docs.append(doc)
+                snapshot.post_tfs.append(tf)
+            snapshot.post_start.append(len(snapshot.post_docs))
+        latin_terms = [token for token in snapshot.term_ids if is_latin_term(token)]
+        snapshot.latin_terms = "\n" + "".join(f"{token}\n" for token in latin_terms)
+
+        snapshot.built_at = time.time()
+        snapshot.build_ms = (time.monotonic() - started) * 1000
+        return snapshot
+
+    async def rebuild(self):
+        """重新构建索引（数据库读取和构建在线程池中执行）"""
+        loop = asyncio.get_running_loop()
+        while True:
+            self._rebuild_pending = False
+            try:
+                snapshot = await loop.run_in_executor(None, self._build)
+            except Exception as e:
+                print(f"Failed to build knowledge search index: {e}")
+                return
+            self._swap(snapshot)
+            print(f"Knowledge search index built: {snapshot.doc_count} items, "
+                  f"{len(snapshot.term_ids)} terms in {snapshot.build_ms:.0f}ms")
+            # 构建期间又有内容变更时再构建一次
+            if not self._rebuild_pending:
+                return
+
+    def schedule_rebuild(self):
+        """在后台调度一次索引重建（正在构建时合并为下一次构建）"""
+        if not settings.knowledge_index_enabled:
+            return
+        if self._rebuild_task is not None and not self._rebuild_task.done():
+            self._rebuild_pending = True
+            return
+        try:
+            self._rebuild_task = asyncio.get_running_loop().create_task(self.rebuild())
+        except RuntimeError:
+            # 没有运行中的事件循环（如同步脚本），直接同步构建
+            self._swap(self._build())
+
+    def _swap(self, snapshot: _IndexSnapshot):
+        """替换快照，丢弃已包含在新快照中的增量和墓碑"""
+        self._snapshot = snapshot
+        self._delta = {
+            item_id: doc for item_id, doc in self._delta.items() if doc.change_id > snapshot.change_id
+        }
+        self._tombstones = {
+            item_id: change_id for item_id, change_id in self._tombstones.items()
+            if change_id > snapshot.change_id
+        }
+
+    @staticmethod
+    def prepare(row) -> _DeltaDocument:
+        """切分条目（线程池中执行），row 需包含 id、category_id、content_type、title、author、content"""
+        freqs, length = document_terms(row.title, row.author, row.content)
+        return _DeltaDocument(0, row.id, row.category_id, row.content_type, freqs, length)
+
+    def apply_change(self, change_id: int, item_id: int, document: Optional[_DeltaDocument]):
+        """应用一条变更：document 为 None 表示条目已删除或停用"""
+        snapshot = self._snapshot
+        if snapshot is not None and change_id <= snapshot.change_id:
+            return
+        self._tombstones[item_id] = change_id
+        if document is None:
+            self._delta.pop(item_id, None)
+        else:
+            document.change_id = change_id
+            self._delta[item_id] = document
+
+    @property
+    def delta_size(self) -> int:
+        """尚未合并进快照的变更条目数"""
+        return len(self._tombstones)
+
+    @property
+    def built_change_id(self) -> Optional[int]:
+        return self._snapshot.change_id if self._snapshot else None
+
+    @property
+    def rebuilding(self) -> bool:
+        return self._rebuild_task is not None and not self._rebuild_task.done()
+
+    @property
+    def built_at(self) -> Optional[float]:
+        return self._snapshot.built_at if self._snapshot else None
+
+    @property
+    def build_started_at(self) -> Optional[float]:
+        """当前快照开始构建的时间（之前提交的条目都已包含）"""
+        snapshot = self._snapshot
+        return snapshot.built_at - snapshot.build_ms / 1000 if snapshot else None
+
+    def search(
+        self,
+        query: str,
+        category_id: Optional[int] = None,
+        content_type: Optional[str] = None,
+        limit: Optional[int] = None,
+        match_all: bool = True
+    ) -> Optional[Tuple[int, List[int]]]:
+        """检索知识条目，返回 (命中总数, 按相关度排序的前 limit 个ID)
+
+        match_all 为 True 时要求包含查询的全部索引词（搜索框），
+        为 False 时包含任一索引词即可（自然语言问题的检索）。
+        索引未就绪，或要求全部匹配但查询含单个汉字（索引中没有对应的二元组）、
+        含有是其他索引词一部分的英文/数字词（如 "cp" 之于 "cpr"）时返回 None，由调用方回退到 LIKE。
+        """
+        snapshot = self._snapshot
+        if not self.ready:
+            return None
+        started = time.perf_counter()
+
+        terms = query_terms(query, match_all)
+        if terms is None:
+            return None
+        if not terms:
+            return 0, []
+
+        # 检索可能在线程池中执行（kb 模式检索），复制增量段，避免与事件循环中应用的变更并发修改
+        delta, tombstones = self._delta.copy(), self._tombstones.copy()
+        if match_all and self.partial_latin_terms(snapshot, delta, terms):
+            return None
+        doc_count = snapshot.doc_count + len(delta)
+        idfs: Dict[str, float] = {}
+        for term in terms:
+            term_id = snapshot.term_ids.get(term)
+            df = snapshot.post_start[term_id + 1] - snapshot.post_start[term_id] if term_id is not None else 0
+            df += sum(1 for doc in delta.values() if term in doc.freqs)
+            idfs[term] = math.log(1 + (doc_count - df + 0.5) / (df + 0.5))
+
+        # 快照中的文档用文档序号（>= 0）标识，增量文档用负的变更记录ID标识（比快照中的文档更新）
+        scores = self._score_snapshot(snapshot, terms, idfs, match_all)
+        candidates = list(scores.items())
+        if tombstones:
+            candidates = [(doc, s) for doc, s in candidates if snapshot.doc_ids[doc] not in tombstones]
+        if category_id:
+            candidates = [(doc, s) for doc, s in candidates if snapshot.doc_categories[doc] == category_id]
+        if content_type:
+            candidates = [(doc, s) for doc, s in candidates if snapshot.doc_types[doc] == content_type]
+
+        delta_ids: Dict[int, int] = {}
+        for document in delta.values():
+            if category_id and document.category_id != category_id:
+                continue
+            if content_type and document.content_type != content_type:
+                continue
+            norm = BM25_K1 * (1 - BM25_B + BM25_B * document.length / snapshot.avg_length)
+            score, matched = 0.0, 0
+            for term in terms:
+                tf = document.freqs.get(term)
+                if tf:
+                    score += idfs[term] * tf * (BM25_K1 + 1) / (tf + norm)
+                    matched += 1
+                elif match_all:
+                    break
+            if matched and (matched == len(terms) or not match_all):
+                candidates.append((-document.change_id, score))
+                delta_ids[-document.change_id] = document.item_id
+
+        total = len(candidates)
+        # 分数相同时较新的条目在前；只需要前 limit 个时用堆选取
+        rank_key = lambda entry: (-entry[1], entry[0])
+        if limit is not None and limit < total:
+            ranked = heapq.nsmallest(limit, candidates, key=rank_key)
+        else:
+            ranked = sorted(candidates, key=rank_key)
+
+        self.searches += 1
+        self.search_time_total += time.perf_counter() - started
+        return total, [snapshot.doc_ids[doc] if doc >= 0 else delta_ids[doc] for doc, _ in ranked]
+
+    @staticmethod
+    def partial_latin_terms(snapshot: _IndexSnapshot, delta: Dict[int, _DeltaDocument], terms: List[str]) -> bool:
+        """是否有英文/数字检索词是其他索引词的一部分
+
+        LIKE 会匹配这些更长的词（"12" 匹配 "120"），整词索引只能匹配完全相同的词，结果不完整。
+        """
+        for term in terms:
+            if not is_latin_term(term):
+                continue
+            # 词表以换行分隔，出现次数多于完全相同的词时说明还出现在其他词中
+            occurrences = snapshot.latin_terms.count(term)
+            if f"\n{term}\n" in snapshot.latin_terms:
+                occurrences -= 1
+            if occurrences > 0:
+                return True
+            if any(term in token and token != term for doc in delta.values() for token in doc.freqs):
+                return True
+        return False
+
+    @staticmethod
+    def _score_snapshot(
+        snapshot: _IndexSnapshot,
+        terms: List[str],
+        idfs: Dict[str, float],
+        match_all: bool
+    ) -> Dict[int, float]:
+        """在快照的倒排表中计算 BM25 分数，返回 文档序号 -> 分数"""
+        term_ids = []
+        for term in terms:
+            term_id = snapshot.term_ids.get(term)
+            if term_id is not None:
+                term_ids.append((term_id, idfs[term]))
+            elif match_all:
+                return {}
+        if not term_ids:
+            return {}
+
+        # 从最稀有的词开始求交集，候选集只会缩小
+        term_ids.sort(key=lambda t: snapshot.post_start[t[0] + 1] - snapshot.post_start[t[0]])
+        post_docs, post_tfs, doc_norms = snapshot.post_docs, snapshot.post_tfs, snapshot.doc_norms
+        scores: Optional[Dict[int, float]] = None
+        for term_id, idf in term_ids:
+            start, end = snapshot.postings(term_id)
+            df = end - start
+            if scores is None or not match_all:
+                # 第一个词，或任一词匹配即可时累加分数
+                scores = {} if scores is None else scores
+                for pos in range(start, end):
+                    doc, tf = post_docs[pos], post_tfs[pos]
+                    scores[doc] = scores.get(doc, 0.0) + idf * tf * (BM25_K1 + 1) / (tf + doc_norms[doc])
+                continue
+            matched: Dict[int, float] = {}
+            if len(scores) * BISECT_RATIO < df:
+                for doc, score in scores.items():
+                    pos = bisect_left(post_docs, doc, start, end)
+                    if pos < end and post_docs[pos] == doc:
+                        tf = post_tfs[pos]
+                        matched[doc] = score + idf * tf * (BM25_K1 + 1) / (tf + doc_norms[doc])
+            else:
+                for pos in range(start, end):
+                    doc = post_docs[pos]
+                    score = scores.get(doc)
+                    if score is not None:
+                        tf = post_tfs[pos]
+                        matched[doc] = score + idf * tf * (BM25_K1 + 1) / (tf + doc_norms[doc])
+            scores = matched
+            if not scores:
+                return {}
+        return scores or {}
+
+    def stats(self) -> Dict[str, Any]:
+        """索引统计"""
+        snapshot = self._snapshot
+        return {
+            "enabled": settings.knowledge_index_enabled,
+            "ready": snapshot is not None,
+            "documents": snapshot.doc_count if snapshot else 0,
+            "terms": len(snapshot.term_ids) if snapshot else 0,
+            "postings": len(snapshot.post_docs) if snapshot else 0,
+            "change_id": snapshot.change_id if snapshot else 0,
+            "delta_documents": len(self._delta),
+            "tombstones": len(self._tombstones),
+            "built_at": snapshot.built_at if snapshot else None,
+            "build_ms": round(snapshot.build_ms, 1) if snapshot else 0.0,
+            "rebuilding": self.rebuilding,
+            "searches": self.searches,
+            "avg_search_ms": round(self.search_time_total / self.searches * 1000, 3) if self.searches else 0.0
+        }
+
+# 创建全局知识库检索索引实例
+knowledge_index = KnowledgeSearchIndex()
@@ -0,0 +1,166 @@
+from typing import Dict, Any, List, Optional, Tuple
+import asyncio
+import re
+from sqlalchemy.ext.asyncio import AsyncSession
+from sqlalchemy.orm import Session
+from app.core.config import settings
+from app.models.knowledge import KnowledgeItem
+from app.services.context_builder import estimate_tokens
+from app.services.knowledge_index import knowledge_index, query_terms
+from app.services.knowledge_fts import knowledge_fts
+from app.services.knowledge_vectors import knowledge_vectors
+
+# 按句末标点和换行切分段落
+_SENTENCE_RE = re.compile(r"[^。！？!?；;\n]+[。！？!?；;]?")
+
+# 每条资料的格式开销（编号、标题行等）
+PASSAGE_TOKEN_OVERHEAD = 8
+
+# 倒数排名融合（RRF）常数
+RRF_K = 60
+
+def fuse_rankings(rankings: List[List[int]]) -> List[int]:
+    """用倒数排名融合合并多路检索结果"""
+    scores: Dict[int, float] = {}
+    for ranking in rankings:
+        for rank, item_id in enumerate(ranking):
+            scores[item_id] = scores.get(item_id, 0.0) + 1.0 / (RRF_K + rank + 1)
+    return sorted(scores, key=lambda item_id: -scores[item_id])
+
+class KnowledgeRetriever:
+    """知识库检索增强（kb 模式）
+
+    关键词检索（内存索引优先，其次全文检索表）和语义向量检索两路召回，
+    用倒数排名融合排序，从每个条目中截取与问题最相关的一段，在token预算内拼成系统提示。
+    classified_grouped_aggregated.txt 的内容由 import_knowledge_content.py 导入 knowledge_items，同样参与检索。
+    """
+
+    async def retrieve(self, db: AsyncSession, question: str) -> List[Dict[str, Any]]:
+        """检索与问题相关的资料段落，返回 [{id, title, category_id, content}]
+
+        关键词打分和向量相似度计算在线程池中执行，不阻塞事件循环；
+        只有全文检索表回退和读取选中条目的查询通过 AsyncSession.run_sync 执行。
+        """
+        if not settings.rag_enabled or not question.strip():
+            return []
+        loop = asyncio.get_running_loop()
+        keyword_ids, semantic_ids = await loop.run_in_executor(None, self.rank, question)
+        return await db.run_sync(self.load_passages, question, keyword_ids, semantic_ids)
+
+    def rank(self, question: str) -> Tuple[Optional[List[int]], List[int]]:
+        """内存索引和向量索引两路召回，返回 (关键词结果, 语义结果)
+
+        纯计算，不访问数据库；内存索引不可用时关键词结果为 None，由 load_passages 回退到全文检索表。
+        """
+        # 多取一些候选，部分条目可能没有可用的段落
+        limit = settings.rag_top_k * 2
+        result = knowledge_index.search(question, limit=limit, match_all=False)
+        keyword_ids = result[1] if result is not None else None
+        try:
+            semantic_ids = knowledge_vectors.search(question, limit) or []
+        except Exception as e:
+            # 语义检索失败不影响回答，只使用关键词结果
+            print(f"Knowledge vector search failed: {e}")
+            semantic_ids = []
+        return keyword_ids, semantic_ids
+
+    def load_passages(
+        self,
+        db: Session,
+        question: str,
+        keyword_ids: Optional[List[int]],
+        semantic_ids: List[int]
+    ) -> List[Dict[str, Any]]:
+        """融合两路结果，读取排名靠前的条目并截取段落（同步函数，通过 run_sync 调用）"""
+        top_k = settings.rag_top_k
+        if keyword_ids is None:
+            result = knowledge_fts.search(db, question, 0, top_k * 2, match_all=False)
+            keyword_ids = result[1] if result is not None else []
+        ranked_ids = fuse_rankings([keyword_ids, semantic_ids])[:top_k * 2]
+        if not ranked_ids:
+            return []
+
+        items = db.query(KnowledgeItem).filter(
+            KnowledgeItem.id.in_(ranked_ids),
+            KnowledgeItem.status == "active"
+        ).all()
+        items_by_id = {item.id: item for item in items}
+
+        terms = query_terms(question, match_all=False) or []
+        passages: List[Dict[str, Any]] = []
+        used = 0
+        for item_id in ranked_ids:
+            item = items_by_id.get(item_id)
+            if item is None:
+                continue
+            content = self._best_passage(item.content or "", terms, settings.rag_passage_chars)
+            if not content:
+                continue
+            cost = estimate_tokens(item.title) + estimate_tokens(content) + PASSAGE_TOKEN_OVERHEAD
+            if used + cost > settings.rag_token_budget:
+                continue
+            passages.append({
+                "id": item.id,
+                "title": item.title,
+                "category_id": item.category_id,
+                "content": content
+            })
+            used += cost
+            if len(passages) >= top_k:
+                break
+        return passages
+
+    @staticmethod
+    def _best_passage(content: str, terms: List[str], max_chars: int) -> str:
+        """从正文中截取命中检索词最多的连续句子（不超过 max_chars 个字符）"""
+        sentences = [s.strip() for s in _SENTENCE_RE.findall(content) if s.strip()]
+        if not sentences:
+            return ""
+        if len(content) <= max_chars:
+            return content.strip()
+
+        def hits(text: str) -> int:
+            return sum(1 for term in terms if term in text.lower())
+
+        best_text, best_hits = "", -1
+        for start in range(len(sentences)):
+            text = ""
+            for sentence in sentences[start:]:
+                if text and len(text) + len(sentence) > max_chars:
+                    break
+                text += sentence
+            text = text[:max_chars]
+            score = hits(text)
+            if score > best_hits:
+                best_text, best_hits = text, score
+        return best_text
+
+    @staticmethod
+    def build_context_message(passages: List[Dict[str, Any]]) -> Optional[Dict[str, str]]:
+        """把检索到的资料拼成系统消息"""
+        if not passages:
+            return None
+        lines = [
+            "以下是知识库中与用户问题相关的资料。回答时请优先依据这些资料，"
+            "引用时用[编号]标注；资料未涉及的内容请说明依据常规急救知识，不要编造。"
+        ]
+        for index, passage in enumerate(passages, 1):
+            lines.append(f"[{index}] {passage['title']}\n{passage['content']}")
+        return {"role": "system", "content": "\n\n".join(lines)}
+
+    @staticmethod
+    def to_references(passages: List[Dict[str, Any]]) -> List[Dict[str, Any]]:
+        """保存到 ChatMessage.references 并推送给前端的引用信息（编号与提示词中的[编号]一致）"""
+        return [
+            {
+                "id": p["id"],
+                "citation": f"[{index}]",
+                "title": p["title"],
+                "content": p["content"],
+                "category_id": p["category_id"]
+            }
+            for index, p in enumerate(passages, 1)
+        ]
+
+# 创建全局知识库检索器实例
+knowledge_retriever = KnowledgeRetriever()
@@ -0,0 +1,45 @@
+import re
+from sqlalchemy import bindparam, event, inspect, select
+from app.core.database import engine
+from app.models.knowledge import KnowledgeItem
+
+# 摘要的最大字符数
+SNIPPET_LENGTH = 150
+
+def make_snippet(content: str) -> str:
+    """取内容开头的一段作为摘要（合并空白字符，超出长度时截断并加省略号）"""
+    text = re.sub(r"\s+", " ", content or "").strip()
+    if len(text) <= SNIPPET_LENGTH:
+        return text
+    return text[:SNIPPET_LENGTH].rstrip() + "…"
+
+def backfill_snippets() -> int:
+    """为没有摘要的条目（旧数据、绕过 ORM 写入的数据）补上摘要，返回补齐的条目数"""
+    table = KnowledgeItem.__table__
+    # updated_at 保持原值（摘要不是内容变更）
+    statement = table.update().where(table.c.id == bindparam("item_id")).values(
+        snippet=bindparam("value"), updated_at=table.c.updated_at
+    )
+    count = 0
+    last_id = 0
+    with engine.begin() as conn:
+        while True:
+            rows = conn.execute(
+                select(table.c.id, table.c.content)
+                .where(table.c.snippet.is_(None), table.c.id > last_id)
+                .order_by(table.c.id).limit(1000)
+            ).all()
+            if not rows:
+                return count
+            last_id = rows[-1].id
+            conn.execute(statement, [{"item_id": row.id, "value": make_snippet(row.content)} for row in rows])
+            count += len(rows)
+
+@event.listens_for(KnowledgeItem, "before_insert")
+def _snippet_before_insert(mapper, connection, target):
+    target.snippet = make_snippet(target.content)
+
+@event.listens_for(KnowledgeItem, "before_update")
+def _snippet_before_update(mapper, connection, target):
+    if inspect(target).attrs.content.history.has_changes():
+        target.snippet = make_snippet(target.content)
@@ -0,0 +1,310 @@
+from typing import Dict, Any, List, Optional, Tuple
+from datetime import datetime, timedelta, timezone
+import asyncio
+import time
+from sqlalchemy import event, func, inspect, or_
+from app.core.config import settings
+from app.core.database import SessionLocal
+from app.models.knowledge import KnowledgeItem, KnowledgeIndexChange
+from app.services.knowledge_index import knowledge_index
+from app.services.knowledge_vectors import knowledge_vectors
+
+# 变更后需要更新检索索引的字段（与全文检索表一致，另加分类和类型过滤字段）
+INDEXED_FIELDS = ("title", "author", "content", "status", "category_id", "content_type")
+
+# 每轮最多应用的变更记录数
+APPLY_BATCH_SIZE = 200
+
+# 变更记录保留时间（秒），超过后清理；各进程的索引在此之前都已应用或合并
+CHANGE_RETENTION_SECONDS = 86400
+
+# 最多跟踪的记录ID空缺数，超过时不再逐个等待，改为合并
+MAX_TRACKED_GAPS = 500
+
+def _as_timestamp(value: Optional[datetime]) -> Optional[float]:
+    if value is None:
+        return None
+    if value.tzinfo is None:
+        # SQLite 的 CURRENT_TIMESTAMP 为不带时区的 UTC 时间
+        value = value.replace(tzinfo=timezone.utc)
+    return value.timestamp()
+
+class KnowledgeIndexSync:
+    """知识库检索索引的增量维护
+
+    KnowledgeItem 的写入通过 ORM 事件（app.models 导入本模块时注册）在同一事务内追加变更记录（knowledge_index_changes），
+    每个进程的后台任务按记录ID顺序读取新变更，重新加载条目后增量更新内存倒排索引和向量索引；
+    增量（墓碑）过多或存在时间过长时合并，即在后台全量重建后替换。
+
+    PostgreSQL 的序列号在插入时分配，事务提交的顺序可能与ID顺序不同：读到较大的ID时，
+    较小的ID可能还未提交。读取新变更时记下跳过的ID（空缺），之后每轮再查询这些ID，提交后补上；
+    空缺超过 index_sync_gap_timeout 仍未出现视为事务已回滚。补上或放弃空缺后，
+    要求两个索引在此之后重新构建一次（合并），弥补增量应用时可能被快照位置过滤掉的变更。
+    """
+
+    def __init__(self):
+        self._task: Optional[asyncio.Task] = None
+        self.applied_change_id = 0
+        self.applied_changes = 0
+        self.last_applied_at: Optional[float] = None
+        self.compactions = 0
+        self.skipped_changes = 0
+        self.late_changes = 0
+        self._gaps: Dict[int, float] = {}  # 尚未读到的记录ID -> 发现空缺的时间
+        self._resync_after: Optional[float] = None  # 索引需要在该时间之后重新构建
+        self._last_cleanup = 0.0
+
+    def _latest_change_id(self) -> int:
+        db = SessionLocal()
+        try:
+            return db.query(func.max(KnowledgeIndexChange.id)).scalar() or 0
+        finally:
+            db.close()
+
+    def _load_changes(
+        self, after_id: int, gap_ids: List[int]
+    ) -> Tuple[List[Tuple[int, int]], List[Tuple[int, int]], Dict[int, Any]]:
+        """读取新的变更记录、已提交的空缺记录及对应条目的当前内容（同步，运行在线程池中）
+
+        返回 (新记录, 空缺中已提交的记录, 条目ID -> (倒排索引文档, 段落向量))，
+        记录为 (变更记录ID, 条目ID)，停用或已删除的条目不在字典中。
+        """
+        db = SessionLocal()
+        try:
+            changes = db.query(
+                KnowledgeIndexChange.id, KnowledgeIndexChange.item_id
+            ).filter(
+                KnowledgeIndexChange.id > after_id
+            ).order_by(KnowledgeIndexChange.id).limit(APPLY_BATCH_SIZE).all()
+            late = db.query(
+                KnowledgeIndexChange.id, KnowledgeIndexChange.item_id
+            ).filter(
+                KnowledgeIndexChange.id.in_(gap_ids)
+            ).all() if gap_ids else []
+            if not changes and not late:
+                return [], [], {}
+            rows = db.query(
+                KnowledgeItem.id,
+                KnowledgeItem.category_id,
+                KnowledgeItem.content_type,
+                KnowledgeItem.title,
+                KnowledgeItem.author,
+                KnowledgeItem.content
+            ).filter(
+                KnowledgeItem.id.in_({change.item_id for change in changes + late}),
+                KnowledgeItem.status == "active"
+            ).all()
+        finally:
+            db.close()
+
+        prepared: Dict[int, Any] = {}
+        for row in rows:
+            document = knowledge_index.prepare(row) if settings.knowledge_index_enabled else None
+            vectors = knowledge_vectors.prepare(row.title, row.content) if settings.vector_index_enabled else None
+            prepared[row.id] = (document, vectors)
+        return [(c.id, c.item_id) for c in changes], [(c.id, c.item_id) for c in late], prepared
+
+    def _require_resync(self):
+        """要求两个索引在当前时间之后重新构建一次"""
+        self._resync_after = time.time()
+
+    async def apply_pending(self) -> int:
+        """应用所有新的变更记录，返回应用的记录数"""
+        loop = asyncio.get_running_loop()
+        latest = await loop.run_in_executor(None, self._latest_change_id)
+        if latest - self.applied_change_id >= settings.index_compact_threshold:
+            # 积压过多（如批量导入）时不逐条应用，直接合并为全量重建
+            for index in (knowledge_index, knowledge_vectors):
+                index.required_change_id = max(index.required_change_id, latest)
+            self.skipped_changes += latest - self.applied_change_id
+            self.applied_change_id = latest
+            # 合并会包含之前的空缺
+            self._gaps.clear()
+            return 0
+        applied = 0
+        gap_ids = list(self._gaps)
+        while True:
+            changes, late, prepared = await loop.run_in_executor(
+                None, self._load_changes, self.applied_change_id, gap_ids
+            )
+            gap_ids = []
+            if late:
+                for change_id, _ in late:
+                    self._gaps.pop(change_id, None)
+                self.late_changes += len(late)
+                self._require_resync()
+            if not changes and not late:
+                self._expire_gaps()
+                return applied
+            now = time.time()
+            expected = self.applied_change_id + 1
+            for change_id, _ in changes:
+                for missing in range(expected, change_id):
+                    self._gaps[missing] = now
+                expected = change_id + 1
+            # 同一条目在一批中多次变更时只应用最后一次（条目内容已是最新）
+            latest: Dict[int, int] = {}
+            for change_id, item_id in sorted(late + changes):
+                latest[item_id] = change_id
+            for item_id, change_id in latest.items():
+                document, vectors = prepared.get(item_id, (None, None))
+                if settings.knowledge_index_enabled:
+                    knowledge_index.apply_change(change_id, item_id, document)
+                if settings.vector_index_enabled:
+                    knowledge_vectors.apply_change(change_id, item_id, vectors)
+            if changes:
+                self.applied_change_id = changes[-1][0]
+            self.applied_changes += len(changes) + len(late)
+            self.last_applied_at = time.time()
+            applied += len(changes) + len(late)
+
+    def _expire_gaps(self):
+        """放弃等待超时的空缺（事务已回滚），空缺过多时全部放弃；放弃后要求重新构建"""
+        cutoff = time.time() - settings.index_sync_gap_timeout
+        expired = [change_id for change_id, seen_at in self._gaps.items() if seen_at < cutoff]
+        if len(self._gaps) > MAX_TRACKED_GAPS:
+            expired = list(self._gaps)
+        if expired:
+            for change_id in expired:
+                del self._gaps[change_id]
+            self._require_resync()
+
+    def compact_if_needed(self, quiet: bool):
+        """增量过多、存在时间过长或跳过了积压的变更时在后台合并（全量重建）
+
+        quiet 表示本轮没有新的变更；批量导入进行中不合并，避免每写入一批就重建一次。
+        """
+        now = time.time()
+        for index in (knowledge_index, knowledge_vectors):
+            built_change_id = index.built_change_id
+            if built_change_id is None or index.rebuilding:
+                continue
+            # 跳过了积压的变更、补上或放弃了空缺、增量过多、或增量存在时间过长
+            stale = built_change_id < index.required_change_id or (
+                self._resync_after is not None and (index.build_started_at or 0.0) < self._resync_after
+            )
+            size = index.delta_size
+            overdue = size and now - (index.built_at or 0.0) >= settings.index_compact_interval
+            if (quiet and (stale or size >= settings.index_compact_threshold)) or overdue:
+                index.schedule_rebuild()
+                self.compactions += 1
+
+    def _cleanup(self):
+        """清理过期的变更记录（同步，运行在线程池中）"""
+        cutoff = datetime.now(timezone.utc) - timedelta(seconds=CHANGE_RETENTION_SECONDS)
+        db = SessionLocal()
+        try:
+            db.query(KnowledgeIndexChange).filter(
+                KnowledgeIndexChange.created_at < cutoff
+            ).delete(synchronize_session=False)
+            db.commit()
+        finally:
+            db.close()
+
+    async def run(self):
+        """后台循环：应用变更、按需合并、定期清理"""
+        loop = asyncio.get_running_loop()
+        while True:
+            try:
+                previous_change_id = self.applied_change_id
+                await self.apply_pending()
+                self.compact_if_needed(quiet=self.applied_change_id == previous_change_id)
+                if time.time() - self._last_cleanup >= 3600:
+                    self._last_cleanup = time.time()
+                    await loop.run_in_executor(None, self._cleanup)
+            except asyncio.CancelledError:
+                raise
+            except Exception as e:
+                print(f"Failed to apply knowledge index changes: {e}")
+            await asyncio.sleep(settings.index_sync_interval)
+
+    def _start_position(self) -> int:
+        """开始跟踪的变更记录位置（同步，运行在线程池中）"""
+        change_id = self._latest_change_id()
+        # 磁盘上的向量索引可能构建于服务停止之前，从它包含的位置开始补上期间的变更
+        if settings.vector_index_enabled:
+            built_change_id = knowledge_vectors.built_change_id
+            if built_change_id is not None:
+                change_id = min(change_id, built_change_id)
+        return change_id
+
+    async def start(self):
+        """启动时调用（在构建索引之前）：从当前最新的变更记录开始跟踪，读取位置在线程池中执行"""
+        if self._task is not None and not self._task.done():
+            return
+        loop = asyncio.get_running_loop()
+        try:
+            self.applied_change_id = await loop.run_in_executor(None, self._start_position)
+        except Exception as e:
+            print(f"Failed to read knowledge index changes: {e}")
+        self._last_cleanup = time.time()
+        self._task = loop.create_task(self.run())
+
+    async def stop(self):
+        if self._task is not None:
+            self._task.cancel()
+            try:
+                await self._task
+            except asyncio.CancelledError:
+                pass
+            self._task = None
+
+    def _pending(self, applied_change_id: int, gap_ids: List[int]) -> Tuple[int, Optional[datetime]]:
+        """尚未应用的变更记录数和最早的记录时间（同步，运行在线程池中）"""
+        db = SessionLocal()
+        try:
+            pending = KnowledgeIndexChange.id > applied_change_id
+            if gap_ids:
+                pending = or_(pending, KnowledgeIndexChange.id.in_(gap_ids))
+            return db.query(
+                func.count(KnowledgeIndexChange.id), func.min(KnowledgeIndexChange.created_at)
+            ).filter(pending).one()
+        finally:
+            db.close()
+
+    async def stats(self) -> Dict[str, Any]:
+        """增量维护统计；pending_changes/lag_seconds 为索引落后于数据库的程度（包含空缺中已提交的记录）"""
+        pending, oldest = await asyncio.get_running_loop().run_in_executor(
+            None, self._pending, self.applied_change_id, list(self._gaps)
+        )
+        oldest_at = _as_timestamp(oldest)
+        return {
+            "running": self._task is not None and not self._task.done(),
+            "applied_change_id": self.applied_change_id,
+            "applied_changes": self.applied_changes,
+            "last_applied_at": self.last_applied_at,
+            "pending_changes": pending,
+            "lag_seconds": round(max(0.0, time.time() - oldest_at), 1) if oldest_at else 0.0,
+            "keyword_delta": knowledge_index.delta_size,
+            "vector_delta": knowledge_vectors.delta_size,
+            # 跳过积压变更后、合并完成前，索引不包含这些变更
+            "keyword_stale": (knowledge_index.built_change_id or 0) < knowledge_index.required_change_id,
+            "vector_stale": (knowledge_vectors.built_change_id or 0) < knowledge_vectors.required_change_id,
+            "compactions": self.compactions,
+            "skipped_changes": self.skipped_changes,
+            "open_gaps": len(self._gaps),
+            "late_changes": self.late_changes
+        }
+
+# 创建全局检索索引增量维护实例
+knowledge_sync = KnowledgeIndexSync()
+
+def record_changes(connection, item_ids: List[int]):
+    """追加变更记录（ORM 事件和绕过 ORM 的批量导入共用）"""
+    if item_ids:
+        connection.execute(KnowledgeIndexChange.__table__.insert(), [{"item_id": item_id} for item_id in item_ids])
+
+@event.listens_for(KnowledgeItem, "after_insert")
+def _record_inserted_item(mapper, connection, target):
+    record_changes(connection, [target.id])
+
+@event.listens_for(KnowledgeItem, "after_update")
+def _record_updated_item(mapper, connection, target):
+    # 查看次数等统计字段的更新不产生变更记录
+    state = inspect(target)
+    if any(state.attrs[field].history.has_changes() for field in INDEXED_FIELDS):
+        record_changes(connection, [target.id])
+
+@event.listens_for(KnowledgeItem, "after_delete")
+def _record_deleted_item(mapper, connection, target):
+    record_changes(connection, [target.id])
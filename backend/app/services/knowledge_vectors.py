@@ -0,0 +1,508 @@
+from typing import Dict, Any, List, Optional, Callable, Sequence, Tuple
+import asyncio
+import importlib
+import json
+import math
+import os
+import re
+import threading
+import time
+import unicodedata
+import zlib
+import numpy as np
+from sqlalchemy import func
+from app.core.config import settings
+from app.core.database import SessionLocal
+from app.models.knowledge import KnowledgeItem, KnowledgeIndexChange
+
+# 嵌入函数：输入一批文本，返回 (文本数, 维度) 的 float32 矩阵，每行已L2归一化
+EmbeddingFunction = Callable[[Sequence[str]], np.ndarray]
+
+_TOKEN_RE = re.compile(r"[\u3400-\u4dbf\u4e00-\u9fff]+|[a-z0-9]+")
+_CJK_START = "\u3400"
+_PASSAGE_SPLIT_RE = re.compile(r"(?<=[。！？!?；;\n])")
+
+# 每次矩阵乘法处理的行数，限制临时内存
+SEARCH_BLOCK_ROWS = 16384
+
+# 构建锁超过该时间视为上次构建异常退出
+BUILD_LOCK_STALE_SECONDS = 1800
+
+# 映射时文件已被其他进程的重建删除，重新读取 meta.json 的次数
+MAP_ATTEMPTS = 3
+
+class HashingEmbedder:
+    """无需网络和训练的默认嵌入：汉字单字/二元组和英文词经哈希映射到固定维度
+
+    单字特征让“心跳停了”和“心脏骤停”这类改写仍有重叠，二元组保留词序信息。
+    """
+
+    name = "hashing"
+
+    def __init__(self, dim: int):
+        self.dim = dim
+
+    def _features(self, text: str) -> Dict[str, float]:
+        features: Dict[str, float] = {}
+        text = unicodedata.normalize("NFKC", text or "").lower()
+        for run in _TOKEN_RE.findall(text):
+            if run[0] >= _CJK_START:
+                for char in run:
+                    features[char] = features.get(char, 0.0) + 0.5
+                for i in range(len(run) - 1):
+                    bigram = run[i:i + 2]
+                    features[bigram] = features.get(bigram, 0.0) + 1.0
+            else:
+                features[run] = features.get(run, 0.0) + 1.0
+        return features
+
+    def __call__(self, texts: Sequence[str]) -> np.ndarray:
+        matrix = np.zeros((len(texts), self.dim), dtype=np.float32)
+        for row, text in enumerate(texts):
+            for feature, count in self._features(text).items():
+                h = zlib.crc32(feature.encode("utf-8"))
+                sign = 1.0 if (h >> 31) & 1 else -1.0
+                matrix[row, h % self.dim] += sign * (1.0 + math.log(count))
+        norms = np.linalg.norm(matrix, axis=1, keepdims=True)
+        norms[norms == 0] = 1.0
+        return matrix / norms
+
+def load_embedder() -> EmbeddingFunction:
+    """按配置加载嵌入函数：hashing，或 "模块路径:工厂函数"（工厂函数接收维度参数）"""
+    spec = settings.vector_embedder
+    if spec == "hashing":
+        return HashingEmbedder(settings.vector_dim)
+    module_name, _, attr = spec.partition(":")
+    factory = getattr(importlib.import_module(module_name), attr)
+    return factory(settings.vector_dim)
+
+def split_passages(text: str, max_chars: int) -> List[str]:
+    """按句子把正文切成不超过 max_chars 个字符的段落"""
+    passages: List[str] = []
+    current = ""
+    for sentence in _PASSAGE_SPLIT_RE.split(text or ""):
+        sentence = sentence.strip()
+        if not sentence:
+            continue
+        if current and len(current) + len(sentence) > max_chars:
+            passages.append(current)
+            current = ""
+        current += sentence[:max_chars]
+    if current:
+        passages.append(current)
+    return passages
+
+def item_passages(title: str, content: str) -> List[str]:
+    """条目的待嵌入文本：标题单独成段，并作为每个段落的前缀"""
+    return [title] + [f"{title} {passage}" for passage in split_passages(content, settings.vector_passage_chars)]
+
+class _MappedIndex:
+    """只读映射的向量文件；多个进程映射同一文件时共享操作系统页缓存"""
+
+    def __init__(self, directory: str, meta: Dict[str, Any]):
+        self.meta = meta
+        self.version = meta["version"]
+        count, dim = meta["count"], meta["dim"]
+        dtype = np.int8 if meta["dtype"] == "int8" else np.float16
+        self.item_ids = np.load(os.path.join(directory, f"ids-{self.version}.npy"), mmap_mode="r")
+        self.vectors = np.memmap(
+            os.path.join(directory, f"vectors-{self.version}.bin"), dtype=dtype, mode="r", shape=(count, dim)
+        ) if count else np.zeros((0, dim), dtype=dtype)
+        self.scales = np.load(os.path.join(directory, f"scales-{self.version}.npy"), mmap_mode="r") \
+            if meta["dtype"] == "int8" else None
+
+class KnowledgeVectorIndex:
+    """知识库段落的稠密向量索引（CPU）
+
+    - 每个知识条目切成若干段落，逐段嵌入，向量以 float16 或 int8（逐行缩放）写入磁盘
+    - 检索时 np.memmap 映射文件，分块做矩阵乘法并用 argpartition 取 top-k
+    - 文件名带版本号，meta.json 原子替换；各 worker 检测到版本变化后重新映射，
+      构建通过锁文件保证同一时间只有一个进程执行
+    - 条目变更由 knowledge_sync 通过 apply_change() 增量应用：新向量保存在各进程内存中的增量段，
+      文件中的旧向量记入墓碑并在检索时屏蔽；新版本文件映射后丢弃已包含的增量
+    - 检索在线程池中执行，变更在事件循环中应用：映射、增量和墓碑只在锁内修改，
+      检索在锁内取一份快照后在锁外计算，合并的增量矩阵和墓碑掩码按代数缓存
+    """
+
+    def __init__(self):
+        self._embedder: Optional[EmbeddingFunction] = None
+        self._mapped: Optional[_MappedIndex] = None
+        self._meta_mtime = 0.0
+        self._delta: Dict[int, Tuple[int, np.ndarray]] = {}  # 条目ID -> (变更记录ID, 段落向量)
+        self._tombstones: Dict[int, int] = {}  # 向量文件中已失效的条目ID -> 变更记录ID
+        self._delta_rows: Optional[Tuple[np.ndarray, np.ndarray]] = None  # 合并后的 (条目ID, 向量矩阵)
+        self._tombstone_mask: Optional[np.ndarray] = None
+        # 映射、增量或墓碑每次变化时加一，缓存只在代数未变时写回
+        self._generation = 0
+        self._lock = threading.Lock()
+        self.required_change_id = 0  # 变更积压时跳过增量，向量文件需要包含到该位置
+        self._rebuild_task: Optional[asyncio.Task] = None
+        self.searches = 0
+        self.search_time_total = 0.0
+
+    @property
+    def directory(self) -> str:
+        return settings.vector_index_dir
+
+    @property
+    def embedder(self) -> EmbeddingFunction:
+        if self._embedder is None:
+            self._embedder = load_embedder()
+        return self._embedder
+
+    @property
+    def embedder_name(self) -> str:
+        return getattr(self.embedder, "name", settings.vector_embedder)
+
+    def _meta_path(self) -> str:
+        return os.path.join(self.directory, "meta.json")
+
+    def _read_meta(self) -> Optional[Dict[str, Any]]:
+        try:
+            with open(self._meta_path(), "r", encoding="utf-8") as f:
+                return json.load(f)
+        except FileNotFoundError:
+            return None
+
+    def compatible(self, meta: Dict[str, Any]) -> bool:
+        """向量文件的嵌入方式和维度是否与当前配置一致（不一致时查询向量与文件中的向量不在同一空间）"""
+        return meta.get("embedder") == self.embedder_name and meta.get("dim") == settings.vector_dim
+
+    def _refresh_mapping(self) -> Optional[_MappedIndex]:
+        """meta.json 变化时重新映射向量文件（加锁）"""
+        with self._lock:
+            return self._refresh_mapping_locked()
+
+    def _refresh_mapping_locked(self) -> Optional[_MappedIndex]:
+        """meta.json 变化时重新映射向量文件，调用方持有 _lock
+
+        其他进程重建完成后会删除旧版本文件，读取 meta.json 之后、映射之前文件可能已被删除：
+        此时重新读取 meta.json（指向新版本）再映射，仍失败时继续使用已映射的版本。
+        与当前配置不兼容的向量文件不映射，检索返回 None（启动时 ensure_built 会重建）。
+        """
+        for _ in range(MAP_ATTEMPTS):
+            try:
+                mtime = os.stat(self._meta_path()).st_mtime
+            except FileNotFoundError:
+                return None
+            if mtime == self._meta_mtime:
+                return self._mapped
+            try:
+                meta = self._read_meta()
+                if meta is None:
+                    return None
+                mapped = _MappedIndex(self.directory, meta) if self.compatible(meta) else None
+            except FileNotFoundError:
+                continue
+            self._mapped = mapped
+            self._meta_mtime = mtime
+            self._invalidate()
+            if mapped is not None:
+                self._prune(meta.get("change_id", 0))
+            return mapped
+        return self._mapped
+
+    def _invalidate(self):
+        """映射、增量或墓碑变化后丢弃缓存，调用方持有 _lock"""
+        self._generation += 1
+        self._delta_rows = None
+        self._tombstone_mask = None
+
+    def _prune(self, change_id: int):
+        """丢弃已包含在向量文件中的增量和墓碑，调用方持有 _lock"""
+        self._delta = {
+            item_id: entry for item_id, entry in self._delta.items() if entry[0] > change_id
+        }
+        self._tombstones = {
+            item_id: entry for item_id, entry in self._tombstones.items() if entry > change_id
+        }
+        self._invalidate()
+
+    def prepare(self, title: str, content: str) -> np.ndarray:
+        """嵌入条目的全部段落（线程池中执行）"""
+        return self.embedder(item_passages(title, content))
+
+    def apply_change(self, change_id: int, item_id: int, vectors: Optional[np.ndarray]):
+        """应用一条变更：vectors 为 None 表示条目已删除或停用"""
+        vectors = vectors.astype(np.float32) if vectors is not None else None
+        with self._lock:
+            mapped = self._refresh_mapping_locked()
+            if mapped is not None and change_id <= mapped.meta.get("change_id", 0):
+                return
+            self._tombstones[item_id] = change_id
+            if vectors is None:
+                self._delta.pop(item_id, None)
+            else:
+                self._delta[item_id] = (change_id, vectors)
+            self._invalidate()
+
+    @property
+    def delta_size(self) -> int:
+        """尚未合并进向量文件的变更条目数"""
+        if settings.vector_index_enabled:
+            self._refresh_mapping()
+        return len(self._tombstones)
+
+    @property
+    def rebuilding(self) -> bool:
+        return self._rebuild_task is not None and not self._rebuild_task.done()
+
+    @property
+    def built_at(self) -> Optional[float]:
+        mapped = self._refresh_mapping() if settings.vector_index_enabled else None
+        return mapped.meta.get("built_at") if mapped else None
+
+    @property
+    def build_started_at(self) -> Optional[float]:
+        """当前向量文件开始构建的时间（之前提交的条目都已包含）"""
+        mapped = self._refresh_mapping() if settings.vector_index_enabled else None
+        return mapped.meta["built_at"] - mapped.meta["build_ms"] / 1000 if mapped else None
+
+    @property
+    def built_change_id(self) -> Optional[int]:
+        """磁盘上的向量文件已包含的变更记录位置，未启用或还没有向量文件时返回 None"""
+        mapped = self._refresh_mapping() if settings.vector_index_enabled else None
+        return mapped.meta.get("change_id", 0) if mapped else None
+
+    def _snapshot(self) -> Optional[Tuple[_MappedIndex, Tuple[np.ndarray, np.ndarray], Optional[np.ndarray]]]:
+        """一次检索使用的 (映射, 增量矩阵, 墓碑掩码)，索引不可用时返回 None
+
+        在锁内刷新映射并复制增量和墓碑，合并和掩码在锁外按副本计算；
+        计算期间有新的变更或重新映射时不写回缓存，下次检索按新数据重新计算。
+        """
+        with self._lock:
+            mapped = self._refresh_mapping_locked()
+            if mapped is None:
+                return None
+            generation = self._generation
+            delta_rows, mask = self._delta_rows, self._tombstone_mask
+            delta = dict(self._delta) if delta_rows is None else None
+            tombstones = frozenset(self._tombstones) if mask is None and self._tombstones else None
+
+        if delta is not None:
+            entries = list(delta.items())
+            ids = np.array([item_id for item_id, (_, vectors) in entries for _ in range(len(vectors))], dtype=np.int64)
+            matrix = np.concatenate([vectors for _, (_, vectors) in entries]) if entries \
+                else np.zeros((0, settings.vector_dim), dtype=np.float32)
+            delta_rows = (ids, matrix)
+        if tombstones is not None:
+            mask = np.isin(mapped.item_ids, np.fromiter(tombstones, dtype=np.int64, count=len(tombstones)))
+
+        if delta is not None or tombstones is not None:
+            with self._lock:
+                if self._generation == generation:
+                    self._delta_rows, self._tombstone_mask = delta_rows, mask
+        return mapped, delta_rows, mask
+
+    def _quantize(self, vectors: np.ndarray):
+        """float32 -> 存储格式，int8 时返回逐行缩放系数"""
+        if settings.vector_dtype == "int8":
+            scales = np.abs(vectors).max(axis=1) / 127.0
+            scales[scales == 0] = 1.0
+            quantized = np.round(vectors / scales[:, None]).astype(np.int8)
+            return quantized, scales.astype(np.float32)
+        return vectors.astype(np.float16), None
+
+    def _acquire_build_lock(self) -> Optional[str]:
+        lock_path = os.path.join(self.directory, "build.lock")
+        try:
+            fd = os.open(lock_path, os.O_CREAT | os.O_EXCL | os.O_WRONLY)
+        except FileExistsError:
+            try:
+                if time.time() - os.stat(lock_path).st_mtime < BUILD_LOCK_STALE_SECONDS:
+                    return None
+                os.remove(lock_path)
+                fd = os.open(lock_path, os.O_CREAT | os.O_EXCL | os.O_WRONLY)
+            except (FileNotFoundError, FileExistsError):
+                return None
+        os.write(fd, str(os.getpid()).encode())
+        os.close(fd)
+        return lock_path
+
+    def build(self) -> Optional[Dict[str, Any]]:
+        """从数据库构建向量文件（同步，运行在线程池中）；其他进程正在构建时返回 None"""
+        os.makedirs(self.directory, exist_ok=True)
+        lock_path = self._acquire_build_lock()
+        if lock_path is None:
+            return None
+        started = time.monotonic()
+        version = str(int(time.time() * 1000))
+        vectors_path = os.path.join(self.directory, f"vectors-{version}.bin")
+        dtype = np.int8 if settings.vector_dtype == "int8" else np.float16
+        item_ids: List[int] = []
+        scales: List[np.ndarray] = []
+        db = SessionLocal()
+        try:
+            # 先记录变更位置再读取条目，之后的变更由各进程的增量段补上
+            change_id = db.query(func.max(KnowledgeIndexChange.id)).scalar() or 0
+            rows = db.query(
+                KnowledgeItem.id, KnowledgeItem.title, KnowledgeItem.content
+            ).filter(
+                KnowledgeItem.status == "active"
+            ).yield_per(500)
+
+            with open(vectors_path, "wb") as out:
+                batch_ids: List[int] = []
+                batch_texts: List[str] = []
+
+                def flush():
+                    if not batch_texts:
+                        return
+                    quantized, batch_scales = self._quantize(self.embedder(batch_texts))
+                    out.write(quantized.astype(dtype).tobytes())
+                    if batch_scales is not None:
+                        scales.append(batch_scales)
+                    item_ids.extend(batch_ids)
+                    batch_ids.clear()
+                    batch_texts.clear()
+
+                for row in rows:
+                    for passage in item_passages(row.title, row.content):
+                        batch_ids.append(row.id)
+                        batch_texts.append(passage)
+                    if len(batch_texts) >= 1024:
+                        flush()
+                flush()
+
+            np.save(os.path.join(self.directory, f"ids-{version}.npy"), np.array(item_ids, dtype=np.int64))
+            if settings.vector_dtype == "int8":
+                np.save(os.path.join(self.directory, f"scales-{version}.npy"),
+                        np.concatenate(scales) if scales else np.zeros(0, dtype=np.float32))
+
+            meta = {
+                "version": version,
+                "count": len(item_ids),
+                "dim": settings.vector_dim,
+                "dtype": settings.vector_dtype,
+                "embedder": self.embedder_name,
+                "change_id": change_id,
+                "built_at": time.time(),
+                "build_ms": round((time.monotonic() - started) * 1000, 1)
+            }
+            tmp_meta = self._meta_path() + ".tmp"
+            with open(tmp_meta, "w", encoding="utf-8") as f:
+                json.dump(meta, f)
+            os.replace(tmp_meta, self._meta_path())
+            self._remove_old_versions(version)
+            return meta
+        finally:
+            db.close()
+            os.remove(lock_path)
+
+    def _remove_old_versions(self, keep_version: str):
+        """删除旧版本文件（已映射旧文件的进程在重新映射前仍可读取）"""
+        for name in os.listdir(self.directory):
+            if name.startswith(("vectors-", "ids-", "scales-")) and keep_version not in name:
+                try:
+                    os.remove(os.path.join(self.directory, name))
+                except OSError:
+                    pass
+
+    async def rebuild(self):
+        """重新构建向量索引（在线程池中执行）"""
+        loop = asyncio.get_running_loop()
+        try:
+            meta = await loop.run_in_executor(None, self.build)
+        except Exception as e:
+            print(f"Failed to build knowledge vector index: {e}")
+            return
+        if meta is not None:
+            print(f"Knowledge vector index built: {meta['count']} passages in {meta['build_ms']:.0f}ms")
+
+    def schedule_rebuild(self):
+        """在后台调度一次重建（已在构建时不重复调度）"""
+        if not settings.vector_index_enabled:
+            return
+        if self._rebuild_task is not None and not self._rebuild_task.done():
+            return
+        self._rebuild_task = asyncio.get_running_loop().create_task(self.rebuild())
+
+    def ensure_built(self):
+        """启动时调用：磁盘上还没有索引，或索引的嵌入方式、维度与配置不一致时在后台构建"""
+        if not settings.vector_index_enabled:
+            return
+        meta = self._read_meta()
+        if meta is not None and not self.compatible(meta):
+            print(f"Knowledge vector index built with {meta.get('embedder')}/{meta.get('dim')}, "
+                  f"configured {self.embedder_name}/{settings.vector_dim}; rebuilding")
+        if meta is None or not self.compatible(meta):
+            self.schedule_rebuild()
+
+    def search_batch(self, queries: Sequence[str], top_k: int) -> Optional[List[List[int]]]:
+        """批量语义检索，返回每个查询按相似度排序的知识条目ID；索引不可用时返回 None"""
+        if not settings.vector_index_enabled:
+            return None
+        snapshot = self._snapshot()
+        if snapshot is None:
+            return None
+        mapped, (delta_ids, delta_matrix), mask = snapshot
+        started = time.perf_counter()
+
+        count = mapped.meta["count"]
+        total = count + len(delta_ids)
+        if total == 0 or not queries:
+            return [[] for _ in queries]
+        query_matrix = self.embedder(queries).T  # (dim, 查询数)
+        # 向量文件的行在前，增量段的行在后
+        scores = np.empty((total, len(queries)), dtype=np.float32)
+        for start in range(0, count, SEARCH_BLOCK_ROWS):
+            end = min(start + SEARCH_BLOCK_ROWS, count)
+            block = np.asarray(mapped.vectors[start:end], dtype=np.float32) @ query_matrix
+            if mapped.scales is not None:
+                block *= np.asarray(mapped.scales[start:end])[:, None]
+            scores[start:end] = block
+        if mask is not None:
+            scores[:count][mask] = -np.inf
+        if len(delta_ids):
+            scores[count:] = delta_matrix @ query_matrix
+
+        # 同一条目有多个段落，多取一些行再按条目去重
+        rows = min(total, top_k * 4)
+        results: List[List[int]] = []
+        for column in range(len(queries)):
+            column_scores = scores[:, column]
+            candidates = np.argpartition(-column_scores, rows - 1)[:rows]
+            candidates = candidates[np.argsort(-column_scores[candidates])]
+            ranked: List[int] = []
+            for row in candidates:
+                if column_scores[row] == -np.inf:
+                    break
+                item_id = int(mapped.item_ids[row]) if row < count else int(delta_ids[row - count])
+                if item_id not in ranked:
+                    ranked.append(item_id)
+                    if len(ranked) >= top_k:
+                        break
+            results.append(ranked)
+
+        self.searches += len(queries)
+        self.search_time_total += time.perf_counter() - started
+        return results
+
+    def search(self, query: str, top_k: int) -> Optional[List[int]]:
+        """语义检索单个查询"""
+        results = self.search_batch([query], top_k)
+        return results[0] if results is not None else None
+
+    def stats(self) -> Dict[str, Any]:
+        """向量索引统计"""
+        mapped = self._refresh_mapping() if settings.vector_index_enabled else None
+        meta = mapped.meta if mapped else {}
+        return {
+            "enabled": settings.vector_index_enabled,
+            "ready": mapped is not None,
+            "passages": meta.get("count", 0),
+            "dim": meta.get("dim"),
+            "dtype": meta.get("dtype"),
+            "embedder": meta.get("embedder"),
+            "version": meta.get("version"),
+            "change_id": meta.get("change_id", 0),
+            "delta_items": len(self._delta),
+            "tombstones": len(self._tombstones),
+            "build_ms": meta.get("build_ms"),
+            "rebuilding": self.rebuilding,
+            "searches": self.searches,
+            "avg_search_ms": round(self.search_time_total / self.searches * 1000, 3) if self.searches else 0.0
+        }
+
+# 创建全局知识库向量索引实例
+knowledge_vectors = KnowledgeVectorIndex()
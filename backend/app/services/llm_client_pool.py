@@ -0,0 +1,61 @@
+from typing import Dict, Tuple
+import httpx
+from openai import AsyncOpenAI
+from app.core.config import settings
+
+class LLMClientPool:
+    """长连接LLM客户端池
+
+    按 (base_url, api_key) 复用 AsyncOpenAI 客户端及其底层 httpx 连接池，
+    避免每次请求都重新建立 TCP/TLS 连接。
+    """
+
+    def __init__(self):
+        # 客户端的创建是同步的，单事件循环内无需加锁
+        self._clients: Dict[Tuple[str, str], AsyncOpenAI] = {}
+
+    def _build_http_client(self) -> httpx.AsyncClient:
+        """创建带keep-alive和连接数限制的HTTP客户端"""
+        limits = httpx.Limits(
+            max_connections=settings.llm_max_connections,
+            max_keepalive_connections=settings.llm_max_keepalive_connections,
+            keepalive_expiry=settings.llm_keepalive_expiry
+        )
+        timeout = httpx.Timeout(
+            settings.llm_request_timeout,
+            connect=settings.llm_connect_timeout
+        )
+        return httpx.AsyncClient(limits=limits, timeout=timeout)
+
+    def get_client(self, api_key: str, base_url: str) -> AsyncOpenAI:
+        """获取（或创建）对应端点的客户端"""
+        key = (base_url.rstrip("/"), api_key)
+        client = self._clients.get(key)
+        if client is None:
+            client = AsyncOpenAI(
+                api_key=api_key,
+                base_url=base_url,
+                max_retries=settings.llm_max_retries,
+                http_client=self._build_http_client()
+            )
+            self._clients[key] = client
+            print(f"LLM client created for {key[0]} (pool size: {len(self._clients)})")
+        return client
+
+    async def aclose(self) -> None:
+        """关闭所有客户端（应用关闭时调用）"""
+        clients = list(self._clients.values())
+        self._clients = {}
+        for client in clients:
+            try:
+                await client.close()
+            except Exception as e:
+                print(f"Failed to close LLM client: {e}")
+        print(f"LLM client pool closed ({len(clients)} clients)")
+
+    def stats(self) -> Dict[str, int]:
+        """连接池统计"""
+        return {"clients": len(self._clients)}
+
+# 创建全局客户端池实例
+llm_client_pool = LLMClientPool()
@@ -0,0 +1,91 @@
+from typing import Dict, Any, List
+from collections import deque
+import time
+from app.core.config import settings
+
+# 计算p95所需的最少样本数，样本不足时使用默认对冲延迟
+MIN_SAMPLES_FOR_P95 = 5
+
+class _EndpointStats:
+    def __init__(self):
+        self.ttft_ewma = 0.0
+        self.samples: deque = deque(maxlen=settings.llm_latency_window)
+        self.successes = 0
+        self.failures = 0
+        self.hedge_wins = 0
+        self.last_failure_at = 0.0
+
+class EndpointLatencyTracker:
+    """按端点统计首token延迟（EWMA + 滑动窗口p95）和失败情况"""
+
+    def __init__(self):
+        self._endpoints: Dict[str, _EndpointStats] = {}
+
+    @staticmethod
+    def endpoint_key(endpoint: Dict[str, Any]) -> str:
+        return f"{endpoint['base_url'].rstrip('/')}|{endpoint['model_name']}"
+
+    def _get(self, key: str) -> _EndpointStats:
+        stats = self._endpoints.get(key)
+        if stats is None:
+            stats = _EndpointStats()
+            self._endpoints[key] = stats
+        return stats
+
+    def record_ttft(self, key: str, seconds: float, hedged: bool = False):
+        """记录一次成功请求的首token延迟"""
+        stats = self._get(key)
+        alpha = settings.llm_latency_ewma_alpha
+        stats.ttft_ewma = seconds if stats.successes == 0 else alpha * seconds + (1 - alpha) * stats.ttft_ewma
+        stats.samples.append(seconds)
+        stats.successes += 1
+        if hedged:
+            stats.hedge_wins += 1
+
+    def record_failure(self, key: str):
+        """记录一次首token前的失败"""
+        stats = self._get(key)
+        stats.failures += 1
+        stats.last_failure_at = time.time()
+
+    def p95(self, key: str) -> float:
+        stats = self._endpoints.get(key)
+        if stats is None or len(stats.samples) < MIN_SAMPLES_FOR_P95:
+            return 0.0
+        ordered = sorted(stats.samples)
+        return ordered[min(len(ordered) - 1, int(len(ordered) * 0.95))]
+
+    def hedge_delay(self, key: str) -> float:
+        """首token超过该时间仍未到达时发起对冲请求"""
+        p95 = self.p95(key)
+        if not p95:
+            return settings.llm_hedge_default_delay
+        return min(max(p95 * settings.llm_hedge_p95_multiplier, settings.llm_hedge_min_delay),
+                   settings.llm_hedge_max_delay)
+
+    def order_endpoints(self, endpoints: List[Dict[str, Any]]) -> List[Dict[str, Any]]:
+        """保持配置顺序，但把冷却期内失败过的端点排到最后"""
+        now = time.time()
+
+        def cooling_down(endpoint: Dict[str, Any]) -> bool:
+            stats = self._endpoints.get(self.endpoint_key(endpoint))
+            return stats is not None and now - stats.last_failure_at < settings.llm_endpoint_cooldown
+
+        return sorted(endpoints, key=cooling_down)
+
+    def stats(self) -> Dict[str, Any]:
+        """各端点延迟统计"""
+        return {
+            key: {
+                "ttft_ewma_ms": round(stats.ttft_ewma * 1000, 1),
+                "ttft_p95_ms": round(self.p95(key) * 1000, 1),
+                "hedge_delay_ms": round(self.hedge_delay(key) * 1000, 1),
+                "successes": stats.successes,
+                "failures": stats.failures,
+                "hedge_wins": stats.hedge_wins
+            }
+            for key, stats in self._endpoints.items()
+        }
+
+# 创建全局端点延迟统计实例
+llm_latency_tracker = EndpointLatencyTracker()
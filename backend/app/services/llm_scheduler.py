@@ -0,0 +1,173 @@
+from typing import Dict, Any
+from collections import deque
+from contextlib import asynccontextmanager
+import asyncio
+import time
+from app.core.config import settings
+
+# 模式优先级（数值越小优先级越高）
+MODE_PRIORITIES = {
+    "emergency": 0,
+    "triage": 1,
+    "graph": 2,
+    "kb": 3
+}
+
+class LLMOverloadedError(Exception):
+    """排队请求过多或等待超时，低优先级请求被拒绝"""
+
+    def __init__(self, mode: str, reason: str):
+        self.mode = mode
+        self.reason = reason
+        super().__init__(f"LLM scheduler rejected {mode} request: {reason}")
+
+class _Waiter:
+    def __init__(self, future: asyncio.Future):
+        self.future = future
+        self.enqueued_at = time.monotonic()
+
+class LLMScheduler:
+    """上游LLM调用的优先级并发调度器
+
+    - 全局并发上限 + 按模式的并发上限
+    - 空出名额时严格按优先级放行（emergency > triage > graph > kb）
+    - 低优先级模式排队过长或等待超时时直接拒绝
+    各模式上限之和应小于全局上限，给高优先级模式预留名额。
+    """
+
+    def __init__(self):
+        self._active: Dict[str, int] = {mode: 0 for mode in MODE_PRIORITIES}
+        self._queues: Dict[str, deque] = {mode: deque() for mode in MODE_PRIORITIES}
+        self._total_active = 0
+        self._stats: Dict[str, Dict[str, float]] = {
+            mode: {"admitted": 0, "rejected": 0, "wait_total": 0.0, "wait_max": 0.0, "extra": 0, "extra_denied": 0}
+            for mode in MODE_PRIORITIES
+        }
+
+    def _normalize_mode(self, mode: str) -> str:
+        return mode if mode in MODE_PRIORITIES else "kb"
+
+    def _mode_limit(self, mode: str) -> int:
+        return settings.llm_concurrency_limits.get(mode, settings.llm_max_concurrency)
+
+    def _dispatch(self):
+        """按优先级从各模式队列中放行请求"""
+        for mode in sorted(MODE_PRIORITIES, key=MODE_PRIORITIES.get):
+            queue = self._queues[mode]
+            while queue and self._total_active < settings.llm_max_concurrency \
+                    and self._active[mode] < self._mode_limit(mode):
+                waiter = queue.popleft()
+                if waiter.future.done():
+                    continue
+                self._admit(mode, waiter)
+                waiter.future.set_result(None)
+
+    def _admit(self, mode: str, waiter: _Waiter):
+        self._active[mode] += 1
+        self._total_active += 1
+        wait = time.monotonic() - waiter.enqueued_at
+        stats = self._stats[mode]
+        stats["admitted"] += 1
+        stats["wait_total"] += wait
+        stats["wait_max"] = max(stats["wait_max"], wait)
+
+    async def acquire(self, mode: str) -> str:
+        """申请一个上游调用名额，返回归一化后的模式名"""
+        mode = self._normalize_mode(mode)
+        queue = self._queues[mode]
+
+        threshold = settings.llm_queue_reject_thresholds.get(mode)
+        if threshold is not None and len(queue) >= threshold:
+            self._stats[mode]["rejected"] += 1
+            raise LLMOverloadedError(mode, f"queue depth {len(queue)} >= {threshold}")
+
+        waiter = _Waiter(asyncio.get_running_loop().create_future())
+        queue.append(waiter)
+        self._dispatch()
+        if waiter.future.done():
+            return mode
+
+        timeout = settings.llm_queue_timeouts.get(mode)
+        try:
+            await asyncio.wait_for(asyncio.shield(waiter.future), timeout)
+        except asyncio.TimeoutError:
+            if not self._remove_waiter(mode, waiter):
+                # 超时的同时恰好被放行
+                return mode
+            self._stats[mode]["rejected"] += 1
+            raise LLMOverloadedError(mode, f"waited more than {timeout}s")
+        except asyncio.CancelledError:
+            if not self._remove_waiter(mode, waiter):
+                # 已被放行但调用方取消，归还名额
+                self.release(mode)
+            raise
+        return mode
+
+    def try_acquire(self, mode: str) -> bool:
+        """不排队地申请一个额外名额（对冲请求），没有空闲名额或有同级及更高优先级的请求在排队时返回 False"""
+        mode = self._normalize_mode(mode)
+        priority = MODE_PRIORITIES[mode]
+        queued = any(
+            self._queues[other] for other, other_priority in MODE_PRIORITIES.items() if other_priority <= priority
+        )
+        if queued or self._total_active >= settings.llm_max_concurrency \
+                or self._active[mode] >= self._mode_limit(mode):
+            self._stats[mode]["extra_denied"] += 1
+            return False
+        self._active[mode] += 1
+        self._total_active += 1
+        self._stats[mode]["extra"] += 1
+        return True
+
+    def _remove_waiter(self, mode: str, waiter: _Waiter) -> bool:
+        """从队列移除等待者，返回是否仍在队列中（未被放行）"""
+        if waiter.future.done():
+            return False
+        waiter.future.cancel()
+        try:
+            self._queues[mode].remove(waiter)
+        except ValueError:
+            pass
+        return True
+
+    def release(self, mode: str):
+        """归还名额并放行排队的请求"""
+        mode = self._normalize_mode(mode)
+        self._active[mode] -= 1
+        self._total_active -= 1
+        self._dispatch()
+
+    @asynccontextmanager
+    async def slot(self, mode: str):
+        """在上游调用期间占用一个名额"""
+        mode = await self.acquire(mode)
+        try:
+            yield
+        finally:
+            self.release(mode)
+
+    def stats(self) -> Dict[str, Any]:
+        """调度统计：并发数、队列深度和等待时间"""
+        modes = {}
+        for mode, stats in self._stats.items():
+            admitted = stats["admitted"]
+            modes[mode] = {
+                "priority": MODE_PRIORITIES[mode],
+                "active": self._active[mode],
+                "limit": self._mode_limit(mode),
+                "queue_depth": len(self._queues[mode]),
+                "admitted": int(admitted),
+                "rejected": int(stats["rejected"]),
+                "avg_wait_ms": round(stats["wait_total"] / admitted * 1000, 2) if admitted else 0.0,
+                "max_wait_ms": round(stats["wait_max"] * 1000, 2),
+                "extra": int(stats["extra"]),
+                "extra_denied": int(stats["extra_denied"])
+            }
+        return {
+            "active": self._total_active,
+            "max_concurrency": settings.llm_max_concurrency,
+            "modes": modes
+        }
+
+# 创建全局调度器实例
+llm_scheduler = LLMScheduler()
@@ -0,0 +1,375 @@
+from typing import Dict, Any, Deque, IO, Iterable, List, Optional, Tuple
+from collections import deque
+from datetime import datetime, timezone
+from itertools import islice
+import asyncio
+import glob
+import json
+import os
+import time
+import uuid
+from sqlalchemy import DateTime
+from sqlalchemy.dialects import postgresql, sqlite
+from sqlalchemy.exc import DataError, DBAPIError, IntegrityError
+from app.core.config import settings
+from app.core.database import Base, engine
+
+try:
+    import fcntl
+except ImportError:  # Windows：没有文件锁，运行中的段文件打开时不能改名，同样不会被其他进程领取
+    fcntl = None
+
+# 重试间隔的上限（秒）
+MAX_RETRY_BACKOFF = 30.0
+
+# 预写日志段文件超过该大小后换新段，旧段中的写入全部完成后删除
+JOURNAL_SEGMENT_BYTES = 4 * 1024 * 1024
+
+def utc_now() -> datetime:
+    """入队时确定的写入时间（写入可能晚于入队，不能依赖数据库的默认值）"""
+    return datetime.now(timezone.utc)
+
+def _is_permanent(error: Exception) -> bool:
+    """重试也不会成功的错误（约束冲突、数据不合法、语句本身出错），数据库连接类错误可以重试"""
+    return isinstance(error, (IntegrityError, DataError)) or not isinstance(error, DBAPIError)
+
+def _lock(journal: IO) -> bool:
+    """对段文件加排他锁（不等待），运行中的进程持有自己段文件的锁"""
+    if fcntl is None:
+        return True
+    try:
+        fcntl.flock(journal.fileno(), fcntl.LOCK_EX | fcntl.LOCK_NB)
+        return True
+    except OSError:
+        return False
+
+class QueuedWrite:
+    """一条待写入的记录：插入一行，或按主键更新一行"""
+
+    def __init__(self, table: str, op: str, values: Dict[str, Any], keys: Iterable[str], row_id: Any = None):
+        self.table = table
+        self.op = op
+        self.values = values
+        self.keys = list(keys)
+        self.row_id = row_id
+        self.seq = 0
+        self.attempts = 0
+
+    def to_json(self) -> str:
+        return json.dumps({
+            "table": self.table,
+            "op": self.op,
+            "values": self.values,
+            "keys": self.keys,
+            "row_id": self.row_id
+        }, ensure_ascii=False, default=lambda value: value.isoformat())
+
+    @classmethod
+    def from_json(cls, line: str) -> "QueuedWrite":
+        data = json.loads(line)
+        table = Base.metadata.tables[data["table"]]
+        values = data["values"]
+        # 时间字段在日志中保存为 ISO 字符串
+        for column in table.columns:
+            if isinstance(column.type, DateTime) and isinstance(values.get(column.name), str):
+                values[column.name] = datetime.fromisoformat(values[column.name])
+        return cls(data["table"], data["op"], values, data["keys"], data.get("row_id"))
+
+class MessageWriteBehind:
+    """消息写后队列
+
+    流式问答把用户消息、助手消息和会话更新放入队列后立即继续（不在首字和结束帧之前等待提交），
+    后台任务按入队顺序、按批在一个事务中写入；插入按主键 ON CONFLICT DO NOTHING，重试不会重复写入。
+    入队时先追加到本进程的预写日志段文件（write_behind_journal.seg-*，默认只刷到操作系统，
+    write_behind_fsync 开启后每条落盘），段中写入全部完成后清空；进程异常退出后，
+    下次启动时领取没有进程持有的段文件并重放。
+    一批写入失败时逐条写入这一批，找出无法写入的记录：约束冲突等不可重试的错误立即移入日志文件，
+    连接类错误按指数退避重试，单条连续失败 write_behind_max_retries 次后移入日志文件，不阻塞后续写入。
+    每条写入带有会话ID和用户ID两个键，读取会话消息、构建上下文、列表和删除前先等待对应键的写入完成。
+    """
+
+    def __init__(self):
+        self._queue: Deque[QueuedWrite] = deque()
+        # 每个键最后一条写入的序号；写入按序完成，序号不大于 _done_seq 的写入都已完成
+        self._last_seq: Dict[str, int] = {}
+        self._enqueued_seq = 0
+        self._done_seq = 0
+        self._task: Optional[asyncio.Task] = None
+        self._inflight: Optional[asyncio.Future] = None
+        self._wakeup: Optional[asyncio.Event] = None
+        self._changed: Optional[asyncio.Event] = None
+        # 序号不大于该值的记录逐条写入（所在的批次写入失败）
+        self._isolate_until = 0
+        # 当前预写日志段，以及已写满、等待其中写入完成后删除的段（文件, 最后序号）
+        self._segment: Optional[IO] = None
+        self._full_segments: List[Tuple[IO, int]] = []
+        self.written = 0
+        self.batches = 0
+        self.failures = 0
+        self.journaled = 0
+        self.journal_errors = 0
+        self.replayed = 0
+        self.wait_timeouts = 0
+        self.last_write_at: Optional[float] = None
+
+    def add(self, obj: Any, keys: Iterable[str]):
+        """插入 ORM 对象对应的一行（只取已赋值的字段，其余使用列默认值）"""
+        table = obj.__table__
+        values = {}
+        for column in table.columns:
+            value = getattr(obj, column.key)
+            if value is not None:
+                values[column.name] = value
+        self._enqueue(QueuedWrite(table.name, "insert", values, keys))
+
+    def update(self, model: Any, row_id: Any, values: Dict[str, Any], keys: Iterable[str]):
+        """按主键更新一行（列的 onupdate 默认值照常生效）"""
+        self._enqueue(QueuedWrite(model.__tablename__, "update", values, keys, row_id))
+
+    def _enqueue(self, write: QueuedWrite):
+        if self._wakeup is None:
+            # 队列未运行（未启动或已关闭）：直接保存到日志文件，下次启动时写入
+            self._spill([write])
+            return
+        self._enqueued_seq += 1
+        write.seq = self._enqueued_seq
+        self._append_segment(write)
+        self._queue.append(write)
+        for key in write.keys:
+            self._last_seq[key] = write.seq
+        self._wakeup.set()
+
+    async def wait_for(self, key: str):
+        """等待该键（会话ID或用户ID）此前入队的写入完成，超过 write_behind_wait_timeout 后直接返回
+
+        只等待调用时已入队的写入，之后持续入队的新写入不会让读取一直等待。
+        """
+        target = self._last_seq.get(key, 0)
+        if target <= self._done_seq:
+            return
+        try:
+            await asyncio.wait_for(self._settled(target), settings.write_behind_wait_timeout)
+        except asyncio.TimeoutError:
+            self.wait_timeouts += 1
+
+    async def _settled(self, seq: int):
+        while self._done_seq < seq:
+            await self._changed.wait()
+
+    def _finish(self, writes: List[QueuedWrite]):
+        """写入（或移入日志文件）后推进已完成的序号，唤醒等待中的读取"""
+        if writes:
+            self._done_seq = max(self._done_seq, writes[-1].seq)
+        for write in writes:
+            for key in write.keys:
+                if self._last_seq.get(key, 0) <= self._done_seq:
+                    self._last_seq.pop(key, None)
+        self._changed.set()
+        self._changed = asyncio.Event()
+        self._trim_segments()
+
+    def _open_segment(self):
+        path = f"{settings.write_behind_journal}.seg-{uuid.uuid4().hex[:8]}"
+        os.makedirs(os.path.dirname(path) or ".", exist_ok=True)
+        self._segment = open(path, "a", encoding="utf-8")
+        _lock(self._segment)
+
+    def _append_segment(self, write: QueuedWrite):
+        """入队前把记录追加到预写日志段，写满后换新段"""
+        if self._segment is None:
+            return
+        try:
+            self._segment.write(write.to_json() + "\n")
+            self._segment.flush()
+            if settings.write_behind_fsync:
+                os.fsync(self._segment.fileno())
+            if self._segment.tell() >= JOURNAL_SEGMENT_BYTES:
+                self._full_segments.append((self._segment, write.seq))
+                self._open_segment()
+        except Exception as e:
+            # 日志写入失败不影响入队，只是异常退出时这条记录无法重放
+            self.journal_errors += 1
+            print(f"Failed to append queued message to journal: {e}")
+
+    def _trim_segments(self):
+        """删除其中写入已全部完成的已满段；全部写入完成时清空当前段"""
+        while self._full_segments and self._full_segments[0][1] <= self._done_seq:
+            segment, _ = self._full_segments.pop(0)
+            segment.close()
+            os.remove(segment.name)
+        if self._segment is not None and self._done_seq >= self._enqueued_seq and self._segment.tell() > 0:
+            self._segment.truncate(0)
+            self._segment.seek(0)
+
+    def _statement(self, dialect: str, write: QueuedWrite):
+        table = Base.metadata.tables[write.table]
+        if write.op == "update":
+            return table.update().where(table.c.id == write.row_id).values(**write.values)
+        if dialect == "sqlite":
+            return sqlite.insert(table).values(**write.values).on_conflict_do_nothing(index_elements=["id"])
+        if dialect == "postgresql":
+            return postgresql.insert(table).values(**write.values).on_conflict_do_nothing(index_elements=["id"])
+        return table.insert().values(**write.values)
+
+    def _write(self, writes: List[QueuedWrite]):
+        """在一个事务中写入一批记录（同步，运行在线程池中，整批只占用一次事件循环调度）"""
+        with engine.begin() as conn:
+            for write in writes:
+                conn.execute(self._statement(engine.dialect.name, write))
+
+    async def _flush_batch(self) -> bool:
+        """写入队首的一批记录，返回是否需要退避后重试"""
+        # 失败批次中的记录逐条写入，其余按批写入（写入期间入队的记录进入下一批）
+        size = 1 if self._queue[0].seq <= self._isolate_until else settings.write_behind_batch_size
+        batch = list(islice(self._queue, size))
+        try:
+            await asyncio.get_running_loop().run_in_executor(None, self._write, batch)
+        except Exception as e:
+            self.failures += 1
+            print(f"Failed to write {len(batch)} queued messages: {e}")
+            permanent = _is_permanent(e)
+            if len(batch) > 1:
+                self._isolate_until = batch[-1].seq
+                return not permanent
+            batch[0].attempts += 1
+            if not permanent and batch[0].attempts < settings.write_behind_max_retries:
+                return True
+            # 单条记录无法写入：移入日志文件，不阻塞后续写入
+            self._queue.popleft()
+            self._spill(batch)
+            self._finish(batch)
+            return False
+        for _ in batch:
+            self._queue.popleft()
+        self._finish(batch)
+        self.written += len(batch)
+        self.batches += 1
+        self.last_write_at = time.time()
+        return False
+
+    async def run(self):
+        failures = 0
+        while True:
+            if not self._queue:
+                self._wakeup.clear()
+                await self._wakeup.wait()
+                continue
+            # 关闭时取消后台任务不会中断正在进行的写入
+            self._inflight = asyncio.ensure_future(self._flush_batch())
+            if await asyncio.shield(self._inflight):
+                failures += 1
+                await asyncio.sleep(min(settings.write_behind_retry_backoff * 2 ** (failures - 1), MAX_RETRY_BACKOFF))
+            else:
+                failures = 0
+
+    def _spill(self, writes: List[QueuedWrite]):
+        """把无法写入的记录追加到日志文件"""
+        path = settings.write_behind_journal
+        try:
+            os.makedirs(os.path.dirname(path) or ".", exist_ok=True)
+            with open(path, "a", encoding="utf-8") as journal:
+                for write in writes:
+                    journal.write(write.to_json() + "\n")
+            self.journaled += len(writes)
+        except Exception as e:
+            print(f"Failed to save {len(writes)} queued messages to journal: {e}")
+
+    def _claimable(self, path: str) -> bool:
+        """段文件没有被运行中的进程持有"""
+        try:
+            with open(path, "a", encoding="utf-8") as journal:
+                return _lock(journal)
+        except OSError:
+            return False
+
+    def _replay_journal(self):
+        """领取日志文件（改名后只有当前进程读取），记录重新入队（写入本进程的日志段）后删除
+
+        包括移入日志文件的记录、已退出进程留下的日志段，以及此前领取后未处理完就退出的文件。
+        """
+        path = settings.write_behind_journal
+        sources = [path] + glob.glob(f"{path}.replay-*")
+        sources += [segment for segment in glob.glob(f"{path}.seg-*") if self._claimable(segment)]
+        replayed = 0
+        for source in sources:
+            if self._segment is not None and source == self._segment.name:
+                continue
+            claimed = f"{path}.replay-{uuid.uuid4().hex[:8]}"
+            try:
+                os.replace(source, claimed)
+            except OSError:
+                # 已被其他进程领取，或（Windows）仍被运行中的进程打开
+                continue
+            with open(claimed, encoding="utf-8") as journal:
+                for line in journal:
+                    if not line.strip():
+                        continue
+                    try:
+                        write = QueuedWrite.from_json(line)
+                    except (ValueError, KeyError) as e:
+                        print(f"Skipped invalid journal entry: {e}")
+                        continue
+                    self._enqueue(write)
+                    replayed += 1
+            os.remove(claimed)
+        self.replayed += replayed
+        if replayed:
+            print(f"Replaying {replayed} queued messages from journal")
+
+    def start(self):
+        if self._task is not None and not self._task.done():
+            return
+        self._wakeup = asyncio.Event()
+        self._changed = asyncio.Event()
+        try:
+            self._open_segment()
+        except OSError as e:
+            print(f"Write-behind journal unavailable: {e}")
+        self._replay_journal()
+        self._task = asyncio.get_running_loop().create_task(self.run())
+
+    async def stop(self):
+        """关闭时调用：写入剩余记录，仍未写入的留在日志段中，下次启动时重放"""
+        if self._task is not None:
+            self._task.cancel()
+            try:
+                await self._task
+            except asyncio.CancelledError:
+                pass
+            self._task = None
+        if self._inflight is not None:
+            await self._inflight
+            self._inflight = None
+        while self._queue:
+            if await self._flush_batch():
+                break
+        if self._queue and self._segment is None:
+            # 没有日志段（无法创建）时保存到日志文件
+            self._spill(list(self._queue))
+        self._queue.clear()
+        # 有未写入记录的段保留（关闭后释放锁，下次启动时领取），其余删除
+        for segment in [segment for segment, _ in self._full_segments] + [self._segment]:
+            if segment is None:
+                continue
+            segment.close()
+            if os.path.getsize(segment.name) == 0:
+                os.remove(segment.name)
+        self._full_segments = []
+        self._segment = None
+        self._wakeup = None
+
+    def stats(self) -> Dict[str, Any]:
+        return {
+            "queued": len(self._queue),
+            "written": self.written,
+            "batches": self.batches,
+            "failures": self.failures,
+            "journaled": self.journaled,
+            "journal_errors": self.journal_errors,
+            "replayed": self.replayed,
+            "wait_timeouts": self.wait_timeouts,
+            "last_write_at": self.last_write_at
+        }
+
+# 创建全局消息写后队列实例
+message_writer = MessageWriteBehind()
@@ -0,0 +1,139 @@
+from typing import List, Dict, Any, Optional, AsyncGenerator
+from collections import OrderedDict
+import hashlib
+import json
+import re
+import time
+import unicodedata
+from app.core.config import settings
+
+# 归一化时去除的结尾标点（问句末尾的问号、句号等不影响语义）
+_TRAILING_PUNCTUATION = "?？。.!！~～…"
+_WHITESPACE_RE = re.compile(r"\s+")
+
+# 回放缓存答案时每个answer块的字符数
+REPLAY_CHUNK_SIZE = 64
+
+def normalize_text(text: str) -> str:
+    """归一化提问文本：全角转半角、统一大小写、合并空白、去除结尾标点"""
+    text = unicodedata.normalize("NFKC", text or "").lower()
+    text = _WHITESPACE_RE.sub(" ", text).strip()
+    return text.rstrip(_TRAILING_PUNCTUATION + " ")
+
+def make_request_key(module_name: str, request_params: Dict[str, Any]) -> str:
+    """根据模块、模型、参数和归一化后的消息生成请求键"""
+    payload = {
+        "module": module_name,
+        "model": request_params.get("model"),
+        "temperature": request_params.get("temperature"),
+        "max_tokens": request_params.get("max_tokens"),
+        "extra_body": request_params.get("extra_body"),
+        "messages": [
+            [msg["role"], normalize_text(msg["content"])]
+            for msg in request_params.get("messages", [])
+        ]
+    }
+    raw = json.dumps(payload, ensure_ascii=False, sort_keys=True)
+    return hashlib.sha256(raw.encode("utf-8")).hexdigest()
+
+class ResponseCache:
+    """LLM回复缓存（LRU + TTL）
+
+    只缓存上游正常完成的回复，命中时按与上游相同的事件序列
+    （thinking/answer_start/answer/done）回放。
+    """
+
+    def __init__(self, max_entries: int, ttl: int, modules: List[str]):
+        self.max_entries = max_entries
+        self.ttl = ttl
+        self.modules = set(modules)
+        self._entries: "OrderedDict[str, Dict[str, Any]]" = OrderedDict()
+        self.hits = 0
+        self.misses = 0
+        self.evictions = 0
+
+    def is_enabled_for(self, module_name: str) -> bool:
+        """判断模块是否启用回复缓存"""
+        return settings.response_cache_enabled and module_name in self.modules
+
+    def get(self, key: str) -> Optional[Dict[str, Any]]:
+        """查找缓存，命中时移动到LRU队尾"""
+        entry = self._entries.get(key)
+        if entry is None:
+            self.misses += 1
+            return None
+        if time.time() - entry["created_at"] > self.ttl:
+            del self._entries[key]
+            self.misses += 1
+            return None
+        self._entries.move_to_end(key)
+        self.hits += 1
+        return entry
+
+    def set(self, key: str, module_name: str, content: str, thinking: str = ""):
+        """写入缓存，超出容量时淘汰最久未使用的条目"""
+        if not content:
+            return
+        self._entries[key] = {
+            "module": module_name,
+            "content": content,
+            "thinking": thinking,
+            "created_at": time.time()
+        }
+        self._entries.move_to_end(key)
+        while len(self._entries) > self.max_entries:
+            self._entries.popitem(last=False)
+            self.evictions += 1
+
+    def invalidate_module(self, module_name: str) -> int:
+        """清除某个模块的全部缓存（配置变更时调用）"""
+        keys = [key for key, entry in self._entries.items() if entry["module"] == module_name]
+        for key in keys:
+            del self._entries[key]
+        return len(keys)
+
+    def clear(self):
+        """清空缓存"""
+        self._entries.clear()
+
+    def stats(self) -> Dict[str, Any]:
+        """缓存统计"""
+        total = self.hits + self.misses
+        return {
+            "enabled": settings.response_cache_enabled,
+            "modules": sorted(self.modules),
+            "entries": len(self._entries),
+            "max_entries": self.max_entries,
+            "ttl": self.ttl,
+            "hits": self.hits,
+            "misses": self.misses,
+            "evictions": self.evictions,
+            "hit_rate": round(self.hits / total, 4) if total else 0.0
+        }
+
+    async def replay(self, entry: Dict[str, Any]) -> AsyncGenerator[Dict[str, Any], None]:
+        """按上游事件序列回放缓存的回复"""
+        thinking = entry.get("thinking") or ""
+        if thinking:
+            yield {"type": "thinking", "content": thinking}
+
+        yield {"type": "answer_start", "content": ""}
+
+        content = entry["content"]
+        for i in range(0, len(content), REPLAY_CHUNK_SIZE):
+            yield {"type": "answer", "content": content[i:i + REPLAY_CHUNK_SIZE]}
+
+        yield {
+            "type": "done",
+            "content": content,
+            "thinking_enabled": bool(thinking),
+            "thinking_content_length": len(thinking),
+            "cached": True
+        }
+
+# 创建全局回复缓存实例
+response_cache = ResponseCache(
+    max_entries=settings.response_cache_max_entries,
+    ttl=settings.response_cache_ttl,
+    modules=settings.response_cache_modules
+)
@@ -0,0 +1,145 @@
+from typing import Dict, Any, List, Optional, Tuple
+import asyncio
+import time
+import uuid
+from contextlib import nullcontext
+from sqlalchemy import delete, select
+from sqlalchemy.orm import Session
+from app.core.config import settings
+from app.core.database import engine
+
+# 已结束的任务保留时间（秒）
+JOB_RETENTION_SECONDS = 3600
+
+class PurgeJob:
+    """后台删除任务的进度"""
+
+    def __init__(self, owner_id: str, kind: str, total: int):
+        self.id = uuid.uuid4().hex
+        self.owner_id = owner_id
+        self.kind = kind
+        self.total = total
+        self.deleted_sessions = 0
+        self.deleted_messages = 0
+        self.status = "running"  # running, completed, failed
+        self.error: Optional[str] = None
+        self.started_at = time.time()
+        self.finished_at: Optional[float] = None
+
+    def as_dict(self) -> Dict[str, Any]:
+        return {
+            "job_id": self.id,
+            "kind": self.kind,
+            "status": self.status,
+            "total": self.total,
+            "deleted_sessions": self.deleted_sessions,
+            "deleted_messages": self.deleted_messages,
+            "progress": round(self.deleted_sessions / self.total, 4) if self.total else 1.0,
+            "error": self.error,
+            "started_at": self.started_at,
+            "finished_at": self.finished_at
+        }
+
+class SessionPurger:
+    """会话及消息的批量删除
+
+    按会话ID分块执行 DELETE ... WHERE session_id IN (...)，每块一个事务，不把消息加载到 ORM，
+    也不在一个长事务中持有写锁。会话较多时在后台任务中删除，通过任务ID查询进度
+    （任务记录在当前进程内，多 worker 部署时只能在发起删除的 worker 上查到）。
+    """
+
+    def __init__(self):
+        self._jobs: Dict[str, PurgeJob] = {}
+
+    def delete_sessions(
+        self,
+        session_model: Any,
+        message_model: Any,
+        session_ids: List[str],
+        job: Optional[PurgeJob] = None,
+        db: Optional[Session] = None
+    ) -> Tuple[int, int]:
+        """分块删除会话及其消息（同步），返回 (删除的会话数, 删除的消息数)
+
+        传入 db 时在该会话中执行并逐块提交（请求内的小批量删除），否则每块使用新的连接。
+        """
+        chunk_size = settings.session_purge_chunk_size
+        deleted_sessions = deleted_messages = 0
+        for start in range(0, len(session_ids), chunk_size):
+            chunk = session_ids[start:start + chunk_size]
+            with (nullcontext(db) if db is not None else engine.begin()) as conn:
+                messages = conn.execute(
+                    delete(message_model).where(message_model.session_id.in_(chunk)),
+                    execution_options={"synchronize_session": False}
+                ).rowcount
+                sessions = conn.execute(
+                    delete(session_model).where(session_model.id.in_(chunk)),
+                    execution_options={"synchronize_session": False}
+                ).rowcount
+            if db is not None:
+                db.commit()
+            deleted_sessions += sessions
+            deleted_messages += messages
+            if job is not None:
+                job.deleted_sessions = deleted_sessions
+                job.deleted_messages = deleted_messages
+        return deleted_sessions, deleted_messages
+
+    def delete_messages(self, message_model: Any, *conditions) -> int:
+        """分块删除满足条件的消息（同步，维护脚本使用），返回删除的消息数"""
+        chunk_size = settings.session_purge_chunk_size
+        deleted = 0
+        while True:
+            with engine.begin() as conn:
+                ids = conn.execute(
+                    select(message_model.id).where(*conditions).limit(chunk_size)
+                ).scalars().all()
+                if not ids:
+                    return deleted
+                deleted += conn.execute(
+                    delete(message_model).where(message_model.id.in_(ids))
+                ).rowcount
+
+    def start_job(
+        self,
+        owner_id: str,
+        kind: str,
+        session_model: Any,
+        message_model: Any,
+        session_ids: List[str]
+    ) -> PurgeJob:
+        """在线程池中删除会话，立即返回任务"""
+        self._prune()
+        job = PurgeJob(owner_id, kind, len(session_ids))
+        self._jobs[job.id] = job
+        asyncio.get_running_loop().run_in_executor(
+            None, self._run_job, job, session_model, message_model, session_ids
+        )
+        return job
+
+    def _run_job(self, job: PurgeJob, session_model: Any, message_model: Any, session_ids: List[str]):
+        try:
+            self.delete_sessions(session_model, message_model, session_ids, job)
+            job.status = "completed"
+        except Exception as e:
+            # 已提交的块不回滚，重新清空即可删除剩余会话
+            job.status = "failed"
+            job.error = str(e)
+            print(f"Session purge job {job.id} failed: {e}")
+        finally:
+            job.finished_at = time.time()
+
+    def get_job(self, job_id: str, owner_id: str) -> Optional[PurgeJob]:
+        job = self._jobs.get(job_id)
+        if job is None or job.owner_id != owner_id:
+            return None
+        return job
+
+    def _prune(self):
+        now = time.time()
+        for job_id, job in list(self._jobs.items()):
+            if job.finished_at is not None and now - job.finished_at > JOB_RETENTION_SECONDS:
+                del self._jobs[job_id]
+
+# 创建全局会话批量删除实例
+session_purger = SessionPurger()
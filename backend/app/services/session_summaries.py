@@ -0,0 +1,35 @@
+from typing import Any, Dict, List, Tuple
+from sqlalchemy import case, func, select
+from sqlalchemy.orm import Session
+
+def session_summaries(db: Session, message_model: Any, session_ids: List[str]) -> Dict[str, Tuple[int, str]]:
+    """一次查询统计一组会话的消息数和最后一条用户消息
+
+    按会话分区的窗口函数：count() 得到消息数，row_number() 按“用户消息优先、时间倒序”排序，
+    每个会话只取第一行。返回 会话ID -> (消息数, 最后一条用户消息内容)，没有消息的会话不在字典中。
+    """
+    if not session_ids:
+        return {}
+    partition = message_model.session_id
+    ranked = select(
+        partition.label("session_id"),
+        message_model.role,
+        message_model.content,
+        func.count().over(partition_by=partition).label("message_count"),
+        func.row_number().over(
+            partition_by=partition,
+            order_by=(
+                case((message_model.role == "user", 0), else_=1),
+                message_model.created_at.desc(),
+                message_model.id.desc()
+            )
+        ).label("position")
+    ).where(partition.in_(session_ids)).subquery()
+    rows = db.execute(
+        select(ranked.c.session_id, ranked.c.role, ranked.c.content, ranked.c.message_count)
+        .where(ranked.c.position == 1)
+    ).all()
+    return {
+        row.session_id: (row.message_count, row.content if row.role == "user" else "")
+        for row in rows
+    }
@@ -0,0 +1,95 @@
+from typing import Dict, Any, List, Optional, Callable, AsyncGenerator
+import asyncio
+
+class _Flight:
+    """一次正在进行的上游生成"""
+
+    def __init__(self):
+        self.chunks: List[Dict[str, Any]] = []  # 已产生的事件（供迟到的订阅者回放）
+        self.done = False
+        self.error: Optional[BaseException] = None
+        self.subscribers = 0
+        self.changed = asyncio.Event()
+        self.task: Optional[asyncio.Task] = None
+
+class SingleFlight:
+    """相同请求的并发合并
+
+    同一请求键在进行中时，后来的调用不再访问上游，而是订阅同一次生成：
+    先收到已缓冲的前缀，再实时收到后续事件。所有订阅者都离开时取消上游生成。
+    """
+
+    def __init__(self):
+        self._flights: Dict[str, _Flight] = {}
+        self.started = 0
+        self.coalesced = 0
+
+    async def stream(
+        self,
+        key: str,
+        factory: Callable[[], AsyncGenerator[Dict[str, Any], None]]
+    ) -> AsyncGenerator[Dict[str, Any], None]:
+        """订阅请求键对应的生成，没有进行中的生成时由factory发起"""
+        flight = self._flights.get(key)
+        if flight is None:
+            flight = _Flight()
+            self._flights[key] = flight
+            flight.task = asyncio.get_running_loop().create_task(self._run(key, flight, factory))
+            self.started += 1
+        else:
+            self.coalesced += 1
+
+        flight.subscribers += 1
+        index = 0
+        try:
+            while True:
+                while index < len(flight.chunks):
+                    yield flight.chunks[index]
+                    index += 1
+                if flight.done:
+                    if flight.error is not None:
+                        raise flight.error
+                    return
+                flight.changed.clear()
+                await flight.changed.wait()
+        finally:
+            flight.subscribers -= 1
+            if flight.subscribers == 0 and not flight.done:
+                # 没有订阅者了，不再让新请求加入并取消上游生成
+                if self._flights.get(key) is flight:
+                    del self._flights[key]
+                flight.task.cancel()
+
+    async def _run(
+        self,
+        key: str,
+        flight: _Flight,
+        factory: Callable[[], AsyncGenerator[Dict[str, Any], None]]
+    ):
+        """在后台任务中拉取上游事件并通知所有订阅者"""
+        try:
+            async for chunk in factory():
+                flight.chunks.append(chunk)
+                flight.changed.set()
+        except asyncio.CancelledError:
+            flight.error = RuntimeError("Upstream generation cancelled")
+            raise
+        except Exception as e:
+            flight.error = e
+        finally:
+            flight.done = True
+            flight.changed.set()
+            if self._flights.get(key) is flight:
+                del self._flights[key]
+
+    def stats(self) -> Dict[str, int]:
+        """合并统计"""
+        return {
+            "in_flight": len(self._flights),
+            "started": self.started,
+            "coalesced": self.coalesced,
+            "subscribers": sum(flight.subscribers for flight in self._flights.values())
+        }
+
+# 创建全局请求合并实例
+single_flight = SingleFlight()
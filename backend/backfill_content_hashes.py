@@ -0,0 +1,30 @@
+#!/usr/bin/env python3
+"""
+为知识条目补齐去重哈希（content_hash）
+
+批量导入以 content_hash 去重，只有写入了哈希的条目参与去重。content_hash 字段新增时
+服务启动会补齐一次；之后通过管理接口、初始化脚本或SQL写入的条目没有哈希，
+需要让它们参与导入去重时执行一次本脚本（读取全表，不要在每次导入前执行）。
+"""
+import sys
+import os
+import time
+sys.path.append(os.path.dirname(os.path.abspath(__file__)))
+
+from app.core.database import create_tables, upgrade_schema
+from app.services.knowledge_importer import backfill_content_hashes
+
+def main():
+    """补齐知识条目的去重哈希"""
+    print("🔧 开始补齐知识条目去重哈希...")
+    create_tables()
+    upgrade_schema()
+
+    started = time.time()
+    count = backfill_content_hashes()
+    print(f"✅ 补齐完成：{count} 条知识条目，耗时 {time.time() - started:.1f} 秒")
+    return True
+
+if __name__ == "__main__":
+    success = main()
+    sys.exit(0 if success else 1)
@@ -0,0 +1,133 @@
+#!/usr/bin/env python3
+"""
+并发流式问答压测
+
+同时发起多路 /api/chat/sessions/{id}/messages 流式请求，统计吞吐量、首字时间和完成时间；
+压测期间持续请求会话列表，统计其延迟（事件循环被数据库查询阻塞时延迟明显升高）。
+
+用法（先启动 mock_llm_server.py 并把 LLM 配置指向它）：
+    python benchmark_streams.py --token <JWT> --concurrency 50 --streams 200
+
+对比改动前后：在两个版本上用相同参数各运行一次，比较输出的 streams/s 和延迟分位数。
+压测时建议关闭回复缓存和请求合并（RESPONSE_CACHE_ENABLED=false、LLM_SINGLE_FLIGHT_ENABLED=false），
+并调高 LLM_CONCURRENCY_LIMITS，否则测到的是缓存和LLM调度排队而不是接口本身。
+"""
+import argparse
+import asyncio
+import json
+import time
+from typing import Dict, List, Optional
+
+import httpx
+
+def percentile(values: List[float], pct: float) -> float:
+    if not values:
+        return 0.0
+    values = sorted(values)
+    index = min(len(values) - 1, int(round(pct / 100 * (len(values) - 1))))
+    return values[index]
+
+def describe(name: str, values: List[float]):
+    print(f"  {name:<16} p50={percentile(values, 50) * 1000:8.1f}ms  "
+          f"p95={percentile(values, 95) * 1000:8.1f}ms  max={max(values, default=0) * 1000:8.1f}ms")
+
+async def create_session(client: httpx.AsyncClient, mode: str) -> str:
+    response = await client.post("/api/chat/sessions", json={"title": "压测会话", "mode": mode})
+    response.raise_for_status()
+    return response.json()["data"]["id"]
+
+async def run_stream(client: httpx.AsyncClient, session_id: str, question: str, results: Dict[str, List[float]]):
+    """发送一条消息并读完流式响应"""
+    started = time.perf_counter()
+    first_answer: Optional[float] = None
+    completed = False
+    try:
+        async with client.stream(
+            "POST", f"/api/chat/sessions/{session_id}/messages", json={"content": question}
+        ) as response:
+            async for line in response.aiter_lines():
+                if not line.startswith("data: "):
+                    continue
+                event = json.loads(line[6:])
+                if event.get("type") == "answer" and first_answer is None:
+                    first_answer = time.perf_counter() - started
+                elif event.get("type") == "done":
+                    completed = True
+                elif event.get("type") == "error":
+                    break
+    except httpx.HTTPError as e:
+        print(f"❌ 流式请求失败: {e}")
+    if completed:
+        results["ttft"].append(first_answer or 0.0)
+        results["total"].append(time.perf_counter() - started)
+    else:
+        results["failed"].append(1.0)
+
+async def probe(client: httpx.AsyncClient, mode: str, stop: asyncio.Event, latencies: List[float]):
+    """压测期间持续请求会话列表"""
+    while not stop.is_set():
+        started = time.perf_counter()
+        try:
+            response = await client.get("/api/chat/sessions", params={"mode": mode, "limit": 20})
+            response.raise_for_status()
+            latencies.append(time.perf_counter() - started)
+        except httpx.HTTPError as e:
+            print(f"❌ 会话列表请求失败: {e}")
+        await asyncio.sleep(0.05)
+
+async def main(args: argparse.Namespace):
+    limits = httpx.Limits(max_connections=args.concurrency + 4, max_keepalive_connections=args.concurrency + 4)
+    async with httpx.AsyncClient(
+        base_url=args.base_url,
+        headers={"Authorization": f"Bearer {args.token}"},
+        timeout=httpx.Timeout(120.0),
+        limits=limits
+    ) as client:
+        print(f"🔧 创建 {args.concurrency} 个会话...")
+        sessions = [await create_session(client, args.mode) for _ in range(args.concurrency)]
+
+        results: Dict[str, List[float]] = {"ttft": [], "total": [], "failed": []}
+        probe_latencies: List[float] = []
+        queue: asyncio.Queue = asyncio.Queue()
+        for index in range(args.streams):
+            queue.put_nowait(index)
+
+        async def worker(session_id: str):
+            # 每个会话同一时间只有一路流
+            while True:
+                try:
+                    queue.get_nowait()
+                except asyncio.QueueEmpty:
+                    return
+                await run_stream(client, session_id, args.question, results)
+
+        stop = asyncio.Event()
+        probe_task = asyncio.ensure_future(probe(client, args.mode, stop, probe_latencies))
+        print(f"🚀 {args.streams} 路流式请求，并发 {args.concurrency}...")
+        started = time.perf_counter()
+        await asyncio.gather(*(worker(session_id) for session_id in sessions))
+        elapsed = time.perf_counter() - started
+        stop.set()
+        await probe_task
+
+        if args.cleanup:
+            await client.delete("/api/chat/sessions", params={"mode": args.mode})
+
+    completed = len(results["total"])
+    print("\n📊 结果")
+    print(f"  完成 {completed} 路，失败 {len(results['failed'])} 路，用时 {elapsed:.1f}s")
+    print(f"  吞吐量 {completed / elapsed:.2f} streams/s")
+    describe("首字时间", results["ttft"])
+    describe("完成时间", results["total"])
+    describe("会话列表延迟", probe_latencies)
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="并发流式问答压测")
+    parser.add_argument("--base-url", default="http://127.0.0.1:8000")
+    parser.add_argument("--token", required=True, help="登录后获得的 access_token")
+    parser.add_argument("--concurrency", type=int, default=50, help="同时进行的流数（会话数）")
+    parser.add_argument("--streams", type=int, default=200, help="总请求数")
+    parser.add_argument("--mode", default="kb", help="会话模式（kb 模式包含知识库检索）")
+    parser.add_argument("--question", default="心肺复苏的基本步骤是什么？")
+    parser.add_argument("--cleanup", action="store_true", help="结束后清空该模式下的会话")
+    asyncio.run(main(parser.parse_args()))
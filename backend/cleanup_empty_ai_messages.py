@@ -12,66 +12,62 @@ sys.path.insert(0, current_dir)
 
 from app.core.database import get_db
 from app.models.emergency import EmergencyMessage
+from app.services.session_purge import session_purger
+
+# 空内容的AI消息
+EMPTY_AI_MESSAGE = (
+    EmergencyMessage.role == "assistant",
+    EmergencyMessage.content.is_(None) | (EmergencyMessage.content == "")
+)
+
+# 最多显示的消息数
+PREVIEW_LIMIT = 20
 
 def main():
     print("🧹 开始清理空内容的AI消息...")
     
     db = next(get_db())
     
-    # 查找所有空内容的AI消息
-    empty_ai_messages = db.query(EmergencyMessage).filter(
-        EmergencyMessage.role == "assistant",
-        EmergencyMessage.content.is_(None) | (EmergencyMessage.content == "")
-    ).all()
+    # 统计所有空内容的AI消息
+    empty_count = db.query(EmergencyMessage).filter(*EMPTY_AI_MESSAGE).count()
     
-    print(f"\n📊 找到 {len(empty_ai_messages)} 条空内容的AI消息")
+    print(f"\n📊 找到 {empty_count} 条空内容的AI消息")
     
-    if len(empty_ai_messages) == 0:
+    if empty_count == 0:
         print("✅ 没有需要清理的空消息")
         return
     
-    # 显示将要删除的消息
-    for msg in empty_ai_messages:
+    # 显示将要删除的消息（只显示前几条）
+    for msg in db.query(EmergencyMessage).filter(*EMPTY_AI_MESSAGE).limit(PREVIEW_LIMIT):
         print(f"\n消息ID: {msg.id}")
         print(f"  会话ID: {msg.session_id}")
         print(f"  内容: {repr(msg.content)}")
         print(f"  创建时间: {msg.created_at}")
+    if empty_count > PREVIEW_LIMIT:
+        print(f"\n  ... 还有 {empty_count - PREVIEW_LIMIT} 条")
+    db.commit()
     
     # 确认删除
-    confirm = input(f"\n❓ 确定要删除这 {len(empty_ai_messages)} 条空消息吗？(y/N): ")
+    confirm = input(f"\n❓ 确定要删除这 {empty_count} 条空消息吗？(y/N): ")
     
     if confirm.lower() != 'y':
         print("❌ 取消删除操作")
         return
     
-    # 执行删除
-    deleted_count = 0
-    for msg in empty_ai_messages:
-        try:
-            db.delete(msg)
-            deleted_count += 1
-            print(f"✅ 删除消息: {msg.id}")
-        except Exception as e:
-            print(f"❌ 删除消息失败 {msg.id}: {e}")
-    
-    # 提交更改
+    # 分块删除（每块一个事务）
     try:
-        db.commit()
+        deleted_count = session_purger.delete_messages(EmergencyMessage, *EMPTY_AI_MESSAGE)
         print(f"\n🎉 成功删除 {deleted_count} 条空消息")
     except Exception as e:
-        db.rollback()
-        print(f"❌ 提交更改失败: {e}")
+        print(f"❌ 删除失败: {e}")
     
     # 验证清理结果
-    remaining_empty_messages = db.query(EmergencyMessage).filter(
-        EmergencyMessage.role == "assistant",
-        EmergencyMessage.content.is_(None) | (EmergencyMessage.content == "")
-    ).all()
+    remaining_count = db.query(EmergencyMessage).filter(*EMPTY_AI_MESSAGE).count()
     
-    if len(remaining_empty_messages) == 0:
+    if remaining_count == 0:
         print("✅ 所有空消息已清理完成")
     else:
-        print(f"⚠️  仍有 {len(remaining_empty_messages)} 条空消息未清理")
+        print(f"⚠️  仍有 {remaining_count} 条空消息未清理")
 
 if __name__ == "__main__":
     main() 
\ No newline at end of file
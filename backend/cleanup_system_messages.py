@@ -12,70 +12,65 @@ sys.path.insert(0, current_dir)
 
 from app.core.database import get_db
 from app.models.emergency import EmergencySession, EmergencyMessage
+from app.services.session_purge import session_purger
+
+# 旧版本创建会话时自动写入的系统消息
+SYSTEM_MESSAGE = (
+    EmergencyMessage.role == "assistant",
+    EmergencyMessage.content.like("%您正在处理%情况。请描述具体情况，我将为您提供专业的应急指导。%")
+)
+
+# 最多显示的消息数
+PREVIEW_LIMIT = 20
 
 def main():
     print("🧹 开始清理应急指导中的旧系统自动消息...")
     
     db = next(get_db())
     
-    # 查找所有包含系统自动消息的记录
-    system_messages = db.query(EmergencyMessage).filter(
-        EmergencyMessage.role == "assistant",
-        EmergencyMessage.content.like("%您正在处理%情况。请描述具体情况，我将为您提供专业的应急指导。%")
-    ).all()
+    # 统计所有系统自动消息
+    system_count = db.query(EmergencyMessage).filter(*SYSTEM_MESSAGE).count()
     
-    print(f"\n📊 找到 {len(system_messages)} 条系统自动消息")
+    print(f"\n📊 找到 {system_count} 条系统自动消息")
     
-    if len(system_messages) == 0:
+    if system_count == 0:
         print("✅ 没有需要清理的系统消息")
         return
     
-    # 显示将要删除的消息
-    for msg in system_messages:
-        session = db.query(EmergencySession).filter(
-            EmergencySession.id == msg.session_id
-        ).first()
-        
-        print(f"\n会话: {session.title if session else 'Unknown'}")
+    # 显示将要删除的消息（只显示前几条，会话标题随消息一起查询）
+    preview = db.query(EmergencyMessage, EmergencySession.title).outerjoin(
+        EmergencySession, EmergencySession.id == EmergencyMessage.session_id
+    ).filter(*SYSTEM_MESSAGE).limit(PREVIEW_LIMIT)
+    for msg, title in preview:
+        print(f"\n会话: {title or 'Unknown'}")
         print(f"  消息ID: {msg.id}")
         print(f"  内容: {msg.content[:80]}...")
         print(f"  创建时间: {msg.created_at}")
+    if system_count > PREVIEW_LIMIT:
+        print(f"\n  ... 还有 {system_count - PREVIEW_LIMIT} 条")
+    db.commit()
     
     # 确认删除
-    confirm = input(f"\n❓ 确定要删除这 {len(system_messages)} 条系统消息吗？(y/N): ")
+    confirm = input(f"\n❓ 确定要删除这 {system_count} 条系统消息吗？(y/N): ")
     
     if confirm.lower() != 'y':
         print("❌ 取消删除操作")
         return
     
-    # 执行删除
-    deleted_count = 0
-    for msg in system_messages:
-        try:
-            db.delete(msg)
-            deleted_count += 1
-            print(f"✅ 删除消息: {msg.id}")
-        except Exception as e:
-            print(f"❌ 删除消息失败 {msg.id}: {e}")
-    
-    # 提交更改
+    # 分块删除（每块一个事务）
     try:
-        db.commit()
+        deleted_count = session_purger.delete_messages(EmergencyMessage, *SYSTEM_MESSAGE)
         print(f"\n🎉 成功删除 {deleted_count} 条系统消息")
     except Exception as e:
-        db.rollback()
-        print(f"❌ 提交更改失败: {e}")
+        print(f"❌ 删除失败: {e}")
     
     # 验证清理结果
-    remaining_system_messages = db.query(EmergencyMessage).filter(
-        EmergencyMessage.role == "assistant",
-        EmergencyMessage.content.like("%您正在处理%情况。请描述具体情况，我将为您提供专业的应急指导。%")
-    ).all()
+    remaining_count = db.query(EmergencyMessage).filter(*SYSTEM_MESSAGE).count()
     
-    if len(remaining_system_messages) == 0:
+    if remaining_count == 0:
         print("✅ 所有系统消息已清理完成")
     else:
-        print(f"⚠️  仍有 {len(remaining_system_messages)} 条系统消息未清理")
+        print(f"⚠️  仍有 {remaining_count} 条系统消息未清理")
 
 if __name__ == "__main__":
     main() 
\ No newline at end of file
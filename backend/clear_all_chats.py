@@ -6,10 +6,12 @@ import sys
 import os
 sys.path.append(os.path.dirname(os.path.abspath(__file__)))
 
+from sqlalchemy import func
 from app.core.database import SessionLocal
 from app.models.user import User
 from app.models.chat import ChatSession, ChatMessage
 from app.models.emergency import EmergencySession, EmergencyMessage
+from app.services.session_purge import session_purger
 
 def clear_all_chats():
     """清空数据库中所有用户的聊天记录"""
@@ -18,68 +20,43 @@ def clear_all_chats():
     db = SessionLocal()
     
     try:
-        # 统计当前记录数
-        all_chat_sessions = db.query(ChatSession).all()
-        all_emergency_sessions = db.query(EmergencySession).all()
-        all_chat_messages = db.query(ChatMessage).all()
-        all_emergency_messages = db.query(EmergencyMessage).all()
+        # 统计当前记录数（只计数，不加载记录）
+        chat_session_count = db.query(ChatSession).count()
+        chat_message_count = db.query(ChatMessage).count()
+        emergency_session_count = db.query(EmergencySession).count()
+        emergency_message_count = db.query(EmergencyMessage).count()
         
         print(f"📊 当前数据库统计:")
-        print(f"  - 聊天会话: {len(all_chat_sessions)} 个")
-        print(f"  - 聊天消息: {len(all_chat_messages)} 条")
-        print(f"  - 应急指导会话: {len(all_emergency_sessions)} 个")
-        print(f"  - 应急指导消息: {len(all_emergency_messages)} 条")
+        print(f"  - 聊天会话: {chat_session_count} 个")
+        print(f"  - 聊天消息: {chat_message_count} 条")
+        print(f"  - 应急指导会话: {emergency_session_count} 个")
+        print(f"  - 应急指导消息: {emergency_message_count} 条")
         
         # 按用户分组显示
         user_stats = {}
-        for session in all_chat_sessions:
-            user = db.query(User).filter(User.id == session.user_id).first()
-            username = user.username if user else "未知用户"
-            if username not in user_stats:
-                user_stats[username] = {"chat_sessions": 0, "emergency_sessions": 0}
-            user_stats[username]["chat_sessions"] += 1
-        
-        for session in all_emergency_sessions:
-            user = db.query(User).filter(User.id == session.user_id).first()
-            username = user.username if user else "未知用户"
-            if username not in user_stats:
-                user_stats[username] = {"chat_sessions": 0, "emergency_sessions": 0}
-            user_stats[username]["emergency_sessions"] += 1
+        for key, model in (("chat_sessions", ChatSession), ("emergency_sessions", EmergencySession)):
+            rows = db.query(User.username, func.count(model.id)).select_from(model).outerjoin(
+                User, User.id == model.user_id
+            ).group_by(User.username).all()
+            for username, count in rows:
+                stats = user_stats.setdefault(username or "未知用户", {"chat_sessions": 0, "emergency_sessions": 0})
+                stats[key] += count
         
         print(f"\n📋 按用户分组统计:")
         for username, stats in user_stats.items():
             print(f"  - {username}: 聊天会话 {stats['chat_sessions']} 个, 应急指导会话 {stats['emergency_sessions']} 个")
         
-        # 显示详细会话信息
-        if all_chat_sessions:
-            print(f"\n📋 聊天会话详情:")
-            for session in all_chat_sessions[:10]:  # 只显示前10个
-                user = db.query(User).filter(User.id == session.user_id).first()
-                username = user.username if user else "未知用户"
-                message_count = db.query(ChatMessage).filter(ChatMessage.session_id == session.id).count()
-                print(f"  - [{username}] {session.title} (ID: {session.id[:8]}...) - {message_count} 条消息")
-            if len(all_chat_sessions) > 10:
-                print(f"  ... 还有 {len(all_chat_sessions) - 10} 个会话")
-        
-        if all_emergency_sessions:
-            print(f"\n📋 应急指导会话详情:")
-            for session in all_emergency_sessions:
-                user = db.query(User).filter(User.id == session.user_id).first()
-                username = user.username if user else "未知用户"
-                message_count = db.query(EmergencyMessage).filter(EmergencyMessage.session_id == session.id).count()
-                print(f"  - [{username}] {session.title} ({session.scenario_type}) (ID: {session.id[:8]}...) - {message_count} 条消息")
-        
         # 确认删除
-        if not all_chat_sessions and not all_emergency_sessions:
+        if not chat_session_count and not emergency_session_count:
             print("✅ 数据库中没有聊天记录，无需清空")
             return
         
         print(f"\n⚠️  即将删除所有聊天记录，此操作不可撤销！")
         print(f"总计将删除:")
-        print(f"  - 聊天会话: {len(all_chat_sessions)} 个")
-        print(f"  - 聊天消息: {len(all_chat_messages)} 条")
-        print(f"  - 应急指导会话: {len(all_emergency_sessions)} 个")
-        print(f"  - 应急指导消息: {len(all_emergency_messages)} 条")
+        print(f"  - 聊天会话: {chat_session_count} 个")
+        print(f"  - 聊天消息: {chat_message_count} 条")
+        print(f"  - 应急指导会话: {emergency_session_count} 个")
+        print(f"  - 应急指导消息: {emergency_message_count} 条")
         
         confirm = input("\n请输入 'DELETE_ALL' 确认删除所有记录: ")
         
@@ -89,32 +66,16 @@ def clear_all_chats():
         
         print("\n🗑️  开始删除...")
         
-        # 删除所有聊天消息
-        deleted_chat_messages = 0
-        for message in all_chat_messages:
-            db.delete(message)
-            deleted_chat_messages += 1
-        
-        # 删除所有应急指导消息
-        deleted_emergency_messages = 0
-        for message in all_emergency_messages:
-            db.delete(message)
-            deleted_emergency_messages += 1
-        
-        # 删除所有聊天会话
-        deleted_chat_sessions = 0
-        for session in all_chat_sessions:
-            db.delete(session)
-            deleted_chat_sessions += 1
-        
-        # 删除所有应急指导会话
-        deleted_emergency_sessions = 0
-        for session in all_emergency_sessions:
-            db.delete(session)
-            deleted_emergency_sessions += 1
-        
-        # 提交更改
+        # 按会话ID分块删除（每块一个事务），不把消息加载到内存
+        chat_session_ids = [row.id for row in db.query(ChatSession.id)]
+        emergency_session_ids = [row.id for row in db.query(EmergencySession.id)]
         db.commit()
+        deleted_chat_sessions, deleted_chat_messages = session_purger.delete_sessions(
+            ChatSession, ChatMessage, chat_session_ids
+        )
+        deleted_emergency_sessions, deleted_emergency_messages = session_purger.delete_sessions(
+            EmergencySession, EmergencyMessage, emergency_session_ids
+        )
         
         print(f"\n🎉 清空完成！")
         print(f"✅ 删除统计:")
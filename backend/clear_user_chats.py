@@ -10,6 +10,7 @@ from app.core.database import SessionLocal
 from app.models.user import User
 from app.models.chat import ChatSession, ChatMessage
 from app.models.emergency import EmergencySession, EmergencyMessage
+from app.services.session_purge import session_purger
 
 def clear_user_chats(username: str):
     """清空指定用户的聊天记录"""
@@ -59,28 +60,13 @@ def clear_user_chats(username: str):
             print("❌ 操作已取消")
             return
         
-        # 删除聊天记录
-        deleted_chat_messages = 0
-        deleted_emergency_messages = 0
-        
-        # 删除聊天消息和会话
-        for session in chat_sessions:
-            messages = db.query(ChatMessage).filter(ChatMessage.session_id == session.id).all()
-            for message in messages:
-                db.delete(message)
-                deleted_chat_messages += 1
-            db.delete(session)
-        
-        # 删除应急指导消息和会话
-        for session in emergency_sessions:
-            messages = db.query(EmergencyMessage).filter(EmergencyMessage.session_id == session.id).all()
-            for message in messages:
-                db.delete(message)
-                deleted_emergency_messages += 1
-            db.delete(session)
-        
-        # 提交更改
-        db.commit()
+        # 按会话ID分块删除消息和会话（每块一个事务）
+        _, deleted_chat_messages = session_purger.delete_sessions(
+            ChatSession, ChatMessage, [session.id for session in chat_sessions], db=db
+        )
+        _, deleted_emergency_messages = session_purger.delete_sessions(
+            EmergencySession, EmergencyMessage, [session.id for session in emergency_sessions], db=db
+        )
         
         print(f"\n🎉 清空完成！")
         print(f"✅ 删除统计:")
@@ -1,7 +1,16 @@
 #!/usr/bin/env python3
 """
 知识内容导入脚本
+
+默认导入 classified_grouped_aggregated.txt；也可以指定 NDJSON（.ndjson/.jsonl）或 CSV 文件。
+按批写入并以内容哈希（分类、标题、正文）去重，重复执行不会产生重复条目；
+修改过内容的条目会作为新条目写入。通过其他方式写入的条目需要先执行
+backfill_content_hashes.py 才参与去重。
+
+用法:
+    python import_knowledge_content.py [文件路径] [--format text|ndjson|csv] [--batch-size 500]
 """
+import argparse
 import os
 import sys
 from pathlib import Path
@@ -10,108 +19,57 @@ from pathlib import Path
 project_root = Path(__file__).parent
 sys.path.insert(0, str(project_root))
 
-from sqlalchemy.orm import Session
-from app.core.database import SessionLocal
-from app.models.knowledge import KnowledgeCategory, KnowledgeItem
+from app.core.database import create_tables, upgrade_schema
+from app.services.knowledge_fts import knowledge_fts
+from app.services.knowledge_importer import (
+    KnowledgeImporter, ImportStats, IMPORT_FORMATS, backfill_content_hashes, detect_format
+)
 
-def import_knowledge_content():
+def import_knowledge_content(path: Path, format: str = None, batch_size: int = 500) -> bool:
     """导入知识内容"""
-    db = SessionLocal()
+    if not path.exists():
+        print(f"❌ 找不到文件: {path}")
+        return False
+
+    # 补齐 content_hash 字段和全文检索表
+    create_tables()
+    if ("knowledge_items", "content_hash") in upgrade_schema():
+        print(f"🔑 已为 {backfill_content_hashes()} 条已有知识条目补上去重哈希")
+    knowledge_fts.ensure_schema()
+
+    format = format or detect_format(path.name)
+    total_bytes = os.path.getsize(path)
+    print(f"📄 文件: {path}（{format}，{total_bytes / 1024 / 1024:.1f} MB）")
+
+    def progress(stats: ImportStats):
+        print(f"   已读取 {stats.read} 条，新增 {stats.inserted} 条，"
+              f"{stats.read / stats.elapsed if stats.elapsed else 0:.0f} 条/秒")
+
     try:
-        # 读取文本文件
-        text_file = project_root / "classified_grouped_aggregated.txt"
-        if not text_file.exists():
-            print(f"❌ 找不到文件: {text_file}")
-            return
-        
-        with open(text_file, 'r', encoding='utf-8') as f:
-            content = f.read()
-        
-        # 解析内容
-        sections = content.split('## 分类: ')
-        
-        # 获取分类映射
-        categories = db.query(KnowledgeCategory).all()
-        category_map = {cat.name: cat.id for cat in categories}
-        
-        total_items = 0
-        
-        for section in sections[1:]:  # 跳过第一个空部分
-            lines = section.strip().split('\n')
-            if not lines:
-                continue
-                
-            category_name = lines[0].split('（')[0].strip()
-            category_id = category_map.get(category_name)
-            
-            if not category_id:
-                print(f"⚠️  未找到分类: {category_name}")
-                continue
-            
-            print(f"📝 处理分类: {category_name}")
-            
-            # 解析知识条目
-            current_item = None
-            for line in lines[1:]:
-                line = line.strip()
-                if not line:
-                    continue
-                
-                # 检查是否是新的条目 [数字]
-                if line.startswith('[') and ']' in line:
-                    # 保存前一个条目
-                    if current_item:
-                        # 检查是否已存在
-                        existing = db.query(KnowledgeItem).filter(
-                            KnowledgeItem.title == current_item['title'],
-                            KnowledgeItem.category_id == category_id
-                        ).first()
-                        
-                        if not existing:
-                            item = KnowledgeItem(**current_item)
-                            db.add(item)
-                            total_items += 1
-                    
-                    # 开始新条目
-                    item_num = line[1:line.find(']')]
-                    content_text = line[line.find(']')+1:].strip()
-                    
-                    current_item = {
-                        'category_id': category_id,
-                        'title': f"{category_name} - 条目{item_num}",
-                        'content': content_text,
-                        'content_type': 'document',
-                        'author': '急救医学专家团队',
-                        'view_count': 0,
-                        'status': 'active'
-                    }
-                else:
-                    # 继续当前条目的内容
-                    if current_item:
-                        current_item['content'] += '\n' + line
-            
-            # 保存最后一个条目
-            if current_item:
-                existing = db.query(KnowledgeItem).filter(
-                    KnowledgeItem.title == current_item['title'],
-                    KnowledgeItem.category_id == category_id
-                ).first()
-                
-                if not existing:
-                    item = KnowledgeItem(**current_item)
-                    db.add(item)
-                    total_items += 1
-        
-        db.commit()
-        print(f"✅ 知识内容导入成功，共导入 {total_items} 条内容")
-        
+        with open(path, "rb") as f:
+            stats = KnowledgeImporter(batch_size).import_stream(f, format, progress)
     except Exception as e:
         print(f"❌ 导入知识内容失败: {e}")
-        db.rollback()
-    finally:
-        db.close()
+        return False
+
+    result = stats.as_dict()
+    for name in result["unknown_categories"]:
+        print(f"⚠️  未找到分类: {name}")
+    print(f"✅ 知识内容导入成功：读取 {result['read']} 条，新增 {result['inserted']} 条，"
+          f"重复 {result['duplicates']} 条，无效 {result['invalid']} 条")
+    print(f"⏱️  用时 {result['elapsed_seconds']}s，{result['items_per_second']} 条/秒，"
+          f"{total_bytes / 1024 / 1024 / max(stats.elapsed, 1e-6):.1f} MB/秒")
+    return True
 
 if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="导入知识内容")
+    parser.add_argument("path", nargs="?", default=str(project_root / "classified_grouped_aggregated.txt"))
+    parser.add_argument("--format", choices=IMPORT_FORMATS, default=None, help="默认按扩展名判断")
+    parser.add_argument("--batch-size", type=int, default=500)
+    args = parser.parse_args()
+
     print("🚀 开始导入知识内容...")
-    import_knowledge_content()
-    print("🎉 知识内容导入完成！") 
\ No newline at end of file
+    if import_knowledge_content(Path(args.path), args.format, args.batch_size):
+        print("🎉 知识内容导入完成！")
+    else:
+        sys.exit(1)
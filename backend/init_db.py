@@ -12,12 +12,15 @@ from app.core.security import get_password_hash, generate_user_id
 from app.models.user import User
 from app.models.knowledge import KnowledgeCategory, KnowledgeItem
 from app.models.message import ContactMessage
+from app.services.knowledge_fts import knowledge_fts
 from datetime import datetime
 
 def init_database():
     """初始化数据库"""
     print("正在创建数据库表...")
     create_tables()
+    # 注册全文检索表的同步事件，写入的条目同时写入检索表
+    knowledge_fts.ensure_schema()
     print("数据库表创建完成")
     
     # 创建数据库会话
@@ -11,6 +11,7 @@ from sqlalchemy.orm import Session
 from app.core.database import SessionLocal, engine
 from app.models.knowledge import KnowledgeCategory, KnowledgeItem, VideoLink, BookLink
 from app.models import knowledge
+from app.services.knowledge_fts import knowledge_fts
 
 # 确保数据库表存在
 knowledge.Base.metadata.create_all(bind=engine)
@@ -217,6 +218,9 @@ def main():
     categories_data = parse_knowledge_file(file_path)
     print(f"解析完成，共找到 {len(categories_data)} 个分类")
     
+    # 注册全文检索表的同步事件，写入的条目同时写入检索表
+    knowledge_fts.ensure_schema()
+    
     # 创建数据库会话
     db = SessionLocal()
     
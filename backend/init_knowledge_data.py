@@ -14,6 +14,7 @@ from sqlalchemy.orm import Session
 from app.core.database import SessionLocal, engine
 from app.models.knowledge import KnowledgeCategory, KnowledgeItem, VideoLink, BookLink
 from app.models.user import User
+from app.services.knowledge_fts import knowledge_fts
 from app.core.security import get_password_hash
 
 def init_database():
@@ -323,6 +324,8 @@ def main():
     
     # 初始化数据库
     init_database()
+    # 注册全文检索表的同步事件，写入的条目同时写入检索表
+    knowledge_fts.ensure_schema()
     print("✅ 数据库表创建完成")
     
     # 创建管理员用户
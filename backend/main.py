@@ -2,7 +2,9 @@ from fastapi import FastAPI, HTTPException
 from fastapi.middleware.cors import CORSMiddleware
 from fastapi.responses import JSONResponse
 from fastapi.staticfiles import StaticFiles
+from contextlib import asynccontextmanager
 import uvicorn
+import asyncio
 from datetime import datetime
 import os
 from dotenv import load_dotenv
@@ -10,13 +12,78 @@ from dotenv import load_dotenv
 # 加载环境变量
 load_dotenv()
 
+from app.core.database import create_tables, upgrade_schema, async_engine
+from app.services.llm_client_pool import llm_client_pool
+from app.services.ai_service import ai_service
+from app.services.knowledge_index import knowledge_index
+from app.services.knowledge_fts import knowledge_fts
+from app.services.knowledge_vectors import knowledge_vectors
+from app.services.knowledge_sync import knowledge_sync
+from app.services.item_counters import item_counters
+from app.services.message_writer import message_writer
+from app.services.knowledge_snippets import backfill_snippets
+from app.services.knowledge_importer import backfill_content_hashes
+
+def prepare_knowledge_data():
+    """补齐知识条目摘要、重建刚创建的全文检索表，数据量大时较慢，在后台线程中执行"""
+    try:
+        # 为没有摘要的知识条目补上摘要（列表接口 fields=summary 使用）
+        filled = backfill_snippets()
+        if filled:
+            print(f"Filled snippets for {filled} knowledge items")
+        # 重建完成前全文检索回退到SQL
+        if knowledge_fts.needs_rebuild:
+            count = knowledge_fts.rebuild()
+            print(f"Knowledge full-text search table created ({count} items indexed)")
+    except Exception as e:
+        print(f"Failed to prepare knowledge data: {e}")
+
+@asynccontextmanager
+async def lifespan(app: FastAPI):
+    """应用生命周期：启动初始化与关闭清理"""
+    loop = asyncio.get_running_loop()
+    # 创建缺失的表并补齐新增字段（接收请求前完成；同步数据库操作放到线程池，不阻塞事件循环）
+    await loop.run_in_executor(None, create_tables)
+    added_columns = await loop.run_in_executor(None, upgrade_schema)
+    # 去重键字段刚加上时为已有知识条目补一次哈希（读取全表，之后导入只依赖 ON CONFLICT 去重）
+    if ("knowledge_items", "content_hash") in added_columns:
+        filled = await loop.run_in_executor(None, backfill_content_hashes)
+        print(f"Filled content hashes for {filled} knowledge items")
+    # 注册全文检索表的同步事件并创建检索表（只执行DDL，重建在后台进行），之后的知识条目写入都会同步
+    await loop.run_in_executor(None, knowledge_fts.ensure_schema, False)
+    # 摘要补齐和全文检索表重建在后台执行，不推迟启动
+    loop.run_in_executor(None, prepare_knowledge_data)
+    # 预加载LLM配置缓存
+    await ai_service.refresh_config_cache()
+    # 跟踪知识条目变更并增量更新检索索引（先于索引构建启动，构建期间的变更不会遗漏）
+    await knowledge_sync.start()
+    # 查看/下载次数在内存中累加，后台定期批量写入
+    item_counters.start()
+    # 消息在后台按批写入（重放上次关闭时未写入的记录）
+    message_writer.start()
+    # 后台构建知识库检索索引（构建完成前检索回退到SQL）
+    knowledge_index.schedule_rebuild()
+    # 磁盘上没有向量索引时在后台构建（已有时各worker直接映射共享）
+    knowledge_vectors.ensure_built()
+    yield
+    await knowledge_sync.stop()
+    # 写入剩余的查看/下载次数
+    await item_counters.stop()
+    # 写入队列中剩余的消息
+    await message_writer.stop()
+    # 关闭LLM长连接
+    await llm_client_pool.aclose()
+    # 关闭异步数据库连接池
+    await async_engine.dispose()
+
 # 创建FastAPI应用
 app = FastAPI(
     title="院前急救助手系统 API",
     description="Pre-hospital Emergency Assistant System API",
     version="1.0.0",
     docs_url="/docs",
-    redoc_url="/redoc"
+    redoc_url="/redoc",
+    lifespan=lifespan
 )
 
 # CORS配置
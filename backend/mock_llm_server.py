@@ -0,0 +1,215 @@
+#!/usr/bin/env python3
+"""
+本地OpenAI兼容的模拟LLM服务（用于离线压测和延迟测试）
+
+实现 /v1/chat/completions（流式与非流式）和 /v1/models，
+流式输出支持 reasoning_content（思考过程）增量。
+首token延迟、输出速度、错误率和卡顿均可配置。
+
+用法：
+    python mock_llm_server.py --port 9000 --ttft 0.5 --tokens-per-sec 40
+
+然后将 LLM 配置的 base_url 指向 http://127.0.0.1:9000/v1（api_key 任意）。
+单个请求也可以通过请求头覆盖参数，例如 X-Mock-TTFT: 2.0。
+"""
+import argparse
+import asyncio
+import json
+import random
+import time
+import uuid
+from typing import Dict, Any, List, Optional
+
+import uvicorn
+from fastapi import FastAPI, Request
+from fastapi.responses import JSONResponse, StreamingResponse
+
+# 默认回复内容（按需重复到 max_tokens）
+DEFAULT_ANSWER = (
+    "心肺复苏（CPR）基本步骤：\n"
+    "1. **确认现场安全**，判断患者意识和呼吸。\n"
+    "2. **立即呼救**，拨打120并设法取得AED。\n"
+    "3. **胸外按压**：两乳头连线中点，深度5-6厘米，频率100-120次/分。\n"
+    "4. **开放气道并人工呼吸**：按压与通气比例30:2。\n"
+    "5. **尽早使用AED**，按语音提示操作，持续CPR直至专业人员到达。\n"
+)
+DEFAULT_REASONING = "先判断患者是否有反应和正常呼吸，再决定是否立即开始胸外按压，同时安排他人取AED。"
+
+class MockSettings:
+    """模拟服务参数"""
+
+    def __init__(self, args: argparse.Namespace):
+        self.ttft = args.ttft
+        self.ttft_jitter = args.ttft_jitter
+        self.tokens_per_sec = args.tokens_per_sec
+        self.chars_per_token = args.chars_per_token
+        self.error_rate = args.error_rate
+        self.midstream_error_rate = args.midstream_error_rate
+        self.stall_rate = args.stall_rate
+        self.stall_seconds = args.stall_seconds
+        self.reasoning = args.reasoning
+
+    def for_request(self, request: Request) -> Dict[str, float]:
+        """合并请求头中的覆盖参数"""
+        def override(name: str, default: float) -> float:
+            value = request.headers.get(f"x-mock-{name}")
+            return float(value) if value is not None else default
+
+        return {
+            "ttft": override("ttft", self.ttft),
+            "ttft_jitter": override("ttft-jitter", self.ttft_jitter),
+            "tokens_per_sec": override("tokens-per-sec", self.tokens_per_sec),
+            "error_rate": override("error-rate", self.error_rate),
+            "midstream_error_rate": override("midstream-error-rate", self.midstream_error_rate),
+            "stall_rate": override("stall-rate", self.stall_rate),
+            "stall_seconds": override("stall-seconds", self.stall_seconds)
+        }
+
+class MockStats:
+    """请求统计"""
+
+    def __init__(self):
+        self.requests = 0
+        self.active = 0
+        self.errors = 0
+        self.stalls = 0
+        self.completed = 0
+        self.cancelled = 0
+        self.tokens = 0
+
+def split_tokens(text: str, chars_per_token: int) -> List[str]:
+    """把文本切成模拟的token片段"""
+    return [text[i:i + chars_per_token] for i in range(0, len(text), chars_per_token)]
+
+def build_answer(messages: List[Dict[str, Any]], max_tokens: int, chars_per_token: int) -> str:
+    """根据最后一条用户消息生成确定的回复内容"""
+    question = ""
+    for msg in reversed(messages):
+        if msg.get("role") == "user":
+            question = str(msg.get("content", ""))[:40]
+            break
+    answer = f"关于「{question}」：\n{DEFAULT_ANSWER}" if question else DEFAULT_ANSWER
+    max_chars = max_tokens * chars_per_token
+    while len(answer) < min(max_chars, len(DEFAULT_ANSWER) * 2):
+        answer += DEFAULT_ANSWER
+    return answer[:max_chars]
+
+def create_app(mock: MockSettings) -> FastAPI:
+    app = FastAPI(title="Mock OpenAI-compatible LLM")
+    stats = MockStats()
+
+    def chunk_payload(completion_id: str, model: str, delta: Dict[str, Any], finish_reason: Optional[str] = None) -> str:
+        payload = {
+            "id": completion_id,
+            "object": "chat.completion.chunk",
+            "created": int(time.time()),
+            "model": model,
+            "choices": [{"index": 0, "delta": delta, "finish_reason": finish_reason}]
+        }
+        return f"data: {json.dumps(payload, ensure_ascii=False)}\n\n"
+
+    @app.get("/v1/models")
+    async def list_models():
+        return {"object": "list", "data": [{"id": "mock-model", "object": "model", "owned_by": "mock"}]}
+
+    @app.get("/stats")
+    async def get_stats():
+        return stats.__dict__
+
+    @app.post("/v1/chat/completions")
+    async def chat_completions(request: Request):
+        body = await request.json()
+        params = mock.for_request(request)
+        stats.requests += 1
+
+        if random.random() < params["error_rate"]:
+            stats.errors += 1
+            return JSONResponse(
+                status_code=500,
+                content={"error": {"message": "mock upstream error", "type": "server_error"}}
+            )
+
+        model = body.get("model", "mock-model")
+        messages = body.get("messages", [])
+        max_tokens = int(body.get("max_tokens") or 512)
+        enable_thinking = bool(body.get("enable_thinking")) or mock.reasoning
+        answer = build_answer(messages, max_tokens, mock.chars_per_token)
+        completion_id = f"chatcmpl-{uuid.uuid4().hex[:24]}"
+        ttft = max(0.0, params["ttft"] + random.uniform(-params["ttft_jitter"], params["ttft_jitter"]))
+        interval = 1.0 / params["tokens_per_sec"] if params["tokens_per_sec"] > 0 else 0.0
+
+        if not body.get("stream"):
+            await asyncio.sleep(ttft + interval * len(split_tokens(answer, mock.chars_per_token)))
+            stats.completed += 1
+            return {
+                "id": completion_id,
+                "object": "chat.completion",
+                "created": int(time.time()),
+                "model": model,
+                "choices": [{
+                    "index": 0,
+                    "message": {"role": "assistant", "content": answer},
+                    "finish_reason": "stop"
+                }],
+                "usage": {"prompt_tokens": 0, "completion_tokens": max_tokens, "total_tokens": max_tokens}
+            }
+
+        async def generate():
+            stats.active += 1
+            try:
+                await asyncio.sleep(ttft)
+                yield chunk_payload(completion_id, model, {"role": "assistant", "content": ""})
+
+                pieces = []
+                if enable_thinking:
+                    pieces += [("reasoning_content", t) for t in split_tokens(DEFAULT_REASONING, mock.chars_per_token)]
+                pieces += [("content", t) for t in split_tokens(answer, mock.chars_per_token)]
+
+                stall_at = random.randrange(len(pieces)) if random.random() < params["stall_rate"] else -1
+                error_at = random.randrange(len(pieces)) if random.random() < params["midstream_error_rate"] else -1
+
+                for index, (field, token) in enumerate(pieces):
+                    if index == stall_at:
+                        stats.stalls += 1
+                        await asyncio.sleep(params["stall_seconds"])
+                    if index == error_at:
+                        stats.errors += 1
+                        # 直接中断连接，模拟上游异常断流
+                        raise RuntimeError("mock mid-stream failure")
+                    if interval:
+                        await asyncio.sleep(interval)
+                    stats.tokens += 1
+                    yield chunk_payload(completion_id, model, {field: token})
+
+                yield chunk_payload(completion_id, model, {}, finish_reason="stop")
+                yield "data: [DONE]\n\n"
+                stats.completed += 1
+            except asyncio.CancelledError:
+                stats.cancelled += 1
+                raise
+            finally:
+                stats.active -= 1
+
+        return StreamingResponse(generate(), media_type="text/event-stream")
+
+    return app
+
+def parse_args() -> argparse.Namespace:
+    parser = argparse.ArgumentParser(description="本地OpenAI兼容模拟LLM服务")
+    parser.add_argument("--host", default="127.0.0.1")
+    parser.add_argument("--port", type=int, default=9000)
+    parser.add_argument("--ttft", type=float, default=0.3, help="首token延迟（秒）")
+    parser.add_argument("--ttft-jitter", type=float, default=0.1, help="首token延迟随机抖动（秒）")
+    parser.add_argument("--tokens-per-sec", type=float, default=50.0, help="输出速度（token/秒，0为不限速）")
+    parser.add_argument("--chars-per-token", type=int, default=2, help="每个token的字符数")
+    parser.add_argument("--error-rate", type=float, default=0.0, help="直接返回500的概率")
+    parser.add_argument("--midstream-error-rate", type=float, default=0.0, help="输出中途断流的概率")
+    parser.add_argument("--stall-rate", type=float, default=0.0, help="输出中途卡顿的概率")
+    parser.add_argument("--stall-seconds", type=float, default=5.0, help="卡顿时长（秒）")
+    parser.add_argument("--reasoning", action="store_true", help="始终输出reasoning_content思考过程")
+    return parser.parse_args()
+
+if __name__ == "__main__":
+    args = parse_args()
+    print(f"🚀 模拟LLM服务启动: http://{args.host}:{args.port}/v1")
+    uvicorn.run(create_app(MockSettings(args)), host=args.host, port=args.port, log_level="warning")
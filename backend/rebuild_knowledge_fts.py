@@ -0,0 +1,30 @@
+#!/usr/bin/env python3
+"""
+重建知识库全文检索表（SQLite FTS5 / PostgreSQL tsvector）
+
+通过脚本或SQL批量导入知识内容后执行一次，使检索表与 knowledge_items 一致。
+"""
+import sys
+import os
+import time
+sys.path.append(os.path.dirname(os.path.abspath(__file__)))
+
+from app.core.database import engine
+from app.services.knowledge_fts import knowledge_fts
+
+def rebuild_knowledge_fts():
+    """重建知识库全文检索表"""
+    print(f"🔧 开始重建知识库全文检索表（数据库: {engine.dialect.name}）...")
+    
+    if not knowledge_fts.ensure_schema(rebuild_if_created=False):
+        print("❌ 当前数据库不支持全文检索表")
+        return False
+    
+    started = time.time()
+    count = knowledge_fts.rebuild()
+    print(f"✅ 重建完成：{count} 条知识内容，耗时 {time.time() - started:.1f} 秒")
+    return True
+
+if __name__ == "__main__":
+    success = rebuild_knowledge_fts()
+    sys.exit(0 if success else 1)
@@ -0,0 +1,41 @@
+import os
+import tempfile
+
+# 在导入应用模块前指定测试用的临时数据库和日志文件，不影响开发数据库
+_data_dir = tempfile.mkdtemp(prefix="pha-tests-")
+os.environ["DATABASE_URL"] = f"sqlite:///{os.path.join(_data_dir, 'test.db')}"
+os.environ["DEBUG"] = "false"
+os.environ["WRITE_BEHIND_JOURNAL"] = os.path.join(_data_dir, "write_behind_journal.jsonl")
+os.environ["VECTOR_INDEX_DIR"] = os.path.join(_data_dir, "vector_index")
+
+import pytest
+from app.core.database import SessionLocal, create_tables
+from app.models.knowledge import KnowledgeCategory, KnowledgeItem
+
+@pytest.fixture
+def add_items():
+    """通过 ORM 写入知识条目：add_items(*(标题, 正文)) 返回条目ID列表，用例结束后删除本用例写入的条目和分类"""
+    create_tables()
+    db = SessionLocal()
+    category = KnowledgeCategory(name="测试分类")
+    db.add(category)
+    db.commit()
+    created = []
+
+    def add(*rows, **fields):
+        items = [
+            KnowledgeItem(category_id=category.id, title=title, content=content, content_type="document", **fields)
+            for title, content in rows
+        ]
+        db.add_all(items)
+        db.commit()
+        created.extend(item.id for item in items)
+        return [item.id for item in items]
+
+    add.category_id = category.id
+    yield add
+    for item in db.query(KnowledgeItem).filter(KnowledgeItem.id.in_(created)):
+        db.delete(item)
+    db.delete(category)
+    db.commit()
+    db.close()
@@ -0,0 +1,45 @@
+import asyncio
+import threading
+from app.models.llm_config import LLMConfig
+from app.services.ai_service import AIService
+
+def config(model_name):
+    return LLMConfig(
+        module_name="chat_kb", display_name="知识库问答", api_key="key",
+        base_url="http://llm.local/v1", model_name=model_name, is_enabled=True
+    )
+
+async def test_refresh_does_not_overwrite_update_made_during_the_read():
+    service = AIService()
+    snapshots = [{"chat_kb": AIService._config_to_dict(config("old-model"))},
+                 {"chat_kb": AIService._config_to_dict(config("new-model"))}]
+    reading, release = threading.Event(), threading.Event()
+    loads = []
+
+    def load_configs():
+        loads.append(True)
+        if len(loads) == 1:
+            # 第一次读取的是修改提交前的数据，读取完成前管理端更新了配置
+            reading.set()
+            release.wait(1)
+        return snapshots[len(loads) - 1]
+
+    service._load_configs = load_configs
+    refresh = asyncio.ensure_future(service.refresh_config_cache())
+    await asyncio.get_running_loop().run_in_executor(None, reading.wait, 1)
+    service.update_module_config(config("new-model"))
+    release.set()
+    await refresh
+
+    assert len(loads) == 2
+    assert service._get_module_config("chat_kb")["model_name"] == "new-model"
+
+async def test_refresh_replaces_cache_when_nothing_changed():
+    service = AIService()
+    service._load_configs = lambda: {"chat_kb": AIService._config_to_dict(config("model"))}
+
+    await service.refresh_config_cache()
+
+    assert service._get_module_config("chat_kb")["model_name"] == "model"
+    service.invalidate_module_config("chat_kb")
+    assert service._get_module_config("chat_kb")["model_name"] == service.default_model
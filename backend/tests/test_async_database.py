@@ -0,0 +1,53 @@
+import uuid
+import pytest
+from fastapi import HTTPException
+from fastapi.security import HTTPAuthorizationCredentials
+from app.core.database import AsyncSessionLocal, SessionLocal, async_database_url, create_tables
+from app.core.deps import get_current_user_async
+from app.core.security import create_access_token
+from app.models.user import User
+
+@pytest.mark.parametrize("url, expected", [
+    ("sqlite:///./app.db", "sqlite+aiosqlite:///./app.db"),
+    ("postgresql://u:p@db/pha", "postgresql+asyncpg://u:p@db/pha"),
+    ("postgresql+psycopg2://u:p@db/pha", "postgresql+asyncpg://u:p@db/pha"),
+    ("postgres://u:p@db/pha", "postgresql+asyncpg://u:p@db/pha"),
+    ("mysql+aiomysql://u:p@db/pha", "mysql+aiomysql://u:p@db/pha"),
+])
+def test_async_database_url(url, expected):
+    assert async_database_url(url) == expected
+
+@pytest.fixture
+def user():
+    create_tables()
+    name = uuid.uuid4().hex[:12]
+    with SessionLocal() as db:
+        user = User(id=uuid.uuid4().hex, username=name, email=f"{name}@example.com", hashed_password="x")
+        db.add(user)
+        db.commit()
+        user_id = user.id
+    yield user_id
+    with SessionLocal() as db:
+        db.query(User).filter(User.id == user_id).delete()
+        db.commit()
+
+def credentials(user_id):
+    return HTTPAuthorizationCredentials(scheme="Bearer", credentials=create_access_token({"sub": user_id}))
+
+async def test_current_user_dependency_releases_the_connection(user):
+    async with AsyncSessionLocal() as db:
+        current = await get_current_user_async(credentials(user), db)
+
+        # 读事务已结束（流式输出期间不占用连接），提交后属性仍可直接访问，不触发隐式查询
+        assert not db.in_transaction()
+        assert current.id == user and current.status == "active"
+
+async def test_inactive_user_is_rejected(user):
+    with SessionLocal() as db:
+        db.get(User, user).status = "inactive"
+        db.commit()
+
+    async with AsyncSessionLocal() as db:
+        with pytest.raises(HTTPException) as exc_info:
+            await get_current_user_async(credentials(user), db)
+    assert exc_info.value.status_code == 401
@@ -0,0 +1,70 @@
+import json
+import pytest
+from sqlalchemy import event
+from app.core.database import SessionLocal, create_tables, engine
+from app.models.knowledge import KnowledgeCategory
+from app.services.category_cache import CategoryTreeCache, category_tree_cache
+
+@pytest.fixture
+def db():
+    create_tables()
+    db = SessionLocal()
+    created = []
+    db.created = created
+    yield db
+    db.rollback()
+    for category in reversed(created):
+        db.delete(db.get(KnowledgeCategory, category))
+    db.commit()
+    db.close()
+
+def add_category(db, name, parent=None, **fields):
+    category = KnowledgeCategory(name=name, parent_id=parent.id if parent else None, **fields)
+    db.add(category)
+    db.commit()
+    db.created.append(category.id)
+    return category
+
+def find(nodes, name):
+    return next(node for node in nodes if node["name"] == name)
+
+def test_tree_is_built_from_one_query(db):
+    root = add_category(db, "缓存-根", sort_order=-2)
+    add_category(db, "缓存-子2", root, sort_order=2)
+    child = add_category(db, "缓存-子1", root, sort_order=1)
+    add_category(db, "缓存-孙", child)
+    add_category(db, "缓存-停用", root, status="inactive")
+    statements = []
+    listener = lambda *args: statements.append(args[2])
+
+    event.listen(engine, "before_cursor_execute", listener)
+    try:
+        body, version = CategoryTreeCache().get(db)
+    finally:
+        event.remove(engine, "before_cursor_execute", listener)
+
+    assert len(statements) == 1
+    node = find(json.loads(body)["data"], "缓存-根")
+    assert [child["name"] for child in node["children"]] == ["缓存-子1", "缓存-子2"]
+    assert node["children"][0]["children"][0]["name"] == "缓存-孙"
+    assert node["children"][1]["children"] is None
+    assert len(version) == 16
+
+def test_cached_until_a_category_change_is_committed(db):
+    cache = CategoryTreeCache()
+    body, version = cache.get(db)
+    assert cache.get(db) == (body, version)
+    assert (cache.hits, cache.misses) == (1, 1)
+
+    # 回滚的变更不使缓存失效
+    category_tree_cache.get(db)
+    db.add(KnowledgeCategory(name="缓存-回滚"))
+    db.flush()
+    db.rollback()
+    assert category_tree_cache._body is not None
+
+    add_category(db, "缓存-新增")
+    assert category_tree_cache._body is None
+    body, new_version = category_tree_cache.get(db)
+    assert new_version != version
+    assert find(json.loads(body)["data"], "缓存-新增")
@@ -0,0 +1,71 @@
+from datetime import datetime, timedelta, timezone
+import uuid
+import pytest
+from app.core.config import settings
+from app.core.database import SessionLocal, create_tables
+from app.models.chat import ChatSession, ChatMessage
+from app.services.context_builder import ChatContextBuilder, estimate_tokens
+
+@pytest.fixture
+def db():
+    create_tables()
+    db = SessionLocal()
+    yield db
+    db.rollback()
+    db.close()
+
+def add_session(db, turns, content="内容"):
+    """写入 turns 轮问答（每条消息 content * 40），返回会话"""
+    session = ChatSession(id=uuid.uuid4().hex, user_id="u1", title="测试", mode="kb")
+    db.add(session)
+    start = datetime(2025, 1, 1, tzinfo=timezone.utc)
+    for i in range(turns * 2):
+        db.add(ChatMessage(
+            id=f"{session.id}-{i:04d}", session_id=session.id, role="user" if i % 2 == 0 else "assistant",
+            content=f"{i}:{content * 40}", created_at=start + timedelta(seconds=i)
+        ))
+    db.commit()
+    return session
+
+def test_older_messages_fold_into_excerpt_window(db, monkeypatch):
+    monkeypatch.setattr(settings, "context_token_budgets", {"kb": 200})
+    session = add_session(db, 5)
+
+    messages, total = ChatContextBuilder().build(db, session)
+
+    assert total == 10
+    assert messages[0]["role"] == "system" and "摘录" in messages[0]["content"]
+    assert messages[1]["role"] == "user"
+    # 摘录每条只保留开头部分
+    assert all(len(line) <= 4 + 80 + 1 for line in session.summary.split("\n") if line.startswith("用户："))
+    folded = session.summary_message_count
+    assert folded + len(messages) - 1 == total
+    assert session.summary_last_message_id == f"{session.id}-{folded - 1:04d}"
+
+def test_excerpt_window_is_capped_by_its_own_budget(db, monkeypatch):
+    monkeypatch.setattr(settings, "context_token_budgets", {"kb": 200})
+    monkeypatch.setattr(settings, "context_summary_token_budget", 800)
+    builder = ChatContextBuilder()
+    # 摘录预算不超过模式预算的一半
+    assert builder.get_excerpt_budget("kb") == 100
+    session = add_session(db, 30)
+
+    messages, _ = builder.build(db, session)
+
+    assert estimate_tokens(session.summary) <= 100
+    assert session.summary_message_count > 0
+    # 只保留最近被折叠的消息
+    assert f"{session.summary_message_count - 1}:" in session.summary.split("\n")[-1]
+    assert not session.summary.startswith("用户：0:")
+
+def test_stored_excerpts_over_budget_are_trimmed_before_sending(db, monkeypatch):
+    monkeypatch.setattr(settings, "context_token_budgets", {"kb": 2000})
+    session = add_session(db, 1)
+    session.summary = "\n".join(f"用户：{'旧' * 50}" for _ in range(20))
+    monkeypatch.setattr(settings, "context_summary_token_budget", 120)
+
+    messages, _ = ChatContextBuilder().build(db, session)
+
+    excerpts = messages[0]["content"].split("\n", 1)[1]
+    assert estimate_tokens(excerpts) <= 120
+    assert excerpts.count("用户：") == 2
@@ -0,0 +1,53 @@
+from app.core.database import SessionLocal
+from app.models.knowledge import KnowledgeItem
+from app.services.item_counters import ItemCounterBuffer
+
+def counts(item_id):
+    with SessionLocal() as db:
+        item = db.get(KnowledgeItem, item_id)
+        return item.view_count, item.download_count
+
+async def test_increments_are_merged_and_written_in_one_flush(add_items):
+    first, second = add_items(("条目一", "内容"), ("条目二", "内容"))
+    counters = ItemCounterBuffer()
+    for _ in range(3):
+        counters.increment("view_count", first)
+    counters.increment("download_count", second, 2)
+
+    # 写入前详情接口读取的值 = 数据库中的值 + 未写入的增量
+    assert counts(first) == (0, 0)
+    assert counters.pending("view_count", first) == 3
+
+    assert await counters.flush() == 5
+    assert counts(first) == (3, 0)
+    assert counts(second) == (0, 2)
+    assert counters.pending("view_count", first) == 0
+    assert counters.stats()["flushes"] == 1
+    assert await counters.flush() == 0
+
+async def test_failed_flush_keeps_increments_for_retry(add_items, monkeypatch):
+    (item_id,) = add_items(("条目", "内容"))
+    counters = ItemCounterBuffer()
+    counters.increment("view_count", item_id, 2)
+
+    def fail(batch):
+        raise RuntimeError("database is locked")
+    monkeypatch.setattr(counters, "_write", fail)
+    assert await counters.flush() == 0
+    counters.increment("view_count", item_id)
+    assert counters.pending("view_count", item_id) == 3
+    assert counters.stats()["failures"] == 1
+
+    monkeypatch.undo()
+    assert await counters.flush() == 3
+    assert counts(item_id) == (3, 0)
+
+async def test_stop_writes_remaining_increments(add_items):
+    (item_id,) = add_items(("条目", "内容"))
+    counters = ItemCounterBuffer()
+    counters.start()
+    counters.increment("download_count", item_id)
+
+    await counters.stop()
+
+    assert counts(item_id) == (0, 1)
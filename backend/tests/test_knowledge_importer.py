@@ -0,0 +1,67 @@
+import io
+import pytest
+from app.core.database import SessionLocal
+from app.models.knowledge import KnowledgeItem
+from app.services import knowledge_importer as importer_module
+from app.services.knowledge_importer import KnowledgeImporter, backfill_content_hashes, content_hash
+
+@pytest.fixture
+def category(add_items):
+    """测试分类ID，用例结束时先删除导入的条目"""
+    yield add_items.category_id
+    with SessionLocal() as db:
+        db.query(KnowledgeItem).filter(KnowledgeItem.category_id == add_items.category_id).delete()
+        db.commit()
+
+def item_titles(category_id):
+    with SessionLocal() as db:
+        return sorted(title for (title,) in db.query(KnowledgeItem.title).filter(KnowledgeItem.category_id == category_id))
+
+def test_grouped_text_import_is_idempotent(category):
+    text = (
+        "## 分类: 测试分类（说明）\n"
+        "[1] 评估现场安全。\n继续观察呼吸。\n"
+        "[2] 检查意识。\n"
+    ).encode("utf-8")
+
+    first = KnowledgeImporter(batch_size=1).import_stream(io.BytesIO(text), "text")
+    second = KnowledgeImporter().import_stream(io.BytesIO(text), "text")
+
+    assert (first.read, first.inserted, first.duplicates) == (2, 2, 0)
+    assert (second.read, second.inserted, second.duplicates) == (2, 0, 2)
+    assert item_titles(category) == ["测试分类 - 条目1", "测试分类 - 条目2"]
+    with SessionLocal() as db:
+        item = db.query(KnowledgeItem).filter(KnowledgeItem.title == "测试分类 - 条目1").one()
+        assert item.content == "评估现场安全。\n继续观察呼吸。"
+        assert item.snippet
+
+def test_dedup_key_is_content_hash(category):
+    """标题和分类相同、正文修改过的记录作为新条目写入"""
+    importer = KnowledgeImporter()
+    importer.run([{"category_id": category, "title": "止血", "content": "直接压迫。"}])
+    stats = importer.run([
+        {"category_id": category, "title": "止血", "content": "直接压迫。"},
+        {"category_id": category, "title": "止血", "content": "直接压迫伤口，必要时使用止血带。"},
+        {"category_id": category, "title": "", "content": "没有标题"},
+        {"category": "不存在的分类", "title": "止血", "content": "直接压迫。"}
+    ])
+
+    assert (stats.inserted, stats.duplicates, stats.invalid) == (1, 1, 2)
+    assert stats.unknown_categories == ["不存在的分类"]
+    assert item_titles(category) == ["止血", "止血"]
+
+def test_import_does_not_backfill_existing_items(category, add_items, monkeypatch):
+    """导入不扫描全表补哈希：没有哈希的旧条目需先执行 backfill_content_hashes"""
+    (legacy_id,) = add_items(("心肺复苏", "胸外按压每分钟100至120次。"))
+    record = {"category_id": category, "title": "心肺复苏", "content": "胸外按压每分钟100至120次。"}
+    monkeypatch.setattr(importer_module, "backfill_content_hashes", lambda: pytest.fail("backfill during import"))
+
+    assert KnowledgeImporter().run([record]).inserted == 1
+
+    with SessionLocal() as db:
+        db.query(KnowledgeItem).filter(KnowledgeItem.category_id == category, KnowledgeItem.id != legacy_id).delete()
+        db.commit()
+    assert backfill_content_hashes() >= 1
+    with SessionLocal() as db:
+        assert db.get(KnowledgeItem, legacy_id).content_hash == content_hash(category, "心肺复苏", "胸外按压每分钟100至120次。")
+    assert KnowledgeImporter().run([record]).duplicates == 1
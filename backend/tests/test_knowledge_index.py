@@ -0,0 +1,84 @@
+import pytest
+from app.api.routes.knowledge import search_items_page
+from app.core.database import SessionLocal
+from app.models.knowledge import KnowledgeItem
+from app.services.knowledge_fts import knowledge_fts
+from app.services.knowledge_index import KnowledgeSearchIndex, knowledge_index, tokenize
+
+ROWS = [
+    ("AED 使用方法", "打开 AED 电源，按语音提示贴电极片。"),
+    ("心肺复苏", "CPR 按压频率每分钟 100 到 120 次，按压深度 5 到 6 厘米。"),
+    ("心电图", "怀疑急性心梗时尽快完成 12 导联心电图。"),
+    ("AEDs 配置", "公共场所应配置多台 AEDs。"),
+]
+
+@pytest.fixture
+def items(add_items, monkeypatch):
+    ids = add_items(*ROWS)
+    monkeypatch.setattr(knowledge_index, "_snapshot", None)
+    monkeypatch.setattr(knowledge_index, "_delta", {})
+    monkeypatch.setattr(knowledge_index, "_tombstones", {})
+    knowledge_index._swap(knowledge_index._build())
+    # 全文检索表同样参与回退链
+    assert knowledge_fts.ensure_schema()
+    return ids
+
+def like_ids(db, category_id, query):
+    return {row.id for row in db.query(KnowledgeItem.id).filter(
+        KnowledgeItem.category_id == category_id,
+        KnowledgeItem.status == "active",
+        KnowledgeItem.title.contains(query) | KnowledgeItem.content.contains(query) | KnowledgeItem.author.contains(query)
+    )}
+
+def search_ids(db, category_id, query):
+    """与 /api/knowledge/items 相同：检索索引返回 None 时回退到 LIKE"""
+    result = search_items_page(db, query, 0, 100, category_id)
+    if result is None:
+        return like_ids(db, category_id, query)
+    return {item.id for item in result[1]}
+
+def test_tokenize():
+    assert tokenize("心肺复苏CPR") == ["心肺", "肺复", "复苏", "cpr"]
+    assert tokenize("Ｃ１２０") == ["c120"]
+
+@pytest.mark.parametrize("query", ["ae", "AE", "cp", "12", "aed", "AEDs", "cpr", "120", "心肺复苏", "心电图", "按压频率", "dose"])
+def test_search_matches_like(items, add_items, query):
+    db = SessionLocal()
+    try:
+        assert search_ids(db, add_items.category_id, query) == like_ids(db, add_items.category_id, query)
+    finally:
+        db.close()
+
+def test_partial_ascii_terms_fall_back(items):
+    # "12" 是 "120" 的一部分，"ae" 是 "aed"/"aeds" 的一部分
+    assert knowledge_index.search("12") is None
+    assert knowledge_index.search("ae") is None
+    assert knowledge_index.search("120") == (1, [items[1]])
+    # 自然语言检索（kb 模式）不要求与 LIKE 一致，按整词匹配
+    assert knowledge_index.search("ae", match_all=False) == (0, [])
+
+def test_title_hits_rank_first(items):
+    total, ids = knowledge_index.search("心电")
+    assert total == 1 and ids == [items[2]]
+    _, ids = knowledge_index.search("按压", match_all=False)
+    assert ids == [items[1]]
+    # "aed" 是 "aeds" 的一部分，回退到 LIKE
+    assert knowledge_index.search("aed") is None
+    assert knowledge_index.search("aeds") == (1, [items[3]])
+
+def test_changes_are_applied_incrementally(items):
+    index = KnowledgeSearchIndex()
+    index._swap(index._build())
+    change_id = index.built_change_id + 1
+
+    class Row:
+        id, category_id, content_type = 999999, 1, "document"
+        title, author, content = "洗胃", None, "口服中毒后洗胃。"
+
+    index.apply_change(change_id, Row.id, index.prepare(Row))
+    index.apply_change(change_id + 1, items[1], None)
+
+    assert index.search("洗胃") == (1, [Row.id])
+    assert index.search("cpr") == (0, [])
+    assert index.stats()["delta_documents"] == 1
+    assert index.stats()["tombstones"] == 2
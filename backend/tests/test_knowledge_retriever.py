@@ -0,0 +1,55 @@
+import threading
+import pytest
+from app.core.config import settings
+from app.core.database import AsyncSessionLocal
+from app.services.knowledge_fts import knowledge_fts
+from app.services.knowledge_index import knowledge_index
+from app.services.knowledge_retriever import knowledge_retriever
+from app.services.knowledge_vectors import knowledge_vectors
+
+@pytest.fixture
+def items(add_items, monkeypatch):
+    ids = add_items(
+        ("心肺复苏", "胸外按压深度为5到6厘米。按压频率为每分钟100到120次。"),
+        ("外伤止血", "伤口出血时先直接压迫止血，再加压包扎。")
+    )
+    # 用例结束后恢复全局索引的状态
+    monkeypatch.setattr(knowledge_index, "_snapshot", None)
+    monkeypatch.setattr(knowledge_index, "_delta", {})
+    monkeypatch.setattr(knowledge_index, "_tombstones", {})
+    return ids
+
+async def test_ranking_runs_off_the_event_loop(items, monkeypatch):
+    knowledge_index._swap(knowledge_index._build())
+    threads = []
+    index_search = knowledge_index.search
+
+    def search(*args, **kwargs):
+        threads.append(threading.current_thread())
+        return index_search(*args, **kwargs)
+
+    def vector_search(question, limit):
+        threads.append(threading.current_thread())
+        return [items[1]]
+
+    monkeypatch.setattr(knowledge_index, "search", search)
+    monkeypatch.setattr(knowledge_vectors, "search", vector_search)
+
+    async with AsyncSessionLocal() as db:
+        passages = await knowledge_retriever.retrieve(db, "胸外按压的频率是多少")
+
+    # 关键词打分和向量检索都在线程池中执行
+    assert len(threads) == 2
+    assert threading.main_thread() not in threads
+    assert [p["id"] for p in passages] == items
+    assert passages[0]["content"].startswith("胸外按压")
+
+async def test_falls_back_to_fts_when_index_not_ready(items, monkeypatch):
+    monkeypatch.setattr(settings, "knowledge_index_enabled", False)
+    monkeypatch.setattr(knowledge_vectors, "search", lambda question, limit: None)
+    assert knowledge_fts.ensure_schema()
+
+    async with AsyncSessionLocal() as db:
+        passages = await knowledge_retriever.retrieve(db, "伤口出血怎么处理")
+
+    assert [p["id"] for p in passages] == [items[1]]
@@ -0,0 +1,137 @@
+import threading
+import pytest
+from app.core.config import settings
+from app.core.database import SessionLocal
+from app.models.knowledge import KnowledgeIndexChange, KnowledgeItem
+from app.services.knowledge_index import knowledge_index
+from app.services.knowledge_sync import KnowledgeIndexSync
+
+@pytest.fixture
+def sync(add_items, monkeypatch):
+    """只维护内存倒排索引；索引和同步任务从当前最新的变更记录开始"""
+    monkeypatch.setattr(settings, "vector_index_enabled", False)
+    monkeypatch.setattr(knowledge_index, "_snapshot", None)
+    monkeypatch.setattr(knowledge_index, "_delta", {})
+    monkeypatch.setattr(knowledge_index, "_tombstones", {})
+    monkeypatch.setattr(knowledge_index, "required_change_id", 0)
+    knowledge_index._swap(knowledge_index._build())
+    sync = KnowledgeIndexSync()
+    sync.applied_change_id = sync._latest_change_id()
+    return sync
+
+def update_item(item_id, **values):
+    db = SessionLocal()
+    try:
+        item = db.get(KnowledgeItem, item_id)
+        for name, value in values.items():
+            setattr(item, name, value)
+        db.commit()
+    finally:
+        db.close()
+
+def add_change(change_id, item_id):
+    """直接写入变更记录（模拟 PostgreSQL 上较小的序列号较晚提交）"""
+    db = SessionLocal()
+    try:
+        db.add(KnowledgeIndexChange(id=change_id, item_id=item_id))
+        db.commit()
+    finally:
+        db.close()
+
+async def test_orm_writes_are_applied_to_the_index(sync, add_items):
+    [item_id] = add_items(("溺水", "清理口鼻异物后开放气道。"))
+    assert knowledge_index.search("溺水") == (0, [])
+
+    assert await sync.apply_pending() == 1
+    assert knowledge_index.search("溺水") == (1, [item_id])
+
+    update_item(item_id, title="淹溺")
+    # 统计字段的更新不产生变更记录
+    update_item(item_id, view_count=5)
+    assert await sync.apply_pending() == 1
+    assert knowledge_index.search("溺水") == (0, [])
+    assert knowledge_index.search("淹溺") == (1, [item_id])
+
+    update_item(item_id, status="inactive")
+    await sync.apply_pending()
+    assert knowledge_index.search("淹溺") == (0, [])
+    assert (await sync.stats())["pending_changes"] == 0
+
+async def test_late_committed_change_is_applied(sync, add_items):
+    [item_id] = add_items(("烫伤", "用冷水冲洗二十分钟。"))
+    await sync.apply_pending()
+    base = sync.applied_change_id
+    # base+1 已分配但未提交，base+2 先提交
+    add_change(base + 2, item_id)
+    await sync.apply_pending()
+    assert sync.applied_change_id == base + 2
+    assert (await sync.stats())["open_gaps"] == 1
+
+    add_change(base + 1, item_id)
+    stats = await sync.stats()
+    assert stats["pending_changes"] == 1
+
+    assert await sync.apply_pending() == 1
+    stats = await sync.stats()
+    assert stats["open_gaps"] == 0
+    assert stats["late_changes"] == 1
+    assert stats["pending_changes"] == 0
+
+    # 补上空缺后要求重新构建，弥补可能被快照位置过滤掉的变更
+    sync.compact_if_needed(quiet=True)
+    assert knowledge_index.rebuilding
+    await knowledge_index._rebuild_task
+    assert knowledge_index.search("烫伤") == (1, [item_id])
+    sync.compact_if_needed(quiet=True)
+    assert not knowledge_index.rebuilding
+
+async def test_rolled_back_gap_expires(sync, add_items, monkeypatch):
+    [item_id] = add_items(("鼻出血", "身体前倾，捏住鼻翼。"))
+    await sync.apply_pending()
+    base = sync.applied_change_id
+    add_change(base + 2, item_id)
+    await sync.apply_pending()
+    assert (await sync.stats())["open_gaps"] == 1
+
+    monkeypatch.setattr(settings, "index_sync_gap_timeout", 0.0)
+    await sync.apply_pending()
+    assert (await sync.stats())["open_gaps"] == 0
+    sync.compact_if_needed(quiet=True)
+    assert knowledge_index.rebuilding
+    await knowledge_index._rebuild_task
+
+async def test_backlog_is_compacted_instead_of_applied(sync, add_items, monkeypatch):
+    monkeypatch.setattr(settings, "index_compact_threshold", 2)
+    ids = add_items(("扭伤一", "冰敷。"), ("扭伤二", "抬高患肢。"), ("扭伤三", "加压包扎。"))
+
+    assert await sync.apply_pending() == 0
+    assert (await sync.stats())["skipped_changes"] == 3
+    assert knowledge_index.required_change_id == sync.applied_change_id
+
+    # 批量导入进行中不合并，本轮没有新变更时合并
+    sync.compact_if_needed(quiet=False)
+    assert not knowledge_index.rebuilding
+    sync.compact_if_needed(quiet=True)
+    await knowledge_index._rebuild_task
+    assert knowledge_index.search("扭伤")[0] == 3
+    assert set(knowledge_index.search("扭伤")[1]) == set(ids)
+
+async def test_start_reads_the_position_off_the_event_loop(add_items, monkeypatch):
+    monkeypatch.setattr(settings, "vector_index_enabled", False)
+    sync = KnowledgeIndexSync()
+    latest = sync._latest_change_id()
+    loop_thread = threading.get_ident()
+    threads = []
+    read_position = sync._start_position
+
+    def start_position():
+        threads.append(threading.get_ident())
+        return read_position()
+
+    monkeypatch.setattr(sync, "_start_position", start_position)
+    await sync.start()
+    try:
+        assert sync.applied_change_id == latest
+        assert threads and threads[0] != loop_thread
+    finally:
+        await sync.stop()
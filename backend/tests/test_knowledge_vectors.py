@@ -0,0 +1,148 @@
+import threading
+import time
+import numpy as np
+import pytest
+from app.core.config import settings
+from app.services import knowledge_vectors as vectors_module
+from app.services.knowledge_vectors import KnowledgeVectorIndex, split_passages
+
+class ReversedEmbedder:
+    """与默认哈希嵌入维度相同、向量空间不同的嵌入"""
+
+    name = "reversed"
+
+    def __init__(self, dim):
+        self.hashing = vectors_module.HashingEmbedder(dim)
+
+    def __call__(self, texts):
+        return self.hashing(texts)[:, ::-1].copy()
+
+def reversed_embedder(dim):
+    return ReversedEmbedder(dim)
+
+@pytest.fixture
+def items(add_items, tmp_path, monkeypatch):
+    monkeypatch.setattr(settings, "vector_index_dir", str(tmp_path / "vectors"))
+    return add_items(
+        ("心脏骤停", "发现患者心脏骤停后立即开始胸外按压，并尽快使用除颤仪。"),
+        ("低血糖", "意识清醒的低血糖患者口服葡萄糖或含糖饮料。"),
+        ("骨折固定", "用夹板固定骨折部位，超过上下两个关节。")
+    )
+
+def test_split_passages():
+    assert split_passages("第一句。第二句！第三句", 8) == ["第一句。第二句！", "第三句"]
+
+@pytest.mark.parametrize("dtype", ["float16", "int8"])
+def test_build_and_search(items, monkeypatch, dtype):
+    monkeypatch.setattr(settings, "vector_dtype", dtype)
+    index = KnowledgeVectorIndex()
+    assert index.search("心跳停了怎么办", 2) is None
+    meta = index.build()
+
+    assert meta["embedder"] == "hashing"
+    assert index.search("心跳停了怎么办", 2)[0] == items[0]
+    assert index.search_batch(["血糖低", "夹板"], 1) == [[items[1]], [items[2]]]
+
+def test_changes_are_applied_incrementally(items):
+    index = KnowledgeVectorIndex()
+    index.build()
+    change_id = index.built_change_id + 1
+
+    index.apply_change(change_id, 999999, index.prepare("中暑", "移到阴凉处，补充淡盐水。"))
+    index.apply_change(change_id + 1, items[1], None)
+
+    assert index.search("中暑了", 1) == [999999]
+    assert items[1] not in index.search("低血糖", 3)
+
+def test_mapping_retries_when_files_are_removed_by_another_rebuild(items, monkeypatch):
+    reader, builder = KnowledgeVectorIndex(), KnowledgeVectorIndex()
+    builder.build()
+    mapped_index = vectors_module._MappedIndex
+    rebuilt = []
+
+    def racing_map(directory, meta):
+        # 读取 meta.json 之后，另一个 worker 完成重建并删除了旧版本文件
+        if not rebuilt:
+            time.sleep(0.002)
+            rebuilt.append(builder.build()["version"])
+        return mapped_index(directory, meta)
+
+    monkeypatch.setattr(vectors_module, "_MappedIndex", racing_map)
+
+    assert reader.search("除颤", 1) == [items[0]]
+    assert reader.stats()["version"] == rebuilt[0]
+
+def test_index_built_with_other_embedder_is_not_mapped(items, monkeypatch):
+    KnowledgeVectorIndex().build()
+    monkeypatch.setattr(settings, "vector_embedder", f"{__name__}:reversed_embedder")
+    index = KnowledgeVectorIndex()
+
+    assert index.embedder_name == "reversed"
+    assert index.search("除颤", 1) is None
+    assert index.stats()["ready"] is False
+
+async def test_ensure_built_rebuilds_incompatible_index(items, monkeypatch):
+    KnowledgeVectorIndex().build()
+    monkeypatch.setattr(settings, "vector_embedder", f"{__name__}:reversed_embedder")
+    index = KnowledgeVectorIndex()
+
+    index.ensure_built()
+    assert index.rebuilding
+    await index._rebuild_task
+
+    assert index.stats()["embedder"] == "reversed"
+    assert index.search("除颤", 1) == [items[0]]
+
+def test_int8_quantization_keeps_scores(monkeypatch):
+    monkeypatch.setattr(settings, "vector_dtype", "int8")
+    vectors = np.random.default_rng(0).standard_normal((4, 16)).astype(np.float32)
+    quantized, scales = KnowledgeVectorIndex()._quantize(vectors)
+    assert np.allclose(quantized * scales[:, None], vectors, atol=scales.max())
+
+def test_change_applied_during_search_is_not_hidden_by_stale_cache(items, monkeypatch):
+    index = KnowledgeVectorIndex()
+    index.build()
+    change_id = index.built_change_id + 1
+    index.apply_change(change_id, items[2], index.prepare("骨折固定", "用夹板固定骨折部位。"))
+    isin = np.isin
+    applied = []
+
+    def isin_with_concurrent_change(*args, **kwargs):
+        # 检索在锁外计算墓碑掩码时，同步线程应用了一条删除
+        if not applied:
+            thread = threading.Thread(target=index.apply_change, args=(change_id + 1, items[0], None))
+            thread.start()
+            thread.join()
+            applied.append(True)
+        return isin(*args, **kwargs)
+
+    monkeypatch.setattr(np, "isin", isin_with_concurrent_change)
+
+    assert index.search("除颤", 1) == [items[0]]
+    assert applied
+    # 按旧墓碑算出的掩码没有写回缓存，之后的检索看到删除
+    assert items[0] not in index.search("除颤", 3)
+
+def test_concurrent_changes_and_searches(items):
+    index = KnowledgeVectorIndex()
+    index.build()
+    change_id = index.built_change_id
+    vectors = index.prepare("中暑", "移到阴凉处，补充淡盐水。")
+    errors = []
+
+    def search():
+        try:
+            for _ in range(200):
+                index.search_batch(["中暑", "除颤"], 2)
+        except Exception as e:
+            errors.append(e)
+
+    threads = [threading.Thread(target=search) for _ in range(4)]
+    for thread in threads:
+        thread.start()
+    for i in range(1, 400):
+        index.apply_change(change_id + i, 1000000 + i % 50, vectors if i % 3 else None)
+    for thread in threads:
+        thread.join()
+
+    assert errors == []
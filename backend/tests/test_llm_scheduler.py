@@ -0,0 +1,141 @@
+import asyncio
+import pytest
+from app.core.config import settings
+from app.services.llm_scheduler import LLMScheduler, LLMOverloadedError
+
+@pytest.fixture
+def limits(monkeypatch):
+    """全局 2 个名额，每个模式最多 2 个；kb 排队超过 2 个或等待超过 0.05 秒拒绝"""
+    monkeypatch.setattr(settings, "llm_max_concurrency", 2)
+    monkeypatch.setattr(settings, "llm_concurrency_limits", {"emergency": 2, "triage": 2, "graph": 2, "kb": 2})
+    monkeypatch.setattr(settings, "llm_queue_reject_thresholds", {"kb": 2})
+    monkeypatch.setattr(settings, "llm_queue_timeouts", {"kb": 0.05})
+
+async def test_acquire_within_limits_does_not_queue(limits):
+    scheduler = LLMScheduler()
+
+    assert await scheduler.acquire("kb") == "kb"
+    assert await scheduler.acquire("unknown") == "kb"
+
+    stats = scheduler.stats()
+    assert stats["active"] == 2
+    assert stats["modes"]["kb"]["admitted"] == 2
+
+async def test_freed_slot_goes_to_highest_priority(limits):
+    scheduler = LLMScheduler()
+    await scheduler.acquire("kb")
+    await scheduler.acquire("kb")
+
+    # kb 先排队，emergency 后排队
+    kb = asyncio.ensure_future(scheduler.acquire("kb"))
+    await asyncio.sleep(0)
+    emergency = asyncio.ensure_future(scheduler.acquire("emergency"))
+    await asyncio.sleep(0)
+
+    # 释放时在 release 内同步放行
+    scheduler.release("kb")
+    modes = scheduler.stats()["modes"]
+    assert modes["emergency"]["active"] == 1
+    assert modes["kb"]["queue_depth"] == 1
+
+    scheduler.release("kb")
+    assert await asyncio.gather(kb, emergency) == ["kb", "emergency"]
+    assert scheduler.stats()["modes"]["kb"]["queue_depth"] == 0
+
+async def test_mode_limit_reserves_capacity_for_other_modes(limits, monkeypatch):
+    monkeypatch.setattr(settings, "llm_concurrency_limits", {"emergency": 2, "triage": 2, "graph": 2, "kb": 1})
+    scheduler = LLMScheduler()
+    await scheduler.acquire("kb")
+
+    # kb 已达到模式上限，全局名额留给 emergency
+    queued = asyncio.ensure_future(scheduler.acquire("kb"))
+    await asyncio.sleep(0)
+    assert not queued.done()
+    assert await scheduler.acquire("emergency") == "emergency"
+    queued.cancel()
+
+async def test_rejects_when_queue_too_deep(limits, monkeypatch):
+    monkeypatch.setattr(settings, "llm_queue_timeouts", {})
+    scheduler = LLMScheduler()
+    await scheduler.acquire("kb")
+    await scheduler.acquire("kb")
+    queued = [asyncio.ensure_future(scheduler.acquire("kb")) for _ in range(2)]
+    await asyncio.sleep(0)
+
+    with pytest.raises(LLMOverloadedError) as exc_info:
+        await scheduler.acquire("kb")
+    assert exc_info.value.mode == "kb"
+    assert scheduler.stats()["modes"]["kb"]["rejected"] == 1
+
+    # 没有拒绝阈值的高优先级模式照常排队
+    emergency = asyncio.ensure_future(scheduler.acquire("emergency"))
+    await asyncio.sleep(0)
+    assert not emergency.done()
+    for task in queued + [emergency]:
+        task.cancel()
+
+async def test_rejects_after_queue_timeout(limits):
+    scheduler = LLMScheduler()
+    await scheduler.acquire("kb")
+    await scheduler.acquire("kb")
+
+    with pytest.raises(LLMOverloadedError):
+        await scheduler.acquire("kb")
+
+    stats = scheduler.stats()["modes"]["kb"]
+    assert stats["queue_depth"] == 0
+    assert stats["rejected"] == 1
+
+async def test_cancelled_waiter_leaves_queue(limits):
+    scheduler = LLMScheduler()
+    await scheduler.acquire("emergency")
+    await scheduler.acquire("emergency")
+
+    queued = asyncio.ensure_future(scheduler.acquire("emergency"))
+    await asyncio.sleep(0)
+    queued.cancel()
+    await asyncio.sleep(0)
+    assert scheduler.stats()["modes"]["emergency"]["queue_depth"] == 0
+
+    # 释放的名额不会分给已取消的等待者
+    scheduler.release("emergency")
+    assert scheduler.stats()["active"] == 1
+
+async def test_slot_releases_on_exit(limits):
+    scheduler = LLMScheduler()
+
+    with pytest.raises(RuntimeError):
+        async with scheduler.slot("triage"):
+            assert scheduler.stats()["active"] == 1
+            raise RuntimeError("upstream failed")
+
+    assert scheduler.stats()["active"] == 0
+
+async def test_try_acquire_takes_only_free_slots(limits):
+    scheduler = LLMScheduler()
+
+    assert scheduler.try_acquire("kb")
+    assert scheduler.try_acquire("kb")
+    # 名额已满时不排队，直接返回 False
+    assert not scheduler.try_acquire("kb")
+
+    stats = scheduler.stats()["modes"]["kb"]
+    assert stats["extra"] == 2
+    assert stats["extra_denied"] == 1
+
+async def test_try_acquire_yields_to_queued_requests(limits):
+    scheduler = LLMScheduler()
+    await scheduler.acquire("kb")
+    await scheduler.acquire("triage")
+    queued = asyncio.ensure_future(scheduler.acquire("triage"))
+    await asyncio.sleep(0)
+
+    # 有同级或更高优先级的请求在排队时，对冲请求不能插队
+    assert not scheduler.try_acquire("kb")
+    assert not scheduler.try_acquire("triage")
+
+    # 排队的请求放行后才有空闲名额
+    scheduler.release("kb")
+    assert await queued == "triage"
+    scheduler.release("triage")
+    assert scheduler.try_acquire("kb")
@@ -0,0 +1,172 @@
+import glob
+import os
+import uuid
+import pytest
+from sqlalchemy.exc import OperationalError
+from app.core.config import settings
+from app.core.database import SessionLocal, create_tables
+from app.models.chat import ChatMessage
+from app.services.message_writer import MessageWriteBehind, QueuedWrite, utc_now
+
+@pytest.fixture
+def journal(tmp_path, monkeypatch):
+    """每个用例使用独立的日志文件，重试间隔缩短"""
+    path = str(tmp_path / "journal.jsonl")
+    monkeypatch.setattr(settings, "write_behind_journal", path)
+    monkeypatch.setattr(settings, "write_behind_retry_backoff", 0.01)
+    monkeypatch.setattr(settings, "write_behind_wait_timeout", 5.0)
+    create_tables()
+    return path
+
+@pytest.fixture
+def session_id():
+    return uuid.uuid4().hex
+
+def message(session_id, role="user"):
+    # role 为 None 时违反 NOT NULL 约束，无论重试多少次都无法写入
+    return ChatMessage(id=uuid.uuid4().hex, session_id=session_id, role=role, content="内容", created_at=utc_now())
+
+def stored_ids(session_id):
+    db = SessionLocal()
+    try:
+        return {row.id for row in db.query(ChatMessage.id).filter(ChatMessage.session_id == session_id)}
+    finally:
+        db.close()
+
+def journal_entries(path):
+    if not os.path.exists(path):
+        return []
+    with open(path, encoding="utf-8") as journal:
+        return [QueuedWrite.from_json(line) for line in journal if line.strip()]
+
+async def test_writes_are_batched_and_segment_is_trimmed(journal, session_id):
+    writer = MessageWriteBehind()
+    writer.start()
+    messages = [message(session_id) for _ in range(5)]
+    for item in messages:
+        writer.add(item, [session_id])
+    segment = writer._segment.name
+    # 入队时已追加到预写日志段
+    assert len(journal_entries(segment)) == 5
+
+    await writer.wait_for(session_id)
+
+    assert stored_ids(session_id) == {item.id for item in messages}
+    assert writer.stats()["batches"] == 1
+    assert os.path.getsize(segment) == 0
+    await writer.stop()
+    assert glob.glob(f"{journal}*") == []
+
+async def test_bad_row_is_dead_lettered_without_stalling(journal, session_id):
+    writer = MessageWriteBehind()
+    writer.start()
+    good = [message(session_id) for _ in range(6)]
+    bad = message(session_id, role=None)
+    for item in good[:3] + [bad] + good[3:]:
+        writer.add(item, [session_id])
+
+    await writer.wait_for(session_id)
+
+    # 失败批次逐条写入：正常记录全部写入，约束冲突的记录立即移入日志文件，不等待重试
+    assert stored_ids(session_id) == {item.id for item in good}
+    assert [entry.values["id"] for entry in journal_entries(journal)] == [bad.id]
+    assert writer.stats()["failures"] == 2
+
+    # 越过失败批次后恢复按批写入
+    later = [message(session_id) for _ in range(4)]
+    batches = writer.stats()["batches"]
+    for item in later:
+        writer.add(item, [session_id])
+    await writer.wait_for(session_id)
+    assert writer.stats()["batches"] == batches + 1
+    await writer.stop()
+
+async def test_transient_errors_are_retried(journal, session_id, monkeypatch):
+    writer = MessageWriteBehind()
+    writer.start()
+    write = writer._write
+    attempts = []
+
+    def flaky_write(batch):
+        attempts.append(len(batch))
+        if len(attempts) <= 3:
+            raise OperationalError("INSERT", {}, Exception("database is locked"))
+        write(batch)
+
+    monkeypatch.setattr(writer, "_write", flaky_write)
+    messages = [message(session_id) for _ in range(3)]
+    for item in messages:
+        writer.add(item, [session_id])
+
+    await writer.wait_for(session_id)
+
+    assert stored_ids(session_id) == {item.id for item in messages}
+    assert attempts[0] == 3
+    assert journal_entries(journal) == []
+    await writer.stop()
+
+async def test_single_row_dead_lettered_after_max_retries(journal, session_id, monkeypatch):
+    monkeypatch.setattr(settings, "write_behind_max_retries", 2)
+    writer = MessageWriteBehind()
+    writer.start()
+
+    def failing_write(batch):
+        raise OperationalError("INSERT", {}, Exception("disk I/O error"))
+
+    monkeypatch.setattr(writer, "_write", failing_write)
+    item = message(session_id)
+    writer.add(item, [session_id])
+
+    await writer.wait_for(session_id)
+
+    assert [entry.values["id"] for entry in journal_entries(journal)] == [item.id]
+    assert writer.stats()["queued"] == 0
+    await writer.stop()
+
+async def test_segment_of_crashed_process_is_replayed(journal, session_id):
+    crashed = MessageWriteBehind()
+    crashed.start()
+    # 模拟异常退出：后台任务停止，入队的记录只在预写日志段中
+    crashed._task.cancel()
+    messages = [message(session_id) for _ in range(3)]
+    for item in messages:
+        crashed.add(item, [session_id])
+    crashed._segment.close()
+
+    writer = MessageWriteBehind()
+    writer.start()
+    await writer.wait_for(session_id)
+
+    assert writer.stats()["replayed"] == 3
+    assert stored_ids(session_id) == {item.id for item in messages}
+    await writer.stop()
+    assert glob.glob(f"{journal}*") == []
+
+async def test_live_segment_is_not_claimed(journal, session_id):
+    running = MessageWriteBehind()
+    running.start()
+    running._task.cancel()
+    running.add(message(session_id), [session_id])
+
+    # 另一个进程启动时不领取仍被持有的段
+    other = MessageWriteBehind()
+    other.start()
+    assert other.stats()["replayed"] == 0
+    await other.stop()
+    assert os.path.exists(running._segment.name)
+    running._segment.close()
+
+async def test_writes_after_stop_go_to_journal(journal, session_id):
+    writer = MessageWriteBehind()
+    writer.start()
+    await writer.stop()
+    item = message(session_id)
+    writer.add(item, [session_id])
+
+    assert [entry.values["id"] for entry in journal_entries(journal)] == [item.id]
+
+    # 下次启动时重放
+    writer.start()
+    await writer.wait_for(session_id)
+    assert stored_ids(session_id) == {item.id}
+    await writer.stop()
@@ -0,0 +1,89 @@
+from datetime import datetime, timedelta
+import pytest
+from fastapi import HTTPException
+from app.core.database import SessionLocal, create_tables
+from app.core.pagination import (
+    decode_cursor, encode_cursor, keyset_paginate, offset_cursor, offset_page_info, resolve_total_mode
+)
+from app.models.message import ContactMessage
+
+def test_cursor_roundtrip():
+    data = {"k": ["2025-08-07T17:57:23.123456+00:00", "消息-1"]}
+    cursor = encode_cursor(data)
+
+    assert "=" not in cursor
+    assert decode_cursor(cursor) == data
+
+@pytest.mark.parametrize("cursor", ["!!!", "bm90IGpzb24", encode_cursor(["not", "a", "dict"])])
+def test_invalid_cursor_is_rejected(cursor):
+    with pytest.raises(HTTPException) as exc_info:
+        decode_cursor(cursor)
+    assert exc_info.value.status_code == 400
+
+def test_offset_cursor():
+    assert offset_cursor(None, 3, 20) == 40
+    assert offset_cursor(encode_cursor({"o": 60}), 1, 20) == 60
+    # (created_at, id) 位置游标不是偏移量
+    assert offset_cursor(encode_cursor({"k": ["2025-01-01T00:00:00", "a"]}), 1, 20) is None
+    for data in ({"o": -1}, {"o": "20"}, {}):
+        with pytest.raises(HTTPException):
+            offset_cursor(encode_cursor(data), 1, 20)
+
+def test_offset_page_info():
+    assert offset_page_info(0, 20, 20, 45)["next_cursor"] == encode_cursor({"o": 20})
+    last = offset_page_info(40, 20, 5, 45)
+    assert last["has_more"] is False
+    assert last["next_cursor"] is None
+
+def test_total_mode_defaults():
+    assert resolve_total_mode(None, None) == "exact"
+    assert resolve_total_mode(None, "cursor") == "none"
+    assert resolve_total_mode("approx", "cursor") == "approx"
+
+@pytest.fixture
+def db():
+    create_tables()
+    session = SessionLocal()
+    session.query(ContactMessage).delete()
+    # 部分消息的 created_at 相同，按 id 区分先后
+    base = datetime(2025, 1, 1, 8, 0, 0)
+    for i in range(7):
+        session.add(ContactMessage(
+            id=f"m{i}", name="n", email="e@example.com", content="c",
+            created_at=base + timedelta(seconds=i // 2)
+        ))
+    session.commit()
+    yield session
+    session.query(ContactMessage).delete()
+    session.commit()
+    session.close()
+
+def test_keyset_pages_cover_all_rows_in_order(db):
+    query = db.query(ContactMessage)
+    seen = []
+    rows, info = keyset_paginate(db, query, ContactMessage, 1, 3)
+    assert info["total"] == 7
+    seen += [row.id for row in rows]
+    while info["has_more"]:
+        rows, info = keyset_paginate(db, query, ContactMessage, 1, 3, cursor=info["next_cursor"])
+        # 按游标翻页默认不计数
+        assert info["total"] is None
+        seen += [row.id for row in rows]
+
+    assert seen == [f"m{i}" for i in reversed(range(7))]
+
+def test_keyset_cursor_is_stable_after_inserts(db):
+    query = db.query(ContactMessage)
+    _, info = keyset_paginate(db, query, ContactMessage, 1, 3)
+
+    # 翻页期间插入更新的消息不会让下一页重复或跳过
+    db.add(ContactMessage(id="m9", name="n", email="e@example.com", content="c", created_at=datetime(2025, 1, 2)))
+    db.commit()
+    rows, _ = keyset_paginate(db, query, ContactMessage, 1, 3, cursor=info["next_cursor"])
+
+    assert [row.id for row in rows] == ["m3", "m2", "m1"]
+
+def test_keyset_rejects_malformed_position(db):
+    with pytest.raises(HTTPException) as exc_info:
+        keyset_paginate(db, db.query(ContactMessage), ContactMessage, 1, 3, cursor=encode_cursor({"k": ["yesterday", "m1"]}))
+    assert exc_info.value.status_code == 400
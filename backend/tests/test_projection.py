@@ -0,0 +1,46 @@
+import re
+import pytest
+from fastapi import HTTPException
+from sqlalchemy import event
+from app.core.database import SessionLocal, engine
+from app.core.projection import column_options, parse_fields, project
+from app.models.knowledge import KnowledgeItem
+from app.schemas.knowledge import KNOWLEDGE_ITEM_FIELDS, KNOWLEDGE_ITEM_FIELD_PRESETS
+from app.services.knowledge_snippets import SNIPPET_LENGTH, make_snippet
+
+def test_parse_fields_expands_presets_and_always_includes_id():
+    assert parse_fields(None, KNOWLEDGE_ITEM_FIELDS) is None
+    assert parse_fields("title, author", KNOWLEDGE_ITEM_FIELDS) == ["id", "title", "author"]
+    summary = parse_fields("summary", KNOWLEDGE_ITEM_FIELDS, KNOWLEDGE_ITEM_FIELD_PRESETS)
+    assert "snippet" in summary and "content" not in summary
+
+    with pytest.raises(HTTPException) as exc_info:
+        parse_fields("title,password", KNOWLEDGE_ITEM_FIELDS)
+    assert exc_info.value.status_code == 400
+
+def test_make_snippet():
+    assert make_snippet("  胸外按压\n\n深度5厘米  ") == "胸外按压 深度5厘米"
+    long_snippet = make_snippet("字" * (SNIPPET_LENGTH + 10))
+    assert len(long_snippet) == SNIPPET_LENGTH + 1 and long_snippet.endswith("…")
+
+def test_summary_fields_do_not_load_content(add_items):
+    (item_id,) = add_items(("心肺复苏", "胸外按压" * 100))
+    fields = parse_fields("summary", KNOWLEDGE_ITEM_FIELDS, KNOWLEDGE_ITEM_FIELD_PRESETS)
+    statements = []
+    listener = lambda *args: statements.append(args[2])
+
+    with SessionLocal() as db:
+        event.listen(engine, "before_cursor_execute", listener)
+        try:
+            item = db.query(KnowledgeItem).options(*column_options(KnowledgeItem, fields, ("created_at", "id"))).filter(
+                KnowledgeItem.id == item_id
+            ).one()
+            data = project(item, fields)
+        finally:
+            event.remove(engine, "before_cursor_execute", listener)
+
+    # 摘要在写入时生成，列表只读取摘要列，不读取正文
+    assert data["snippet"] == make_snippet("胸外按压" * 100)
+    assert len(statements) == 1
+    assert not re.search(r"knowledge_items\.content\b(?!_)", statements[0])
+    assert "knowledge_items.snippet" in statements[0]
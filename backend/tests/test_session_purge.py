@@ -0,0 +1,65 @@
+import asyncio
+import uuid
+import pytest
+from app.core.config import settings
+from app.core.database import SessionLocal, create_tables
+from app.models.chat import ChatSession, ChatMessage
+from app.services.session_purge import SessionPurger
+
+@pytest.fixture
+def sessions():
+    """写入若干会话（每个会话2条消息），返回会话ID列表"""
+    create_tables()
+    owner = uuid.uuid4().hex
+
+    def add(count):
+        with SessionLocal() as db:
+            ids = [uuid.uuid4().hex for _ in range(count)]
+            for session_id in ids:
+                db.add(ChatSession(id=session_id, user_id=owner, title="测试", mode="kb"))
+                db.add_all(
+                    ChatMessage(id=uuid.uuid4().hex, session_id=session_id, role=role, content="内容")
+                    for role in ("user", "assistant")
+                )
+            db.commit()
+        return ids
+
+    return add
+
+def remaining(session_ids):
+    with SessionLocal() as db:
+        return (
+            db.query(ChatSession).filter(ChatSession.id.in_(session_ids)).count(),
+            db.query(ChatMessage).filter(ChatMessage.session_id.in_(session_ids)).count()
+        )
+
+def test_delete_sessions_in_chunks(sessions, monkeypatch):
+    monkeypatch.setattr(settings, "session_purge_chunk_size", 2)
+    ids = sessions(5)
+    kept = sessions(1)
+
+    with SessionLocal() as db:
+        result = SessionPurger().delete_sessions(ChatSession, ChatMessage, ids, db=db)
+
+    assert result == (5, 10)
+    assert remaining(ids) == (0, 0)
+    assert remaining(kept) == (1, 2)
+
+async def test_background_job_reports_progress_until_completed(sessions, monkeypatch):
+    monkeypatch.setattr(settings, "session_purge_chunk_size", 3)
+    ids = sessions(7)
+    purger = SessionPurger()
+
+    job = purger.start_job("u1", "chat_sessions", ChatSession, ChatMessage, ids)
+    # 删除在线程池中执行，可能在这里检查之前就已完成
+    assert job.as_dict()["status"] in ("running", "completed")
+    for _ in range(1000):
+        if job.finished_at is not None:
+            break
+        await asyncio.sleep(0.01)
+
+    info = purger.get_job(job.id, "u1").as_dict()
+    assert (info["status"], info["deleted_sessions"], info["deleted_messages"], info["progress"]) == ("completed", 7, 14, 1.0)
+    assert remaining(ids) == (0, 0)
+    # 任务只能由发起删除的用户查询
+    assert purger.get_job(job.id, "u2") is None
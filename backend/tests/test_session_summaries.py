@@ -0,0 +1,39 @@
+from datetime import datetime, timedelta, timezone
+import uuid
+from sqlalchemy import event
+from app.core.database import SessionLocal, create_tables, engine
+from app.models.chat import ChatSession, ChatMessage
+from app.services.session_summaries import session_summaries
+
+def add_session(db, roles):
+    session = ChatSession(id=uuid.uuid4().hex, user_id="u1", title="测试", mode="kb")
+    db.add(session)
+    start = datetime(2025, 1, 1, tzinfo=timezone.utc)
+    db.add_all(
+        ChatMessage(id=f"{session.id}-{i}", session_id=session.id, role=role,
+                    content=f"{role}-{i}", created_at=start + timedelta(seconds=i))
+        for i, role in enumerate(roles)
+    )
+    return session.id
+
+def test_counts_and_last_user_message_in_one_query():
+    create_tables()
+    with SessionLocal() as db:
+        chatted = add_session(db, ["user", "assistant", "user", "assistant"])
+        assistant_only = add_session(db, ["assistant"])
+        empty = add_session(db, [])
+        db.commit()
+        statements = []
+        listener = lambda *args: statements.append(args[2])
+
+        event.listen(engine, "before_cursor_execute", listener)
+        try:
+            summaries = session_summaries(db, ChatMessage, [chatted, assistant_only, empty])
+        finally:
+            event.remove(engine, "before_cursor_execute", listener)
+
+    assert len(statements) == 1
+    assert summaries[chatted] == (4, "user-2")
+    assert summaries[assistant_only] == (1, "")
+    assert empty not in summaries
+    assert session_summaries(None, ChatMessage, []) == {}
@@ -0,0 +1,103 @@
+import asyncio
+from app.services.single_flight import SingleFlight
+
+def make_factory(chunks, calls, gate=None, error=None):
+    """返回上游生成器工厂：逐个产生 chunks（gate 不为空时每个事件前等待放行），可选在最后抛出 error"""
+    async def factory():
+        calls.append(1)
+        for chunk in chunks:
+            if gate is not None:
+                await gate.get()
+            yield chunk
+        if error is not None:
+            raise error
+    return factory
+
+async def collect(stream):
+    return [chunk async for chunk in stream]
+
+async def test_concurrent_requests_share_one_upstream_call():
+    flight = SingleFlight()
+    calls = []
+    chunks = [{"type": "answer", "content": str(i)} for i in range(3)]
+    factory = make_factory(chunks, calls)
+
+    results = await asyncio.gather(
+        collect(flight.stream("k", factory)),
+        collect(flight.stream("k", factory))
+    )
+
+    assert results == [chunks, chunks]
+    assert len(calls) == 1
+    assert flight.stats() == {"in_flight": 0, "started": 1, "coalesced": 1, "subscribers": 0}
+
+async def test_late_subscriber_receives_buffered_prefix():
+    flight = SingleFlight()
+    calls = []
+    gate = asyncio.Queue()
+    chunks = [{"n": i} for i in range(4)]
+    factory = make_factory(chunks, calls, gate)
+
+    first = flight.stream("k", factory)
+    gate.put_nowait(None)
+    gate.put_nowait(None)
+    assert await first.__anext__() == {"n": 0}
+    assert await first.__anext__() == {"n": 1}
+
+    # 已产生两个事件后加入的订阅者先收到这两个事件，再收到后续事件
+    late = asyncio.ensure_future(collect(flight.stream("k", factory)))
+    await asyncio.sleep(0)
+    gate.put_nowait(None)
+    gate.put_nowait(None)
+    rest = await collect(first)
+
+    assert rest == chunks[2:]
+    assert await late == chunks
+    assert len(calls) == 1
+
+async def test_different_keys_are_not_coalesced():
+    flight = SingleFlight()
+    calls = []
+    factory = make_factory([{"n": 1}], calls)
+
+    await asyncio.gather(collect(flight.stream("a", factory)), collect(flight.stream("b", factory)))
+
+    assert len(calls) == 2
+    assert flight.stats()["coalesced"] == 0
+
+async def test_upstream_error_reaches_every_subscriber():
+    flight = SingleFlight()
+    calls = []
+    factory = make_factory([{"n": 1}], calls, error=ValueError("upstream failed"))
+
+    results = await asyncio.gather(
+        collect(flight.stream("k", factory)),
+        collect(flight.stream("k", factory)),
+        return_exceptions=True
+    )
+
+    assert all(isinstance(result, ValueError) for result in results)
+    assert len(calls) == 1
+
+async def test_upstream_cancelled_when_all_subscribers_leave():
+    flight = SingleFlight()
+    calls = []
+    gate = asyncio.Queue()
+    factory = make_factory([{"n": i} for i in range(10)], calls, gate)
+
+    stream = flight.stream("k", factory)
+    gate.put_nowait(None)
+    assert await stream.__anext__() == {"n": 0}
+    task = next(iter(flight._flights.values())).task
+    await stream.aclose()
+    await asyncio.sleep(0)
+
+    assert task.cancelled()
+    assert flight.stats()["in_flight"] == 0
+
+    # 取消后的新请求重新发起上游调用
+    gate.put_nowait(None)
+    new_stream = flight.stream("k", factory)
+    assert await new_stream.__anext__() == {"n": 0}
+    assert len(calls) == 2
+    await new_stream.aclose()
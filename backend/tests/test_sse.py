@@ -0,0 +1,87 @@
+import asyncio
+from app.core.sse import CLIENT_DISCONNECTED, SSEWriter, coalesce_deltas, sse_metrics
+
+async def upstream(chunks, closed=None):
+    try:
+        for chunk in chunks:
+            await asyncio.sleep(0)
+            yield chunk
+    finally:
+        if closed is not None:
+            closed.append(True)
+
+async def collect(stream):
+    return [chunk async for chunk in stream]
+
+async def test_deltas_are_merged_between_other_events():
+    chunks = (
+        [{"type": "thinking", "content": "想"}, {"type": "thinking", "content": "一想"}]
+        + [{"type": "answer", "content": str(i)} for i in range(5)]
+        + [{"type": "done", "content": "01234"}]
+    )
+    result = await collect(coalesce_deltas(upstream(chunks), flush_interval=10, max_bytes=1024))
+
+    # 每种增量的第一段立即输出，其余合并到类型变化或上游结束时输出
+    assert result == [
+        {"type": "thinking", "content": "想"},
+        {"type": "thinking", "content": "一想"},
+        {"type": "answer", "content": "0"},
+        {"type": "answer", "content": "1234"},
+        {"type": "done", "content": "01234"},
+    ]
+
+async def test_max_bytes_flushes_early():
+    chunks = [{"type": "answer", "content": "ab"} for _ in range(5)]
+    result = await collect(coalesce_deltas(upstream(chunks), flush_interval=10, max_bytes=4))
+
+    assert [chunk["content"] for chunk in result] == ["ab", "abab", "abab"]
+
+async def test_zero_interval_passes_every_delta_through():
+    chunks = [{"type": "answer", "content": str(i)} for i in range(3)]
+    result = await collect(coalesce_deltas(upstream(chunks), flush_interval=0))
+
+    assert result == chunks
+
+async def test_closing_the_stream_closes_upstream():
+    closed = []
+    stream = coalesce_deltas(upstream([{"type": "answer", "content": "x"}] * 10, closed), flush_interval=10)
+    assert (await stream.__anext__())["content"] == "x"
+    await stream.aclose()
+    await asyncio.sleep(0)
+
+    assert closed == [True]
+
+def test_disconnected_saves_partial_content():
+    saved = []
+    before = sse_metrics.stats()["cancelled"].get("test", {}).get("streams", 0)
+
+    SSEWriter("test").disconnected("部分回答", 4, 100, saved.append)
+    SSEWriter("test").disconnected("", 0, 100, saved.append)
+
+    assert saved == ["部分回答"]
+    stats = sse_metrics.stats()["cancelled"]["test"]
+    assert stats["streams"] == before + 2
+
+async def test_generator_saves_partial_answer_on_disconnect():
+    """路由中的生成器写法：断开时保存已输出的部分内容后重新抛出"""
+    saved = []
+
+    async def generate():
+        sse = SSEWriter("test")
+        parts = []
+        try:
+            for i in range(10):
+                parts.append(str(i))
+                yield sse.frame({"type": "answer", "content": str(i)})
+        except CLIENT_DISCONNECTED:
+            sse.disconnected("".join(parts), len(parts), save_partial=saved.append)
+            raise
+        finally:
+            sse.close()
+
+    frames = generate()
+    await frames.__anext__()
+    await frames.__anext__()
+    await frames.aclose()
+
+    assert saved == ["01"]
@@ -0,0 +1,130 @@
+import asyncio
+import pytest
+from fastapi import HTTPException
+from app.core.config import settings
+from app.core.stream_replay import StreamReplay
+from app.services.llm_scheduler import LLMScheduler
+
+async def frames(count, gate=None):
+    for i in range(count):
+        if gate is not None:
+            await gate.get()
+        yield f"data: {i}\n\n"
+
+def event_id(frame):
+    return frame.split("\n", 1)[0][len("id: "):]
+
+def payload(frame):
+    return frame.split("\n", 1)[1]
+
+async def test_resume_replays_missed_frames_by_last_event_id():
+    replay = StreamReplay()
+    gate = asyncio.Queue()
+    stream = replay.start("chat", "u1", frames(4, gate), key="s1", resumable=True)
+    subscriber = replay.subscribe(stream)
+
+    gate.put_nowait(1)
+    first = await subscriber.__anext__()
+    assert payload(first) == "data: 0\n\n"
+    # 客户端在等待下一帧时断开（与 Starlette 收到 http.disconnect 时取消输出任务相同），断线期间生成继续
+    waiting = asyncio.ensure_future(subscriber.__anext__())
+    await asyncio.sleep(0)
+    waiting.cancel()
+    with pytest.raises(asyncio.CancelledError):
+        await waiting
+    for _ in range(3):
+        gate.put_nowait(1)
+    await stream.task
+
+    resumed_stream, seq = replay.resume(event_id(first), "u1", "chat", "s1")
+    assert resumed_stream is stream and seq == 1
+    rest = [frame async for frame in replay.subscribe(resumed_stream, seq)]
+
+    assert [payload(frame) for frame in rest] == ["data: 1\n\n", "data: 2\n\n", "data: 3\n\n"]
+    assert [event_id(frame) for frame in rest] == [f"{stream.id}:{i}" for i in (2, 3, 4)]
+    assert replay.stats()["replayed_frames"] == 3
+
+@pytest.mark.parametrize("owner, name, key", [("u2", "chat", "s1"), ("u1", "emergency", "s1"), ("u1", "chat", "s2")])
+async def test_resume_is_bound_to_owner_route_and_key(owner, name, key):
+    replay = StreamReplay()
+    stream = replay.start("chat", "u1", frames(1), key="s1")
+    await stream.task
+
+    with pytest.raises(HTTPException) as exc_info:
+        replay.resume(f"{stream.id}:1", owner, name, key)
+    assert exc_info.value.status_code == 404
+
+async def test_expired_frames_are_reported(monkeypatch):
+    monkeypatch.setattr(settings, "stream_replay_max_frames", 2)
+    replay = StreamReplay()
+    stream = replay.start("chat", "u1", frames(5))
+    await stream.task
+
+    frames_out = [frame async for frame in replay.subscribe(stream, 1)]
+    assert "replay_expired" in frames_out[0]
+
+async def test_task_cancelled_before_first_step_finishes_stream(monkeypatch):
+    monkeypatch.setattr(settings, "stream_replay_ttl", 0)
+    replay = StreamReplay()
+    stream = replay.start("chat", "u1", frames(3))
+    waiting = asyncio.ensure_future(replay.subscribe(stream).__anext__())
+    stream.task.cancel()
+
+    with pytest.raises(StopAsyncIteration):
+        await asyncio.wait_for(waiting, 1)
+    assert stream.done
+    replay._prune()
+    assert replay.stats()["streams"] == 0
+
+async def disconnect(subscriber):
+    """客户端在等待下一帧时断开（与 Starlette 收到 http.disconnect 时取消输出任务相同）"""
+    waiting = asyncio.ensure_future(subscriber.__anext__())
+    await asyncio.sleep(0)
+    waiting.cancel()
+    with pytest.raises(asyncio.CancelledError):
+        await waiting
+
+async def scheduled_frames(scheduler, closed):
+    async with scheduler.slot("kb"):
+        try:
+            yield "data: 0\n\n"
+            await asyncio.Event().wait()
+            yield "data: 1\n\n"
+        finally:
+            closed.set()
+
+async def test_disconnect_without_resume_support_cancels_upstream_and_releases_slot(monkeypatch):
+    monkeypatch.setattr(settings, "stream_resume_grace", 60)
+    replay = StreamReplay()
+    scheduler = LLMScheduler()
+    closed = asyncio.Event()
+    stream = replay.start("chat", "u1", scheduled_frames(scheduler, closed))
+    subscriber = replay.subscribe(stream)
+
+    await subscriber.__anext__()
+    assert scheduler.stats()["active"] == 1
+    await disconnect(subscriber)
+
+    # 不等待宽限期：上游生成器立即关闭，名额归还
+    await asyncio.wait_for(stream.task, 1)
+    assert closed.is_set()
+    assert scheduler.stats()["active"] == 0
+    assert replay.stats()["abandoned"] == 1
+
+async def test_disconnect_with_resume_support_keeps_generating_during_grace(monkeypatch):
+    monkeypatch.setattr(settings, "stream_resume_grace", 0.05)
+    replay = StreamReplay()
+    scheduler = LLMScheduler()
+    closed = asyncio.Event()
+    stream = replay.start("chat", "u1", scheduled_frames(scheduler, closed), resumable=True)
+    subscriber = replay.subscribe(stream)
+
+    await subscriber.__anext__()
+    await disconnect(subscriber)
+    await asyncio.sleep(0)
+    assert not stream.done and scheduler.stats()["active"] == 1
+
+    # 宽限期内没有重连：停止生成并归还名额
+    await asyncio.wait_for(stream.task, 1)
+    assert closed.is_set()
+    assert scheduler.stats()["active"] == 0
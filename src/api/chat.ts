@@ -7,6 +7,8 @@ export interface ChatMessage {
   references?: Array<{
     id: string
     citation: string
+    title?: string
+    content?: string
   }>
   createdAt: string
   created_at?: string // 后端返回的字段名
@@ -22,6 +24,18 @@ export interface ChatSession {
   updated_at?: string // 后端返回的字段名
 }
 
+// 后台清空会话任务（会话较多时清空接口返回）
+export interface PurgeJob {
+  job_id: string
+  kind: string
+  status: 'running' | 'completed' | 'failed'
+  total: number
+  deleted_sessions: number
+  deleted_messages: number
+  progress: number
+  error?: string | null
+}
+
 export interface ChatResponse {
   code: number
   message: string
@@ -48,6 +62,7 @@ export interface StreamEvent {
     | 'assistant_message'
     | 'usage'
     | 'session_info'
+    | 'references'
   content?: string
   message_id?: string
   data?: any
@@ -284,8 +299,22 @@ export const deleteChatSession = (sessionId: string) => {
 }
 
 // 清空所有会话
+// 会话较多时在后台删除，data 为任务信息，需要通过 getPurgeJob 查询到完成
 export const clearAllChatSessions = (mode: string = 'kb') => {
-  return request.delete('/api/chat/sessions', { params: { mode } })
+  return request.delete<{
+    code: number
+    message: string
+    data?: PurgeJob | null
+  }>('/api/chat/sessions', { params: { mode } })
+}
+
+// 查询后台清空会话任务的进度
+export const getPurgeJob = (jobId: string) => {
+  return request.get<{
+    code: number
+    message: string
+    data: PurgeJob
+  }>(`/api/chat/purge-jobs/${jobId}`)
 }
 
 // 批量删除会话
@@ -14,6 +14,7 @@ export const getKnowledgeItems = (params: {
   search?: string
   page?: number
   page_size?: number
+  fields?: string
 }) => {
   return request.get<ApiResponse<PaginatedResponse<any>>>('/api/knowledge/items', {
     params,
@@ -24,6 +25,10 @@ export const getKnowledgeItem = (itemId: number) => {
   return request.get<ApiResponse<any>>(`/api/knowledge/items/${itemId}`)
 }
 
+export const downloadKnowledgeItem = (itemId: number) => {
+  return request.post<ApiResponse<{ file_url: string }>>(`/api/knowledge/items/${itemId}/download`)
+}
+
 // 管理员API - 知识内容管理
 export const createKnowledgeItem = (data: {
   category_id: number
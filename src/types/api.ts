@@ -8,10 +8,14 @@ export interface ApiResponse<T = any> {
 
 // 分页响应格式
 export interface PaginatedResponse<T> {
-  total: number
+  total: number | null
   page: number
   pageSize: number
   records: T[]
+  // 游标分页：next_cursor 传回 cursor 参数获取下一页
+  total_exact?: boolean
+  has_more?: boolean
+  next_cursor?: string | null
 }
 
 // 用户相关类型
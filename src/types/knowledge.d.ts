@@ -15,7 +15,8 @@ export interface KnowledgeItem {
   id: number
   category_id: number
   title: string
-  content: string
+  content?: string
+  snippet?: string
   content_type: string
   author?: string
   publisher?: string
@@ -89,4 +90,6 @@ export interface SearchParams {
   keyword: string
   page?: number
   page_size?: number
+  // 返回字段，summary 不含正文
+  fields?: string
 }